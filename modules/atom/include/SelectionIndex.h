@@ -0,0 +1,137 @@
+/**
+ *  \file IMP/atom/SelectionIndex.h
+ *  \brief Fast repeated selection of parts of a hierarchy.
+ *
+ *  Copyright 2007-2017 IMP Inventors. All rights reserved.
+ */
+
+#ifndef IMPATOM_SELECTION_INDEX_H
+#define IMPATOM_SELECTION_INDEX_H
+
+#include <IMP/atom/atom_config.h>
+#include "Atom.h"
+#include "Hierarchy.h"
+#include "Representation.h"
+#include <IMP/Object.h>
+#include <IMP/object_macros.h>
+#include <boost/unordered_map.hpp>
+#include <map>
+#include <utility>
+#include <vector>
+
+IMPATOM_BEGIN_NAMESPACE
+
+//! Answer many Selection-like queries on the same hierarchy quickly.
+/** Each Selection walks the hierarchy from the root every time its
+    particles are requested, which is slow when selecting, say, every
+    cross-linked residue of a large system. A SelectionIndex instead
+    walks the hierarchy once per resolution and stores the selected
+    particles keyed by molecule name and residue index, so that each
+    query is a few hash lookups.
+
+    The particles returned for a query are the same, and in the same order,
+    as those returned by the equivalent Selection, for example
+    \code
+    Selection(hierarchy=h, molecule="A", residue_index=12, copy_index=1,
+              resolution=10).get_selected_particle_indexes()
+    \endcode
+    is the same as
+    \code
+    SelectionIndex(h).get_selected_particle_indexes(["A"], [12], [1],
+                                                    resolution=10)
+    \endcode
+    In Python, get_selected_particles() takes the same keyword
+    arguments as Selection.
+
+    A query for several residue indexes returns the particles of each
+    residue's selection, in hierarchy order. This is not always what a
+    single Selection returns: Selection descends into the children of a
+    node as soon as any child matches any of the residues, so if a
+    fragment covers residues 1 to 4 but only has children for residues
+    1 and 2, Selection with residue indexes 1 and 3 returns just the
+    particles of residue 1, while the index also returns those of
+    residue 2 (which cover residue 3). The results are the same whenever
+    at most one residue index is given.
+
+    The index is rebuilt automatically when the structure of any hierarchy
+    in the model changes (children or representations are added or
+    removed). Call update() after other changes, such as renaming a
+    molecule or changing the index of a residue.
+
+    \see Selection
+ */
+class IMPATOMEXPORT SelectionIndex : public Object {
+#ifndef SWIG
+  struct Leaf {
+    ParticleIndex pi;
+    std::string molecule, chain_id;
+    bool has_molecule, has_chain_id;
+    int copy_index, state_index, atom_type;
+    Ints residue_indexes;
+  };
+  typedef std::pair<std::string, int> MoleculeResidue;
+  struct Table {
+    std::vector<Leaf> leaves;
+    boost::unordered_map<std::string, Ints> by_molecule;
+    boost::unordered_map<int, Ints> by_residue;
+    boost::unordered_map<MoleculeResidue, Ints> by_molecule_residue;
+  };
+
+  Model *m_;
+  ParticleIndexes h_;
+  RepresentationType representation_type_;
+  mutable std::map<double, Table> tables_;
+  mutable unsigned int age_;
+
+  void add_leaves(ParticleIndex pi, Leaf data, bool found_rep_node,
+                  double resolution, Table &table) const;
+  const Table &get_table(double resolution) const;
+  bool get_is_match(const Leaf &leaf, const Ints &copy_indexes,
+                    const Ints &state_indexes, const Strings &chain_ids,
+                    const Ints &atom_types) const;
+#endif
+
+ public:
+  SelectionIndex(Hierarchy h, RepresentationType representation_type = BALLS,
+                 std::string name = "SelectionIndex%1%");
+  SelectionIndex(Model *m, const ParticleIndexes &pis,
+                 RepresentationType representation_type = BALLS,
+                 std::string name = "SelectionIndex%1%");
+
+  Model *get_model() const { return m_; }
+
+  //! Get the indexes of the particles Selection would return
+  /** Each list restricts the selection to particles matching one of its
+      entries, as for the corresponding Selection::set_*() method; an empty
+      list does not restrict the selection. Several residue indexes select
+      the union of the particles for each residue (see above).
+   */
+  ParticleIndexes get_selected_particle_indexes(
+      const Strings &molecules, const Ints &residue_indexes,
+      const Ints &copy_indexes = Ints(), const Ints &state_indexes = Ints(),
+      const Strings &chain_ids = Strings(),
+      const AtomTypes &atom_types = AtomTypes(),
+      double resolution = 0) const;
+
+  //! Select one particle for each of many residues in a single call
+  /** For each i, return the first particle (in Selection order) of
+      residue residue_indexes[i] in the molecule called molecules[i], in
+      copy copy_indexes[i] (or in any copy, if copy_indexes is empty).
+      ParticleIndex() is returned for residues that are not found.
+   */
+  ParticleIndexes get_residue_particle_indexes(
+      const Strings &molecules, const Ints &residue_indexes,
+      const Ints &copy_indexes = Ints(), int state_index = -1,
+      double resolution = 0) const;
+
+  //! Forget everything stored, so the next query walks the hierarchy again
+  void update();
+
+  IMP_OBJECT_METHODS(SelectionIndex);
+};
+
+IMP_OBJECTS(SelectionIndex, SelectionIndexes);
+
+IMPATOM_END_NAMESPACE
+
+#endif /* IMPATOM_SELECTION_INDEX_H */
@@ -9,6 +9,7 @@
 #include <IMP/atom/Atom.h>
 #include <IMP/atom/Mass.h>
 #include <IMP/core/Gaussian.h>
+#include <IMP/core/Hierarchy.h>
 #include <IMP/log.h>
 
 #include <boost/unordered_map.hpp>
@@ -190,6 +191,7 @@ void Representation::add_representation(ParticleIndexAdaptor rep,
     get_model()->add_attribute(get_resolution_key(index), get_particle_index(),
                                resolution);
   }
+  core::internal::increment_hierarchy_age(get_model());
 }
 
 Floats Representation::get_resolutions(RepresentationType type) const {
@@ -0,0 +1,297 @@
+/**
+ *  \file SelectionIndex.cpp
+ *  \brief Fast repeated selection of parts of a hierarchy.
+ *
+ *  Copyright 2007-2017 IMP Inventors. All rights reserved.
+ *
+ */
+
+#include <IMP/atom/SelectionIndex.h>
+#include <IMP/atom/Chain.h>
+#include <IMP/atom/Copy.h>
+#include <IMP/atom/Domain.h>
+#include <IMP/atom/Fragment.h>
+#include <IMP/atom/Molecule.h>
+#include <IMP/atom/Residue.h>
+#include <IMP/atom/State.h>
+#include <IMP/core/Hierarchy.h>
+#include <algorithm>
+#include <iterator>
+
+IMPATOM_BEGIN_NAMESPACE
+
+namespace {
+// The residues a node covers, as used by Selection::set_residue_indexes()
+Ints get_residue_indexes(Model *m, ParticleIndex pi) {
+  if (Residue::get_is_setup(m, pi)) {
+    return Ints(1, Residue(m, pi).get_index());
+  } else if (Fragment::get_is_setup(m, pi)) {
+    Ints ret = Fragment(m, pi).get_residue_indexes();
+    std::sort(ret.begin(), ret.end());
+    return ret;
+  } else if (Domain::get_is_setup(m, pi)) {
+    IntRange ir = Domain(m, pi).get_index_range();
+    Ints ret;
+    for (int i = ir.first; i < ir.second; ++i) ret.push_back(i);
+    return ret;
+  }
+  return Ints();
+}
+
+/* Residues of a node that apply to all of its descendants. As for the
+   residue index predicate of Selection, a residue that is also covered
+   by a child is left for that child to match. */
+Ints get_inherited_residue_indexes(Model *m, ParticleIndex pi) {
+  Ints ret = get_residue_indexes(m, pi);
+  if (ret.empty()) return ret;
+  IMP_FOREACH(ParticleIndex ch, Hierarchy(m, pi).get_children_indexes()) {
+    Ints cur = get_residue_indexes(m, ch);
+    Ints left;
+    std::set_difference(ret.begin(), ret.end(), cur.begin(), cur.end(),
+                         std::back_inserter(left));
+    std::swap(ret, left);
+  }
+  return ret;
+}
+
+// The nodes a node is replaced by when searching at the given resolution
+ParticleIndexes get_expanded(Model *m, ParticleIndex pi, double resolution,
+                             RepresentationType representation_type,
+                             bool &from_rep) {
+  ParticleIndexes ret;
+  if (Representation::get_is_setup(m, pi)) {
+    from_rep = true;
+    if (resolution == ALL_RESOLUTIONS) {
+      ret = Representation(m, pi).get_representations(representation_type);
+    } else {
+      Hierarchy tmp = Representation(m, pi).get_representation(
+          resolution, representation_type);
+      if (tmp) ret.push_back(tmp);
+    }
+  } else {
+    ret.push_back(pi);
+  }
+  return ret;
+}
+
+Ints get_sorted(Ints v) {
+  std::sort(v.begin(), v.end());
+  return v;
+}
+
+template <class T>
+bool get_is_in(const Vector<T> &sorted, const T &v) {
+  return std::binary_search(sorted.begin(), sorted.end(), v);
+}
+}
+
+SelectionIndex::SelectionIndex(Hierarchy h,
+                               RepresentationType representation_type,
+                               std::string name)
+    : Object(name),
+      m_(h.get_model()),
+      h_(1, h.get_particle_index()),
+      representation_type_(representation_type),
+      age_(core::internal::get_hierarchy_age(m_)) {}
+
+SelectionIndex::SelectionIndex(Model *m, const ParticleIndexes &pis,
+                               RepresentationType representation_type,
+                               std::string name)
+    : Object(name),
+      m_(m),
+      h_(pis),
+      representation_type_(representation_type),
+      age_(core::internal::get_hierarchy_age(m_)) {}
+
+void SelectionIndex::update() { tables_.clear(); }
+
+void SelectionIndex::add_leaves(ParticleIndex pi, Leaf data,
+                                bool found_rep_node, double resolution,
+                                Table &table) const {
+  // the outermost molecule, copy, state, chain and atom are the ones
+  // that Selection matches against
+  if (!data.has_molecule && Molecule::get_is_setup(m_, pi)) {
+    data.has_molecule = true;
+    data.molecule = m_->get_particle_name(pi);
+  }
+  if (!data.has_chain_id && Chain::get_is_setup(m_, pi)) {
+    data.has_chain_id = true;
+    data.chain_id = Chain(m_, pi).get_id();
+  }
+  if (data.copy_index < 0 && Copy::get_is_setup(m_, pi)) {
+    data.copy_index = Copy(m_, pi).get_copy_index();
+  }
+  if (data.state_index < 0 && State::get_is_setup(m_, pi)) {
+    data.state_index = State(m_, pi).get_state_index();
+  }
+  if (data.atom_type < 0 && Atom::get_is_setup(m_, pi)) {
+    data.atom_type = Atom(m_, pi).get_atom_type().get_index();
+  }
+  Ints residues = get_inherited_residue_indexes(m_, pi);
+  if (!residues.empty()) {
+    Ints merged;
+    std::set_union(data.residue_indexes.begin(), data.residue_indexes.end(),
+                   residues.begin(), residues.end(),
+                   std::back_inserter(merged));
+    std::swap(data.residue_indexes, merged);
+  }
+
+  bool has_children = false;
+  IMP_FOREACH(ParticleIndex ch, Hierarchy(m_, pi).get_children_indexes()) {
+    bool from_rep = false;
+    ParticleIndexes exp =
+        get_expanded(m_, ch, resolution, representation_type_, from_rep);
+    IMP_FOREACH(ParticleIndex rpi, exp) {
+      has_children = true;
+      add_leaves(rpi, data, found_rep_node || from_rep, resolution, table);
+    }
+  }
+  if (!has_children && (representation_type_ == BALLS || found_rep_node)) {
+    data.pi = pi;
+    int index = table.leaves.size();
+    IMP_FOREACH(int r, data.residue_indexes) {
+      table.by_residue[r].push_back(index);
+      if (data.has_molecule) {
+        table.by_molecule_residue[MoleculeResidue(data.molecule, r)]
+            .push_back(index);
+      }
+    }
+    if (data.has_molecule) {
+      table.by_molecule[data.molecule].push_back(index);
+    }
+    table.leaves.push_back(data);
+  }
+}
+
+const SelectionIndex::Table &SelectionIndex::get_table(
+    double resolution) const {
+  unsigned int age = core::internal::get_hierarchy_age(m_);
+  if (age != age_) {
+    IMP_LOG_TERSE("Hierarchy changed, clearing " << get_name() << std::endl);
+    tables_.clear();
+    age_ = age;
+  }
+  std::map<double, Table>::const_iterator it = tables_.find(resolution);
+  if (it != tables_.end()) return it->second;
+  IMP_LOG_TERSE("Indexing " << h_ << " at resolution " << resolution
+                << std::endl);
+  Table &table = tables_[resolution];
+  Leaf data;
+  data.has_molecule = data.has_chain_id = false;
+  data.copy_index = data.state_index = data.atom_type = -1;
+  IMP_FOREACH(ParticleIndex pi, h_) {
+    bool from_rep = false;
+    ParticleIndexes exp =
+        get_expanded(m_, pi, resolution, representation_type_, from_rep);
+    IMP_FOREACH(ParticleIndex rpi, exp) {
+      add_leaves(rpi, data, from_rep, resolution, table);
+    }
+  }
+  return table;
+}
+
+bool SelectionIndex::get_is_match(const Leaf &leaf, const Ints &copy_indexes,
+                                  const Ints &state_indexes,
+                                  const Strings &chain_ids,
+                                  const Ints &atom_types) const {
+  if (!copy_indexes.empty() &&
+      (leaf.copy_index < 0 || !get_is_in(copy_indexes, leaf.copy_index))) {
+    return false;
+  }
+  if (!state_indexes.empty() &&
+      (leaf.state_index < 0 || !get_is_in(state_indexes, leaf.state_index))) {
+    return false;
+  }
+  if (!chain_ids.empty() &&
+      (!leaf.has_chain_id || !get_is_in(chain_ids, leaf.chain_id))) {
+    return false;
+  }
+  if (!atom_types.empty() &&
+      (leaf.atom_type < 0 || !get_is_in(atom_types, leaf.atom_type))) {
+    return false;
+  }
+  return true;
+}
+
+ParticleIndexes SelectionIndex::get_selected_particle_indexes(
+    const Strings &molecules, const Ints &residue_indexes,
+    const Ints &copy_indexes, const Ints &state_indexes,
+    const Strings &chain_ids, const AtomTypes &atom_types,
+    double resolution) const {
+  const Table &table = get_table(resolution);
+  Ints candidates;
+  if (!molecules.empty() && !residue_indexes.empty()) {
+    IMP_FOREACH(std::string mol, molecules) {
+      IMP_FOREACH(int r, residue_indexes) {
+        boost::unordered_map<MoleculeResidue, Ints>::const_iterator it =
+            table.by_molecule_residue.find(MoleculeResidue(mol, r));
+        if (it != table.by_molecule_residue.end()) candidates += it->second;
+      }
+    }
+  } else if (!molecules.empty()) {
+    IMP_FOREACH(std::string mol, molecules) {
+      boost::unordered_map<std::string, Ints>::const_iterator it =
+          table.by_molecule.find(mol);
+      if (it != table.by_molecule.end()) candidates += it->second;
+    }
+  } else if (!residue_indexes.empty()) {
+    IMP_FOREACH(int r, residue_indexes) {
+      boost::unordered_map<int, Ints>::const_iterator it =
+          table.by_residue.find(r);
+      if (it != table.by_residue.end()) candidates += it->second;
+    }
+  } else {
+    for (unsigned int i = 0; i < table.leaves.size(); ++i) {
+      candidates.push_back(i);
+    }
+  }
+  // a leaf may be found through several residues; return each once,
+  // in the order Selection would
+  std::sort(candidates.begin(), candidates.end());
+  candidates.erase(std::unique(candidates.begin(), candidates.end()),
+                   candidates.end());
+
+  Strings chains = chain_ids;
+  std::sort(chains.begin(), chains.end());
+  Ints types;
+  IMP_FOREACH(AtomType at, atom_types) types.push_back(at.get_index());
+  Ints copies = get_sorted(copy_indexes), states = get_sorted(state_indexes);
+  std::sort(types.begin(), types.end());
+  ParticleIndexes ret;
+  IMP_FOREACH(int i, candidates) {
+    const Leaf &leaf = table.leaves[i];
+    if (get_is_match(leaf, copies, states, chains, types)) {
+      ret.push_back(leaf.pi);
+    }
+  }
+  return ret;
+}
+
+ParticleIndexes SelectionIndex::get_residue_particle_indexes(
+    const Strings &molecules, const Ints &residue_indexes,
+    const Ints &copy_indexes, int state_index, double resolution) const {
+  IMP_USAGE_CHECK(molecules.size() == residue_indexes.size(),
+                  "Need one molecule name for each residue index");
+  IMP_USAGE_CHECK(copy_indexes.empty() ||
+                      copy_indexes.size() == residue_indexes.size(),
+                  "Need either no copy indexes or one for each residue index");
+  const Table &table = get_table(resolution);
+  ParticleIndexes ret(residue_indexes.size());
+  for (unsigned int i = 0; i < residue_indexes.size(); ++i) {
+    boost::unordered_map<MoleculeResidue, Ints>::const_iterator it =
+        table.by_molecule_residue.find(
+            MoleculeResidue(molecules[i], residue_indexes[i]));
+    if (it == table.by_molecule_residue.end()) continue;
+    IMP_FOREACH(int index, it->second) {
+      const Leaf &leaf = table.leaves[index];
+      if ((copy_indexes.empty() || leaf.copy_index == copy_indexes[i]) &&
+          (state_index < 0 || leaf.state_index == state_index)) {
+        ret[i] = leaf.pi;
+        break;
+      }
+    }
+  }
+  return ret;
+}
+
+IMPATOM_END_NAMESPACE
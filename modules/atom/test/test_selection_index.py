@@ -0,0 +1,126 @@
+import IMP
+import IMP.atom
+import IMP.core
+import IMP.test
+
+
+class Tests(IMP.test.TestCase):
+
+    def _make_system(self):
+        m = IMP.Model()
+        top = IMP.atom.Hierarchy.setup_particle(IMP.Particle(m))
+        for copy in range(2):
+            self._add_molecule(m, top, "Prot", copy)
+        return m, top
+
+    def _add_molecule(self, m, top, name, copy):
+        mh = IMP.atom.read_pdb(self.get_input_file_name('1z5s_C.pdb'), m)
+        IMP.atom.Molecule.setup_particle(mh)
+        IMP.atom.Copy.setup_particle(mh, copy)
+        mh.set_name(name)
+        top.add_child(mh)
+
+    def _assert_same(self, index, hierarchy, **kwargs):
+        sel = IMP.atom.Selection(hierarchy, **kwargs).get_selected_particles()
+        self.assertEqual(index.get_selected_particles(**kwargs), sel)
+
+    def test_queries(self):
+        """Test that SelectionIndex matches Selection"""
+        m, top = self._make_system()
+        index = IMP.atom.SelectionIndex(top)
+        for kwargs in ({}, {'molecule': 'Prot'}, {'molecule': 'Nope'},
+                       {'molecule': 'Prot', 'residue_index': 432},
+                       {'residue_indexes': range(430, 440), 'copy_index': 1},
+                       {'chain_id': 'C', 'residue_index': 440},
+                       {'atom_type': IMP.atom.AT_CA, 'copy_indexes': [0]},
+                       {'atom_types': [IMP.atom.AT_CA, IMP.atom.AT_N],
+                        'molecules': ['Prot'], 'residue_index': 432}):
+            self._assert_same(index, top, **kwargs)
+
+    def test_representation(self):
+        """Test SelectionIndex with multiple resolutions"""
+        m = IMP.Model()
+        mh = IMP.atom.read_pdb(self.get_input_file_name('1z5s_C.pdb'), m)
+        res1 = IMP.atom.create_simplified_along_backbone(mh, 1)
+        res10 = IMP.atom.create_simplified_along_backbone(mh, 10)
+        root = IMP.atom.Hierarchy.setup_particle(IMP.Particle(m))
+        root.add_child(mh)
+        rep = IMP.atom.Representation.setup_particle(root, 0)
+        rep.add_representation(res1, IMP.atom.BALLS, 1)
+        rep.add_representation(res10, IMP.atom.BALLS, 10)
+        index = IMP.atom.SelectionIndex(root)
+        for resolution in (0, 1, 10):
+            for r in (432, 437, 500):
+                self._assert_same(index, root, resolution=resolution,
+                                  residue_index=r)
+            self._assert_same(index, root, resolution=resolution)
+
+    def test_multiple_residues(self):
+        """Test SelectionIndex with several residue indexes"""
+        m, top = self._make_system()
+        index = IMP.atom.SelectionIndex(top)
+        residues = [432, 440, 437]
+        sel = set()
+        for r in residues:
+            s = IMP.atom.Selection(top, residue_index=r, copy_index=1)
+            sel |= set(s.get_selected_particles())
+        ps = index.get_selected_particles(residue_indexes=residues,
+                                          copy_index=1)
+        self.assertEqual(set(ps), sel)
+        self.assertEqual(len(ps), len(sel))
+
+        # a fragment covering residues that its children do not
+        m = IMP.Model()
+        frag = IMP.atom.Fragment.setup_particle(IMP.Particle(m), [1, 2, 3, 4])
+        res = []
+        for i in (1, 2):
+            r = IMP.atom.Residue.setup_particle(IMP.Particle(m),
+                                                IMP.atom.ALA, i)
+            frag.add_child(r)
+            res.append(r.get_particle())
+        index = IMP.atom.SelectionIndex(frag)
+        self.assertEqual(IMP.atom.Selection(frag, residue_index=3)
+                         .get_selected_particles(), res)
+        self.assertEqual(index.get_selected_particles(residue_index=3), res)
+        self.assertEqual(index.get_selected_particles(residue_index=1),
+                         res[:1])
+        # Selection stops at the first child matching any residue, while
+        # the index returns the union of the single residue selections
+        self.assertEqual(IMP.atom.Selection(frag, residue_indexes=[1, 3])
+                         .get_selected_particles(), res[:1])
+        self.assertEqual(index.get_selected_particles(residue_indexes=[1, 3]),
+                         res)
+
+    def test_residue_particle_indexes(self):
+        """Test selecting many residues in one call"""
+        m, top = self._make_system()
+        index = IMP.atom.SelectionIndex(top)
+        pis = index.get_residue_particle_indexes(
+            ['Prot', 'Prot', 'Prot', 'Nope'], [432, 433, 99999, 432],
+            [0, 1, 0, 0])
+        self.assertEqual(len(pis), 4)
+        for pi, r, copy in zip(pis[:2], (432, 433), (0, 1)):
+            sel = IMP.atom.Selection(top, molecule='Prot', residue_index=r,
+                                     copy_index=copy)
+            self.assertEqual(pi, sel.get_selected_particle_indexes()[0])
+        self.assertEqual(pis[2], IMP.ParticleIndex())
+        self.assertEqual(pis[3], IMP.ParticleIndex())
+
+    def test_update(self):
+        """Test that SelectionIndex notices changes to the hierarchy"""
+        m, top = self._make_system()
+        index = IMP.atom.SelectionIndex(top)
+        self._assert_same(index, top, residue_index=432)
+        self._add_molecule(m, top, "Other", 0)
+        self._assert_same(index, top, residue_index=432)
+        self._assert_same(index, top, molecule='Other')
+        top.remove_child(top.get_child(0))
+        self._assert_same(index, top, residue_index=432)
+        # renaming is not tracked automatically
+        top.get_child(0).set_name("Renamed")
+        index.update()
+        self._assert_same(index, top, molecule='Renamed')
+
+
+if __name__ == '__main__':
+    IMP.test.main()
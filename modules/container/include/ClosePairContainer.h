@@ -36,7 +36,8 @@ frequently. Also, too large a slack value generates many particle pairs
 whose score is zero, thereby unnecessarily slowing down the score
 calculation. As a result,
 it may be useful to experiment with the parameter. You may wish to use
-the get_slack_estimate() function to help with this experimentation.
+the get_slack_estimate() function to help with this experimentation, or
+let the container adjust the slack itself with set_auto_tuning().
 
 \note The non-bonded list will contain pairs that are further than
 `distance_cutoff` apart. If you use an IMP::PairScore with the generated
@@ -117,6 +118,37 @@ class IMPCONTAINEREXPORT ClosePairContainer :
   /** Get the number of times this container has performed a partial
       recomputation of its contents. */
   unsigned int get_number_of_partial_rebuilds() const;
+  /** Get the mean number of pairs in the container over all
+      update calls. */
+  double get_mean_number_of_pairs() const;
+  /** Get the total wall-clock time, in seconds, spent updating the
+      contents of this container. */
+  double get_update_time() const;
+  /** Get the total wall-clock time, in seconds, spent evaluating the
+      model after this container was updated. */
+  double get_evaluation_time() const;
+  //! Get the close pairs finder currently used
+  core::ClosePairsFinder *get_close_pairs_finder() const;
+
+  //! Adapt the slack and the close pairs finder to the measured cost
+  /** When tuning is on, the total wall-clock time spent updating the
+      container and evaluating the model is averaged over each window of
+      `window` evaluations. The first few windows compare the passed
+      close pairs finder with the grid and (if CGAL is available) box
+      sweep finders, and the cheapest one is kept. After that, the slack
+      is moved up or down after each window, turning around with a
+      smaller step whenever the cost goes up, so that it follows the
+      best value as the optimization proceeds. The slack stays within
+      the range set by set_slack_range().
+
+      \note The contents of the container, and so the order in which
+      pairs are scored, then depend on timings, so runs are no longer
+      exactly reproducible.
+   */
+  void set_auto_tuning(bool tf, unsigned int window = 100);
+  bool get_auto_tuning() const;
+  //! Set the range of slack values tried when auto tuning
+  void set_slack_range(double min_slack, double max_slack);
 
  private:
   virtual std::size_t do_get_contents_hash() const IMP_OVERRIDE;
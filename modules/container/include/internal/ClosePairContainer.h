@@ -19,6 +19,7 @@
 #include <IMP/SingletonContainer.h>
 #include <IMP/internal/ContainerScoreState.h>
 #include <IMP/internal/ListLikeContainer.h>
+#include <boost/date_time/posix_time/posix_time_types.hpp>
 
 IMPCONTAINER_BEGIN_INTERNAL_NAMESPACE
 
@@ -34,6 +35,22 @@ class IMPCONTAINEREXPORT ClosePairContainer
   typedef IMP::internal::ContainerScoreState<ClosePairContainer> SS;
   PointerMember<SS> score_state_;
 
+  // timing statistics, in seconds
+  double update_time_, evaluation_time_, last_update_time_;
+  double pairs_sum_;
+  boost::posix_time::ptime evaluation_start_;
+  bool evaluating_;
+
+  // automatic tuning of the slack and the close pairs finder
+  bool tuning_;
+  unsigned int window_, window_evaluations_;
+  double window_time_, last_cost_, slack_factor_;
+  double min_slack_, max_slack_;
+  // slack chosen by the tuner, applied before the next update (-1 if none)
+  double pending_slack_;
+  Vector<PointerMember<core::ClosePairsFinder> > finders_;
+  Floats finder_costs_;
+
   void initialize(SingletonContainer *c, double distance, double slack,
                   core::ClosePairsFinder *cpf);
 
@@ -42,6 +59,8 @@ class IMPCONTAINEREXPORT ClosePairContainer
   void do_first_call();
   void do_incremental();
   void do_rebuild();
+  void setup_finders();
+  void do_tune();
 
  public:
   ModelObjectsTemp get_score_state_inputs() const;
@@ -49,7 +68,7 @@ class IMPCONTAINEREXPORT ClosePairContainer
   virtual ParticleIndexPairs get_range_indexes() const IMP_OVERRIDE;
   virtual ModelObjectsTemp do_get_inputs() const IMP_OVERRIDE;
   void do_score_state_before_evaluate();
-  void do_score_state_after_evaluate() {}
+  void do_score_state_after_evaluate();
 
   ClosePairContainer(SingletonContainer *c, double distance,
                      core::ClosePairsFinder *cpf, double slack = 1,
@@ -93,6 +112,14 @@ class IMPCONTAINEREXPORT ClosePairContainer
   unsigned int get_number_of_partial_rebuilds() const {
     return partial_rebuilds_;
   }
+  double get_mean_number_of_pairs() const {
+    return updates_ == 0 ? 0. : pairs_sum_ / updates_;
+  }
+  double get_update_time() const { return update_time_; }
+  double get_evaluation_time() const { return evaluation_time_; }
+  void set_auto_tuning(bool tf, unsigned int window = 100);
+  bool get_auto_tuning() const { return tuning_; }
+  void set_slack_range(double min_slack, double max_slack);
 
   IMP_OBJECT_METHODS(ClosePairContainer);
 };
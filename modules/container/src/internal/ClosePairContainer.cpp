@@ -16,12 +16,24 @@
 #include <boost/unordered_set.hpp>
 #include <IMP/utility.h>
 #include <algorithm>
+#include <cmath>
+#include <typeinfo>
 
 #include <IMP/core/RigidClosePairsFinder.h>
 #include <IMP/core/rigid_bodies.h>
 
 IMPCONTAINER_BEGIN_INTERNAL_NAMESPACE
 
+namespace {
+double get_seconds_since(const boost::posix_time::ptime &start) {
+  return (boost::posix_time::microsec_clock::universal_time() - start)
+             .total_microseconds() /
+         1e6;
+}
+
+// the slack is changed by at least this factor when tuning
+const double min_slack_factor = 1.1;
+}
 
 IMP_LIST_IMPL(ClosePairContainer, PairFilter, pair_filter, PairFilter *,
               PairFilters);
@@ -50,16 +62,117 @@ void ClosePairContainer::initialize(SingletonContainer *c, double distance,
   updates_ = 0;
   rebuilds_ = 0;
   partial_rebuilds_ = 0;
+  update_time_ = evaluation_time_ = last_update_time_ = 0.;
+  pairs_sum_ = 0.;
+  evaluating_ = false;
+  tuning_ = false;
+  window_ = 100;
+  window_evaluations_ = 0;
+  window_time_ = 0.;
+  last_cost_ = -1.;
+  slack_factor_ = 1.5;
+  min_slack_ = 0.1;
+  max_slack_ = std::max(4. * slack, 10.);
+  pending_slack_ = -1.;
+  finders_.clear();
+  finder_costs_.clear();
 }
 
 void ClosePairContainer::set_slack(double s) {
+  pending_slack_ = -1.;
   slack_ = s;
   cpf_->set_distance(distance_ + 2 * slack_);
+  moved_->set_threshold(slack_);
   ParticleIndexPairs et;
   swap(et);
   first_call_ = true;
 }
 
+void ClosePairContainer::set_auto_tuning(bool tf, unsigned int window) {
+  IMP_USAGE_CHECK(window > 0, "The tuning window must not be empty");
+  tuning_ = tf;
+  window_ = window;
+  window_evaluations_ = 0;
+  window_time_ = 0.;
+  last_cost_ = -1.;
+  pending_slack_ = -1.;
+  finders_.clear();
+  finder_costs_.clear();
+  if (tuning_) setup_finders();
+}
+
+void ClosePairContainer::set_slack_range(double min_slack, double max_slack) {
+  IMP_USAGE_CHECK(min_slack > 0 && min_slack <= max_slack,
+                  "Invalid slack range " << min_slack << " to " << max_slack);
+  min_slack_ = min_slack;
+  max_slack_ = max_slack;
+}
+
+void ClosePairContainer::setup_finders() {
+  // try the grid and box sweep engines as well as the passed finder,
+  // keeping the rigid body handling if the passed finder has it
+  finders_.push_back(cpf_);
+  bool rigid = dynamic_cast<core::RigidClosePairsFinder *>(cpf_.get());
+  Vector<Pointer<core::ClosePairsFinder> > engines;
+  engines.push_back(new core::GridClosePairsFinder());
+#ifdef IMP_CORE_USE_IMP_CGAL
+  engines.push_back(new core::BoxSweepClosePairsFinder());
+#endif
+  for (unsigned int i = 0; i < engines.size(); ++i) {
+    if (rigid) {
+      finders_.push_back(new core::RigidClosePairsFinder(engines[i]));
+    } else if (typeid(*engines[i]) != typeid(*cpf_)) {
+      finders_.push_back(engines[i]);
+    } else {
+      engines[i]->set_was_used(true);
+    }
+  }
+}
+
+void ClosePairContainer::do_tune() {
+  double cost = window_time_ / window_evaluations_;
+  window_time_ = 0.;
+  window_evaluations_ = 0;
+  if (finder_costs_.size() < finders_.size()) {
+    // first run each close pairs finder for a window at the starting slack
+    finder_costs_.push_back(cost);
+    IMP_LOG_TERSE("Cost with " << cpf_->get_name() << " is " << cost
+                               << "s per evaluation" << std::endl);
+    if (finder_costs_.size() < finders_.size()) {
+      cpf_ = finders_[finder_costs_.size()];
+    } else {
+      unsigned int best = std::min_element(finder_costs_.begin(),
+                                           finder_costs_.end()) -
+                          finder_costs_.begin();
+      cpf_ = finders_[best];
+      last_cost_ = finder_costs_[best];
+      pending_slack_ = std::min(max_slack_, std::max(min_slack_, slack_));
+    }
+    first_call_ = true;
+    return;
+  }
+  // then follow the total cost downhill by changing the slack
+  if (last_cost_ >= 0 && cost > last_cost_) {
+    // overshot; turn around with a smaller step
+    double step = slack_factor_ > 1. ? slack_factor_ : 1. / slack_factor_;
+    step = std::max(min_slack_factor, std::sqrt(step));
+    slack_factor_ = slack_factor_ > 1. ? 1. / step : step;
+  }
+  last_cost_ = cost;
+  double slack =
+      std::min(max_slack_, std::max(min_slack_, slack_ * slack_factor_));
+  if (slack == slack_) {
+    // at the edge of the allowed range
+    slack_factor_ = 1. / slack_factor_;
+    slack = std::min(max_slack_, std::max(min_slack_, slack_ * slack_factor_));
+  }
+  IMP_LOG_TERSE("Cost with slack " << slack_ << " is " << cost
+                                   << "s per evaluation, trying " << slack
+                                   << std::endl);
+  // set_slack() empties the list, so it is left alone until the next update
+  pending_slack_ = slack;
+}
+
 ModelObjectsTemp ClosePairContainer::do_get_inputs() const {
   ModelObjectsTemp ret;
   ret.push_back(c_);
@@ -231,6 +344,9 @@ void ClosePairContainer::do_score_state_before_evaluate() {
   IMP_CHECK_OBJECT(cpf_);
   set_was_used(true);
   ++updates_;
+  boost::posix_time::ptime start =
+      boost::posix_time::microsec_clock::universal_time();
+  if (pending_slack_ >= 0.) set_slack(pending_slack_);
   try {
     IMP_LOG_TERSE("Moved count is " << moved_->get_access().size()
                                     << std::endl);
@@ -256,6 +372,23 @@ void ClosePairContainer::do_score_state_before_evaluate() {
                   << "slack or reformulate the problem.",
               ValueException);
   }
+  last_update_time_ = get_seconds_since(start);
+  update_time_ += last_update_time_;
+  pairs_sum_ += get_access().size();
+  evaluation_start_ = boost::posix_time::microsec_clock::universal_time();
+  evaluating_ = true;
+}
+
+void ClosePairContainer::do_score_state_after_evaluate() {
+  // Model::update() calls only the before_evaluate part
+  if (!evaluating_) return;
+  evaluating_ = false;
+  double evaluation_time = get_seconds_since(evaluation_start_);
+  evaluation_time_ += evaluation_time;
+  if (tuning_) {
+    window_time_ += last_update_time_ + evaluation_time;
+    if (++window_evaluations_ >= window_) do_tune();
+  }
 }
 
 ParticleIndexPairs ClosePairContainer::get_range_indexes() const {
@@ -69,5 +69,55 @@ class Tests(IMP.test.TestCase):
             ) + cpss.get_number_of_partial_rebuilds(
             ),
             2)
+
+    def test_auto_tuning(self):
+        """Test ClosePairContainer with automatic tuning"""
+        m = IMP.Model()
+        ps = IMP.get_indexes(self.create_particles_in_box(m, 50))
+        for p in ps:
+            IMP.core.XYZR.setup_particle(m, p, 1)
+        pc = IMP.container.ListSingletonContainer(m, ps)
+        cpss = IMP.container.ClosePairContainer(pc, 0., 1.)
+        cpss.set_auto_tuning(True, 3)
+        cpss.set_slack_range(.5, 8.)
+        self.assertTrue(cpss.get_auto_tuning())
+        ssps = IMP.core.SoftSpherePairScore(1.)
+        r = IMP.container.PairsRestraint(ssps, cpss)
+        ref = IMP.container.PairsRestraint(
+            ssps, IMP.container.AllPairContainer(pc))
+        slacks = set()
+        for i in range(60):
+            for p in ps:
+                d = IMP.core.XYZ(m, p)
+                d.set_coordinates(d.get_coordinates()
+                                  + IMP.algebra.get_random_vector_in(
+                                      IMP.algebra.Sphere3D(
+                                          IMP.algebra.get_zero_vector_3d(),
+                                          .5)))
+            self.assertAlmostEqual(r.evaluate(False), ref.evaluate(False),
+                                   delta=1e-6)
+            # a new slack is only applied at the next update, so the
+            # contents stay valid between evaluations
+            pairs = set(tuple(sorted(p.get_index() for p in pp))
+                        for pp in cpss.get_indexes())
+            self.assertGreater(len(pairs), 0)
+            for i in range(len(ps)):
+                for j in range(i):
+                    d = IMP.core.get_distance(IMP.core.XYZR(m, ps[i]),
+                                              IMP.core.XYZR(m, ps[j]))
+                    if d < 0.:
+                        self.assertIn(tuple(sorted((ps[i].get_index(),
+                                                    ps[j].get_index()))),
+                                      pairs)
+            slacks.add(cpss.get_slack())
+        self.assertGreater(len(slacks), 1)
+        for s in slacks:
+            self.assertTrue(.5 <= s <= 8.)
+        self.assertEqual(cpss.get_number_of_update_calls(), 60)
+        self.assertGreater(cpss.get_mean_number_of_pairs(), 0.)
+        self.assertGreaterEqual(cpss.get_update_time(), 0.)
+        self.assertGreaterEqual(cpss.get_evaluation_time(), 0.)
+        self.assertTrue(cpss.get_close_pairs_finder().get_name())
+
 if __name__ == '__main__':
     IMP.test.main()
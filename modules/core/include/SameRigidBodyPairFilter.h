@@ -0,0 +1,38 @@
+/**
+ *  \file IMP/core/SameRigidBodyPairFilter.h
+ *  \brief Filter pairs of particles in the same rigid body.
+ *
+ *  Copyright 2007-2017 IMP Inventors. All rights reserved.
+ */
+
+#ifndef IMPCORE_SAME_RIGID_BODY_PAIR_FILTER_H
+#define IMPCORE_SAME_RIGID_BODY_PAIR_FILTER_H
+
+#include <IMP/core/core_config.h>
+#include <IMP/PairPredicate.h>
+#include <IMP/pair_macros.h>
+
+IMPCORE_BEGIN_NAMESPACE
+
+//! Predicate pairs of particles that are rigid members of the same rigid body.
+/** These pairs never move relative to each other, so they are skipped by
+    RigidClosePairsFinder. Use this filter to skip them as well where
+    close pairs are found without it, eg in
+    IncrementalScoringFunction::add_close_pair_score(). Non-rigid members
+    are not filtered.
+*/
+class IMPCOREEXPORT SameRigidBodyPairFilter : public PairPredicate {
+ public:
+  SameRigidBodyPairFilter(std::string name = "SameRigidBodyPairFilter%1%");
+  virtual int get_value_index(Model *m,
+                              const ParticleIndexPair &p) const
+      IMP_OVERRIDE;
+  virtual ModelObjectsTemp do_get_inputs(
+      Model *m, const ParticleIndexes &pis) const IMP_OVERRIDE;
+  IMP_PAIR_PREDICATE_METHODS(SameRigidBodyPairFilter);
+  IMP_OBJECT_METHODS(SameRigidBodyPairFilter);
+};
+
+IMPCORE_END_NAMESPACE
+
+#endif /* IMPCORE_SAME_RIGID_BODY_PAIR_FILTER_H */
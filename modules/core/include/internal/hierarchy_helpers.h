@@ -60,6 +60,16 @@ struct HierarchyData {
   ObjectKey cache_key_;
 };
 
+//! Return a counter that is increased whenever a hierarchy in a model changes
+/** Adding or removing children (or representations, in IMP.atom)
+    increases the counter, so data cached about a hierarchy can be
+    invalidated by comparing it with the value when the cache was built.
+    The counter may be read and increased from several threads. */
+IMPCOREEXPORT unsigned int get_hierarchy_age(Model *m);
+
+//! Note that the structure of a hierarchy in the model changed
+IMPCOREEXPORT void increment_hierarchy_age(Model *m);
+
 IMPCORE_END_INTERNAL_NAMESPACE
 
 #endif /* IMPCORE_INTERNAL_HIERARCHY_HELPERS_H */
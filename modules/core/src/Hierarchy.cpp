@@ -7,6 +7,8 @@
  */
 
 #include <IMP/core/Hierarchy.h>
+#include <IMP/object_macros.h>
+#include <IMP/thread_macros.h>
 
 #include <sstream>
 
@@ -22,6 +24,45 @@ HierarchyTraits::HierarchyTraits(std::string name) {
   children_ = ParticleIndexesKey((name + "_children").c_str());
 }
 
+namespace internal {
+namespace {
+// The age is kept with the Model, so that changes to one model do not
+// invalidate data cached about hierarchies in another
+class HierarchyAge : public Object {
+ public:
+  unsigned int age;
+  HierarchyAge() : Object("HierarchyAge%1%"), age(0) {}
+  IMP_OBJECT_METHODS(HierarchyAge);
+};
+
+ModelKey get_hierarchy_age_key() {
+  static ModelKey key("hierarchy age");
+  return key;
+}
+}
+
+unsigned int get_hierarchy_age(Model *m) {
+  ModelKey key = get_hierarchy_age_key();
+  unsigned int ret = 0;
+  IMP_OMP_PRAGMA(critical(imp_hierarchy_age)) {
+    if (m->get_has_data(key)) {
+      ret = static_cast<HierarchyAge *>(m->get_data(key))->age;
+    }
+  }
+  return ret;
+}
+
+void increment_hierarchy_age(Model *m) {
+  ModelKey key = get_hierarchy_age_key();
+  IMP_OMP_PRAGMA(critical(imp_hierarchy_age)) {
+    if (!m->get_has_data(key)) {
+      m->add_data(key, new HierarchyAge());
+    }
+    ++static_cast<HierarchyAge *>(m->get_data(key))->age;
+  }
+}
+}
+
 void Hierarchy::show(std::ostream &out) const { out << "Hierarchy"; }
 
 int Hierarchy::get_child_index() const {
@@ -0,0 +1,30 @@
+/**
+ *  \file SameRigidBodyPairFilter.cpp
+ *  \brief Filter pairs of particles in the same rigid body.
+ *
+ *  Copyright 2007-2017 IMP Inventors. All rights reserved.
+ *
+ */
+
+#include "IMP/core/SameRigidBodyPairFilter.h"
+#include "IMP/core/rigid_bodies.h"
+
+IMPCORE_BEGIN_NAMESPACE
+
+SameRigidBodyPairFilter::SameRigidBodyPairFilter(std::string name)
+    : PairPredicate(name) {}
+
+int SameRigidBodyPairFilter::get_value_index(
+    Model *m, const ParticleIndexPair &p) const {
+  return RigidMember::get_is_setup(m, p[0]) &&
+         RigidMember::get_is_setup(m, p[1]) &&
+         RigidMember(m, p[0]).get_rigid_body() ==
+             RigidMember(m, p[1]).get_rigid_body();
+}
+
+ModelObjectsTemp SameRigidBodyPairFilter::do_get_inputs(
+    Model *m, const ParticleIndexes &pis) const {
+  return IMP::get_particles(m, pis);
+}
+
+IMPCORE_END_NAMESPACE
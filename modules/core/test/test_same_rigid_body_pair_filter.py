@@ -0,0 +1,43 @@
+from __future__ import print_function
+import IMP
+import IMP.test
+import IMP.core
+import IMP.algebra
+
+
+class Tests(IMP.test.TestCase):
+
+    def test_filter(self):
+        """Test SameRigidBodyPairFilter"""
+        m = IMP.Model()
+        bb = IMP.algebra.BoundingBox3D(IMP.algebra.Vector3D(0, 0, 0),
+                                       IMP.algebra.Vector3D(10, 10, 10))
+        ps = [m.add_particle("p%d" % i) for i in range(8)]
+        for p in ps:
+            IMP.core.XYZR.setup_particle(
+                m, p, IMP.algebra.Sphere3D(
+                    IMP.algebra.get_random_vector_in(bb), 1))
+        rb0 = IMP.core.RigidBody.setup_particle(m, m.add_particle("rb0"),
+                                                ps[0:3])
+        IMP.core.RigidBody.setup_particle(m, m.add_particle("rb1"), ps[3:5])
+        rb0.add_non_rigid_member(ps[5])
+        f = IMP.core.SameRigidBodyPairFilter()
+        self.assertEqual(f.get_value_index(m, (ps[0], ps[1])), 1)
+        self.assertEqual(f.get_value_index(m, (ps[3], ps[4])), 1)
+        self.assertEqual(f.get_value_index(m, (ps[0], ps[3])), 0)
+        self.assertEqual(f.get_value_index(m, (ps[0], ps[5])), 0)
+        self.assertEqual(f.get_value_index(m, (ps[0], ps[6])), 0)
+        self.assertEqual(f.get_value_index(m, (ps[6], ps[7])), 0)
+
+        # the pairs left are the ones RigidClosePairsFinder finds
+        cpf = IMP.core.RigidClosePairsFinder()
+        cpf.set_distance(100.)
+        found = set(tuple(sorted(p.get_index() for p in pp))
+                    for pp in cpf.get_close_pairs(m, ps))
+        kept = set((ps[i].get_index(), ps[j].get_index())
+                   for i in range(len(ps)) for j in range(i + 1, len(ps))
+                   if not f.get_value_index(m, (ps[i], ps[j])))
+        self.assertEqual(found, kept)
+
+if __name__ == '__main__':
+    IMP.test.main()
@@ -35,6 +35,7 @@ class IMPDOMINOEXPORT DominoSampler : public DiscreteSampler {
   MergeTree mt_;
   bool has_mt_;
   bool csf_;
+  double memory_budget_;
   mutable internal::InferenceStatistics stats_;
 
  public:
@@ -61,6 +62,18 @@ class IMPDOMINOEXPORT DominoSampler : public DiscreteSampler {
   */
   void set_use_cross_subset_filtering(bool tf) { csf_ = tf; }
 
+  //! Limit the memory used by the tables of the merge tree
+  /** While the table of assignments for a subtree of the merge tree is
+      built, it is kept in memory until it takes more than the given number
+      of megabytes. As soon as it does, it and any assignments added later
+      are written to a compressed temporary file (with a
+      WriteCompressedAssignmentContainer), which is read back when the
+      table is merged. 0, the default, keeps all tables in memory.
+   */
+  void set_assignments_memory_budget(double megabytes) {
+    memory_budget_ = megabytes;
+  }
+
   /** \name Statistics
       If you specify the merge tree explicitly, you can query
       for statistics about particular nodes in the merge tree.
@@ -71,6 +84,9 @@ class IMPDOMINOEXPORT DominoSampler : public DiscreteSampler {
       const;
   //! Return a few subset states from that merge
   Assignments get_sample_assignments_for_vertex(unsigned int tree_vertex) const;
+  //! Get the wall-clock time in seconds spent on that vertex of the tree
+  /** This does not include the time spent on its children. */
+  double get_time_for_vertex(unsigned int tree_vertex) const;
   /** @} */
 
   /** \name Interactive mode
@@ -22,7 +22,9 @@
 #include <boost/random/uniform_int.hpp>
 #include <boost/random/uniform_real.hpp>
 #include <boost/shared_array.hpp>
+#include <boost/cstdint.hpp>
 #include <cstdio>
+#include <fstream>
 #include <queue>
 
 #if IMP_DOMINO_HAS_RMF
@@ -298,6 +300,86 @@ class IMPDOMINOEXPORT ReadAssignmentContainer : public AssignmentContainer {
   IMP_OBJECT_METHODS(ReadAssignmentContainer);
 };
 
+//! Store the assignments on disk in compressed chunks.
+/** Assignments are grouped into chunks of a fixed number of assignments.
+    Each assignment is stored as the difference from the previous one in
+    its chunk, using a variable-length encoding in which a run of unchanged
+    values takes a marker byte plus the length of the run (usually one
+    byte), so that the tables generated by merging typically take a small
+    fraction of the space of a WriteAssignmentContainer. Only one chunk is
+    kept in memory.
+
+    Use a ReadCompressedAssignmentContainer to read them back, after this
+    container has been destroyed. As with WriteAssignmentContainer, the file
+    is not guaranteed to work on other platforms.
+ */
+class IMPDOMINOEXPORT WriteCompressedAssignmentContainer
+    : public AssignmentContainer {
+  std::ofstream out_;
+  Order order_;
+  unsigned int chunk_size_;
+  Ints chunk_;
+  std::vector<boost::uint64_t> offsets_;
+  boost::uint64_t position_;
+  unsigned int number_;
+  void flush();
+  virtual void do_destroy() IMP_OVERRIDE;
+
+ public:
+  WriteCompressedAssignmentContainer(
+      std::string out_file, const Subset &s,
+      const ParticlesTemp &all_particles,
+      std::string name = "WriteCompressedAssignmentContainer %1%");
+  //! Set the number of assignments in each compressed chunk
+  /** This can only be changed before any assignments are added. */
+  void set_chunk_size(unsigned int assignments);
+  virtual unsigned int get_number_of_assignments() const IMP_OVERRIDE;
+  virtual Assignment get_assignment(unsigned int i) const IMP_OVERRIDE;
+  virtual void add_assignment(const Assignment &a) IMP_OVERRIDE;
+  IMP_ASSIGNMENT_CONTAINER_METHODS(WriteCompressedAssignmentContainer);
+  IMP_OBJECT_METHODS(WriteCompressedAssignmentContainer);
+};
+
+//! Read assignments written by a WriteCompressedAssignmentContainer.
+/** Any assignment can be read without decompressing the whole file;
+    get_assignment() keeps the last chunk used in memory, so reading the
+    assignments in order is efficient.
+
+    get_assignments() and get_particle_assignments() stream through the
+    file with their own file handle and buffers, so several threads can
+    call them on the same container at the same time (get_assignment()
+    should not be used concurrently).
+ */
+class IMPDOMINOEXPORT ReadCompressedAssignmentContainer
+    : public AssignmentContainer {
+  std::string file_name_;
+  mutable std::ifstream in_;
+  Order order_;
+  unsigned int width_;
+  unsigned int chunk_size_;
+  unsigned int size_;
+  // start of each chunk in the file, followed by the end of the last one
+  std::vector<boost::uint64_t> offsets_;
+  mutable Ints cache_;
+  mutable int cache_chunk_;
+  void read_chunk(std::istream &in, unsigned int chunk, Ints &out) const;
+
+ public:
+  ReadCompressedAssignmentContainer(
+      std::string in_file, const Subset &s,
+      const ParticlesTemp &all_particles,
+      std::string name = "ReadCompressedAssignmentContainer %1%");
+  virtual unsigned int get_number_of_assignments() const IMP_OVERRIDE;
+  virtual Assignment get_assignment(unsigned int i) const IMP_OVERRIDE;
+  virtual Assignments get_assignments(IntRange r) const IMP_OVERRIDE;
+  virtual Assignments get_assignments() const IMP_OVERRIDE;
+  virtual void add_assignment(const Assignment &a) IMP_OVERRIDE;
+  virtual void add_assignments(const Assignments &asgn) IMP_OVERRIDE;
+  virtual Ints get_particle_assignments(unsigned int index) const
+      IMP_OVERRIDE;
+  IMP_OBJECT_METHODS(ReadCompressedAssignmentContainer);
+};
+
 //! Expose a range [begin, end) of an inner assignment container to consumers.
 /** One cannot add assignments to this container.
  */
@@ -33,6 +33,7 @@ IMPDOMINO_BEGIN_INTERNAL_NAMESPACE
 class IMPDOMINOEXPORT InferenceStatistics {
   struct Data {
     int size;
+    double time;
     Assignments sample;
   };
   Data get_data(const Subset &s, AssignmentContainer *ss) const;
@@ -43,8 +44,11 @@ class IMPDOMINOEXPORT InferenceStatistics {
 
  public:
   InferenceStatistics();
-  void add_subset(const Subset &s, AssignmentContainer *ss);
+  //! Record the assignments found for s, and the seconds it took
+  void add_subset(const Subset &s, AssignmentContainer *ss,
+                  double seconds = 0.);
   unsigned int get_number_of_assignments(Subset subset) const;
+  double get_time(Subset subset) const;
   Assignments get_sample_assignments(Subset subset) const;
   ~InferenceStatistics();
 };
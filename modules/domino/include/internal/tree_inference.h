@@ -33,11 +33,13 @@ IMPDOMINOEXPORT void load_leaf_assignments(const Subset &merged_subset,
                                            InferenceStatistics *stats,
                                            AssignmentContainer *out);
 
+/** Tables of assignments for subtrees that take more than memory_budget
+    bytes are kept on disk until they are merged (0 means no limit). */
 IMPDOMINOEXPORT void load_best_conformations(
     const MergeTree &jt, int root, const Subset &all_particles,
     const SubsetFilterTables &filters, const AssignmentsTable *states,
     ListSubsetFilterTable *lsft, InferenceStatistics *stats, unsigned int max,
-    AssignmentContainer *out);
+    AssignmentContainer *out, size_t memory_budget = 0);
 
 IMPDOMINO_END_INTERNAL_NAMESPACE
 
@@ -21,10 +21,15 @@ IMPDOMINO_BEGIN_NAMESPACE
 
 DominoSampler::DominoSampler(Model *m, ParticleStatesTable *pst,
                              std::string name)
-    : DiscreteSampler(m, pst, name), has_mt_(false), csf_(false) {}
+    : DiscreteSampler(m, pst, name),
+      has_mt_(false),
+      csf_(false),
+      memory_budget_(0.) {}
 
 DominoSampler::DominoSampler(Model *m, std::string name)
-    : DiscreteSampler(m, new ParticleStatesTable(), name), csf_(false) {}
+    : DiscreteSampler(m, new ParticleStatesTable(), name),
+      csf_(false),
+      memory_budget_(0.) {}
 
 template <class G>
 void check_graph(const G &jt, Subset known_particles) {
@@ -95,7 +100,9 @@ Assignments DominoSampler::do_get_sample_assignments(
     as->set_was_used(true);
     internal::load_best_conformations(mt, boost::num_vertices(mt) - 1,
                                       known_particles, sfts, sst, lsft, &stats_,
-                                      get_maximum_number_of_assignments(), as);
+                                      get_maximum_number_of_assignments(), as,
+                                      static_cast<size_t>(memory_budget_ *
+                                                          1024 * 1024));
     final_solutions =
         as->get_assignments(IntRange(0, as->get_number_of_assignments()));
     IMP_LOG_TERSE("domino::DominoSampler end get_best_conformations\n");
@@ -132,6 +139,14 @@ Assignments DominoSampler::get_sample_assignments_for_vertex(
   return stats_.get_sample_assignments(subset_map[tree_vertex]);
 }
 
+double DominoSampler::get_time_for_vertex(unsigned int tree_vertex) const {
+  IMP_USAGE_CHECK(has_mt_, "Can only query statistics of the merge tree"
+                               << " if you set one.");
+  boost::property_map<MergeTree, boost::vertex_name_t>::const_type subset_map =
+      boost::get(boost::vertex_name, mt_);
+  return stats_.get_time(subset_map[tree_vertex]);
+}
+
 Assignments DominoSampler::get_vertex_assignments(
     unsigned int node_index, unsigned int max_states) const {
   IMP_NEW(PackedAssignmentContainer, ret, ());
@@ -310,6 +310,290 @@ void ReadAssignmentContainer::add_assignment(const Assignment &) {
   IMP_NOT_IMPLEMENTED;
 }
 
+////////////////////////// Compressed containers
+
+namespace {
+const boost::uint32_t compressed_magic = 0x494d5041;
+// number of assignments, width, chunk size, index offset and magic number
+const int compressed_footer_size = 8 + 4 + 4 + 8 + 4;
+
+void write_varint(boost::uint64_t v, std::string &out) {
+  while (v >= 0x80) {
+    out.push_back(static_cast<char>((v & 0x7f) | 0x80));
+    v >>= 7;
+  }
+  out.push_back(static_cast<char>(v));
+}
+
+boost::uint64_t read_varint(const unsigned char *&p, const unsigned char *end) {
+  boost::uint64_t ret = 0;
+  for (int shift = 0; p != end; shift += 7) {
+    unsigned char c = *p++;
+    ret |= static_cast<boost::uint64_t>(c & 0x7f) << shift;
+    if (!(c & 0x80)) return ret;
+  }
+  IMP_THROW("Truncated chunk in compressed assignments", IOException);
+}
+
+/* Each value is stored as the difference from the same value in the
+   previous row of the chunk, zigzag and varint encoded. A non-zero
+   difference is encoded as a positive number, whose varint never starts
+   with a zero byte, so a zero byte is free to mark a run of zero
+   differences. It is followed by the length of the run minus one, also
+   varint encoded. */
+void encode_chunk(const Ints &data, unsigned int width, std::string &out) {
+  out.clear();
+  boost::uint64_t zeros = 0;
+  for (unsigned int i = 0; i < data.size(); ++i) {
+    boost::int64_t prev = i >= width ? data[i - width] : 0;
+    boost::int64_t delta = data[i] - prev;
+    if (delta == 0) {
+      ++zeros;
+      continue;
+    }
+    if (zeros > 0) {
+      out.push_back(0);
+      write_varint(zeros - 1, out);
+      zeros = 0;
+    }
+    write_varint(delta > 0 ? 2 * delta : -2 * delta - 1, out);
+  }
+  if (zeros > 0) {
+    out.push_back(0);
+    write_varint(zeros - 1, out);
+  }
+}
+
+void decode_chunk(const std::string &in, unsigned int width, unsigned int n,
+                  Ints &out) {
+  out.resize(n);
+  const unsigned char *p = reinterpret_cast<const unsigned char *>(in.data());
+  const unsigned char *end = p + in.size();
+  unsigned int i = 0;
+  while (i < n) {
+    boost::uint64_t v = read_varint(p, end);
+    if (v == 0) {
+      boost::uint64_t zeros = read_varint(p, end) + 1;
+      if (zeros > n - i) {
+        IMP_THROW("Corrupt chunk in compressed assignments", IOException);
+      }
+      for (; zeros > 0; --zeros, ++i) {
+        out[i] = i >= width ? out[i - width] : 0;
+      }
+    } else {
+      boost::int64_t delta = (v & 1) ? -static_cast<boost::int64_t>((v + 1) / 2)
+                                     : static_cast<boost::int64_t>(v / 2);
+      out[i] = (i >= width ? out[i - width] : 0) + delta;
+      ++i;
+    }
+  }
+}
+
+template <class T>
+void write_value(std::ostream &out, T value) {
+  out.write(reinterpret_cast<const char *>(&value), sizeof(T));
+}
+
+template <class T>
+T read_value(std::istream &in) {
+  T value;
+  in.read(reinterpret_cast<char *>(&value), sizeof(T));
+  return value;
+}
+}
+
+WriteCompressedAssignmentContainer::WriteCompressedAssignmentContainer(
+    std::string out_file, const Subset &s,
+    const ParticlesTemp &all_particles, std::string name)
+    : AssignmentContainer(name),
+      out_(out_file.c_str(), std::ios::binary | std::ios::trunc),
+      order_(s, all_particles),
+      chunk_size_(4096),
+      position_(0),
+      number_(0) {
+  if (!out_) {
+    IMP_THROW("Unable to open file " << out_file << " for writing",
+              IOException);
+  }
+}
+
+void WriteCompressedAssignmentContainer::set_chunk_size(
+    unsigned int assignments) {
+  IMP_USAGE_CHECK(number_ == 0,
+                  "Can only set the chunk size before adding assignments");
+  IMP_USAGE_CHECK(assignments > 0, "Chunks cannot be empty");
+  chunk_size_ = assignments;
+}
+
+unsigned int WriteCompressedAssignmentContainer::get_number_of_assignments()
+    const {
+  return number_;
+}
+
+Assignment WriteCompressedAssignmentContainer::get_assignment(unsigned int)
+    const {
+  IMP_NOT_IMPLEMENTED;
+}
+
+void WriteCompressedAssignmentContainer::add_assignment(const Assignment &a) {
+  IMP_USAGE_CHECK(a.size() == order_.size(),
+                  "Sizes don't match: " << a.size() << " vs " << order_.size());
+  Ints ret = order_.get_list_ordered(a);
+  chunk_.insert(chunk_.end(), ret.begin(), ret.end());
+  ++number_;
+  if (chunk_.size() >= chunk_size_ * order_.size()) flush();
+}
+
+void WriteCompressedAssignmentContainer::flush() {
+  set_was_used(true);
+  if (chunk_.empty()) return;
+  std::string buffer;
+  encode_chunk(chunk_, order_.size(), buffer);
+  IMP_LOG_VERBOSE("Compressed " << chunk_.size() << " values into "
+                                << buffer.size() << " bytes" << std::endl);
+  offsets_.push_back(position_);
+  out_.write(buffer.data(), buffer.size());
+  position_ += buffer.size();
+  chunk_.clear();
+}
+
+void WriteCompressedAssignmentContainer::do_destroy() {
+  flush();
+  for (unsigned int i = 0; i < offsets_.size(); ++i) {
+    write_value(out_, offsets_[i]);
+  }
+  write_value<boost::uint64_t>(out_, number_);
+  write_value<boost::uint32_t>(out_, order_.size());
+  write_value<boost::uint32_t>(out_, chunk_size_);
+  write_value<boost::uint64_t>(out_, position_);
+  write_value(out_, compressed_magic);
+  out_.close();
+}
+
+ReadCompressedAssignmentContainer::ReadCompressedAssignmentContainer(
+    std::string in_file, const Subset &s,
+    const ParticlesTemp &all_particles, std::string name)
+    : AssignmentContainer(name),
+      file_name_(in_file),
+      in_(in_file.c_str(), std::ios::binary),
+      order_(s, all_particles),
+      cache_chunk_(-1) {
+  if (!in_) {
+    IMP_THROW("Unable to open file " << in_file << " for reading",
+              IOException);
+  }
+  in_.seekg(-compressed_footer_size, std::ios::end);
+  boost::uint64_t size = read_value<boost::uint64_t>(in_);
+  width_ = read_value<boost::uint32_t>(in_);
+  chunk_size_ = read_value<boost::uint32_t>(in_);
+  boost::uint64_t index = read_value<boost::uint64_t>(in_);
+  if (!in_ || read_value<boost::uint32_t>(in_) != compressed_magic) {
+    IMP_THROW(in_file << " does not contain compressed assignments",
+              IOException);
+  }
+  IMP_USAGE_CHECK(width_ == order_.size(),
+                  "The file stores assignments of size "
+                      << width_ << " but the subset has " << order_.size()
+                      << " particles");
+  size_ = size;
+  unsigned int nchunks = (size_ + chunk_size_ - 1) / chunk_size_;
+  in_.seekg(index);
+  offsets_.resize(nchunks);
+  for (unsigned int i = 0; i < nchunks; ++i) {
+    offsets_[i] = read_value<boost::uint64_t>(in_);
+  }
+  offsets_.push_back(index);
+  IMP_LOG_TERSE("Opened compressed file with " << size_ << " assignments in "
+                                              << nchunks << " chunks"
+                                              << std::endl);
+}
+
+void ReadCompressedAssignmentContainer::read_chunk(std::istream &in,
+                                                   unsigned int chunk,
+                                                   Ints &out) const {
+  std::string buffer(offsets_[chunk + 1] - offsets_[chunk], '\0');
+  in.seekg(offsets_[chunk]);
+  if (!buffer.empty()) in.read(&buffer[0], buffer.size());
+  if (!in) {
+    IMP_THROW("Error reading " << file_name_, IOException);
+  }
+  unsigned int rows = std::min(chunk_size_, size_ - chunk * chunk_size_);
+  decode_chunk(buffer, width_, rows * width_, out);
+}
+
+unsigned int ReadCompressedAssignmentContainer::get_number_of_assignments()
+    const {
+  return size_;
+}
+
+Assignment ReadCompressedAssignmentContainer::get_assignment(unsigned int i)
+    const {
+  IMP_USAGE_CHECK(i < get_number_of_assignments(),
+                  "Not enough assignments: " << i);
+  int chunk = i / chunk_size_;
+  if (chunk != cache_chunk_) {
+    read_chunk(in_, chunk, cache_);
+    cache_chunk_ = chunk;
+  }
+  unsigned int row = i - chunk * chunk_size_;
+  return order_.get_subset_ordered(cache_.begin() + row * width_,
+                                   cache_.begin() + (row + 1) * width_);
+}
+
+Assignments ReadCompressedAssignmentContainer::get_assignments(IntRange r)
+    const {
+  IMP_USAGE_CHECK(r.first >= 0 && r.first <= r.second &&
+                      r.second <= static_cast<int>(size_),
+                  "Invalid range " << r.first << " - " << r.second);
+  Assignments ret(r.second - r.first);
+  if (ret.empty()) return ret;
+  std::ifstream in(file_name_.c_str(), std::ios::binary);
+  Ints buffer;
+  for (unsigned int chunk = r.first / chunk_size_;
+       chunk * chunk_size_ < static_cast<unsigned int>(r.second); ++chunk) {
+    read_chunk(in, chunk, buffer);
+    unsigned int first = std::max<int>(r.first, chunk * chunk_size_);
+    unsigned int last = std::min<unsigned int>(
+        r.second, (chunk + 1) * chunk_size_);
+    for (unsigned int i = first; i < last; ++i) {
+      unsigned int row = i - chunk * chunk_size_;
+      ret[i - r.first] =
+          order_.get_subset_ordered(buffer.begin() + row * width_,
+                                    buffer.begin() + (row + 1) * width_);
+    }
+  }
+  return ret;
+}
+
+Assignments ReadCompressedAssignmentContainer::get_assignments() const {
+  return get_assignments(IntRange(0, get_number_of_assignments()));
+}
+
+void ReadCompressedAssignmentContainer::add_assignment(const Assignment &) {
+  IMP_NOT_IMPLEMENTED;
+}
+
+void ReadCompressedAssignmentContainer::add_assignments(const Assignments &) {
+  IMP_NOT_IMPLEMENTED;
+}
+
+Ints ReadCompressedAssignmentContainer::get_particle_assignments(
+    unsigned int index) const {
+  IMP_USAGE_CHECK(index < width_, "Not a particle of the subset: " << index);
+  Ints ret(size_);
+  std::ifstream in(file_name_.c_str(), std::ios::binary);
+  Ints buffer;
+  for (unsigned int chunk = 0; chunk + 1 < offsets_.size(); ++chunk) {
+    read_chunk(in, chunk, buffer);
+    // buffer is in the stored order, so find the index in that order
+    unsigned int column = order_[index];
+    for (unsigned int row = 0; row * width_ < buffer.size(); ++row) {
+      ret[chunk * chunk_size_ + row] = buffer[row * width_ + column];
+    }
+  }
+  return ret;
+}
+
 ////////////////////////// RangeViewAssignmentContainer
 
 inline unsigned int RangeViewAssignmentContainer::get_number_of_assignments()
@@ -12,6 +12,8 @@
 #include <boost/graph/copy.hpp>
 #include <IMP/random.h>
 #include <IMP/log_macros.h>
+#include <IMP/threads.h>
+#include <IMP/thread_macros.h>
 #include <boost/pending/indirect_cmp.hpp>
 
 IMPDOMINO_BEGIN_INTERNAL_NAMESPACE
@@ -22,10 +24,9 @@ InferenceStatistics::InferenceStatistics()
 
 InferenceStatistics::Data InferenceStatistics::get_data(
     const Subset &, AssignmentContainer *iss) const {
-  Assignments ss =
-      iss->get_assignments(IntRange(0, iss->get_number_of_assignments()));
   Data ret;
   ret.size = iss->get_number_of_assignments();
+  ret.time = 0.;
   Ints sample;
   for (int i = 0; i < ret.size; ++i) {
     if (sample.size() < sample_size) {
@@ -45,8 +46,10 @@ InferenceStatistics::Data InferenceStatistics::get_data(
   return ret;
 }
 
-void InferenceStatistics::add_subset(const Subset &s, AssignmentContainer *ss) {
+void InferenceStatistics::add_subset(const Subset &s, AssignmentContainer *ss,
+                                     double seconds) {
   subsets_[s] = get_data(s, ss);
+  subsets_[s].time = seconds;
 }
 
 InferenceStatistics::~InferenceStatistics() {
@@ -65,6 +68,10 @@ unsigned int InferenceStatistics::get_number_of_assignments(Subset subset)
   return get_data(subset).size;
 }
 
+double InferenceStatistics::get_time(Subset subset) const {
+  return get_data(subset).time;
+}
+
 Assignments InferenceStatistics::get_sample_assignments(Subset subset) const {
   return get_data(subset).sample;
 }
@@ -101,31 +108,90 @@ Assignment get_merged_assignment(const Subset &s, const Assignment &ss0,
   return Assignment(ret);
 }
 
+namespace {
+// number of rows of each table read at a time, and of the first table
+// matched by one task, in load_union()
+const unsigned int join_chunk_size = 256;
+
+// The rows currently being joined by load_union()
+struct JoinBlock {
+  Subset union_subset;
+  Ints ii0, ui0, ui1;
+  Assignments first;
+  // the rows of second and their intersection parts
+  Assignments second, second_keys;
+  // the merged assignments found so far for each row of first
+  Vector<Assignments> merged;
+};
+
+// Merge the given rows of first with the rows of second that agree with them
+// on the intersection, in the order of the rows of second
+void add_matching_rows(JoinBlock *jb, unsigned int begin) {
+  unsigned int end =
+      std::min<unsigned int>(jb->first.size(), begin + join_chunk_size);
+  for (unsigned int i = begin; i < end; ++i) {
+    Assignment key = get_sub_assignment(jb->first[i], jb->ii0);
+    for (unsigned int j = 0; j < jb->second_keys.size(); ++j) {
+      if (jb->second_keys[j] == key) {
+        jb->merged[i].push_back(get_merged_assignment(
+            jb->union_subset, jb->first[i], jb->ui0, jb->second[j], jb->ui1));
+      }
+    }
+  }
+}
+}
+
 void load_union(const Subset &s0, const Subset &s1, AssignmentContainer *nd0,
                 AssignmentContainer *nd1, const EdgeData &ed, size_t max,
                 AssignmentContainer *out) {
-  Ints ii0 = get_index(s0, ed.intersection_subset);
   Ints ii1 = get_index(s1, ed.intersection_subset);
-  Ints ui0 = get_index(ed.union_subset, s0);
-  Ints ui1 = get_index(ed.union_subset, s1);
-  Ints uii = get_index(ed.union_subset, ed.intersection_subset);
-  Assignments nd1a =
-      nd1->get_assignments(IntRange(0, nd1->get_number_of_assignments()));
-  // chunck outer and writing later
+  JoinBlock jb;
+  jb.union_subset = ed.union_subset;
+  jb.ii0 = get_index(s0, ed.intersection_subset);
+  jb.ui0 = get_index(ed.union_subset, s0);
+  jb.ui1 = get_index(ed.union_subset, s1);
   unsigned int nd0sz = nd0->get_number_of_assignments();
+  unsigned int nd1sz = nd1->get_number_of_assignments();
   IMP_PROGRESS_DISPLAY("Merging subsets " << s0 << " and " << s1,
-                       nd0sz * nd1a.size());
-  for (unsigned int i = 0; i < nd0sz; ++i) {
-    Assignment nd0a = nd0->get_assignment(i);
-    Assignment nd0ae = get_sub_assignment(nd0a, ii0);
-    for (unsigned int j = 0; j < nd1a.size(); ++j) {
-      Assignment nd1ae = get_sub_assignment(nd1a[j], ii1);
-      if (nd1ae == nd0ae) {
-        Assignment ss =
-            get_merged_assignment(ed.union_subset, nd0a, ui0, nd1a[j], ui1);
+                       nd0sz * nd1sz);
+  // Both tables are read in blocks, so that tables kept on disk are never
+  // loaded whole. For each block of rows of nd0, nd1 is streamed through
+  // and the rows of the block are matched against each block of nd1 in
+  // parallel. The filters may evaluate restraints on the model, so the
+  // merged assignments are filtered and stored in order afterwards, which
+  // also keeps the output independent of the threads.
+  unsigned int nthreads = std::max(1U, get_number_of_threads());
+  unsigned int block_size = join_chunk_size * nthreads;
+  JoinBlock *pjb = &jb;
+  for (unsigned int first = 0; first < nd0sz; first += block_size) {
+    unsigned int last = std::min(nd0sz, first + block_size);
+    jb.first = nd0->get_assignments(IntRange(first, last));
+    jb.merged.clear();
+    jb.merged.resize(last - first);
+    unsigned int nchunks =
+        (last - first + join_chunk_size - 1) / join_chunk_size;
+    for (unsigned int second = 0; second < nd1sz;
+         second += join_chunk_size) {
+      jb.second = nd1->get_assignments(
+          IntRange(second, std::min(nd1sz, second + join_chunk_size)));
+      jb.second_keys.resize(jb.second.size());
+      for (unsigned int j = 0; j < jb.second.size(); ++j) {
+        jb.second_keys[j] = get_sub_assignment(jb.second[j], ii1);
+      }
+      IMP_THREADS((pjb, nchunks), {
+        for (unsigned int c = 0; c < nchunks; ++c) {
+          IMP_TASK((pjb, c), add_matching_rows(pjb, c * join_chunk_size),
+                   "match assignments");
+        }
+        IMP_OMP_PRAGMA(taskwait)
+      });
+    }
+    for (unsigned int i = 0; i < jb.merged.size(); ++i) {
+      for (unsigned int k = 0; k < jb.merged[i].size(); ++k) {
+        const Assignment &ss = jb.merged[i][k];
         bool ok = true;
-        for (unsigned int k = 0; k < ed.filters.size(); ++k) {
-          if (!ed.filters[k]->get_is_ok(ss)) {
+        for (unsigned int f = 0; f < ed.filters.size(); ++f) {
+          if (!ed.filters[f]->get_is_ok(ss)) {
             ok = false;
             break;
           }
@@ -139,8 +205,8 @@ void load_union(const Subset &s0, const Subset &s1, AssignmentContainer *nd0,
           }
         }
       }
-      IMP::add_to_progress_display(1);
     }
+    IMP::add_to_progress_display((last - first) * nd1sz);
   }
 }
 
@@ -9,15 +9,26 @@
 #include <IMP/domino/internal/inference_utility.h>
 #include <IMP/domino/internal/tree_inference.h>
 #include <IMP/domino/assignment_tables.h>
+#include <IMP/domino/assignment_containers.h>
 #include <IMP/Particle.h>
+#include <IMP/file.h>
 #include <IMP/log.h>
 #include <algorithm>
 #include <boost/graph/copy.hpp>
 #include <boost/pending/indirect_cmp.hpp>
 #include <boost/progress.hpp>
 #include <boost/scoped_ptr.hpp>
+#include <boost/date_time/posix_time/posix_time_types.hpp>
+#include <cstdio>
 
 IMPDOMINO_BEGIN_INTERNAL_NAMESPACE
+namespace {
+double get_elapsed_seconds(const boost::posix_time::ptime &start) {
+  return (boost::posix_time::microsec_clock::universal_time() - start)
+             .total_microseconds() * 1e-6;
+}
+}
+
 void load_merged_assignments(
     const Subset &first_subset, AssignmentContainer *first,
     const Subset &second_subset, AssignmentContainer *second,
@@ -26,9 +37,16 @@ void load_merged_assignments(
   Pointer<AssignmentContainer> outp(out);
   IMP::PointerMember<AssignmentContainer> firstp(first), secondp(second);
   IMP_FUNCTION_LOG;
+  boost::posix_time::ptime start =
+      boost::posix_time::microsec_clock::universal_time();
   EdgeData ed = get_edge_data(first_subset, second_subset, filters);
   load_union(first_subset, second_subset, first, second, ed, max_states, out);
-  if (stats) stats->add_subset(ed.union_subset, out);
+  double seconds = get_elapsed_seconds(start);
+  IMP_LOG_TERSE("Merged " << ed.union_subset << " into "
+                          << out->get_number_of_assignments()
+                          << " assignments in " << seconds << "s"
+                          << std::endl);
+  if (stats) stats->add_subset(ed.union_subset, out, seconds);
   if (lsft) update_list_subset_filter_table(lsft, ed.union_subset, out);
   /*using namespace IMP;
   IMP_LOG_VERBOSE( "After merge, set is " << merged_subset
@@ -42,18 +60,124 @@ void load_leaf_assignments(const Subset &merged_subset,
   Pointer<AssignmentContainer> outp(out);
   IMP_FUNCTION_LOG;
   IMP_LOG_VERBOSE("Looking at leaf " << merged_subset << std::endl);
+  boost::posix_time::ptime start =
+      boost::posix_time::microsec_clock::universal_time();
   states->load_assignments(merged_subset, out);
   if (lsft) update_list_subset_filter_table(lsft, merged_subset, out);
   // using namespace IMP;
   // IMP_LOG_VERBOSE( "Subset data is\n" << ret << std::endl);
-  if (stats) stats->add_subset(merged_subset, out);
+  double seconds = get_elapsed_seconds(start);
+  IMP_LOG_TERSE("Leaf " << merged_subset << " has "
+                        << out->get_number_of_assignments()
+                        << " assignments, found in " << seconds << "s"
+                        << std::endl);
+  if (stats) stats->add_subset(merged_subset, out, seconds);
 }
 namespace {
+// Keep the assignments in memory until they take more than memory_budget
+// bytes, then write them, and any added later, to a temporary file. The
+// file is read back once the assignments are first read.
+class SpillingAssignmentContainer : public AssignmentContainer {
+  Subset s_;
+  ParticlesTemp all_;
+  size_t memory_budget_;
+  std::string file_name_;
+  unsigned int number_;
+  PointerMember<PackedAssignmentContainer> memory_;
+  mutable PointerMember<WriteCompressedAssignmentContainer> write_;
+  mutable PointerMember<ReadCompressedAssignmentContainer> read_;
+
+  void spill() {
+    file_name_ = create_temporary_file_name("domino", ".assignments");
+    IMP_LOG_TERSE("Writing assignments for " << s_ << " to " << file_name_
+                                             << std::endl);
+    write_ = new WriteCompressedAssignmentContainer(file_name_, s_, all_,
+                                                    "Spilled assignments %1%");
+    for (unsigned int i = 0; i < memory_->get_number_of_assignments(); ++i) {
+      write_->add_assignment(memory_->get_assignment(i));
+    }
+    memory_ = nullptr;
+  }
+
+  AssignmentContainer *get_container() const {
+    if (memory_) return memory_;
+    if (write_) {
+      // the file is flushed and closed when the writer is destroyed
+      write_ = nullptr;
+      read_ = new ReadCompressedAssignmentContainer(file_name_, s_, all_,
+                                                    "Spilled assignments %1%");
+    }
+    return read_;
+  }
+
+  virtual void do_destroy() IMP_OVERRIDE {
+    // close the file before removing it
+    write_ = nullptr;
+    read_ = nullptr;
+    if (!file_name_.empty()) std::remove(file_name_.c_str());
+  }
+
+ public:
+  SpillingAssignmentContainer(const Subset &s, const Subset &all,
+                              size_t memory_budget)
+      : AssignmentContainer("SpillingAssignmentContainer %1%"),
+        s_(s),
+        all_(all.begin(), all.end()),
+        memory_budget_(memory_budget),
+        number_(0),
+        memory_(new PackedAssignmentContainer()) {}
+  virtual unsigned int get_number_of_assignments() const IMP_OVERRIDE {
+    return number_;
+  }
+  virtual Assignment get_assignment(unsigned int i) const IMP_OVERRIDE {
+    return get_container()->get_assignment(i);
+  }
+  virtual Assignments get_assignments(IntRange r) const IMP_OVERRIDE {
+    return get_container()->get_assignments(r);
+  }
+  virtual Assignments get_assignments() const IMP_OVERRIDE {
+    return get_container()->get_assignments();
+  }
+  virtual void add_assignment(const Assignment &a) IMP_OVERRIDE {
+    IMP_USAGE_CHECK(!read_, "Cannot add assignments once they have been read");
+    if (memory_) {
+      memory_->add_assignment(a);
+      if (static_cast<size_t>(number_ + 1) * a.size() * sizeof(int) >
+          memory_budget_) {
+        spill();
+      }
+    } else {
+      write_->add_assignment(a);
+    }
+    ++number_;
+  }
+  virtual void add_assignments(const Assignments &asgn) IMP_OVERRIDE {
+    for (unsigned int i = 0; i < asgn.size(); ++i) {
+      add_assignment(asgn[i]);
+    }
+  }
+  virtual Ints get_particle_assignments(unsigned int index) const
+      IMP_OVERRIDE {
+    return get_container()->get_particle_assignments(index);
+  }
+  IMP_OBJECT_METHODS(SpillingAssignmentContainer);
+};
+
+// Create the container for the assignments of a subtree; with a memory
+// budget, tables that are too large are kept on disk until they are merged
+AssignmentContainer *create_subtree_assignments(const Subset &s,
+                                                const Subset &all,
+                                                size_t memory_budget) {
+  if (memory_budget == 0) return new PackedAssignmentContainer();
+  return new SpillingAssignmentContainer(s, all, memory_budget);
+}
+
 void load_best_conformations_internal(
     const MergeTree &jt, unsigned int root, const Subset &all,
     const AssignmentsTable *states, const SubsetFilterTables &filters,
     ListSubsetFilterTable *lsft, InferenceStatistics *stats, unsigned int max,
-    boost::progress_display *progress, AssignmentContainer *out) {
+    size_t memory_budget, boost::progress_display *progress,
+    AssignmentContainer *out) {
   Pointer<AssignmentContainer> outp(out);
   typedef boost::property_map<MergeTree, boost::vertex_name_t>::const_type
       SubsetMap;
@@ -72,12 +196,16 @@ void load_best_conformations_internal(
                        "Not a binary tree");
     int firsti = *be.first;
     int secondi = *(++be.first);
-    IMP_NEW(PackedAssignmentContainer, cpd0, ());
-    IMP_NEW(PackedAssignmentContainer, cpd1, ());
+    Pointer<AssignmentContainer> cpd0 = create_subtree_assignments(
+        boost::get(subset_map, firsti), all, memory_budget);
     load_best_conformations_internal(jt, firsti, all, states, filters, lsft,
-                                     stats, max, progress, cpd0);
+                                     stats, max, memory_budget, progress,
+                                     cpd0);
+    Pointer<AssignmentContainer> cpd1 = create_subtree_assignments(
+        boost::get(subset_map, secondi), all, memory_budget);
     load_best_conformations_internal(jt, secondi, all, states, filters, lsft,
-                                     stats, max, progress, cpd1);
+                                     stats, max, memory_budget, progress,
+                                     cpd1);
     load_merged_assignments(boost::get(subset_map, firsti), cpd0,
                             boost::get(subset_map, secondi), cpd1, filters,
                             lsft, stats, max, out);
@@ -94,7 +222,7 @@ void load_best_conformations(const MergeTree &mt, int root,
                              const AssignmentsTable *states,
                              ListSubsetFilterTable *lsft,
                              InferenceStatistics *stats, unsigned int max,
-                             AssignmentContainer *out) {
+                             AssignmentContainer *out, size_t memory_budget) {
   Pointer<AssignmentContainer> outp(out);
   boost::scoped_ptr<boost::progress_display> progress;
   if (get_log_level() == PROGRESS) {
@@ -102,7 +230,7 @@ void load_best_conformations(const MergeTree &mt, int root,
   }
   return load_best_conformations_internal(mt, root, all_particles, states,
                                           filters, lsft, stats, max,
-                                          progress.get(), out);
+                                          memory_budget, progress.get(), out);
 }
 
 IMPDOMINO_END_INTERNAL_NAMESPACE
@@ -108,6 +108,36 @@ class Tests(IMP.test.TestCase):
         iss.set_cache_size(4)
         self._test_in(iss, ass0, ps0, ps1)
 
+    def test_compressed(self):
+        """Testing writing to a compressed binary data set"""
+        (ps0, ss0, ass0, m0) = self._setup_round_trip()
+        (ps1, ss1, ass1, m1) = self._setup_round_trip()
+        # repeated assignments are stored as runs of unchanged values
+        ass0 = ass0 + [ass0[-1]] * 5
+        name = self.get_tmp_file_name("round_trip.cassignments")
+        pss = IMP.domino.WriteCompressedAssignmentContainer(
+            name, ss0, ps0, "assignments")
+        pss.set_chunk_size(3)
+        self._test_out(pss, ass0)
+        del pss
+        iss = IMP.domino.ReadCompressedAssignmentContainer(
+            name, ss1, ps1, "in assignments")
+        self._test_in(iss, ass0, ps0, ps1)
+        # reading ranges, which may cross chunks, gives the same assignments
+        for first, last in ((0, len(ass0)), (2, 7), (4, 5), (6, 6)):
+            self.assertEqual(list(iss.get_assignments((first, last))),
+                             [iss.get_assignment(i)
+                              for i in range(first, last)])
+        for i in range(len(ss1)):
+            self.assertEqual(list(iss.get_particle_assignments(i)),
+                             [a[i] for a in iss.get_assignments()])
+        bad = self.get_tmp_file_name("bad.cassignments")
+        with open(bad, 'w') as fh:
+            fh.write("not compressed assignments\n" * 4)
+        self.assertRaises(IMP.IOException,
+                          IMP.domino.ReadCompressedAssignmentContainer,
+                          bad, ss1, ps1, "bad")
+
     def test_sample(self):
         """Testing default sample container"""
         sac = IMP.domino.SampleAssignmentContainer(10)
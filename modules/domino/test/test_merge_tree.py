@@ -23,5 +23,77 @@ class Tests(IMP.test.TestCase):
         mbt = IMP.domino.get_balanced_merge_tree(jt)
         # IMP.show_graphviz(mbt)
 
+    def _get_chain_sampler(self, nstates, maximum_score, shared_states):
+        """Set up domino sampling of a chain of 6 particles, returning the
+           merge tree and a function to sample with a number of threads and
+           a memory budget"""
+        m = IMP.Model()
+        ps = [IMP.Particle(m) for i in range(6)]
+        for p in ps:
+            IMP.core.XYZ.setup_particle(p)
+        pst = IMP.domino.ParticleStatesTable()
+
+        def get_states():
+            return IMP.domino.XYZStates([IMP.algebra.Vector3D(i, 0, 0)
+                                         for i in range(nstates)])
+        states = get_states()
+        for p in ps:
+            # particles that share states cannot be in the same state
+            pst.set_particle_states(p, states if shared_states
+                                    else get_states())
+        r = IMP.RestraintSet(m)
+        for i in range(1, len(ps)):
+            r.add_restraint(IMP.core.DistanceRestraint(
+                m, IMP.core.Harmonic(1, 1), ps[i - 1], ps[i]))
+        r.set_maximum_score(maximum_score)
+        mt = IMP.domino.get_merge_tree(IMP.domino.get_junction_tree(
+            IMP.domino.get_interaction_graph([r], pst)))
+
+        def sample(threads, budget):
+            sampler = IMP.domino.DominoSampler(m, pst)
+            sampler.set_restraints([r])
+            sampler.set_merge_tree(mt)
+            sampler.set_assignments_memory_budget(budget)
+            old_threads = IMP.get_number_of_threads()
+            try:
+                IMP.set_number_of_threads(threads)
+                assignments = sampler.get_sample_assignments(
+                    IMP.domino.Subset(ps))
+            finally:
+                IMP.set_number_of_threads(old_threads)
+            return sampler, [list(a) for a in assignments]
+        return mt, sample
+
+    def test_merge_tree_threads_and_budget(self):
+        """Test merge tree sampling with threads and a memory budget"""
+        mt, sample = self._get_chain_sampler(6, .1, True)
+        sampler, serial = sample(1, 0.)
+        self.assertGreater(len(serial), 0)
+        for v in mt.get_vertices():
+            self.assertGreater(sampler.get_number_of_assignments_for_vertex(v),
+                               0)
+            self.assertGreaterEqual(sampler.get_time_for_vertex(v), 0.)
+        # a tiny budget writes every intermediate table to disk
+        for threads, budget in ((4, 0.), (1, 1e-6), (4, 1e-6)):
+            sampler, assignments = sample(threads, budget)
+            self.assertEqual(assignments, serial)
+
+    def test_merge_tree_large_tables(self):
+        """Test merge tree sampling of tables larger than a join block"""
+        # every assignment is allowed, so tables grow to 5^6 rows, well
+        # beyond the 256 rows joined at a time
+        mt, sample = self._get_chain_sampler(5, 1e6, False)
+        sampler, serial = sample(1, 0.)
+        self.assertEqual(len(serial), 5 ** 6)
+        self.assertEqual(len(set(tuple(a) for a in serial)), 5 ** 6)
+        self.assertGreater(max(sampler.get_number_of_assignments_for_vertex(v)
+                               for v in mt.get_vertices()
+                               if v != len(mt.get_vertices()) - 1), 256)
+        # spill all tables, or only those over about 1000 rows, part way
+        # through filling them
+        for threads, budget in ((4, 0.), (4, 1e-6), (1, 0.015), (4, 0.015)):
+            sampler, assignments = sample(threads, budget)
+            self.assertEqual(assignments, serial)
+
 if __name__ == '__main__':
     IMP.test.main()
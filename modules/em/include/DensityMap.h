@@ -327,6 +327,16 @@ class IMPEMEXPORT DensityMap : public IMP::Object {
   //! Get the number of map voxels
   long get_number_of_voxels() const;
 
+  //! Mark the voxel values as modified outside of the DensityMap methods
+  /** Call this after writing to the voxels directly (eg through the
+      NumPy view returned by get_voxel_array() in Python), so that the
+      cached RMS and normalization state are recomputed when needed.
+   */
+  void set_voxels_modified() {
+    normalized_ = false;
+    rms_calculated_ = false;
+  }
+
   //! Set the map dimension and reset all voxels to 0
   /** \param[in] nx x-dimension (voxels)
       \param[in] ny y-dimension (voxels)
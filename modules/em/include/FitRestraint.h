@@ -57,6 +57,12 @@ class IMPEMEXPORT FitRestraint : public Restraint {
           This significantly reduces the running time but is less accurate.
           If the user prefers to get more accurate results, provide
           its members as input particles and not the rigid body.
+    \note Only the particles not in rigid bodies that moved are resampled,
+          and the maps of rigid bodies are only interpolated again when
+          they move. However, each evaluation still copies the map of the
+          particles not in rigid bodies, computes its RMS and adds the
+          rigid body maps to it, so it takes time proportional to the
+          number of voxels of the map even when nothing moved.
    */
   FitRestraint(ParticlesTemp ps, DensityMap *em_map,
                FloatPair norm_factors = FloatPair(0., 0.),
@@ -94,6 +100,9 @@ class IMPEMEXPORT FitRestraint : public Restraint {
   // derivatives
   algebra::Vector3Ds dv_;
   algebra::ReferenceFrame3Ds rbs_orig_rf_;
+  // the rigid body maps at their last transformation
+  mutable algebra::Transformation3Ds rb_transformations_;
+  mutable DensityMaps rb_transformed_maps_;
   FloatKey weight_key_;
   KernelParameters *kernel_params_;
   FloatPair norm_factors_;
@@ -35,7 +35,10 @@ class IMPEMEXPORT SampledDensityMap : public DensityMap {
   /** The header of the map is not determined and no data is being allocated
    */
   SampledDensityMap(KernelType kt = GAUSSIAN)
-      : DensityMap("SampledDensityMap%1%"), kt_(kt) {}
+      : DensityMap("SampledDensityMap%1%"),
+        kt_(kt),
+        incremental_(false),
+        incremental_updates_(0) {}
 
   //! The size of the map is determined by the header and the data is allocated.
   SampledDensityMap(const DensityHeader &header, KernelType kt = GAUSSIAN);
@@ -68,6 +71,23 @@ class IMPEMEXPORT SampledDensityMap : public DensityMap {
    */
   virtual void resample();
 
+  //! Only resample the particles that changed since the last resample()
+  /** If enabled, resample() subtracts the old kernel and adds the new
+      one only for the particles whose position, radius or weight changed
+      since the previous call, so that the cost scales with the number of
+      moved particles (e.g. the members of a single rigid body moved by a
+      Monte Carlo step) rather than with the size of the system. If more
+      than half of the particles moved, or after many updates, the whole
+      map is sampled again.
+
+      \note The map data must not be modified by other means between calls
+            to resample() while this is enabled.
+   */
+  void set_incremental_resampling(bool tf);
+
+  //! Return whether resample() only updates the changed particles
+  bool get_incremental_resampling() const { return incremental_; }
+
   //! Project particles on the grid by their mass value
   /**
   \param ps the particles to project
@@ -123,6 +143,14 @@ class IMPEMEXPORT SampledDensityMap : public DensityMap {
  protected:
   void set_neighbor_mask(float radius);
 
+  //! Forget the sampled particle state, so the next resample is a full one
+  void reset_sampled_state();
+
+#ifndef SWIG
+  template <class F>
+  void resample_with_kernel(const F &f);
+#endif
+
  protected:
   //! kernel handling
   KernelParameters kernel_params_;
@@ -132,6 +160,11 @@ class IMPEMEXPORT SampledDensityMap : public DensityMap {
   FloatKey weight_key_;
   FloatKey x_key_, y_key_, z_key_;
   KernelType kt_;
+  bool incremental_;
+  // particle kernels as last sampled, for incremental resampling
+  algebra::Vector3Ds sampled_centers_;
+  Floats sampled_radii_, sampled_weights_;
+  unsigned int incremental_updates_;
 };
 IMP_OBJECTS(SampledDensityMap, SampledDensityMaps);
 
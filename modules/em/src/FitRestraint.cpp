@@ -97,30 +97,26 @@ void FitRestraint::initialize_model_density_map(FloatKey weight_key) {
       core::transform(rb, move2map_center.get_inverse());
     }
   }
-  // update the none rigid bodies map
+  // update the none rigid bodies map; only the particles that moved
+  // since the last evaluation are resampled
   none_rb_model_dens_map_->set_particles(
       get_as<ParticlesTemp>(not_part_of_rb_), weight_key);
-  if (not_part_of_rb_.size() > 0) {
-    none_rb_model_dens_map_->resample();
-    none_rb_model_dens_map_->calcRMS();
-  }
+  none_rb_model_dens_map_->set_incremental_resampling(true);
   // update the total model dens map
-  if (not_part_of_rb_.size() > 0) {
-    model_dens_map_->copy_map(none_rb_model_dens_map_);
-  } else {
-    model_dens_map_->reset_data(0.);
-  }
-  // add the rigid bodies maps
-  for (unsigned int rb_i = 0; rb_i < rbs_.size(); rb_i++) {
-    algebra::Transformation3D rb_t =
-        algebra::get_transformation_from_first_to_second(
-            rbs_orig_rf_[rb_i], rbs_[rb_i].get_reference_frame());
-    Pointer<DensityMap> transformed =
-        get_transformed(rb_model_dens_map_[rb_i], rb_t);
-    model_dens_map_->add(transformed);
-    transformed->set_was_used(true);
-  }
+  resample();
 }
+
+namespace {
+bool get_is_same_transformation(const algebra::Transformation3D &a,
+                                const algebra::Transformation3D &b) {
+  return algebra::get_squared_distance(a.get_translation(),
+                                       b.get_translation()) == 0. &&
+         algebra::get_squared_distance(a.get_rotation().get_quaternion(),
+                                       b.get_rotation().get_quaternion()) ==
+             0.;
+}
+}
+
 void FitRestraint::resample() const {
   // TODO - first check that the bounding box of the particles
   // matches that of the sampled ones.
@@ -141,12 +137,22 @@ void FitRestraint::resample() const {
     algebra::Transformation3D rb_t =
         algebra::get_transformation_from_first_to_second(
             rbs_orig_rf_[rb_i], rbs_[rb_i].get_reference_frame());
-    Pointer<DensityMap> transformed =
-        get_transformed(rb_model_dens_map_[rb_i], rb_t);
+    // only interpolate the maps of rigid bodies that moved
+    if (rb_i >= rb_transformed_maps_.size()) {
+      rb_transformations_.push_back(rb_t);
+      rb_transformed_maps_.push_back(
+          get_transformed(rb_model_dens_map_[rb_i], rb_t));
+      rb_transformed_maps_.back()->set_was_used(true);
+    } else if (!get_is_same_transformation(rb_t, rb_transformations_[rb_i])) {
+      rb_transformations_[rb_i] = rb_t;
+      rb_transformed_maps_[rb_i] =
+          get_transformed(rb_model_dens_map_[rb_i], rb_t);
+      rb_transformed_maps_[rb_i]->set_was_used(true);
+    }
     IMP_LOG_VERBOSE("transformed map size:"
-                    << get_bounding_box(transformed, -1000.) << std::endl);
-    model_dens_map_->add(transformed);
-    transformed->set_was_used(true);
+                    << get_bounding_box(rb_transformed_maps_[rb_i], -1000.)
+                    << std::endl);
+    model_dens_map_->add(rb_transformed_maps_[rb_i]);
   }
 }
 IMP_LIST_IMPL(FitRestraint, Particle, particle, Particle *, Particles);
@@ -7,11 +7,17 @@
  */
 
 #include <IMP/em/SampledDensityMap.h>
+#include <IMP/threads.h>
+#include <IMP/thread_macros.h>
+#include <algorithm>
 
 IMPEM_BEGIN_NAMESPACE
 
 SampledDensityMap::SampledDensityMap(const DensityHeader &header, KernelType kt)
-    : DensityMap(header, "SampledDensityMap%1%"), kt_(kt) {
+    : DensityMap(header, "SampledDensityMap%1%"),
+      kt_(kt),
+      incremental_(false),
+      incremental_updates_(0) {
   x_key_ = IMP::core::XYZ::get_coordinate_key(0);
   y_key_ = IMP::core::XYZ::get_coordinate_key(1);
   z_key_ = IMP::core::XYZ::get_coordinate_key(2);
@@ -73,7 +79,7 @@ SampledDensityMap::SampledDensityMap(const IMP::ParticlesTemp &ps,
                                      emreal resolution, emreal voxel_size,
                                      IMP::FloatKey mass_key, int sig_cutoff,
                                      KernelType kt)
-    : kt_(kt) {
+    : kt_(kt), incremental_(false), incremental_updates_(0) {
   IMP_LOG_VERBOSE("start SampledDensityMap with resolution: "
                   << resolution << " and voxel size: " << voxel_size
                   << std::endl);
@@ -94,24 +100,18 @@ SampledDensityMap::SampledDensityMap(const IMP::ParticlesTemp &ps,
 void SampledDensityMap::update_resolution(Float res){
   header_.set_resolution(res);
   kernel_params_ = KernelParameters(res);
+  reset_sampled_state();
   resample();
 }
 
 namespace {
 
-IMP::algebra::BoundingBox3D calculate_particles_bounding_box_internal(
-    const Particles &ps) {
-  IMP_INTERNAL_CHECK(ps.size() > 0,
-                     "Can not calculate a particles bounding box for "
-                         << "zero particles" << std::endl);
-  // read the points and determine the dimensions of the map
-  algebra::Vector3Ds all_points;
-  for (IMP::Particles::const_iterator it = ps.begin(); it != ps.end();
-       it++) {
-    all_points.push_back(IMP::core::XYZ(*it).get_coordinates());
-  }
-  return IMP::algebra::BoundingBox3D(all_points);
-}
+// number of particles above which a full resample is split between threads
+const unsigned int threaded_resample_particles = 1000;
+
+// number of incremental updates after which the map is sampled again from
+// scratch, so that rounding errors do not accumulate
+const unsigned int max_incremental_updates = 1000;
 
 class SphereKernel {
   double voxel_size_cube_;
@@ -121,18 +121,19 @@ class SphereKernel {
   SphereKernel(double voxel_size, FloatKey mass_key)
       : voxel_size_cube_(voxel_size * voxel_size * voxel_size),
         mass_key_(mass_key) {};
-  double get_radius(Particle *p) const {
+  double get_particle_radius(Particle *p) const {
     return core::XYZR(p).get_radius();
   }
-  algebra::Vector3D get_center(Particle *p) const {
-    return core::XYZ(p).get_coordinates();
+  double get_particle_weight(Particle *p) const {
+    return p->get_value(mass_key_);
   }
-  double get_value(Particle *p, const algebra::Vector3D &pt) const {
+  double get_radius(double radius) const { return radius; }
+  double get_value(const algebra::Vector3D &center, double radius,
+                   double weight, const algebra::Vector3D &pt) const {
     double wmass =
-        p->get_value(mass_key_) /
-        (algebra::get_volume(core::XYZR(p).get_sphere()) / voxel_size_cube_);
-    if (algebra::get_squared_distance(get_center(p), pt) <
-        square(get_radius(p))) {
+        weight / (algebra::get_volume(algebra::Sphere3D(center, radius)) /
+                  voxel_size_cube_);
+    if (algebra::get_squared_distance(center, pt) < square(radius)) {
       return 1. * wmass;
     }
     return 0.;
@@ -140,19 +141,16 @@ class SphereKernel {
 };
 
 class BinarizedSphereKernel {
-  FloatKey mass_key_;
-
  public:
-  BinarizedSphereKernel(const FloatKey mass_key) : mass_key_(mass_key) {}
-  double get_radius(Particle *p) const {
+  BinarizedSphereKernel() {}
+  double get_particle_radius(Particle *p) const {
     return core::XYZR(p).get_radius();
   }
-  algebra::Vector3D get_center(Particle *p) const {
-    return core::XYZ(p).get_coordinates();
-  }
-  double get_value(Particle *p, const algebra::Vector3D &pt) const {
-    if (algebra::get_squared_distance(get_center(p), pt) <
-        square(get_radius(p))) {
+  double get_particle_weight(Particle *) const { return 1.; }
+  double get_radius(double radius) const { return radius; }
+  double get_value(const algebra::Vector3D &center, double radius, double,
+                   const algebra::Vector3D &pt) const {
+    if (algebra::get_squared_distance(center, pt) < square(radius)) {
       return 1.;
     }
     return 0.;
@@ -166,29 +164,91 @@ class GaussianKernel {
  public:
   GaussianKernel(KernelParameters &kps, const FloatKey &mass_key)
       : kps_(&kps), mass_key_(mass_key) {}
-  double get_radius(Particle *) const {
-    return kps_->get_rkdist();
-  }
-  algebra::Vector3D get_center(Particle *p) const {
-    return core::XYZ(p).get_coordinates();
+  double get_particle_radius(Particle *) const { return 0.; }
+  double get_particle_weight(Particle *p) const {
+    return p->get_value(mass_key_);
   }
-  double get_value(Particle *p, const algebra::Vector3D &pt) const {
-    algebra::Vector3D cs = core::XYZ(p).get_coordinates();
-    double rsq = (cs - pt).get_squared_magnitude();
+  double get_radius(double) const { return kps_->get_rkdist(); }
+  double get_value(const algebra::Vector3D &center, double, double weight,
+                   const algebra::Vector3D &pt) const {
+    double rsq = (center - pt).get_squared_magnitude();
     if(rsq > kps_->get_rkdistsq()) return 0;
     double tmp = EXP(-rsq * kps_->get_inv_rsigsq());
-    return kps_->get_rnormfac() * p->get_value(mass_key_) * tmp;
+    return kps_->get_rnormfac() * weight * tmp;
   }
 };
 
+//! Read the center, radius and weight of the kernel of each particle
 template <class F>
-void internal_resample(em::DensityMap *dmap, Particles ps, const F &f) {
+void get_kernel_sources(const Particles &ps, const F &f,
+                        algebra::Vector3Ds &centers, Floats &radii,
+                        Floats &weights) {
+  centers.resize(ps.size());
+  radii.resize(ps.size());
+  weights.resize(ps.size());
+  for (unsigned int i = 0; i < ps.size(); ++i) {
+    centers[i] = core::XYZ(ps[i]).get_coordinates();
+    radii[i] = f.get_particle_radius(ps[i]);
+    weights[i] = f.get_particle_weight(ps[i]);
+  }
+}
+
+//! Add sign times the kernel of one particle to the slices [zmin, zmax]
+template <class F>
+void add_kernel(em::DensityMap *dmap, const F &f,
+                const algebra::Vector3D &center, double radius, double weight,
+                double sign, int zmin, int zmax) {
   emreal *data = dmap->get_data();
+  const em::DensityHeader *header = dmap->get_header();
+  int ivox, ivoxx, ivoxy, ivoxz, iminx, imaxx, iminy, imaxy, iminz, imaxz;
+  // variables to avoid some multiplications
+  int nxny = header->get_nx() * header->get_ny();
+  int znxny;
+  // compute the box affected by the particle
+  calc_local_bounding_box(dmap, center[0], center[1], center[2],
+                          f.get_radius(radius), iminx, iminy, iminz, imaxx,
+                          imaxy, imaxz);
+  iminz = std::max(iminz, zmin);
+  imaxz = std::min(imaxz, zmax);
+  for (ivoxz = iminz; ivoxz <= imaxz; ivoxz++) {
+    znxny = ivoxz * nxny;
+    for (ivoxy = iminy; ivoxy <= imaxy; ivoxy++) {
+      // we increment ivox this way to avoid unnecessary multiplication
+      // operations.
+      ivox = znxny + ivoxy * header->get_nx() + iminx;
+      for (ivoxx = iminx; ivoxx <= imaxx; ivoxx++) {
+        algebra::Vector3D cur(dmap->get_location_in_dim_by_voxel(ivox, 0),
+                              dmap->get_location_in_dim_by_voxel(ivox, 1),
+                              dmap->get_location_in_dim_by_voxel(ivox, 2));
+        double value = f.get_value(center, radius, weight, cur);
+        data[ivox] += sign * value;
+        ivox++;
+      }
+    }
+  }
+}
+
+//! Add the kernels of all particles to the slices [zmin, zmax]
+template <class F>
+void add_kernels(em::DensityMap *dmap, const F &f,
+                 const algebra::Vector3Ds &centers, const Floats &radii,
+                 const Floats &weights, int zmin, int zmax) {
+  for (unsigned int i = 0; i < centers.size(); ++i) {
+    add_kernel(dmap, f, centers[i], radii[i], weights[i], 1., zmin, zmax);
+  }
+}
+
+template <class F>
+void internal_resample(em::DensityMap *dmap, const algebra::Vector3Ds &centers,
+                       const Floats &radii, const Floats &weights,
+                       const F &f) {
   IMP_LOG_VERBOSE("going to resample particles " << std::endl);
   // check that the particles bounding box is within the density bounding box
   IMP_IF_CHECK(USAGE_AND_INTERNAL) {
-    IMP::algebra::BoundingBox3D particles_bb =
-        calculate_particles_bounding_box_internal(ps);
+    IMP_INTERNAL_CHECK(centers.size() > 0,
+                       "Can not calculate a particles bounding box for "
+                           << "zero particles" << std::endl);
+    IMP::algebra::BoundingBox3D particles_bb(centers);
     IMP::algebra::BoundingBox3D density_bb = get_bounding_box(dmap);
     if (!density_bb.get_contains(particles_bb)) {
       IMP_WARN("The particles to sample are not contained within"
@@ -198,51 +258,107 @@ void internal_resample(em::DensityMap *dmap, Particles ps, const F &f) {
   }
   dmap->reset_data();
   dmap->calc_all_voxel2loc();
-  core::XYZRs xyzr(ps);
-  const em::DensityHeader *header = dmap->get_header();
-  int ivox, ivoxx, ivoxy, ivoxz, iminx, imaxx, iminy, imaxy, iminz, imaxz;
-  // actual sampling
-  // variables to avoid some multiplications
-  int nxny = header->get_nx() * header->get_ny();
-  int znxny;
-  IMP_LOG_VERBOSE("sampling " << ps.size() << " particles " << std::endl);
-  for (unsigned int ii = 0; ii < xyzr.size(); ii++) {
-    algebra::Vector3D center = f.get_center(xyzr[ii]);
-    // compute the box affected by each particle
-    calc_local_bounding_box(dmap, center[0], center[1], center[2],
-                            f.get_radius(xyzr[ii]), iminx, iminy, iminz, imaxx,
-                            imaxy, imaxz);
-    IMP_LOG_VERBOSE("Calculated bounding box for voxel: "
-                    << ii << " is :" << iminx << "," << iminy << "," << iminz
-                    << "," << imaxx << "," << imaxy << "," << imaxz
-                    << std::endl);
-    for (ivoxz = iminz; ivoxz <= imaxz; ivoxz++) {
-      znxny = ivoxz * nxny;
-      for (ivoxy = iminy; ivoxy <= imaxy; ivoxy++) {
-        // we increment ivox this way to avoid unnecessary multiplication
-        // operations.
-        ivox = znxny + ivoxy * header->get_nx() + iminx;
-        for (ivoxx = iminx; ivoxx <= imaxx; ivoxx++) {
-          algebra::Vector3D cur(dmap->get_location_in_dim_by_voxel(ivox, 0),
-                                dmap->get_location_in_dim_by_voxel(ivox, 1),
-                                dmap->get_location_in_dim_by_voxel(ivox, 2));
-          double value = f.get_value(xyzr[ii], cur);
-          data[ivox] += value;
-          ivox++;
-        }
+  int nz = dmap->get_header()->get_nz();
+  IMP_LOG_VERBOSE("sampling " << centers.size() << " particles " << std::endl);
+  int nslabs = std::min<int>(get_number_of_threads(), nz);
+  if (nslabs > 1 && centers.size() >= threaded_resample_particles) {
+    // Each task samples all particles into its own slab of z slices. Every
+    // voxel still gets its contributions in particle order, so the map is
+    // the same whatever the number of threads.
+    const F *pf = &f;
+    const algebra::Vector3Ds *pcenters = &centers;
+    const Floats *pradii = &radii;
+    const Floats *pweights = &weights;
+    IMP_THREADS((dmap, pf, pcenters, pradii, pweights, nz, nslabs), {
+      for (int i = 0; i < nslabs; ++i) {
+        int zmin = nz * i / nslabs;
+        int zmax = nz * (i + 1) / nslabs - 1;
+        IMP_TASK((dmap, pf, pcenters, pradii, pweights, zmin, zmax),
+                 add_kernels(dmap, *pf, *pcenters, *pradii, *pweights, zmin,
+                             zmax),
+                 "resample slab");
       }
+      IMP_OMP_PRAGMA(taskwait)
+    });
+  } else {
+    add_kernels(dmap, f, centers, radii, weights, 0, nz - 1);
+  }
+}
+
+template <class F>
+void internal_resample(em::DensityMap *dmap, const Particles &ps,
+                       const F &f) {
+  algebra::Vector3Ds centers;
+  Floats radii, weights;
+  get_kernel_sources(ps, f, centers, radii, weights);
+  internal_resample(dmap, centers, radii, weights, f);
+}
+
+//! Replace the kernels of the particles that changed since the last call
+/** The old state of the particles is updated to the new one. If too many
+    particles changed for an update to be cheaper than a full resample,
+    nothing is done and false is returned.
+ */
+template <class F>
+bool update_changed_kernels(em::DensityMap *dmap, const F &f,
+                            const algebra::Vector3Ds &centers,
+                            const Floats &radii, const Floats &weights,
+                            algebra::Vector3Ds &old_centers,
+                            Floats &old_radii, Floats &old_weights) {
+  Ints changed;
+  for (unsigned int i = 0; i < centers.size(); ++i) {
+    if (algebra::get_squared_distance(centers[i], old_centers[i]) != 0. ||
+        radii[i] != old_radii[i] || weights[i] != old_weights[i]) {
+      changed.push_back(i);
     }
   }
+  // each changed particle is sampled twice
+  if (2 * changed.size() > centers.size()) return false;
+  IMP_LOG_VERBOSE("updating " << changed.size() << " of " << centers.size()
+                              << " particles " << std::endl);
+  int nz = dmap->get_header()->get_nz();
+  for (unsigned int j = 0; j < changed.size(); ++j) {
+    int i = changed[j];
+    add_kernel(dmap, f, old_centers[i], old_radii[i], old_weights[i], -1., 0,
+               nz - 1);
+    add_kernel(dmap, f, centers[i], radii[i], weights[i], 1., 0, nz - 1);
+    old_centers[i] = centers[i];
+    old_radii[i] = radii[i];
+    old_weights[i] = weights[i];
+  }
+  return true;
 }
 }  // end namespace
 
+template <class F>
+void SampledDensityMap::resample_with_kernel(const F &f) {
+  algebra::Vector3Ds centers;
+  Floats radii, weights;
+  get_kernel_sources(ps_, f, centers, radii, weights);
+  if (incremental_ && sampled_centers_.size() == centers.size() &&
+      incremental_updates_ < max_incremental_updates &&
+      update_changed_kernels(this, f, centers, radii, weights,
+                             sampled_centers_, sampled_radii_,
+                             sampled_weights_)) {
+    ++incremental_updates_;
+  } else {
+    internal_resample(this, centers, radii, weights, f);
+    incremental_updates_ = 0;
+    if (incremental_) {
+      sampled_centers_.swap(centers);
+      sampled_radii_.swap(radii);
+      sampled_weights_.swap(weights);
+    }
+  }
+}
+
 void SampledDensityMap::resample() {
   if (kt_ == GAUSSIAN) {
-    internal_resample(this, ps_, GaussianKernel(kernel_params_, weight_key_));
+    resample_with_kernel(GaussianKernel(kernel_params_, weight_key_));
   } else if (kt_ == BINARIZED_SPHERE) {
-    internal_resample(this, ps_, BinarizedSphereKernel(weight_key_));
+    resample_with_kernel(BinarizedSphereKernel());
   } else {
-    internal_resample(this, ps_, SphereKernel(get_spacing(), weight_key_));
+    resample_with_kernel(SphereKernel(get_spacing(), weight_key_));
   }
   // The values of dmean, dmin,dmax, and rms have changed
   rms_calculated_ = false;
@@ -250,6 +366,18 @@ void SampledDensityMap::resample() {
   IMP_LOG_VERBOSE("finish resampling particles " << std::endl);
 }
 
+void SampledDensityMap::set_incremental_resampling(bool tf) {
+  incremental_ = tf;
+  reset_sampled_state();
+}
+
+void SampledDensityMap::reset_sampled_state() {
+  sampled_centers_.clear();
+  sampled_radii_.clear();
+  sampled_weights_.clear();
+  incremental_updates_ = 0;
+}
+
 void SampledDensityMap::set_particles(const IMP::ParticlesTemp &ps,
                                       IMP::FloatKey mass_key) {
   IMP_INTERNAL_CHECK(ps_.size() == 0, "Particles have already been set");
@@ -258,6 +386,7 @@ void SampledDensityMap::set_particles(const IMP::ParticlesTemp &ps,
   ps_ = get_as<Particles>(ps);
   weight_key_ = mass_key;
   xyzr_ = IMP::core::XYZRs(ps_);
+  reset_sampled_state();
 }
 
 void SampledDensityMap::project(const ParticlesTemp &ps, int x_margin,
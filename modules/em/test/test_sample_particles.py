@@ -108,6 +108,54 @@ class Tests(IMP.test.TestCase):
         os.unlink("xxx.mrc")
         # os.unlink("yyy.mrc")
 
+    def _get_values(self, m):
+        return [m.get_value(i) for i in range(m.get_number_of_voxels())]
+
+    def test_incremental_resample(self):
+        """Check that incremental resampling matches a full resample"""
+        mh = IMP.atom.read_pdb(
+            self.get_input_file_name("d1q3sa1.pdb"),
+            self.imp_model,
+            IMP.atom.CAlphaPDBSelector())
+        IMP.atom.add_radii(mh)
+        ps = IMP.atom.get_leaves(mh)
+        full_map = IMP.em.SampledDensityMap(ps, 6., 2.)
+        for kt in (IMP.em.GAUSSIAN, IMP.em.SPHERE):
+            inc_map = IMP.em.SampledDensityMap(full_map.get_header(), kt)
+            inc_map.set_particles(ps)
+            inc_map.set_incremental_resampling(True)
+            self.assertTrue(inc_map.get_incremental_resampling())
+            inc_map.resample()
+            ref_map = IMP.em.SampledDensityMap(full_map.get_header(), kt)
+            ref_map.set_particles(ps)
+            # move a few particles, then all of them
+            for moved in (ps[:3], ps[10:12], ps):
+                for p in moved:
+                    d = IMP.core.XYZ(p)
+                    d.set_coordinates(d.get_coordinates()
+                                      + IMP.algebra.Vector3D(0.7, -0.4, 0.3))
+                inc_map.resample()
+                ref_map.resample()
+                for a, b in zip(self._get_values(inc_map),
+                                self._get_values(ref_map)):
+                    self.assertAlmostEqual(a, b, delta=1e-6)
+
+    def test_threaded_resample(self):
+        """Check that resampling does not depend on the number of threads"""
+        mh = IMP.atom.read_pdb(
+            self.get_input_file_name("d1q3sa1.pdb"), self.imp_model)
+        IMP.atom.add_radii(mh)
+        ps = IMP.atom.get_leaves(mh)
+        old_threads = IMP.get_number_of_threads()
+        try:
+            IMP.set_number_of_threads(1)
+            serial = IMP.em.SampledDensityMap(ps, 6., 2.)
+            IMP.set_number_of_threads(4)
+            threaded = IMP.em.SampledDensityMap(ps, 6., 2.)
+        finally:
+            IMP.set_number_of_threads(old_threads)
+        self.assertEqual(self._get_values(serial), self._get_values(threaded))
+
 
 if __name__ == '__main__':
     IMP.test.main()
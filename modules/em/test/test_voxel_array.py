@@ -0,0 +1,53 @@
+from __future__ import print_function
+import IMP
+import IMP.test
+import IMP.em
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Tests(IMP.test.TestCase):
+
+    @IMP.test.skipIf(numpy is None, "Requires numpy")
+    def test_voxel_array(self):
+        """Check the NumPy view of the map voxels"""
+        dmap = IMP.em.create_density_map(4, 3, 2, 2.0)
+        dmap.set_value(dmap.xyz_ind2voxel(3, 1, 0), 5.0)
+        a = dmap.get_voxel_array()
+        self.assertEqual(a.shape, (2, 3, 4))
+        self.assertAlmostEqual(a[0, 1, 3], 5.0, delta=1e-6)
+        # changes to the array are seen by the map
+        a[1, 2, 0] = 7.0
+        dmap.set_voxels_modified()
+        self.assertAlmostEqual(dmap.get_value(dmap.xyz_ind2voxel(0, 2, 1)),
+                               7.0, delta=1e-6)
+        self.assertAlmostEqual(dmap.get_max_value(), 7.0, delta=1e-6)
+        # the array keeps the map alive
+        del dmap
+        self.assertAlmostEqual(a.sum(), 12.0, delta=1e-6)
+
+    @IMP.test.skipIf(numpy is None, "Requires numpy")
+    def test_create_from_array(self):
+        """Check creating a map from a NumPy array"""
+        data = numpy.arange(24, dtype=float).reshape(2, 3, 4)
+        dmap = IMP.em.create_density_map_from_array(
+                         data, 1.5, origin=(1., 2., 3.), resolution=10.)
+        h = dmap.get_header()
+        self.assertEqual((h.get_nx(), h.get_ny(), h.get_nz()), (4, 3, 2))
+        self.assertAlmostEqual(dmap.get_spacing(), 1.5, delta=1e-6)
+        self.assertAlmostEqual(h.get_resolution(), 10., delta=1e-6)
+        self.assertLess(IMP.algebra.get_distance(
+                      dmap.get_origin(), IMP.algebra.Vector3D(1., 2., 3.)),
+                      1e-4)
+        self.assertAlmostEqual(dmap.get_value(dmap.xyz_ind2voxel(3, 2, 1)),
+                               23., delta=1e-6)
+        self.assertTrue(numpy.allclose(dmap.get_voxel_array(), data))
+        self.assertRaises(ValueError, IMP.em.create_density_map_from_array,
+                          numpy.zeros((2, 2)), 1.0)
+
+
+if __name__ == '__main__':
+    IMP.test.main()
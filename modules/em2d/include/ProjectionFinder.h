@@ -17,12 +17,14 @@
 #include "IMP/em2d/Image.h"
 #include "IMP/em2d/scores2D.h"
 #include "IMP/em2d/PolarResamplingParameters.h"
+#include "IMP/em2d/Fine2DRegistrationRestraint.h"
 #include "IMP/algebra/Vector3D.h"
 #include "IMP/algebra/Vector2D.h"
 #include "IMP/algebra/Rotation3D.h"
 #include "IMP/algebra/Rotation2D.h"
 #include "IMP/Pointer.h"
 #include "IMP/Particle.h"
+#include "IMP/Optimizer.h"
 #include <string>
 
 IMPEM2D_BEGIN_NAMESPACE
@@ -41,6 +43,7 @@ class IMPEM2DEXPORT Em2DRestraintParameters : public ProjectingParameters {
     optimization_steps = 5;
     simplex_initial_length = 0.1;
     simplex_minimum_size = 0.01;
+    number_of_threads = 0;
   }
 
  public:
@@ -51,6 +54,9 @@ class IMPEM2DEXPORT Em2DRestraintParameters : public ProjectingParameters {
   unsigned int optimization_steps;
   double simplex_initial_length;
   double simplex_minimum_size;
+  //! Number of threads used to register the subject images.
+  //! If 0, IMP::get_number_of_threads() is used.
+  unsigned int number_of_threads;
 
   Em2DRestraintParameters() {
     init_defaults();
@@ -67,7 +73,8 @@ class IMPEM2DEXPORT Em2DRestraintParameters : public ProjectingParameters {
         << " coarse_registration_method " << coarse_registration_method
         << " optimization_steps " << optimization_steps
         << " simplex_initial_length " << simplex_initial_length
-        << " simplex_minimum_size " << simplex_minimum_size << std::endl;
+        << " simplex_minimum_size " << simplex_minimum_size
+        << " number_of_threads " << number_of_threads << std::endl;
   };
 };
 IMP_VALUES(Em2DRestraintParameters, Em2DRestraintParametersList);
@@ -131,13 +138,17 @@ class IMPEM2DEXPORT ProjectionFinder : public IMP::Object {
   //! Coarse registration of all the images using the projections
   //! Based in 2D alignments of the images
   /**
+    The subject images are registered in parallel, using the number of
+    threads given in the Em2DRestraintParameters. The results do not
+    depend on the number of threads.
     \note Given that this registration is based on 2D alignment maximizing the
      cross correlation, the a better score is the best correlation
   **/
   void get_coarse_registration();
 
   //! Performs complete registration of projections against the images.
-  //! This means the coarse registration followed by simplex optimization
+  //! This means the coarse registration followed by simplex optimization.
+  //! As for get_coarse_registration(), subjects are registered in parallel.
   void get_complete_registration();
 
   //! Get the em2d score for a model after the registration performed:
@@ -150,9 +161,13 @@ class IMPEM2DEXPORT ProjectionFinder : public IMP::Object {
   double get_preprocessing_time() const;
 
   //! Time employed for the coarse registration part
+  /** When several threads are used, this is the sum of the times taken
+      for each subject. */
   double get_coarse_registration_time() const;
 
   //! Time employed for the fine registration part
+  /** When several threads are used, this is the sum of the times taken
+      for each subject. */
   double get_fine_registration_time() const;
 
   unsigned int get_number_of_subjects() const { return subjects_.size(); }
@@ -168,10 +183,30 @@ class IMPEM2DEXPORT ProjectionFinder : public IMP::Object {
  protected:
   double preprocessing_time_, coarse_registration_time_,
       fine_registration_time_;
+  // Registration times for each subject
+  Floats coarse_times_, fine_times_;
   //! Coarse registration for one subject
   void get_coarse_registrations_for_subject(unsigned int i,
                                             RegistrationResults &coarse_RRs);
 
+  //! Coarse registration for one subject, using the given work images
+  /** Each thread passes its own images, so that subjects can be
+      registered concurrently. */
+  void get_coarse_registrations_for_subject(unsigned int i,
+                                            RegistrationResults &coarse_RRs,
+                                            Image *aux, Image *match);
+
+  //! Coarse and fine registration for one subject
+  /** fine2d, optimizer and the work images must only be used by one
+      thread at a time. */
+  void do_complete_registration_for_subject(unsigned int i,
+                                            Fine2DRegistrationRestraint *fine2d,
+                                            Optimizer *optimizer, Image *aux,
+                                            Image *match);
+
+  //! Number of threads to use for the registration of the subjects
+  unsigned int get_number_of_registration_threads() const;
+
   void do_preprocess_projection(unsigned int j);
   void do_preprocess_subject(unsigned int i);
 
@@ -22,11 +22,15 @@
 #include "IMP/log.h"
 #include "IMP/Pointer.h"
 #include "IMP/exception.h"
+#include "IMP/threads.h"
+#include "IMP/thread_macros.h"
 #include <boost/timer.hpp>
+#include <boost/date_time/posix_time/posix_time_types.hpp>
 #include <boost/progress.hpp>
 #include <algorithm>
 #include <iostream>
 #include <limits>
+#include <numeric>
 
 IMPEM2D_BEGIN_NAMESPACE
 
@@ -42,6 +46,13 @@ namespace {
     }
     void show(std::ostream &) const {}
   };
+
+  // Wall clock time since start, in seconds. boost::timer measures the CPU
+  // time of the whole process, which is meaningless for one thread.
+  double get_elapsed_seconds(const boost::posix_time::ptime &start) {
+    return (boost::posix_time::microsec_clock::universal_time() - start)
+               .total_microseconds() / 1e6;
+  }
 }
 
 void ProjectionFinder::set_subjects(const em2d::Images &subjects) {
@@ -192,8 +203,20 @@ void ProjectionFinder::do_preprocess_subject(unsigned int i) {
 
 void ProjectionFinder::get_coarse_registrations_for_subject(
     unsigned int i, RegistrationResults &coarse_RRs) {
+  IMP_NEW(Image, aux, ());
+  IMP_NEW(em2d::Image, match, ());
+  aux->set_was_used(true);
+  match->set_was_used(true);
+  get_coarse_registrations_for_subject(i, coarse_RRs, aux, match);
+}
+
+void ProjectionFinder::get_coarse_registrations_for_subject(
+    unsigned int i, RegistrationResults &coarse_RRs, Image *aux,
+    Image *match) {
   IMP_LOG_TERSE("ProjectionFinder: Coarse registration for subject "
                 << i << std::endl);
+  boost::posix_time::ptime start =
+      boost::posix_time::microsec_clock::universal_time();
   algebra::Transformation2D best_2d_transformation;
   double max_ccc = 0.0;
   unsigned int projection_index = 0;
@@ -238,8 +261,6 @@ void ProjectionFinder::get_coarse_registrations_for_subject(
     // The coarse registration is based on maximizing the
     // cross-correlation-coefficient, but any other score can be calculated
     // at this point.
-    IMP_NEW(Image, aux, ());
-    aux->set_was_used(true);
     get_transformed(projections_[j]->get_data(), aux->get_data(), RA.first);
 
     if (variances_.size() > 0) {
@@ -269,8 +290,6 @@ void ProjectionFinder::get_coarse_registrations_for_subject(
   }
 
   if (params_.save_match_images) {
-    IMP_NEW(em2d::Image, match, ());
-
     get_transformed(projections_[projection_index]->get_data(),
                     match->get_data(), best_2d_transformation);
     do_normalize(match, true);
@@ -283,10 +302,12 @@ void ProjectionFinder::get_coarse_registrations_for_subject(
     strm << i << ".spi";
     IMP_NEW(em2d::SpiderImageReaderWriter, srw, ());
     match->set_name(strm.str());  ////
-    match->set_was_used(true);
     match->write(strm.str(), srw);
 
   }
+  if (i < coarse_times_.size()) {
+    coarse_times_[i] = get_elapsed_seconds(start);
+  }
 }
 
 void ProjectionFinder::get_coarse_registration() {
@@ -300,24 +321,52 @@ void ProjectionFinder::get_coarse_registration() {
               ValueException);
   }
 
-  coarse_registration_time_ = 0;
+  unsigned int n_subjects = subjects_.size();
+  unsigned int n_threads = get_number_of_registration_threads();
+  SetNumberOfThreads set_threads(n_threads);
+  coarse_times_.clear();
+  coarse_times_.resize(n_subjects, 0.);
+  // Work images for each thread, created before starting the tasks
+  em2d::Images auxs(n_threads), matches(n_threads);
+  for (unsigned int k = 0; k < n_threads; ++k) {
+    auxs[k] = new Image();
+    auxs[k]->set_was_used(true);
+    matches[k] = new Image();
+    matches[k]->set_was_used(true);
+  }
+  ProjectionFinder *pf = this;
+  em2d::Images *pauxs = &auxs, *pmatches = &matches;
   //  boost::progress_display show_progress(subjects_.size());
-  for (unsigned long i = 0; i < subjects_.size(); ++i) {
-    RegistrationResults coarse_RRs(projections_.size());
-    boost::timer timer_coarse_subject;
-    get_coarse_registrations_for_subject(i, coarse_RRs);
-    coarse_registration_time_ += timer_coarse_subject.elapsed();
-
-    RegistrationResults::iterator best_cc = std::min_element(
-              coarse_RRs.begin(), coarse_RRs.end(),
-              HasHigherCCC<RegistrationResult>());
-    // Best result after coarse registration is based on the ccc
-    registration_results_[i] = *best_cc;
-    registration_results_[i].set_in_image(subjects_[i]->get_header());
-    IMP_LOG_TERSE("Best coarse registration: " << registration_results_[i]
-                                               << std::endl);
-    //    ++show_progress;
+  for (unsigned int first = 0; first < n_subjects; first += n_threads) {
+    unsigned int last = std::min(n_subjects, first + n_threads);
+    std::vector<RegistrationResults> wave_RRs(last - first);
+    std::vector<RegistrationResults> *pwave_RRs = &wave_RRs;
+    IMP_THREADS((pf, pauxs, pmatches, pwave_RRs, first, last), {
+      for (unsigned int i = first; i < last; ++i) {
+        IMP_TASK((pf, pauxs, pmatches, pwave_RRs, first, i),
+                 pf->get_coarse_registrations_for_subject(
+                     i, (*pwave_RRs)[i - first], (*pauxs)[i - first],
+                     (*pmatches)[i - first]),
+                 "coarse registration");
+      }
+      IMP_OMP_PRAGMA(taskwait)
+    });
+    // Pick the best results in subject order
+    for (unsigned int i = first; i < last; ++i) {
+      RegistrationResults &coarse_RRs = wave_RRs[i - first];
+      RegistrationResults::iterator best_cc = std::min_element(
+                coarse_RRs.begin(), coarse_RRs.end(),
+                HasHigherCCC<RegistrationResult>());
+      // Best result after coarse registration is based on the ccc
+      registration_results_[i] = *best_cc;
+      registration_results_[i].set_in_image(subjects_[i]->get_header());
+      IMP_LOG_TERSE("Best coarse registration: " << registration_results_[i]
+                                                 << std::endl);
+      //    ++show_progress;
+    }
   }
+  coarse_registration_time_ =
+      std::accumulate(coarse_times_.begin(), coarse_times_.end(), 0.);
   registration_done_ = true;
 }
 
@@ -338,121 +387,170 @@ void ProjectionFinder::get_complete_registration() {
         ValueException);
   }
 
+  unsigned int n_subjects = subjects_.size();
+  unsigned int n_threads = get_number_of_registration_threads();
+  SetNumberOfThreads set_threads(n_threads);
+  coarse_times_.clear();
+  coarse_times_.resize(n_subjects, 0.);
+  fine_times_.clear();
+  fine_times_.resize(n_subjects, 0.);
+
   unsigned int rows = subjects_[0]->get_header().get_number_of_rows();
   unsigned int cols = subjects_[0]->get_header().get_number_of_columns();
-  IMP_NEW(em2d::Image, match, ());
-  match->set_was_used(true);
-  match->set_size(rows, cols);
-  match->set_name("match image");
-
-  // Set optimizer
-  IMP_NEW(Model, scoring_model, ());
-  IMP_NEW(Fine2DRegistrationRestraint, fine2d, (scoring_model));
-  IMP_NEW(IMP::gsl::Simplex, simplex_optimizer, (scoring_model));
-
-  IMP_LOG_TERSE("ProjectionFinder: Setting Fine2DRegistrationRestraint "
-                << std::endl);
   ProjectingParameters pp(params_.pixel_size, params_.resolution);
-  fine2d->setup(model_particles_, pp, scoring_model, score_function_,
-                masks_manager_);
 
-  simplex_optimizer->set_scoring_function(fine2d);
-  simplex_optimizer->set_initial_length(params_.simplex_initial_length);
-  simplex_optimizer->set_minimum_size(params_.simplex_minimum_size);
+  // Each thread gets its own work images and optimizer (with a model to
+  // hold the registration parameters), all created before starting the tasks
+  Vector<Pointer<Model> > scoring_models(n_threads);
+  Fine2DRegistrationRestraints fine2ds(n_threads);
+  Optimizers optimizers(n_threads);
+  em2d::Images auxs(n_threads), matches(n_threads);
+  for (unsigned int k = 0; k < n_threads; ++k) {
+    auxs[k] = new Image();
+    auxs[k]->set_was_used(true);
+    matches[k] = new Image();
+    matches[k]->set_was_used(true);
+    matches[k]->set_size(rows, cols);
+    matches[k]->set_name("match image");
+
+    // Set optimizer
+    scoring_models[k] = new Model();
+    fine2ds[k] = new Fine2DRegistrationRestraint(scoring_models[k]);
+    IMP_NEW(IMP::gsl::Simplex, simplex_optimizer, (scoring_models[k]));
+
+    IMP_LOG_TERSE("ProjectionFinder: Setting Fine2DRegistrationRestraint "
+                  << std::endl);
+    fine2ds[k]->setup(model_particles_, pp, scoring_models[k],
+                      score_function_, masks_manager_);
+
+    simplex_optimizer->set_scoring_function(fine2ds[k]);
+    simplex_optimizer->set_initial_length(params_.simplex_initial_length);
+    simplex_optimizer->set_minimum_size(params_.simplex_minimum_size);
+    optimizers[k] = simplex_optimizer.get();
+  }
 
   //  IMP::SetLogState log_state(fine2d,TERSE);
 
   // Computation
   //   boost::progress_display show_progress(
   //                    subjects_.size()*projections_.size());
-  coarse_registration_time_ = 0;
-  fine_registration_time_ = 0;
-  for (unsigned long i = 0; i < subjects_.size(); ++i) {
-    RegistrationResults coarse_RRs(projections_.size());
-
-    boost::timer timer_coarse_subject;
-    get_coarse_registrations_for_subject(i, coarse_RRs);
-    coarse_registration_time_ += timer_coarse_subject.elapsed();
-    // The coarse registration scoring is done by cross-correlation
-
-    // Sort pointers to the original list; this should be slightly faster
-    // (no need to copy things around) but also works around a segfault
-    // (possible clang bug?) on OS X 10.10
-    std::vector<RegistrationResult*> sorted_coarse_RRs(coarse_RRs.size());
-    for (unsigned int k = 0; k < coarse_RRs.size(); ++k) {
-      sorted_coarse_RRs[k] = &coarse_RRs[k];
-    }
-    HasHigherCCCPointer hhccc;
-    std::sort(sorted_coarse_RRs.begin(), sorted_coarse_RRs.end(), hhccc);
+  ProjectionFinder *pf = this;
+  em2d::Images *pauxs = &auxs, *pmatches = &matches;
+  Fine2DRegistrationRestraints *pfine2ds = &fine2ds;
+  Optimizers *poptimizers = &optimizers;
+  for (unsigned int first = 0; first < n_subjects; first += n_threads) {
+    unsigned int last = std::min(n_subjects, first + n_threads);
+    IMP_THREADS((pf, pauxs, pmatches, pfine2ds, poptimizers, first, last), {
+      for (unsigned int i = first; i < last; ++i) {
+        IMP_TASK((pf, pauxs, pmatches, pfine2ds, poptimizers, first, i),
+                 pf->do_complete_registration_for_subject(
+                     i, (*pfine2ds)[i - first], (*poptimizers)[i - first],
+                     (*pauxs)[i - first], (*pmatches)[i - first]),
+                 "complete registration");
+      }
+      IMP_OMP_PRAGMA(taskwait)
+    });
+    // ++show_progress;
+  }
+  coarse_registration_time_ =
+      std::accumulate(coarse_times_.begin(), coarse_times_.end(), 0.);
+  fine_registration_time_ =
+      std::accumulate(fine_times_.begin(), fine_times_.end(), 0.);
+  registration_done_ = true;
+}
 
-    unsigned int n_optimized = projections_.size();
-    if (fast_optimization_mode_) {
-      n_optimized = number_of_optimized_projections_;
-    }
+void ProjectionFinder::do_complete_registration_for_subject(
+    unsigned int i, Fine2DRegistrationRestraint *fine2d, Optimizer *optimizer,
+    Image *aux, Image *match) {
+  RegistrationResults coarse_RRs(projections_.size());
+  get_coarse_registrations_for_subject(i, coarse_RRs, aux, match);
+  // The coarse registration scoring is done by cross-correlation
+
+  // Sort pointers to the original list; this should be slightly faster
+  // (no need to copy things around) but also works around a segfault
+  // (possible clang bug?) on OS X 10.10
+  std::vector<RegistrationResult*> sorted_coarse_RRs(coarse_RRs.size());
+  for (unsigned int k = 0; k < coarse_RRs.size(); ++k) {
+    sorted_coarse_RRs[k] = &coarse_RRs[k];
+  }
+  HasHigherCCCPointer hhccc;
+  std::sort(sorted_coarse_RRs.begin(), sorted_coarse_RRs.end(), hhccc);
 
-    RegistrationResult best_fine_registration;
-    best_fine_registration.set_score(std::numeric_limits<double>::max());
-
-    boost::timer timer_fine_subject;
-    for (unsigned int k = 0; k < n_optimized; ++k) {
-      // Fine registration of the subject using simplex
-      sorted_coarse_RRs[k]->set_in_image(subjects_[i]->get_header());
-      IMP_LOG_TERSE(
-          "Setting subject image to "
-          "Fine2DRegistrationRestraint "
-          "from ProjectionFinder"
-          << std::endl);
-      fine2d->set_subject_image(subjects_[i]);
-      simplex_optimizer->optimize(params_.optimization_steps);
-      // Update the registration parameters
-      RegistrationResult fine_registration = fine2d->get_final_registration();
-
-      HasLowerScore<RegistrationResult> has_lower_score;
-      if (has_lower_score(fine_registration, best_fine_registration)) {
-        best_fine_registration = fine_registration;
-      }
-    }
+  unsigned int n_optimized = projections_.size();
+  if (fast_optimization_mode_) {
+    n_optimized = number_of_optimized_projections_;
+  }
 
-    fine_registration_time_ += timer_fine_subject.elapsed();
-    best_fine_registration.set_image_index(i);
-    registration_results_[i] = best_fine_registration;
-    IMP_LOG_TERSE("Fine2DRegistrationRestraint calls: " << fine2d->get_calls()
-                                                        << std::endl);
-
-    IMP_LOG_TERSE("Fine registration: " << registration_results_[i]
-                                        << std::endl);
-    // save if requested
-    if (params_.save_match_images) {
-      IMP_NEW(em2d::SpiderImageReaderWriter, srw, ());
-      IMP_NEW(em2d::TIFFImageReaderWriter, srx, ());
-      srw->set_was_used(true);
-      srx->set_was_used(true);
-      ProjectingOptions options(params_.pixel_size, params_.resolution);
-      options.normalize = true;
-      get_projection(match, model_particles_, registration_results_[i], options,
-                     masks_manager_);
-      std::ostringstream strm;
-      strm << "fine_match-";
-      strm.fill('0');
-      strm.width(4);
-      strm << i << ".spi";
-
-      std::ostringstream strn;
-      strn << "fine_match-";
-      strn.fill('0');
-      strn.width(4);
-      strn << i << ".tif";
-
-      registration_results_[i].set_in_image(match->get_header());
-      match->set_name(strm.str());  //
-      match->write(strm.str(), srw);
-      match->write(strn.str(), srx);
-      
-     
+  RegistrationResult best_fine_registration;
+  best_fine_registration.set_score(std::numeric_limits<double>::max());
+
+  boost::posix_time::ptime start =
+      boost::posix_time::microsec_clock::universal_time();
+  for (unsigned int k = 0; k < n_optimized; ++k) {
+    // Fine registration of the subject using simplex
+    sorted_coarse_RRs[k]->set_in_image(subjects_[i]->get_header());
+    IMP_LOG_TERSE(
+        "Setting subject image to "
+        "Fine2DRegistrationRestraint "
+        "from ProjectionFinder"
+        << std::endl);
+    fine2d->set_subject_image(subjects_[i]);
+    optimizer->optimize(params_.optimization_steps);
+    // Update the registration parameters
+    RegistrationResult fine_registration = fine2d->get_final_registration();
+
+    HasLowerScore<RegistrationResult> has_lower_score;
+    if (has_lower_score(fine_registration, best_fine_registration)) {
+      best_fine_registration = fine_registration;
     }
-    // ++show_progress;
   }
-  registration_done_ = true;
+
+  fine_times_[i] = get_elapsed_seconds(start);
+  best_fine_registration.set_image_index(i);
+  registration_results_[i] = best_fine_registration;
+  IMP_LOG_TERSE("Fine2DRegistrationRestraint calls: " << fine2d->get_calls()
+                                                      << std::endl);
+
+  IMP_LOG_TERSE("Fine registration: " << registration_results_[i]
+                                      << std::endl);
+  // save if requested
+  if (params_.save_match_images) {
+    IMP_NEW(em2d::SpiderImageReaderWriter, srw, ());
+    IMP_NEW(em2d::TIFFImageReaderWriter, srx, ());
+    srw->set_was_used(true);
+    srx->set_was_used(true);
+    ProjectingOptions options(params_.pixel_size, params_.resolution);
+    options.normalize = true;
+    get_projection(match, model_particles_, registration_results_[i], options,
+                   masks_manager_);
+    std::ostringstream strm;
+    strm << "fine_match-";
+    strm.fill('0');
+    strm.width(4);
+    strm << i << ".spi";
+
+    std::ostringstream strn;
+    strn << "fine_match-";
+    strn.fill('0');
+    strn.width(4);
+    strn << i << ".tif";
+
+    registration_results_[i].set_in_image(match->get_header());
+    match->set_name(strm.str());  //
+    match->write(strm.str(), srw);
+    match->write(strn.str(), srx);
+  }
+}
+
+unsigned int ProjectionFinder::get_number_of_registration_threads() const {
+  // The variance images are passed to the shared score function, and saving
+  // the match images creates new objects for each subject, so do not
+  // register subjects concurrently in those cases
+  if (variances_.size() > 0 || params_.save_match_images) return 1;
+  unsigned int n = params_.number_of_threads;
+  if (n == 0) n = IMP::get_number_of_threads();
+  n = std::min(n, static_cast<unsigned int>(subjects_.size()));
+  return std::max(n, 1U);
 }
 
 RegistrationResults ProjectionFinder::get_registration_results() const {
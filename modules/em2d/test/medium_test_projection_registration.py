@@ -94,5 +94,50 @@ class Tests(IMP.test.TestCase):
                                    "theoretical_ccc %8.3f " % (i, ccc, theoretical_ccc))
         os.remove(fn_registration_results)
 
+    def test_registration_threads(self):
+        """Test that registration does not depend on the number of threads"""
+        smodel = IMP.Model()
+        prot = IMP.atom.read_pdb(self.get_input_file_name("1gyt.pdb"), smodel,
+                                 IMP.atom.ATOMPDBSelector())
+        particles = IMP.core.get_leaves(prot)
+        srw = em2d.SpiderImageReaderWriter()
+        names = [self.get_input_file_name(n) for n in em2d.read_selection_file(
+                   self.get_input_file_name("1gyt-subjects-0.5-SNR.sel"))]
+        subjects = em2d.read_images(names, srw)
+        pixel_size = 1.5
+        resolution = 8.5
+        options = em2d.ProjectingOptions(pixel_size, resolution)
+        projections = em2d.get_projections(
+            particles, em2d.get_evenly_distributed_registration_results(10),
+            128, 128, options)
+
+        def get_registration(number_of_threads, complete):
+            params = em2d.Em2DRestraintParameters(pixel_size, resolution, 10)
+            self.assertEqual(params.number_of_threads, 0)
+            params.number_of_threads = number_of_threads
+            params.optimization_steps = 10
+            finder = em2d.ProjectionFinder()
+            finder.setup(em2d.EM2DScore(), params)
+            finder.set_model_particles(particles)
+            finder.set_subjects(subjects)
+            finder.set_projections(projections)
+            if complete:
+                finder.set_fast_mode(1)
+                finder.get_complete_registration()
+                self.assertGreaterEqual(finder.get_fine_registration_time(),
+                                        0.)
+            else:
+                finder.get_coarse_registration()
+            self.assertGreaterEqual(finder.get_coarse_registration_time(), 0.)
+            return [(r.get_projection_index(), r.get_image_index(),
+                     list(r.get_rotation().get_quaternion()),
+                     list(r.get_shift()), r.get_score())
+                    for r in finder.get_registration_results()]
+
+        for complete in (False, True):
+            serial = get_registration(1, complete)
+            threaded = get_registration(3, complete)
+            self.assertEqual(serial, threaded)
+
 if __name__ == '__main__':
     IMP.test.main()
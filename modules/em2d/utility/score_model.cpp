@@ -75,6 +75,9 @@ po::variables_map get_parameters(int argc, char **argv) {
                       "Fast mode. Optimize "
                       "with Simplex only a given number of coarse results. "
                       " If value is 0, all are optimized")(
+      "threads", po::value<unsigned int>()->default_value(0),
+      "Number of threads used to register the subject images. "
+      "If value is 0, all available threads are used")(
       "bm", po::value<str>(),
       "file with solution parameters for the subjects (benchmark purposes)");
   po::variables_map vm;
@@ -186,6 +189,7 @@ int main(int argc, char **argv) {
   if (vm.count("save_i")) {
     save_images = true;
   }
+  unsigned int number_of_threads = vm["threads"].as<unsigned int>();
   unsigned int n_coarse_results_optimized = 0;
   if (vm.count("fast")) {
     n_coarse_results_optimized = vm["fast"].as<unsigned int>();
@@ -262,6 +266,7 @@ int main(int argc, char **argv) {
   params.save_match_images = save_images;
   params.optimization_steps = optimization_steps;
   params.simplex_minimum_size = simplex_minimum_size;
+  params.number_of_threads = number_of_threads;
   finder->setup(score_function, params);
   finder->set_model_particles(ps);
   finder->set_subjects(subjects);
@@ -101,6 +101,37 @@ class IMPISDEXPORT GaussianEMRestraint : public Restraint
 
   //! Get restraint slope
   Float get_slope(){return slope_;}
+
+  //! Set the distance beyond which density particles are grouped for the slope
+  /** By default (a cutoff of zero) the slope term is summed over every
+      pair of model and density particles. With a positive cutoff, the
+      density particles are binned on a grid with cells a quarter of the
+      cutoff wide, and each cell whose centroid is further than the cutoff
+      from a model particle contributes as if all its particles were at the
+      centroid. This is much faster for large maps. Since the distance is
+      convex, the summed distance to the particles of a cell is never less
+      than their number times the distance to its centroid, so the slope
+      score is always underestimated. For a particle a distance s from the
+      centroid of a cell at distance r the error is at most about
+      s^2/(2r), where s is less than the cell diagonal (under half the
+      cutoff), so it falls quickly for cells further away.
+  */
+  void set_slope_cutoff(double cutoff) { slope_cutoff_ = cutoff; }
+
+  //! Get the distance beyond which density particles are grouped for the slope
+  double get_slope_cutoff() const { return slope_cutoff_; }
+
+  //! Set the distance beyond which density pairs are ignored in local mode
+  /** In local mode the density-density overlap is by default summed over
+      every pair of local density particles. With a positive cutoff, only
+      pairs whose spheres are within the cutoff of each other are summed,
+      which is faster for large maps but changes the score, since the
+      Gaussians of more distant pairs can still overlap.
+  */
+  void set_local_dd_cutoff(double cutoff);
+
+  //! Get the distance beyond which density pairs are ignored in local mode
+  double get_local_dd_cutoff() const { return local_dd_cutoff_; }
   virtual double
     unprotected_evaluate(IMP::DerivativeAccumulator *accum) const IMP_OVERRIDE;
   virtual IMP::ModelObjectsTemp do_get_inputs() const IMP_OVERRIDE;
@@ -128,6 +159,14 @@ class IMPISDEXPORT GaussianEMRestraint : public Restraint
   PointerMember<container::CloseBipartitePairContainer> md_container_;
   PointerMember<container::ClosePairContainer> mm_container_;
   ParticleIndexes slope_ps_; //experiment
+  double slope_cutoff_, local_dd_cutoff_;
+  // positions in model_ps_/density_ps_ of each particle index, or -1
+  Ints model_index_, density_index_;
+  Ints slope_indexes_;
+  // density pairs (first <= second) whose spheres are within the local DD
+  // cutoff (or all pairs), and their overlaps, for the local DD score
+  IntPairs dd_pairs_;
+  Floats dd_pair_scores_;
   std::string density_fn_;
 
   //variables needed to tabulate the exponential
@@ -16,6 +16,11 @@
 IMPISD_BEGIN_NAMESPACE
 
 //! Calculate the -Log of a list of restraints.
+/** Each wrapped restraint is expected to return a probability. After each
+    evaluation, the -Log of every individual probability is available from
+    that restraint's Restraint::get_last_score(), so per-restraint output
+    does not need to evaluate the restraints again.
+ */
 class IMPISDEXPORT LogWrapper : public RestraintSet {
   void show_it(std::ostream &out) const;
 
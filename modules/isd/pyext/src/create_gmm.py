@@ -83,13 +83,13 @@ def run():
         if options.multiply_by_mass:
             mass_multiplier=sum(IMP.atom.Mass(p).get_mass() for p in mps)
 
-        pts = [IMP.core.XYZ(p).get_coordinates() for p in mps]
+        pts = np.array([list(IMP.core.XYZ(p).get_coordinates()) for p in mps])
         bbox = None
     elif ext=='mrc':
         dmap = IMP.em.read_map(data_fn,IMP.em.MRCReaderWriter())
         bbox = IMP.em.get_bounding_box(dmap)
         print('sampling points')
-        pts = IMP.isd.sample_points_from_density(dmap,options.num_samples,options.threshold)
+        pts = np.array(IMP.isd.sample_points_from_density(dmap,options.num_samples,options.threshold))
     else:
         print('ERROR: data_fn extension must be pdb, mrc, or npy')
         sys.exit()
@@ -110,7 +110,7 @@ def run():
             gmm = IMP.isd.gmm_tools.fit_gmm_to_points(pts,ncenters,mdl,density_ps,
                                                       options.num_iter,options.covar_type,
                                                       force_radii=options.force_radii,
-                                                      force_weight=options.force_weight,
+                                                      force_weight=force_weight,
                                                       mass_multiplier=mass_multiplier)
         else:
             gmm = IMP.isd.gmm_tools.fit_dirichlet_gmm_to_points(pts,ncenters,mdl,density_ps,
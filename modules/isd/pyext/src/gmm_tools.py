@@ -10,15 +10,474 @@ import IMP.atom
 import IMP.em
 import numpy as np
 import numpy.linalg
+import multiprocessing
+import hashlib
+import tempfile
 import sys,os
 
-try:
-    import sklearn.mixture
-    nosklearn=False
-except:
-    nosklearn=True
 from math import exp,sqrt,copysign
 
+_LOG_2PI = np.log(2. * np.pi)
+
+# Number of points handled at once when evaluating a GMM with up to 16
+# components (fewer with more components), to bound the memory used by the
+# (points x components) arrays
+_CHUNK_SIZE = 65536
+
+class GMM(object):
+    """A Gaussian mixture model in 3D, stored as NumPy arrays.
+    `weights` has shape (K,), `means` (K,3) and `covariances` (K,3,3)
+    (full matrices whatever the covariance type used for fitting).
+    Returned by fit_gmm_to_array() and read_gmm_from_text(); can be passed
+    to decorate_gmm_from_arrays(), gmm2map() and write_gmm_to_map().
+    """
+    def __init__(self, weights, means, covariances, covariance_type='full'):
+        self.weights = np.asarray(weights, dtype=float)
+        self.means = np.asarray(means, dtype=float).reshape(-1, 3)
+        self.covariances = np.asarray(covariances,
+                                      dtype=float).reshape(-1, 3, 3)
+        self.covariance_type = covariance_type
+        #: Number of EM iterations done, and whether the fit converged
+        self.n_iter = 0
+        self.converged = False
+
+    def __len__(self):
+        return len(self.weights)
+
+    def score_samples(self, points):
+        """Return the log probability density at each point"""
+        points = _get_point_array(points)
+        return np.concatenate([_logsumexp(_get_weighted_log_prob(
+                                       chunk, self.weights, self.means,
+                                       self.covariances), axis=1)
+                               for chunk in _get_chunks(points, len(self))])
+
+    def score(self, points):
+        """Return the mean log likelihood of the points"""
+        return np.mean(self.score_samples(points))
+
+    def _get_number_of_parameters(self):
+        k = len(self.weights)
+        ncovar = {'full': 6 * k, 'diag': 3 * k, 'spherical': k,
+                  'tied': 6}[self.covariance_type]
+        return ncovar + 3 * k + k - 1
+
+    def aic(self, points):
+        """Return the Akaike information criterion for the points"""
+        points = _get_point_array(points)
+        return (-2. * self.score(points) * len(points)
+                + 2. * self._get_number_of_parameters())
+
+    def bic(self, points):
+        """Return the Bayesian information criterion for the points"""
+        points = _get_point_array(points)
+        return (-2. * self.score(points) * len(points)
+                + self._get_number_of_parameters() * np.log(len(points)))
+
+    def get_gaussians(self):
+        """Return the components as a list of IMP.algebra.Gaussian3D
+           and a list of weights"""
+        shapes = [IMP.algebra.get_gaussian_from_covariance(
+                         c.tolist(), IMP.algebra.Vector3D(m.tolist()))
+                  for m, c in zip(self.means, self.covariances)]
+        return shapes, self.weights.tolist()
+
+def _get_point_array(points):
+    """Convert points (an array, or a list of coordinates or Vector3Ds)
+       to an (N,3) NumPy array"""
+    if isinstance(points, np.ndarray):
+        return points.astype(float, copy=False).reshape(-1, 3)
+    return np.array([list(p) for p in points], dtype=float).reshape(-1, 3)
+
+def _get_chunks(points, n_components=1):
+    size = max(1024, _CHUNK_SIZE * 16 // max(n_components, 16))
+    for i in range(0, max(len(points), 1), size):
+        yield points[i:i + size]
+
+def _logsumexp(a, axis):
+    amax = np.max(a, axis=axis, keepdims=True)
+    amax[~np.isfinite(amax)] = 0.
+    return (np.log(np.sum(np.exp(a - amax), axis=axis))
+            + np.squeeze(amax, axis=axis))
+
+def _get_weighted_log_prob(points, weights, means, covariances):
+    """Return log(weight_k N(x_n | mean_k, covariance_k)) as an (N,K)
+       array"""
+    n_components = len(weights)
+    chol = np.linalg.cholesky(covariances)
+    # y = (x - mean_k) L_k^-T for all components with one matrix product
+    prec_chol = np.linalg.inv(chol).transpose(0, 2, 1)
+    y = (points.dot(prec_chol.transpose(1, 0, 2).reshape(3, 3 * n_components))
+         - np.einsum('ki,kij->kj', means, prec_chol).reshape(3 * n_components))
+    y = y.reshape(len(points), n_components, 3)
+    log_det = np.sum(np.log(np.diagonal(chol, axis1=1, axis2=2)), axis=1)
+    with np.errstate(divide='ignore'):
+        log_weights = np.log(weights)
+    return (log_weights - log_det
+            - 0.5 * (3. * _LOG_2PI + np.einsum('nki,nki->nk', y, y)))
+
+def _get_full_covariances(covariances, covariance_type, n_components):
+    """Convert covariances as stored for the given type (e.g. by
+       scikit-learn) to a (K,3,3) array"""
+    covariances = np.asarray(covariances, dtype=float)
+    if covariance_type == 'full':
+        return covariances.reshape(n_components, 3, 3)
+    elif covariance_type == 'tied':
+        return np.tile(covariances.reshape(1, 3, 3), (n_components, 1, 1))
+    elif covariance_type == 'diag':
+        return covariances.reshape(n_components, 1, 3) * np.eye(3)
+    else:
+        return covariances.reshape(n_components, 1, 1) * np.eye(3)
+
+def _get_nearest_centers(points, centers):
+    d2 = (np.sum(points * points, axis=1)[:, np.newaxis]
+          - 2. * points.dot(centers.T) + np.sum(centers * centers, axis=1))
+    return np.argmin(d2, axis=1)
+
+def _get_kmeans_centers(points, n_components, rng, max_points=10000,
+                        num_iter=10):
+    """Pick initial GMM centers with k-means++ seeding, refined by a few
+       k-means iterations (on a random subset of the points)"""
+    if len(points) > max_points:
+        points = points[rng.choice(len(points), max_points, replace=False)]
+    centers = np.empty((n_components, 3))
+    centers[0] = points[rng.randint(len(points))]
+    d2 = np.sum((points - centers[0]) ** 2, axis=1)
+    for i in range(1, n_components):
+        total = d2.sum()
+        if total > 0.:
+            centers[i] = points[rng.choice(len(points), p=d2 / total)]
+        else:
+            centers[i] = points[rng.randint(len(points))]
+        d2 = np.minimum(d2, np.sum((points - centers[i]) ** 2, axis=1))
+    for i in range(num_iter):
+        labels = _get_nearest_centers(points, centers)
+        counts = np.bincount(labels, minlength=n_components)
+        filled = counts > 0
+        for dim in range(3):
+            sums = np.bincount(labels, weights=points[:, dim],
+                               minlength=n_components)
+            centers[filled, dim] = sums[filled] / counts[filled]
+    return centers
+
+def _get_statistics(points, resp):
+    """Sufficient statistics of the points for the given responsibilities"""
+    return (resp.sum(axis=0), resp.T.dot(points),
+            np.array([(points * resp[:, k, np.newaxis]).T.dot(points)
+                      for k in range(resp.shape[1])]))
+
+def _m_step(nk, sk, qk, npoints, covariance_type, min_covar, force_radii,
+            force_weight):
+    nk = nk + 10. * np.finfo(float).eps
+    n_components = len(nk)
+    means = sk / nk[:, np.newaxis]
+    scatter = qk - nk[:, np.newaxis, np.newaxis] \
+                   * means[:, :, np.newaxis] * means[:, np.newaxis, :]
+    if force_radii != -1.0:
+        covars = np.tile(np.eye(3) * force_radii, (n_components, 1, 1))
+    else:
+        if covariance_type == 'tied':
+            covars = np.tile(scatter.sum(axis=0) / npoints,
+                             (n_components, 1, 1))
+        else:
+            covars = scatter / nk[:, np.newaxis, np.newaxis]
+            if covariance_type == 'diag':
+                covars = covars * np.eye(3)
+            elif covariance_type == 'spherical':
+                covars = (np.trace(covars, axis1=1, axis2=2)[:, np.newaxis,
+                                                            np.newaxis]
+                          / 3. * np.eye(3))
+        covars = covars + min_covar * np.eye(3)
+    if force_weight != -1.0:
+        weights = np.ones(n_components) * force_weight
+    else:
+        weights = nk / npoints
+    return weights, means, covars
+
+def fit_gmm_to_array(points,
+                     n_components,
+                     num_iter=100,
+                     covariance_type='full',
+                     min_covar=0.001,
+                     init_centers=None,
+                     force_radii=-1.0,
+                     force_weight=-1.0,
+                     tol=1e-3,
+                     seed=None):
+    """Fit a GMM to some points with expectation maximization.
+    Unless init_centers are given, the EM is started from k-means++ seeded
+    k-means centers. Fitting stops early once the mean log likelihood
+    changes by less than tol between iterations. Points are processed in
+    chunks, so large sets of points can be fit in bounded memory.
+
+    points:            (N,3) NumPy array (or list of coordinates)
+    n_components:      number of gaussians to fit
+    num_iter:          maximum number of EM iterations
+    covariance_type:   'full', 'diag' (or 'diagonal'), 'spherical' or 'tied'
+    min_covar:         added to the diagonal of each covariance
+    init_centers:      initial coordinates of the GMM
+    force_radii:       fix the variance of spherical gaussians
+    force_weight:      fix the weights
+    tol:               convergence threshold
+    seed:              seed for the random number generator
+    returns a GMM object
+    """
+    points = _get_point_array(points)
+    if covariance_type == 'diagonal':
+        covariance_type = 'diag'
+    if covariance_type not in ('full', 'diag', 'spherical', 'tied'):
+        raise ValueError("Unknown covariance type %s" % covariance_type)
+    if force_radii != -1.0:
+        covariance_type = 'spherical'
+    if len(points) < n_components:
+        raise ValueError("Cannot fit %d gaussians to %d points"
+                         % (n_components, len(points)))
+    rng = np.random.RandomState(seed)
+    # work relative to the centroid, for numerical stability
+    centroid = points.mean(axis=0)
+    points = points - centroid
+    if init_centers is not None and len(init_centers) > 0:
+        centers = _get_point_array(init_centers) - centroid
+    else:
+        centers = _get_kmeans_centers(points, n_components, rng)
+
+    # initial parameters from assigning each point to its nearest center
+    nk = np.zeros(n_components)
+    sk = np.zeros((n_components, 3))
+    qk = np.zeros((n_components, 3, 3))
+    for chunk in _get_chunks(points, n_components):
+        resp = np.zeros((len(chunk), n_components))
+        resp[np.arange(len(chunk)), _get_nearest_centers(chunk, centers)] = 1.
+        stats = _get_statistics(chunk, resp)
+        nk += stats[0]
+        sk += stats[1]
+        qk += stats[2]
+    weights, means, covars = _m_step(nk, sk, qk, len(points),
+                                     covariance_type, min_covar,
+                                     force_radii, force_weight)
+
+    last_ll = -np.inf
+    converged = False
+    for n_iter in range(1, num_iter + 1):
+        nk = np.zeros(n_components)
+        sk = np.zeros((n_components, 3))
+        qk = np.zeros((n_components, 3, 3))
+        ll = 0.
+        for chunk in _get_chunks(points, n_components):
+            wlp = _get_weighted_log_prob(chunk, weights, means, covars)
+            norm = _logsumexp(wlp, axis=1)
+            ll += norm.sum()
+            stats = _get_statistics(chunk, np.exp(wlp - norm[:, np.newaxis]))
+            nk += stats[0]
+            sk += stats[1]
+            qk += stats[2]
+        weights, means, covars = _m_step(nk, sk, qk, len(points),
+                                         covariance_type, min_covar,
+                                         force_radii, force_weight)
+        ll /= len(points)
+        if abs(ll - last_ll) < tol:
+            converged = True
+            break
+        last_ll = ll
+
+    gmm = GMM(weights, means + centroid, covars, covariance_type)
+    gmm.n_iter = n_iter if num_iter > 0 else 0
+    gmm.converged = converged
+    return gmm
+
+def _fit_gmm_job(args):
+    points, n_components, kwargs = args
+    return fit_gmm_to_array(points, n_components, **kwargs)
+
+def fit_gmms_to_arrays(point_sets, n_components, processes=None, **kwargs):
+    """Fit independent GMMs to several sets of points, in parallel.
+    point_sets:        list of (N,3) NumPy arrays (or lists of coordinates)
+    n_components:      number of gaussians, either for all sets or as a list
+    processes:         number of worker processes (default: the number of
+                       CPUs); 1 fits all sets in this process
+    other keyword arguments are passed to fit_gmm_to_array()
+    returns a list of GMM objects, in the same order as point_sets
+    """
+    if isinstance(n_components, int):
+        n_components = [n_components] * len(point_sets)
+    jobs = [(_get_point_array(points), n, kwargs)
+            for points, n in zip(point_sets, n_components)]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(jobs))
+    if processes <= 1:
+        return [_fit_gmm_job(job) for job in jobs]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_fit_gmm_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+class GMMCache(object):
+    """Content-addressed cache of GMMs derived from EM inputs, on disk.
+    Entries are keyed by a hash of everything the GMM was derived from
+    (input file contents, particle coordinates, fitting parameters), so
+    identical runs can share one directory, even when launched at the same
+    time or on several MPI ranks. Each entry is a NumPy .npz file, written
+    under a temporary name and then renamed into place.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another run may have created it in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        # (path, mtime, size) -> hash of file contents
+        self._file_hashes = {}
+
+    def get_file_hash(self, fname):
+        """Return a hash of the contents of the given file"""
+        st = os.stat(fname)
+        key = (os.path.abspath(fname), st.st_mtime, st.st_size)
+        if key not in self._file_hashes:
+            h = hashlib.sha1()
+            with open(fname, 'rb') as fh:
+                for block in iter(lambda: fh.read(1 << 20), b''):
+                    h.update(block)
+            self._file_hashes[key] = h.hexdigest()
+        return self._file_hashes[key]
+
+    def get_key(self, *parts):
+        """Return a key for the given inputs (strings, numbers, None,
+           or NumPy arrays)"""
+        h = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                part = np.ascontiguousarray(part, dtype=float)
+                h.update(repr(part.shape).encode('ascii'))
+                h.update(part.tobytes())
+            else:
+                h.update(repr(part).encode('utf8'))
+            h.update(b'|')
+        return h.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """Return the GMM stored under key, or None"""
+        try:
+            with np.load(self._get_path(key)) as data:
+                gmm = GMM(data['weights'], data['means'],
+                          data['covariances'],
+                          str(data['covariance_type']))
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+        return gmm
+
+    def set(self, key, gmm):
+        """Store a GMM under key"""
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                np.savez(fh, weights=gmm.weights, means=gmm.means,
+                         covariances=gmm.covariances,
+                         covariance_type=gmm.covariance_type)
+            os.rename(tmpname, self._get_path(key))
+        except:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            raise
+
+_cache = None
+
+def set_cache_directory(directory):
+    """Cache derived EM inputs (GMMs read from text files or fit to points
+    or particles) in the given directory, to be reused by later runs.
+    Pass None to turn off caching. By default, the directory named by the
+    IMP_GMM_CACHE_DIR environment variable is used, if set."""
+    global _cache
+    _cache = GMMCache(directory) if directory else False
+
+def get_cache():
+    """Return the active GMMCache, or None if caching is off"""
+    global _cache
+    if _cache is None:
+        set_cache_directory(os.environ.get('IMP_GMM_CACHE_DIR'))
+    return _cache or None
+
+def _get_cached_gmm(key_parts, fit):
+    """Return the GMM for the given inputs from the cache, or from fit()"""
+    cache = get_cache()
+    if cache is None:
+        return fit()
+    key = cache.get_key(*key_parts)
+    gmm = cache.get(key)
+    if gmm is None:
+        gmm = fit()
+        cache.set(key, gmm)
+    return gmm
+
+def _get_particle_array(ps):
+    """Coordinates, radii and masses of particles, as used to simulate
+       their density"""
+    return np.array([list(IMP.core.XYZ(p).get_coordinates())
+                     + [IMP.core.XYZR(p).get_radius(),
+                        IMP.atom.Mass(p).get_mass()] for p in ps])
+
+def read_gmm_from_text(in_fn):
+    """read the output from write_gmm_to_text as a GMM object"""
+    cache = get_cache()
+    if cache is None:
+        return _read_gmm_from_text(in_fn)
+    return _get_cached_gmm(('read_gmm_from_text', cache.get_file_hash(in_fn)),
+                           lambda: _read_gmm_from_text(in_fn))
+
+def _read_gmm_from_text(in_fn):
+    weights = []
+    means = []
+    covars = []
+    with open(in_fn,'r') as inf:
+        for l in inf:
+            if l[0]!='#':
+                fields=l.split('|')
+                weights.append(float(fields[2]))
+                means.append(fields[3].split())
+                covars.append(fields[4].split())
+    return GMM(weights, np.array(means, dtype=float),
+               np.array(covars, dtype=float))
+
+def decorate_gmm_from_arrays(gmm,
+                             ps,
+                             mdl,
+                             transform=None,
+                             radius_scale=1.0,
+                             mass_scale=1.0):
+    """decorate particles as Gaussian, Mass and XYZR from a GMM object.
+    particles are added to ps as needed"""
+    shapes, weights = gmm.get_gaussians()
+    # radius is the largest standard deviation of each gaussian
+    radii = np.sqrt(np.linalg.eigvalsh(gmm.covariances).max(axis=1)) \
+            * radius_scale
+    for ncomp, (shape, weight, rmax) in enumerate(zip(shapes, weights,
+                                                      radii.tolist())):
+        if ncomp>len(ps)-1:
+            ps.append(IMP.Particle(mdl))
+        p = ps[ncomp]
+        if not IMP.core.Gaussian.get_is_setup(p):
+            IMP.core.Gaussian.setup_particle(p,shape)
+        else:
+            IMP.core.Gaussian(p).set_gaussian(shape)
+        if not IMP.atom.Mass.get_is_setup(p):
+            IMP.atom.Mass.setup_particle(p,weight*mass_scale)
+        else:
+            IMP.atom.Mass(p).set_mass(weight*mass_scale)
+        if not IMP.core.XYZR.get_is_setup(p):
+            IMP.core.XYZR.setup_particle(p,rmax)
+        else:
+            IMP.core.XYZR(p).set_radius(rmax)
+        if not transform is None:
+            IMP.core.transform(IMP.core.RigidBody(p),transform)
+
 def decorate_gmm_from_text(in_fn,
                            ps,
                            mdl,
@@ -26,38 +485,8 @@ def decorate_gmm_from_text(in_fn,
                            radius_scale=1.0,
                            mass_scale=1.0):
     """ read the output from write_gmm_to_text, decorate as Gaussian and Mass"""
-    ncomp=0
-    with open(in_fn,'r') as inf:
-        for l in inf:
-            if l[0]!='#':
-                if ncomp>len(ps)-1:
-                    ps.append(IMP.Particle(mdl))
-                p = ps[ncomp]
-                fields=l.split('|')
-                weight=float(fields[2])
-                center=list(map(float,fields[3].split()))
-                covar=np.array(list(map(float,
-                                        fields[4].split()))).reshape((3,3))
-                #print('on particle',ncomp)
-                shape=IMP.algebra.get_gaussian_from_covariance(covar.tolist(),
-                                                 IMP.algebra.Vector3D(center))
-                if not IMP.core.Gaussian.get_is_setup(p):
-                    g = IMP.core.Gaussian.setup_particle(ps[ncomp],shape)
-                else:
-                    g = IMP.core.Gaussian(ps[ncomp])
-                    g.set_gaussian(shape)
-                if not IMP.atom.Mass.get_is_setup(p):
-                    IMP.atom.Mass.setup_particle(p,weight*mass_scale)
-                else:
-                    IMP.atom.Mass(p).set_mass(weight*mass_scale)
-                rmax = sqrt(max(g.get_variances()))*radius_scale
-                if not IMP.core.XYZR.get_is_setup(ps[ncomp]):
-                    IMP.core.XYZR.setup_particle(ps[ncomp],rmax)
-                else:
-                    IMP.core.XYZR(ps[ncomp]).set_radius(rmax)
-                if not transform is None:
-                    IMP.core.transform(IMP.core.RigidBody(ps[ncomp]),transform)
-                ncomp+=1
+    decorate_gmm_from_arrays(read_gmm_from_text(in_fn), ps, mdl, transform,
+                             radius_scale, mass_scale)
 
 def write_gmm_to_text(ps,out_fn, comments=[]):
     """write a list of gaussians to text. must be decorated as Gaussian and Mass"""
@@ -80,26 +509,27 @@ def write_gmm_to_text(ps,out_fn, comments=[]):
                 outf.write('|{0}|{1}|{2} {3} {4}|{5} {6} {7} {8} {9} {10} {11} {12} {13}|\n'.format(*fm))
 
 def gmm2map(to_draw,voxel_size,bounding_box=None,origin=None, fast=False, factor=2.5):
-    if type(to_draw[0]) in (IMP.Particle,IMP.atom.Hierarchy,IMP.core.Hierarchy):
-        ps=to_draw
+    """rasterize a GMM to a density map. input can be either particles,
+    gaussians or a GMM object"""
+    if isinstance(to_draw, GMM):
+        shapes, weights = to_draw.get_gaussians()
+    elif type(to_draw[0]) in (IMP.Particle,IMP.atom.Hierarchy,IMP.core.Hierarchy):
+        shapes=[IMP.core.Gaussian(p).get_gaussian() for p in to_draw]
+        weights=[IMP.atom.Mass(p).get_mass() for p in to_draw]
     elif type(to_draw[0])==IMP.core.Gaussian:
-        ps=[g.get_particle() for g in to_draw]
+        shapes=[g.get_gaussian() for g in to_draw]
+        weights=[IMP.atom.Mass(g).get_mass() for g in to_draw]
     else:
-        print('ps must be Particles or Gaussians')
+        print('ps must be Particles, Gaussians or a GMM')
         return
     if bounding_box is None:
-        if len(ps)>1:
-            s=IMP.algebra.get_enclosing_sphere([IMP.core.XYZ(p).get_coordinates() for p in ps])
+        if len(shapes)>1:
+            s=IMP.algebra.get_enclosing_sphere([g.get_center() for g in shapes])
             s2=IMP.algebra.Sphere3D(s.get_center(),s.get_radius()*3)
         else:
-            g=IMP.core.Gaussian(ps[0]).get_gaussian()
+            g=shapes[0]
             s2=IMP.algebra.Sphere3D(g.get_center(),max(g.get_variances())*3)
         bounding_box=IMP.algebra.get_bounding_box(s2)
-    shapes=[]
-    weights=[]
-    for p in ps:
-        shapes.append(IMP.core.Gaussian(p).get_gaussian())
-        weights.append(IMP.atom.Mass(p).get_mass())
     print('rasterizing')
     if fast:
         grid=IMP.algebra.get_rasterized_fast(shapes,weights,voxel_size,bounding_box,factor)
@@ -111,14 +541,15 @@ def gmm2map(to_draw,voxel_size,bounding_box=None,origin=None, fast=False, factor
         d1.set_origin(origin)
     return d1
 def write_gmm_to_map(to_draw,out_fn,voxel_size,bounding_box=None,origin=None, fast=False, factor=2.5):
-    """write density map from GMM. input can be either particles or gaussians"""
-    d1 = gmm2map(to_draw,voxel_size,bounding_box,origin, fast)
+    """write density map from GMM. input can be either particles, gaussians
+    or a GMM object"""
+    d1 = gmm2map(to_draw,voxel_size,bounding_box,origin, fast, factor)
     print('will write GMM map to',out_fn)
     IMP.em.write_map(d1,out_fn,IMP.em.MRCReaderWriter())
     del d1
 
 def write_sklearn_gmm_to_map(gmm,out_fn,apix=0,bbox=None,dmap_model=None):
-    """write density map directly from sklearn GMM (kinda slow) """
+    """write density map directly from a GMM object or sklearn GMM"""
     ### create density
     if not dmap_model is None:
         d1=IMP.em.create_density_map(dmap_model)
@@ -127,15 +558,20 @@ def write_sklearn_gmm_to_map(gmm,out_fn,apix=0,bbox=None,dmap_model=None):
 
     ### fill it with values from the GMM
     print('getting coords')
-    nvox=d1.get_number_of_voxels()
-    apos=[list(d1.get_location_by_voxel(nv)) for nv in range(nvox)]
+    voxels=d1.get_voxel_array()
+    iz,iy,ix=np.indices(voxels.shape)
+    apos=np.column_stack((ix.ravel(),iy.ravel(),iz.ravel())) \
+         * d1.get_spacing() + np.array(list(d1.get_origin()))
 
     print('scoring')
-    scores=gmm.score(apos)
+    if hasattr(gmm,'score_samples'):
+        scores=gmm.score_samples(apos)
+    else:
+        scores=gmm.score(apos)
 
     print('assigning')
-    for nv, score in enumerate(scores):
-        d1.set_value(nv,exp(score))
+    voxels[...]=np.exp(np.asarray(scores)).reshape(voxels.shape)
+    d1.set_voxels_modified()
     print('will write GMM map to',out_fn)
     IMP.em.write_map(d1,out_fn,IMP.em.MRCReaderWriter())
 
@@ -195,28 +631,36 @@ def sample_and_fit_to_particles(model,
                                 output_map=None,
                                 output_txt=None):
     density_particles=[]
+    mass_multiplier=1.0
     if multiply_by_total_mass:
         mass_multiplier=sum((IMP.atom.Mass(p).get_mass() for p in set(fragment_particles)))
         print('add_component_density: will multiply by mass',mass_multiplier)
 
-    # simulate density from ps, then calculate points to fit
-    print('add_component_density: sampling points')
-    dmap=IMP.em.SampledDensityMap(fragment_particles,simulation_res,voxel_size,
-                                 IMP.atom.Mass.get_mass_key(),3)
-    dmap.calcRMS()
-    #if not intermediate_map_fn is None:
-    #   IMP.em.write_map(dmap,intermediate_map_fn)
-    pts=IMP.isd.sample_points_from_density(dmap,sampled_points)
-
-    # fit GMM
-    print('add_component_density: fitting GMM to',len(pts),'points')
-    fit_gmm_to_points(points=pts,
-                      n_components=num_components,
-                      mdl=model,
-                      ps=density_particles,
-                      num_iter=num_iter,
-                      covariance_type=covariance_type,
-                      mass_multiplier=mass_multiplier)
+    dmaps=[]
+    def get_dmap():
+        # simulate density from ps
+        if not dmaps:
+            dmap=IMP.em.SampledDensityMap(fragment_particles,simulation_res,
+                                          voxel_size,
+                                          IMP.atom.Mass.get_mass_key(),3)
+            dmap.calcRMS()
+            dmaps.append(dmap)
+        return dmaps[0]
+
+    def fit():
+        # calculate points to fit
+        print('add_component_density: sampling points')
+        pts=np.array(IMP.isd.sample_points_from_density(get_dmap(),
+                                                        sampled_points))
+        print('add_component_density: fitting GMM to',len(pts),'points')
+        return fit_gmm_to_array(pts,num_components,num_iter,covariance_type)
+
+    gmm=_get_cached_gmm(('sample_and_fit_to_particles',
+                         _get_particle_array(fragment_particles),
+                         num_components,sampled_points,simulation_res,
+                         voxel_size,num_iter,covariance_type),fit)
+    decorate_gmm_from_arrays(gmm,density_particles,model,
+                             mass_scale=mass_multiplier)
 
     if not output_txt is None:
         write_gmm_to_text(density_particles,output_txt)
@@ -224,7 +668,7 @@ def sample_and_fit_to_particles(model,
         write_gmm_to_map(to_draw=density_particles,
                          out_fn=output_map,
                          voxel_size=voxel_size,
-                         bounding_box=IMP.em.get_bounding_box(dmap))
+                         bounding_box=IMP.em.get_bounding_box(get_dmap()))
 
     return density_particles
 
@@ -239,80 +683,49 @@ def fit_gmm_to_points(points,
                       force_radii=-1.0,
                       force_weight=-1.0,
                       mass_multiplier=1.0):
-    """fit a GMM to some points. Will return the score and the Akaike score.
+    """fit a GMM to some points. Will return the mean log likelihood of the
+    points and the Akaike score.
     Akaike information criterion for the current model fit. It is a measure
     of the relative quality of the GMM that takes into account the
     parsimony and the goodness of the fit.
     if no particles are provided, they will be created
 
-    points:            list of coordinates (python)
+    points:            list of coordinates (python) or (N,3) NumPy array
     n_components:      number of gaussians to create
     mdl:               IMP Model
     ps:                list of particles to be decorated. if empty, will add
-    num_iter:          number of EM iterations
-    covariance_type:   covar type for the gaussians. options: 'full', 'diagonal', 'spherical'
+    num_iter:          maximum number of EM iterations
+    covariance_type:   covar type for the gaussians. options: 'full', 'diagonal', 'spherical', 'tied'
     min_covar:         assign a minimum value to covariance term. That is used to have more spherical
                        shaped gaussians
     init_centers:      initial coordinates of the GMM
     force_radii:       fix the radii (spheres only)
     force_weight:      fix the weights
     mass_multiplier:   multiply the weights of all the gaussians by this value
-    dirichlet:         use the DGMM fitting (can reduce number of components, takes longer)
+    see fit_gmm_to_array() for the fitting itself
     """
 
 
-    import sklearn.mixture
-
-    params='m'
-    init_params='m'
-    if force_radii==-1.0:
-        params+='c'
-        init_params+='c'
-    else:
-        covariance_type='spherical'
+    points=_get_point_array(points)
+    if force_radii!=-1.0:
         print('forcing spherical with radii',force_radii)
-
-    if force_weight==-1.0:
-        params+='w'
-        init_params+='w'
-    else:
+    if force_weight!=-1.0:
         print('forcing weights to be',force_weight)
 
-    print('creating GMM with params',params,'init params',init_params,'n_components',n_components,'n_iter',num_iter,'covar type',covariance_type)
-    gmm=sklearn.mixture.GMM(n_components=n_components,
-                          n_iter=num_iter,
-                          covariance_type=covariance_type,
-                          min_covar=min_covar,
-                          params=params,
-                          init_params=init_params)
-
-    if force_weight!=-1.0:
-        gmm.weights_=np.array([force_weight]*n_components)
-    if force_radii!=-1.0:
-        gmm.covars_=np.array([[force_radii]*3 for i in range(n_components)])
-    if init_centers!=[]:
-        gmm.means_=init_centers
-    print('fitting')
-    model=gmm.fit(points)
+    print('creating GMM with n_components',n_components,'n_iter',num_iter,'covar type',covariance_type)
+    def fit():
+        return fit_gmm_to_array(points,n_components,num_iter,covariance_type,
+                                min_covar,init_centers,force_radii,
+                                force_weight)
+    gmm=_get_cached_gmm(('fit_gmm_to_points',points,n_components,num_iter,
+                         covariance_type,min_covar,
+                         _get_point_array(init_centers),force_radii,
+                         force_weight),fit)
     score=gmm.score(points)
-    akaikescore=model.aic(points)
-    #print('>>> GMM score',gmm.score(points))
+    akaikescore=gmm.aic(points)
 
     ### convert format to core::Gaussian
-    for ng in range(n_components):
-        covar=gmm.covars_[ng]
-        if covar.size==3:
-            covar=np.diag(covar).tolist()
-        else:
-            covar=covar.tolist()
-        center=list(gmm.means_[ng])
-        weight=mass_multiplier*gmm.weights_[ng]
-        if ng>=len(ps):
-            ps.append(IMP.Particle(mdl))
-        shape=IMP.algebra.get_gaussian_from_covariance(covar,IMP.algebra.Vector3D(center))
-        g=IMP.core.Gaussian.setup_particle(ps[ng],shape)
-        IMP.atom.Mass.setup_particle(ps[ng],weight)
-        IMP.core.XYZR.setup_particle(ps[ng],sqrt(max(g.get_variances())))
+    decorate_gmm_from_arrays(gmm,ps,mdl,mass_scale=mass_multiplier)
 
     return (score,akaikescore)
 
@@ -341,32 +754,22 @@ def fit_dirichlet_gmm_to_points(points,
 
     import sklearn.mixture
 
+    if covariance_type=='diagonal':
+        covariance_type='diag'
+    points=_get_point_array(points)
     ### create and fit GMM
     print('using dirichlet prior')
-    gmm=sklearn.mixture.DPGMM(n_components=n_components,
-                              n_iter=num_iter,
-                              covariance_type=covariance_type)
+    gmm=sklearn.mixture.BayesianGaussianMixture(n_components=n_components,
+                              max_iter=num_iter,
+                              covariance_type=covariance_type,
+                              weight_concentration_prior_type='dirichlet_process')
 
     gmm.fit(points)
 
-    #print('>>> GMM score',gmm.score(points))
-
-    #print gmm.covars_
-    #print gmm.weights_
-    #print gmm.means_
     ### convert format to core::Gaussian
-    for ng in range(n_components):
-        invcovar=gmm.precs_[ng]
-        covar=np.linalg.inv(invcovar)
-        if covar.size==3:
-            covar=np.diag(covar).tolist()
-        else:
-            covar=covar.tolist()
-        center=list(gmm.means_[ng])
-        weight=mass_multiplier*gmm.weights_[ng]
-        if ng>=len(ps):
-            ps.append(IMP.Particle(mdl))
-        shape=IMP.algebra.get_gaussian_from_covariance(covar,IMP.algebra.Vector3D(center))
-        g=IMP.core.Gaussian.setup_particle(ps[ng],shape)
-        IMP.atom.Mass.setup_particle(ps[ng],weight)
-        IMP.core.XYZR.setup_particle(ps[ng],sqrt(max(g.get_variances())))
+    decorate_gmm_from_arrays(GMM(gmm.weights_,gmm.means_,
+                                 _get_full_covariances(gmm.covariances_,
+                                                       covariance_type,
+                                                       n_components),
+                                 covariance_type),
+                             ps,mdl,mass_scale=mass_multiplier)
@@ -12,7 +12,11 @@
 #include <Eigen/LU>
 #include <IMP/algebra/BoundingBoxD.h>
 #include <IMP/algebra/vector_generators.h>
-#include <IMP/isd/em_utilities.h>
+#include <IMP/core/XYZR.h>
+#include <IMP/threads.h>
+#include <IMP/thread_macros.h>
+#include <algorithm>
+#include <map>
 
 IMPISD_BEGIN_NAMESPACE
 
@@ -49,6 +53,170 @@ kahan_vector_sum(KahanVectorAccumulation accumulation,
   return result;
 }
 
+// Pairs are scored in tasks of this many pairs when using threads
+const unsigned int overlap_chunk_size = 1024;
+
+// Model particles are handled in tasks of this size for the slope term
+const unsigned int slope_chunk_size = 64;
+
+/* The means, global covariances and masses of a set of Gaussians, gathered
+   once per evaluation rather than from the decorators for every pair */
+struct GaussianArrays {
+  std::vector<Eigen::Vector3d> means;
+  std::vector<Eigen::Matrix3d> covariances;
+  Floats masses;
+  GaussianArrays(Model *m, const ParticleIndexes &pis)
+      : means(pis.size()), covariances(pis.size()), masses(pis.size()) {
+    for (unsigned int i = 0; i < pis.size(); ++i) {
+      core::Gaussian g(m, pis[i]);
+      means[i] = Eigen::Vector3d(g.get_coordinates().get_data());
+      covariances[i] = g.get_global_covariance();
+      masses[i] = atom::Mass(m, pis[i]).get_mass();
+    }
+  }
+};
+
+// Same as score_gaussian_overlap(), for Gaussian i of a and j of b
+inline double get_overlap(const GaussianArrays &a, int i,
+                          const GaussianArrays &b, int j,
+                          Eigen::Vector3d *deriv) {
+  double determinant;
+  bool invertible;
+  Eigen::Matrix3d inverse = Eigen::Matrix3d::Zero();
+  double mass12 = a.masses[i] * b.masses[j];
+  Eigen::Matrix3d covar = a.covariances[i] + b.covariances[j];
+  Eigen::Vector3d v = b.means[j] - a.means[i];
+  covar.computeInverseAndDetWithCheck(inverse, determinant, invertible);
+  Eigen::Vector3d tmp = inverse * v;
+  // 0.06349... = 1. / sqrt(2.0 * pi) ** 3
+  double score = mass12 * 0.06349363593424097 / (std::sqrt(determinant)) *
+                 std::exp(-0.5 * v.transpose() * tmp);
+  *deriv = -score * tmp;
+  return score;
+}
+
+void add_overlaps(const GaussianArrays *a, const GaussianArrays *b,
+                  const IntPairs *pairs, unsigned int begin, unsigned int end,
+                  Floats *scores, std::vector<Eigen::Vector3d> *derivs) {
+  for (unsigned int i = begin; i < end; ++i) {
+    (*scores)[i] = get_overlap(*a, (*pairs)[i].first, *b, (*pairs)[i].second,
+                               &(*derivs)[i]);
+  }
+}
+
+/* Get the overlap and derivative of each pair. Each pair has its own
+   output slot, so the results do not depend on the number of threads. */
+void get_overlaps(const GaussianArrays &a, const GaussianArrays &b,
+                  const IntPairs &pairs, Floats &scores,
+                  std::vector<Eigen::Vector3d> &derivs) {
+  unsigned int n = pairs.size();
+  scores.resize(n);
+  derivs.resize(n);
+  if (get_number_of_threads() > 1 && n > overlap_chunk_size) {
+    const GaussianArrays *pa = &a, *pb = &b;
+    const IntPairs *ppairs = &pairs;
+    Floats *pscores = &scores;
+    std::vector<Eigen::Vector3d> *pderivs = &derivs;
+    IMP_THREADS((pa, pb, ppairs, pscores, pderivs, n), {
+      for (unsigned int begin = 0; begin < n; begin += overlap_chunk_size) {
+        unsigned int end = std::min(n, begin + overlap_chunk_size);
+        IMP_TASK((pa, pb, ppairs, pscores, pderivs, begin, end),
+                 add_overlaps(pa, pb, ppairs, begin, end, pscores, pderivs),
+                 "gaussian overlaps");
+      }
+      IMP_OMP_PRAGMA(taskwait)
+    });
+  } else {
+    add_overlaps(&a, &b, &pairs, 0, n, &scores, &derivs);
+  }
+}
+
+/* The density Gaussians in one cell of a grid, for the slope term with a
+   cutoff */
+struct DensityCell {
+  Ints members;
+  Eigen::Vector3d centroid;
+};
+
+std::vector<DensityCell> get_density_cells(const GaussianArrays &d,
+                                           double side) {
+  Eigen::Vector3d lb = d.means[0];
+  for (unsigned int i = 1; i < d.means.size(); ++i) {
+    lb = lb.cwiseMin(d.means[i]);
+  }
+  std::map<std::vector<int>, int> index;
+  std::vector<DensityCell> cells;
+  for (unsigned int i = 0; i < d.means.size(); ++i) {
+    std::vector<int> key(3);
+    for (unsigned int k = 0; k < 3; ++k) {
+      key[k] = static_cast<int>(std::floor((d.means[i][k] - lb[k]) / side));
+    }
+    std::map<std::vector<int>, int>::const_iterator it = index.find(key);
+    if (it == index.end()) {
+      it = index.insert(std::make_pair(key, cells.size())).first;
+      cells.push_back(DensityCell());
+      cells.back().centroid = Eigen::Vector3d::Zero();
+    }
+    DensityCell &cell = cells[it->second];
+    cell.members.push_back(i);
+    cell.centroid += d.means[i];
+  }
+  for (unsigned int i = 0; i < cells.size(); ++i) {
+    cells[i].centroid /= cells[i].members.size();
+  }
+  return cells;
+}
+
+struct SlopeData {
+  const GaussianArrays *model, *density;
+  const Ints *indexes;
+  const std::vector<DensityCell> *cells;
+  double slope, cutoff;
+};
+
+/* The slope term for the model Gaussians indexes[begin:end]. Density
+   Gaussians in cells whose centroid is further than the cutoff are
+   replaced by the centroid. */
+void add_slope(const SlopeData *data, unsigned int begin, unsigned int end,
+               Floats *scores, std::vector<KahanVectorAccumulation> *derivs) {
+  const GaussianArrays &d = *data->density;
+  double slope = data->slope;
+  for (unsigned int k = begin; k < end; ++k) {
+    int mi = (*data->indexes)[k];
+    const Eigen::Vector3d &x = data->model->means[mi];
+    KahanVectorAccumulation deriv;
+    double score = 0.;
+    if (data->cells) {
+      for (unsigned int c = 0; c < data->cells->size(); ++c) {
+        const DensityCell &cell = (*data->cells)[c];
+        Eigen::Vector3d w = x - cell.centroid;
+        double r = w.norm();
+        if (r > data->cutoff) {
+          double n = cell.members.size();
+          deriv = kahan_vector_sum(deriv, w * slope * n / r);
+          score += slope * n * r;
+        } else {
+          for (unsigned int j = 0; j < cell.members.size(); ++j) {
+            Eigen::Vector3d v = x - d.means[cell.members[j]];
+            double sd = v.norm();
+            deriv = kahan_vector_sum(deriv, v * slope / sd);
+            score += slope * sd;
+          }
+        }
+      }
+    } else {
+      for (unsigned int j = 0; j < d.means.size(); ++j) {
+        Eigen::Vector3d v = x - d.means[j];
+        double sd = v.norm();
+        deriv = kahan_vector_sum(deriv, v * slope / sd);
+        score += slope * sd;
+      }
+    }
+    (*scores)[k] = score;
+    (*derivs)[mi] = deriv;
+  }
+}
+
 } // anonymous namespace
 
 GaussianEMRestraint::GaussianEMRestraint(
@@ -68,7 +236,9 @@ GaussianEMRestraint::GaussianEMRestraint(
   global_sigma_(global_sigma),
   slope_(slope),
   update_model_(update_model),
-  local_(local){
+  local_(local),
+  slope_cutoff_(0.),
+  local_dd_cutoff_(0.){
     msize_=model_ps.size();
     dsize_=density_ps.size();
 
@@ -86,6 +256,19 @@ GaussianEMRestraint::GaussianEMRestraint(
                       "Density particles must have Mass");
     }
 
+    // map particle indexes to positions in the model and density arrays
+    int maxindex = 0;
+    for (int i=0;i<msize_;i++){
+      maxindex = std::max(maxindex, model_ps_[i].get_index());
+    }
+    for (int j=0;j<dsize_;j++){
+      maxindex = std::max(maxindex, density_ps_[j].get_index());
+    }
+    model_index_.resize(maxindex + 1, -1);
+    density_index_.resize(maxindex + 1, -1);
+    for (int i=0;i<msize_;i++) model_index_[model_ps_[i].get_index()] = i;
+    for (int j=0;j<dsize_;j++) density_index_[density_ps_[j].get_index()] = j;
+
     //Set up md container
     md_container_ = new container::CloseBipartitePairContainer(
          new container::ListSingletonContainer(mdl,model_ps),
@@ -109,92 +292,146 @@ GaussianEMRestraint::GaussianEMRestraint(
                     << " particles out of " << model_ps_.size() << std::endl);
     }
     else slope_ps_ = model_ps_;
+    for (size_t nm=0;nm<slope_ps_.size();nm++){
+      slope_indexes_.push_back(model_index_[slope_ps_[nm].get_index()]);
+    }
   }
 
 void GaussianEMRestraint::compute_initial_scores() {
+  GaussianArrays model(get_model(), model_ps_);
+  GaussianArrays density(get_model(), density_ps_);
+  Floats radii(dsize_, 0.);
+  for (int j=0;j<dsize_;j++){
+    if (core::XYZR::get_is_setup(get_model(), density_ps_[j])) {
+      radii[j] = core::XYZR(get_model(), density_ps_[j]).get_radius();
+    }
+  }
 
-  // precalculate DD score
+  // precalculate DD score, and keep the overlaps of the density pairs
+  // used by the local DD score
   Eigen::Vector3d deriv;
   dd_score_=0.0;
   self_mm_score_=0.0;
+  dd_pairs_.clear();
+  dd_pair_scores_.clear();
   for (int i1=0;i1<dsize_;i1++){
     for (int i2=0;i2<dsize_;i2++){
-      Float score = score_gaussian_overlap(get_model(),
-                    ParticleIndexPair(density_ps_[i1],density_ps_[i2]),
-                    &deriv);
+      Float score = get_overlap(density, i1, density, i2, &deriv);
       dd_score_+=score;
+      if (local_ && i2 >= i1 &&
+          (local_dd_cutoff_ <= 0.0 ||
+           (density.means[i1] - density.means[i2]).norm()
+               - radii[i1] - radii[i2] <= local_dd_cutoff_)) {
+        dd_pairs_.push_back(IntPair(i1, i2));
+        dd_pair_scores_.push_back(score);
+      }
     }
   }
 
   // precalculate the self-mm score and initialize
   for (int i=0;i<msize_;i++){
-    Float score = score_gaussian_overlap(get_model(),
-                    ParticleIndexPair(model_ps_[i],model_ps_[i]),
-                    &deriv);
+    Float score = get_overlap(model, i, model, i, &deriv);
     self_mm_score_+=score;
   }
 }
 
+void GaussianEMRestraint::set_local_dd_cutoff(double cutoff) {
+  local_dd_cutoff_ = cutoff;
+  compute_initial_scores();
+}
+
 double GaussianEMRestraint::unprotected_evaluate(DerivativeAccumulator *accum)
   const {
   //score is the square difference between two GMMs
   KahanAccumulation md_score,mm_score;
   mm_score = kahan_sum(mm_score,self_mm_score_);
-  Eigen::Vector3d deriv;
-  boost::unordered_map<ParticleIndex,KahanVectorAccumulation> derivs_mm,derivs_md,slope_md;
-  std::set<ParticleIndex> local_dens;
+  GaussianArrays model(get_model(), model_ps_);
+  GaussianArrays density(get_model(), density_ps_);
+  std::vector<KahanVectorAccumulation> derivs_mm(msize_), derivs_md(msize_),
+                                       slope_md(msize_);
 
   Float slope_score=0.0;
 
-  if (slope_>0.0){
-    for (ParticleIndexes::const_iterator mit=slope_ps_.begin();
-         mit!=slope_ps_.end();++mit){
-      for (ParticleIndexes::const_iterator dit=density_ps_.begin();
-           dit!=density_ps_.end();++dit){
-        Eigen::Vector3d v = Eigen::Vector3d(core::XYZ(get_model(),*mit).
-                                            get_coordinates().get_data()) -
-                            Eigen::Vector3d(core::XYZ(get_model(),*dit).
-                                            get_coordinates().get_data());
-        Float sd = v.norm();
-        slope_md[*mit] = kahan_vector_sum(slope_md[*mit],v*slope_/sd);
-        slope_score+=slope_*sd;
-      }
+  if (slope_>0.0 && dsize_ > 0){
+    std::vector<DensityCell> cells;
+    SlopeData data;
+    data.model = &model;
+    data.density = &density;
+    data.indexes = &slope_indexes_;
+    data.cells = nullptr;
+    data.slope = slope_;
+    data.cutoff = slope_cutoff_;
+    if (slope_cutoff_ > 0.0) {
+      // cells a quarter of the cutoff wide keep the error of replacing
+      // a cell by its centroid to a few percent
+      cells = get_density_cells(density, slope_cutoff_ / 4.0);
+      data.cells = &cells;
     }
+    unsigned int n = slope_indexes_.size();
+    Floats scores(n);
+    const SlopeData *pdata = &data;
+    Floats *pscores = &scores;
+    std::vector<KahanVectorAccumulation> *pderivs = &slope_md;
+    if (get_number_of_threads() > 1 && n > slope_chunk_size) {
+      IMP_THREADS((pdata, pscores, pderivs, n), {
+        for (unsigned int begin = 0; begin < n; begin += slope_chunk_size) {
+          unsigned int end = std::min(n, begin + slope_chunk_size);
+          IMP_TASK((pdata, pscores, pderivs, begin, end),
+                   add_slope(pdata, begin, end, pscores, pderivs),
+                   "gaussian slope");
+        }
+        IMP_OMP_PRAGMA(taskwait)
+      });
+    } else {
+      add_slope(pdata, 0, n, pscores, pderivs);
+    }
+    for (unsigned int k = 0; k < n; ++k) slope_score += scores[k];
   }
 
-  IMP_CONTAINER_FOREACH(container::ClosePairContainer,
-                          mm_container_,{
-      Float score = score_gaussian_overlap(get_model(),_1,&deriv);
-      mm_score = kahan_sum(mm_score,2*score);
-      if (accum) {
-        //multiply by 2 because...
-        derivs_mm[_1[0]] = kahan_vector_sum(derivs_mm[_1[0]],-2.0*deriv);
-        derivs_mm[_1[1]] = kahan_vector_sum(derivs_mm[_1[1]],2.0*deriv);
-      }
-  });
-
-  IMP_CONTAINER_FOREACH(container::CloseBipartitePairContainer,
-                        md_container_,{
-    Float score = score_gaussian_overlap(get_model(),_1,&deriv);
-    md_score = kahan_sum(md_score,score);
-    if (local_) local_dens.insert(_1[1]);
+  // overlaps are computed (possibly in parallel) into per-pair arrays,
+  // then summed up in container order
+  IntPairs pairs;
+  Floats scores;
+  std::vector<Eigen::Vector3d> derivs;
+  IMP_FOREACH(const ParticleIndexPair &pp, mm_container_->get_contents()) {
+    pairs.push_back(IntPair(model_index_[pp[0].get_index()],
+                            model_index_[pp[1].get_index()]));
+  }
+  get_overlaps(model, model, pairs, scores, derivs);
+  for (unsigned int k = 0; k < pairs.size(); ++k) {
+    mm_score = kahan_sum(mm_score,2*scores[k]);
     if (accum) {
-      derivs_md[_1[0]] = kahan_vector_sum(derivs_md[_1[0]],-deriv);
+      //multiply by 2 because...
+      derivs_mm[pairs[k].first] = kahan_vector_sum(derivs_mm[pairs[k].first],
+                                                   -2.0*derivs[k]);
+      derivs_mm[pairs[k].second] =
+                 kahan_vector_sum(derivs_mm[pairs[k].second], 2.0*derivs[k]);
     }
-  });
+  }
 
+  pairs.clear();
+  IMP_FOREACH(const ParticleIndexPair &pp, md_container_->get_contents()) {
+    pairs.push_back(IntPair(model_index_[pp[0].get_index()],
+                            density_index_[pp[1].get_index()]));
+  }
+  get_overlaps(model, density, pairs, scores, derivs);
+  std::vector<char> local_dens(local_ ? dsize_ : 0, 0);
+  for (unsigned int k = 0; k < pairs.size(); ++k) {
+    md_score = kahan_sum(md_score,scores[k]);
+    if (local_) local_dens[pairs[k].second] = 1;
+    if (accum) {
+      derivs_md[pairs[k].first] = kahan_vector_sum(derivs_md[pairs[k].first],
+                                                   -derivs[k]);
+    }
+  }
 
-  //local gets new DD score each time
+  //local gets new DD score each time, from the density pairs that overlap
   Float dd_score = 0.0;
   if (local_){
-    for(std::set<ParticleIndex>::const_iterator it1=local_dens.begin();
-        it1!=local_dens.end();++it1){
-      for(std::set<ParticleIndex>::const_iterator it2=local_dens.begin();
-          it2!=local_dens.end();++it2){
-        Float score = score_gaussian_overlap(get_model(),
-                                             ParticleIndexPair(*it1,*it2),
-                                             &deriv);
-        dd_score+=score;
+    for (unsigned int k = 0; k < dd_pairs_.size(); ++k) {
+      const IntPair &dp = dd_pairs_[k];
+      if (local_dens[dp.first] && local_dens[dp.second]) {
+        dd_score += (dp.first == dp.second ? 1.0 : 2.0) * dd_pair_scores_[k];
       }
     }
   }
@@ -207,20 +444,19 @@ double GaussianEMRestraint::unprotected_evaluate(DerivativeAccumulator *accum)
   /* energy calculation */
 
   if (accum){
-    for (ParticleIndexes::const_iterator it=model_ps_.begin();
-         it!=model_ps_.end();++it){
+    for (int i=0;i<msize_;i++){
       if (IMP::isinf(log_score) || log_score==0.0) {
-        core::XYZ(get_model(),*it).add_to_derivatives(algebra::Vector3D(0,0,0),
-                                                      *accum);
+        core::XYZ(get_model(),model_ps_[i]).add_to_derivatives(
+                                      algebra::Vector3D(0,0,0), *accum);
       }
       else{
-        algebra::Vector3D d_mm(derivs_mm[*it].sum[0],derivs_mm[*it].sum[1],derivs_mm[*it].sum[2]);
-        algebra::Vector3D d_md(derivs_md[*it].sum[0],derivs_md[*it].sum[1],derivs_md[*it].sum[2]);
+        algebra::Vector3D d_mm(derivs_mm[i].sum[0],derivs_mm[i].sum[1],derivs_mm[i].sum[2]);
+        algebra::Vector3D d_md(derivs_md[i].sum[0],derivs_md[i].sum[1],derivs_md[i].sum[2]);
         Float mmdd=mm_score.sum+dd_score;
         algebra::Vector3D d = -2.0 / cross_correlation_
                               * (mmdd*d_md - md_score.sum*d_mm) / (mmdd * mmdd);
-        d += algebra::Vector3D(slope_md[*it].sum[0],slope_md[*it].sum[1],slope_md[*it].sum[2]);
-        core::XYZ(get_model(),*it).add_to_derivatives(d,*accum);
+        d += algebra::Vector3D(slope_md[i].sum[0],slope_md[i].sum[1],slope_md[i].sum[2]);
+        core::XYZ(get_model(),model_ps_[i]).add_to_derivatives(d,*accum);
       }
     }
   }
@@ -28,7 +28,10 @@ double LogWrapper::unprotected_evaluate(DerivativeAccumulator* accum) const {
     double score = 0;
 
     for (unsigned int i = 0; i <get_number_of_restraints(); ++i) {
-      prob *= get_restraint(i)->unprotected_evaluate(accum);
+      Restraint *r = get_restraint(i);
+      double rprob = r->unprotected_evaluate(accum);
+      r->set_last_score(-std::log(rprob));
+      prob *= rprob;
       if (prob<=std::numeric_limits<double>::min()*1000000.0){
         score=score-std::log(prob);
         prob=1.0;
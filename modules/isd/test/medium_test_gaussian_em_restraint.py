@@ -210,6 +210,57 @@ class Tests(IMP.test.TestCase):
                 self.assertXYZDerivativesInTolerance(self.sf, d, tolerance = 1e-2,percentage=10.0)
         self.gem.set_slope(0.0)
 
+    def test_gem_threads(self):
+        """Test that GMM scores do not depend on the number of threads"""
+        # enough particles and pairs to be split between threads
+        rs = np.random.RandomState()
+        m = IMP.Model()
+        density_ps = create_random_gaussians(m, rs, 20, spherical=False)
+        model_ps = create_random_gaussians(m, rs, 100, spherical=False)
+        psigma = IMP.Particle(m)
+        IMP.isd.Scale.setup_particle(psigma, 1.0)
+        gem = IMP.isd.GaussianEMRestraint(m, model_ps, density_ps, psigma,
+                                          1e8, 1e8, 0.1, True, False)
+        sf = IMP.core.RestraintsScoringFunction([gem])
+        old_threads = IMP.get_number_of_threads()
+        try:
+            for i in range(3):
+                shuffle_particles(model_ps)
+                results = []
+                for threads in (1, 4):
+                    IMP.set_number_of_threads(threads)
+                    score = sf.evaluate(True)
+                    results.append((score,
+                        [IMP.core.XYZ(p).get_derivatives()
+                         for p in model_ps]))
+                self.assertAlmostEqual(results[0][0], results[1][0],
+                                       delta=1e-8)
+                for d1, d2 in zip(results[0][1], results[1][1]):
+                    self.assertLess(IMP.algebra.get_distance(d1, d2), 1e-8)
+        finally:
+            IMP.set_number_of_threads(old_threads)
+
+    def test_gem_slope_cutoff(self):
+        """Test GMM score with a slope cutoff"""
+        reset_coords(self.model_ps,self.orig_coords)
+        slope=0.1
+        self.gem.set_slope(slope)
+        self.assertAlmostEqual(self.gem.get_slope_cutoff(), 0., delta=1e-6)
+        for nt in range(5):
+            shuffle_particles(self.model_ps, 10.0)
+            self.gem.set_slope_cutoff(0.)
+            exact = self.sf.evaluate(False)
+            self.gem.set_slope_cutoff(4.)
+            score = self.sf.evaluate(False)
+            pycc, pyscore = gem_score(self.model_ps, self.density_ps,
+                                      slope=slope)
+            self.assertAlmostEqual(exact, pyscore, delta=0.02)
+            self.assertAlmostEqual(score, exact, delta=0.02 * abs(exact))
+            # grouping density particles never overestimates the distances
+            self.assertLessEqual(score, exact + 1e-8)
+        self.gem.set_slope_cutoff(0.)
+        self.gem.set_slope(0.0)
+
     def test_rasterize(self):
         """Test making a map from a GMM"""
         # Suppress warnings (we don't use the objects set up above)
@@ -251,5 +302,62 @@ class LocalTests(IMP.test.TestCase):
             pycc, pyscore = gem_score(self.model_ps, self.density_ps)
             print(score,pycc,pyscore)
 
+    def _make_gaussian(self, center, std, radius):
+        p = IMP.Particle(self.m)
+        trans = IMP.algebra.Transformation3D(
+                     IMP.algebra.get_identity_rotation_3d(), center)
+        shape = IMP.algebra.Gaussian3D(IMP.algebra.ReferenceFrame3D(trans),
+                                       [std ** 2] * 3)
+        IMP.core.Gaussian.setup_particle(p, shape)
+        IMP.atom.Mass.setup_particle(p, 1.0)
+        IMP.core.XYZR.setup_particle(p)
+        IMP.core.XYZR(p).set_radius(radius)
+        return p
+
+    def test_local_dd_pairs(self):
+        """Test the local DD score sums all pairs of local density particles"""
+        self.m = IMP.Model()
+        # two wide density Gaussians, far apart but overlapping, each with
+        # a model Gaussian on top, and a third density Gaussian far from
+        # any model particle
+        centers = [IMP.algebra.Vector3D(x, 0, 0) for x in (0., 40., 200.)]
+        density_ps = [self._make_gaussian(c, 15., 1.) for c in centers]
+        model_ps = [self._make_gaussian(c, 15., 1.) for c in centers[:2]]
+        psigma = IMP.Particle(self.m)
+        IMP.isd.Scale.setup_particle(psigma, 1.0)
+        gem = IMP.isd.GaussianEMRestraint(self.m, model_ps, density_ps,
+                                          psigma, 1e8, 0.0, 0.0,
+                                          True, False, True)
+        sf = IMP.core.RestraintsScoringFunction([gem])
+        self.assertAlmostEqual(gem.get_local_dd_cutoff(), 0., delta=1e-6)
+
+        mm_score = sum(score_gaussian_overlap(p1, p2)
+                       for p1 in model_ps for p2 in model_ps)
+        md_score = sum(score_gaussian_overlap(pm, pd)
+                       for pm, pd in zip(model_ps, density_ps))
+        def get_cc(dd_pairs):
+            dd_score = sum(score_gaussian_overlap(density_ps[i],
+                                                  density_ps[j])
+                           for i, j in dd_pairs)
+            return 2 * md_score / (mm_score + dd_score)
+        # the first two density particles are local
+        all_pairs = [(i, j) for i in range(2) for j in range(2)]
+        near_pairs = [(0, 0), (1, 1)]
+        self.assertGreater(abs(get_cc(all_pairs) - get_cc(near_pairs)),
+                           1e-3 * get_cc(all_pairs))
+
+        sf.evaluate(False)
+        self.assertAlmostEqual(gem.get_cross_correlation_coefficient(),
+                               get_cc(all_pairs), delta=1e-6)
+        # with a cutoff the distant pair is left out
+        gem.set_local_dd_cutoff(10.)
+        sf.evaluate(False)
+        self.assertAlmostEqual(gem.get_cross_correlation_coefficient(),
+                               get_cc(near_pairs), delta=1e-6)
+        gem.set_local_dd_cutoff(0.)
+        sf.evaluate(False)
+        self.assertAlmostEqual(gem.get_cross_correlation_coefficient(),
+                               get_cc(all_pairs), delta=1e-6)
+
 if __name__ == '__main__':
     IMP.test.main()
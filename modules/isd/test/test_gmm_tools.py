@@ -0,0 +1,177 @@
+from __future__ import print_function, division
+import IMP
+import IMP.algebra
+import IMP.core
+import IMP.atom
+import IMP.em
+import IMP.isd
+import IMP.isd.gmm_tools
+import IMP.test
+import numpy as np
+import os
+
+
+def make_points(seed=1):
+    rng = np.random.RandomState(seed)
+    return np.vstack([
+        rng.multivariate_normal([0., 0., 0.], np.diag([1., 4., 9.]), 3000),
+        rng.multivariate_normal([20., 5., 0.], np.eye(3) * 2., 1000)])
+
+
+class Tests(IMP.test.TestCase):
+
+    def assert_two_components(self, gmm):
+        order = np.argsort(gmm.weights)
+        self.assertEqual(len(gmm), 2)
+        self.assertTrue(np.allclose(gmm.weights[order], [0.25, 0.75],
+                                    atol=0.02))
+        self.assertTrue(np.allclose(gmm.means[order],
+                                    [[20., 5., 0.], [0., 0., 0.]], atol=0.3))
+        return order
+
+    def test_fit_gmm_to_array(self):
+        """Test fitting a GMM to a NumPy array of points"""
+        pts = make_points()
+        gmm = IMP.isd.gmm_tools.fit_gmm_to_array(pts, 2, seed=3)
+        self.assertTrue(gmm.converged)
+        self.assertLess(gmm.n_iter, 100)
+        order = self.assert_two_components(gmm)
+        self.assertTrue(np.allclose(gmm.covariances[order[1]],
+                                    np.diag([1., 4., 9.]), atol=0.6))
+        # score_samples should match the density computed by hand
+        scores = gmm.score_samples(pts[:5])
+        expected = np.zeros(5)
+        for w, m, c in zip(gmm.weights, gmm.means, gmm.covariances):
+            d = pts[:5] - m
+            maha = np.einsum('ni,ij,nj->n', d, np.linalg.inv(c), d)
+            expected += w * np.exp(-0.5 * maha) / np.sqrt(
+                np.linalg.det(2. * np.pi * c))
+        self.assertTrue(np.allclose(scores, np.log(expected)))
+        self.assertAlmostEqual(gmm.score(pts), np.mean(gmm.score_samples(pts)),
+                               delta=1e-8)
+        self.assertLess(gmm.aic(pts), gmm.bic(pts))
+
+    def test_covariance_types(self):
+        """Test fitting constrained covariances"""
+        pts = make_points()
+        for covariance_type in ('diag', 'diagonal', 'spherical', 'tied'):
+            gmm = IMP.isd.gmm_tools.fit_gmm_to_array(
+                pts, 2, covariance_type=covariance_type, seed=3)
+            self.assert_two_components(gmm)
+            if covariance_type != 'tied':
+                for c in gmm.covariances:
+                    self.assertTrue(np.allclose(c, np.diag(np.diag(c))))
+            if covariance_type == 'spherical':
+                for c in gmm.covariances:
+                    self.assertAlmostEqual(c[0][0], c[2][2], delta=1e-8)
+            elif covariance_type == 'tied':
+                self.assertTrue(np.allclose(gmm.covariances[0],
+                                            gmm.covariances[1]))
+        gmm = IMP.isd.gmm_tools.fit_gmm_to_array(
+            pts, 3, force_radii=2., force_weight=0.5, seed=3)
+        self.assertTrue(np.allclose(gmm.weights, 0.5))
+        for c in gmm.covariances:
+            self.assertTrue(np.allclose(c, np.eye(3) * 2.))
+        self.assertRaises(ValueError, IMP.isd.gmm_tools.fit_gmm_to_array,
+                          pts, 2, covariance_type='garbage')
+        self.assertRaises(ValueError, IMP.isd.gmm_tools.fit_gmm_to_array,
+                          pts[:2], 3)
+
+    def test_fit_gmms_to_arrays(self):
+        """Test fitting several GMMs in parallel"""
+        pts = make_points()
+        sets = [pts, pts[3000:], pts[:3000]]
+        parallel = IMP.isd.gmm_tools.fit_gmms_to_arrays(sets, [2, 1, 1],
+                                                        processes=2, seed=5)
+        serial = IMP.isd.gmm_tools.fit_gmms_to_arrays(sets, [2, 1, 1],
+                                                      processes=1, seed=5)
+        self.assertEqual([len(g) for g in parallel], [2, 1, 1])
+        for p, s in zip(parallel, serial):
+            self.assertTrue(np.allclose(p.means, s.means))
+            self.assertTrue(np.allclose(p.covariances, s.covariances))
+        self.assertTrue(np.allclose(parallel[1].means, [[20., 5., 0.]],
+                                    atol=0.3))
+
+    def test_fit_gmm_to_points(self):
+        """Test fitting and decorating particles"""
+        m = IMP.Model()
+        pts = [IMP.algebra.Vector3D(*p) for p in make_points()]
+        ps = []
+        score, aic = IMP.isd.gmm_tools.fit_gmm_to_points(
+            pts, 2, m, ps, mass_multiplier=10.)
+        self.assertEqual(len(ps), 2)
+        self.assertAlmostEqual(sum(IMP.atom.Mass(p).get_mass() for p in ps),
+                               10., delta=1e-6)
+        for p in ps:
+            g = IMP.core.Gaussian(p)
+            self.assertAlmostEqual(IMP.core.XYZR(p).get_radius(),
+                                   max(g.get_variances()) ** 0.5, delta=1e-6)
+        self.assertLess(score, 0.)
+        self.assertGreater(aic, 0.)
+
+    def test_text_and_map(self):
+        """Test GMM text round trip and rasterization of a GMM object"""
+        m = IMP.Model()
+        gmm = IMP.isd.gmm_tools.fit_gmm_to_array(make_points(), 2, seed=3)
+        ps = []
+        IMP.isd.gmm_tools.decorate_gmm_from_arrays(gmm, ps, m)
+        with IMP.test.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, 'gmm.txt')
+            IMP.isd.gmm_tools.write_gmm_to_text(ps, fname)
+            gmm2 = IMP.isd.gmm_tools.read_gmm_from_text(fname)
+            self.assertTrue(np.allclose(gmm.weights, gmm2.weights))
+            self.assertTrue(np.allclose(gmm.means, gmm2.means))
+            self.assertTrue(np.allclose(gmm.covariances, gmm2.covariances))
+            ps2 = []
+            IMP.isd.gmm_tools.decorate_gmm_from_text(fname, ps2, m)
+            self.assertEqual(len(ps2), 2)
+        bb = IMP.algebra.BoundingBox3D(IMP.algebra.Vector3D(-10, -10, -10),
+                                       IMP.algebra.Vector3D(30, 15, 10))
+        d1 = IMP.isd.gmm_tools.gmm2map(gmm, 2.0, bb)
+        d2 = IMP.isd.gmm_tools.gmm2map(ps, 2.0, bb)
+        self.assertTrue(np.allclose(d1.get_voxel_array(),
+                                    d2.get_voxel_array()))
+
+    def test_cache(self):
+        """Test caching of derived GMMs on disk"""
+        old_cache = IMP.isd.gmm_tools._cache
+        m = IMP.Model()
+        pts = make_points()
+        with IMP.test.temporary_directory() as tmpdir:
+            cachedir = os.path.join(tmpdir, 'cache')
+            try:
+                IMP.isd.gmm_tools.set_cache_directory(cachedir)
+                cache = IMP.isd.gmm_tools.get_cache()
+                ps1 = []
+                IMP.isd.gmm_tools.fit_gmm_to_points(pts, 2, m, ps1)
+                self.assertEqual(len(os.listdir(cachedir)), 1)
+                # Modify the stored fit; it should be used rather than a refit
+                key = os.listdir(cachedir)[0][:-4]
+                gmm = cache.get(key)
+                gmm.weights[:] = [0.1, 0.9]
+                cache.set(key, gmm)
+                ps2 = []
+                IMP.isd.gmm_tools.fit_gmm_to_points(pts, 2, m, ps2)
+                self.assertEqual(sorted(IMP.atom.Mass(p).get_mass()
+                                        for p in ps2), [0.1, 0.9])
+                # Different parameters give a new entry
+                IMP.isd.gmm_tools.fit_gmm_to_points(pts, 2, m, [],
+                                                    min_covar=0.1)
+                self.assertEqual(len(os.listdir(cachedir)), 2)
+
+                fname = os.path.join(tmpdir, 'gmm.txt')
+                IMP.isd.gmm_tools.write_gmm_to_text(ps2, fname)
+                g1 = IMP.isd.gmm_tools.read_gmm_from_text(fname)
+                self.assertEqual(len(os.listdir(cachedir)), 3)
+                g2 = IMP.isd.gmm_tools.read_gmm_from_text(fname)
+                self.assertTrue(np.allclose(g1.means, g2.means))
+                self.assertEqual(len(os.listdir(cachedir)), 3)
+
+                IMP.isd.gmm_tools.set_cache_directory(None)
+                self.assertIsNone(IMP.isd.gmm_tools.get_cache())
+            finally:
+                IMP.isd.gmm_tools._cache = old_cache
+
+
+if __name__ == '__main__':
+    IMP.test.main()
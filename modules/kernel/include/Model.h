@@ -302,6 +302,27 @@ class IMPKERNELEXPORT Model : public Object
   //! Get all particle indexes
   ParticleIndexes get_particle_indexes();
 
+  /** \name Bulk access to coordinates and radii
+      These methods get or set the coordinates, radii or coordinate
+      derivatives of many particles in a single call, reading the
+      Model's attribute storage directly. Values are passed as flat lists,
+      eg (x0, y0, z0, x1, y1, z1, ...) for coordinates. From Python,
+      get_coordinates_array() and similar methods return them as
+      NumPy arrays.
+      @{ */
+  //! Get the coordinates of the particles, as a flat list of 3N values
+  Floats get_coordinates_values(ParticleIndexesAdaptor pis) const;
+  //! Set the coordinates of the particles from a flat list of 3N values
+  void set_coordinates_values(ParticleIndexesAdaptor pis,
+                              const Floats &values);
+  //! Get the radii of the particles
+  Floats get_radius_values(ParticleIndexesAdaptor pis) const;
+  //! Set the radii of the particles
+  void set_radius_values(ParticleIndexesAdaptor pis, const Floats &values);
+  //! Get the coordinate derivatives of the particles, as 3N values
+  Floats get_coordinate_derivative_values(ParticleIndexesAdaptor pis) const;
+  /** @} */
+
   //! Get all the ModelObjects associated with this Model.
   ModelObjectsTemp get_model_objects() const;
 
@@ -19,6 +19,7 @@
 #include <IMP/deprecation_macros.h>
 #include <IMP/nullptr.h>
 #include <IMP/RestraintInfo.h>
+#include "internal/EvaluationTimer.h"
 
 IMPKERNEL_BEGIN_NAMESPACE
 class DerivativeAccumulator;
@@ -215,6 +216,21 @@ class IMPKERNELEXPORT Restraint : public ModelObject {
    */
   bool get_was_good() const { return get_last_score() < max_; }
 
+  /** \name Evaluation timing
+      If timing is turned on, the wall-clock time spent scoring this
+      restraint (including any restraints it contains) and the number of
+      times it was scored are accumulated until reset. This is meant for
+      profiling, and is off by default.
+      @{
+  */
+  void set_is_timed(bool tf) { timer_.enabled = tf; }
+  bool get_is_timed() const { return timer_.enabled; }
+  //! Return the total time in seconds spent scoring this restraint
+  double get_evaluation_time() const { return timer_.seconds; }
+  unsigned int get_number_of_evaluations() const { return timer_.calls; }
+  void reset_evaluation_time() { timer_.reset(); }
+  /** @} */
+
   IMP_REF_COUNTED_DESTRUCTOR(Restraint);
 
  protected:
@@ -247,6 +263,7 @@ class IMPKERNELEXPORT Restraint : public ModelObject {
   double weight_;
   double max_;
   mutable double last_score_;
+  mutable internal::EvaluationTimer timer_;
   // cannot be released outside the class
   mutable Pointer<ScoringFunction> cached_internal_scoring_function_;
 };
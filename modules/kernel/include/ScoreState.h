@@ -14,6 +14,7 @@
 #include "utility.h"
 #include "ModelObject.h"
 #include "base_types.h"
+#include "internal/EvaluationTimer.h"
 #include <IMP/check_macros.h>
 #include <IMP/deprecation_macros.h>
 #include <IMP/ref_counted_macros.h>
@@ -52,6 +53,7 @@ IMPKERNEL_BEGIN_NAMESPACE
  */
 class IMPKERNELEXPORT ScoreState : public ModelObject {
   int update_order_;
+  internal::EvaluationTimer timer_;
 
  public:
   ScoreState(Model *m, std::string name);
@@ -61,6 +63,21 @@ class IMPKERNELEXPORT ScoreState : public ModelObject {
   //! Do post evaluation work if needed
   void after_evaluate(DerivativeAccumulator *accpt);
 
+  /** \name Evaluation timing
+      If timing is turned on, the wall-clock time spent in before_evaluate()
+      and after_evaluate() is accumulated until reset, together with the
+      number of updates (calls to before_evaluate()). This is meant for
+      profiling, and is off by default.
+      @{
+  */
+  void set_is_timed(bool tf) { timer_.enabled = tf; }
+  bool get_is_timed() const { return timer_.enabled; }
+  //! Return the total time in seconds spent updating this score state
+  double get_evaluation_time() const { return timer_.seconds; }
+  unsigned int get_number_of_evaluations() const { return timer_.calls; }
+  void reset_evaluation_time() { timer_.reset(); }
+  /** @} */
+
 #ifndef IMP_DOXYGEN
   bool get_has_update_order() const { return update_order_ != -1; }
   unsigned int get_update_order() const { return update_order_; }
@@ -0,0 +1,54 @@
+/**
+ *  \file internal/EvaluationTimer.h
+ *  \brief Accumulate the time spent evaluating restraints and score states.
+ *
+ *  Copyright 2007-2017 IMP Inventors. All rights reserved.
+ */
+
+#ifndef IMPKERNEL_INTERNAL_EVALUATION_TIMER_H
+#define IMPKERNEL_INTERNAL_EVALUATION_TIMER_H
+
+#include <IMP/kernel_config.h>
+#include <IMP/nullptr.h>
+#include <boost/date_time/posix_time/posix_time_types.hpp>
+
+IMPKERNEL_BEGIN_INTERNAL_NAMESPACE
+
+//! Total wall-clock time and number of calls of an evaluation
+struct EvaluationTimer {
+  bool enabled;
+  double seconds;
+  unsigned int calls;
+  EvaluationTimer() : enabled(false), seconds(0.), calls(0) {}
+  void reset() {
+    seconds = 0.;
+    calls = 0;
+  }
+};
+
+//! Add the time until the end of the scope to an enabled EvaluationTimer
+class EvaluationTimerScope {
+  EvaluationTimer *timer_;
+  bool count_;
+  boost::posix_time::ptime start_;
+
+ public:
+  EvaluationTimerScope(EvaluationTimer &timer, bool count = true)
+      : timer_(timer.enabled ? &timer : nullptr), count_(count) {
+    if (timer_) {
+      start_ = boost::posix_time::microsec_clock::universal_time();
+    }
+  }
+  ~EvaluationTimerScope() {
+    if (timer_) {
+      boost::posix_time::time_duration d =
+          boost::posix_time::microsec_clock::universal_time() - start_;
+      timer_->seconds += d.total_microseconds() * 1e-6;
+      if (count_) ++timer_->calls;
+    }
+  }
+};
+
+IMPKERNEL_END_INTERNAL_NAMESPACE
+
+#endif /* IMPKERNEL_INTERNAL_EVALUATION_TIMER_H */
@@ -9,6 +9,7 @@
 #include "IMP/Model.h"
 #include "IMP/Particle.h"
 #include "IMP/internal/scoring_functions.h"
+#include <algorithm>
 
 IMPKERNEL_BEGIN_NAMESPACE
 
@@ -114,6 +115,88 @@ ParticleIndexes Model::get_particle_indexes() {
   return ret;
 }
 
+namespace {
+// Check that the first nkeys sphere attributes (x, y, z, radius) are there
+void check_sphere_attributes(const internal::FloatAttributeTable *table,
+                             const ParticleIndexes &pis, unsigned int nkeys) {
+  IMP_IF_CHECK(USAGE) {
+    IMP_FOREACH(ParticleIndex pi, pis) {
+      for (unsigned int k = 0; k < nkeys; ++k) {
+        IMP_USAGE_CHECK(table->get_has_attribute(FloatKey(k), pi),
+                        "Particle " << pi << " does not have "
+                                    << (k < 3 ? "coordinates" : "a radius"));
+      }
+    }
+  }
+}
+}
+
+Floats Model::get_coordinates_values(ParticleIndexesAdaptor pis) const {
+  const ParticleIndexes &ps = pis;
+  check_sphere_attributes(this, ps, 3);
+  const algebra::Sphere3D *spheres = access_spheres_data();
+  Floats ret(3 * ps.size());
+  for (unsigned int i = 0; i < ps.size(); ++i) {
+    const algebra::Vector3D &v = spheres[ps[i].get_index()].get_center();
+    std::copy(v.begin(), v.end(), ret.begin() + 3 * i);
+  }
+  return ret;
+}
+
+void Model::set_coordinates_values(ParticleIndexesAdaptor pis,
+                                   const Floats &values) {
+  const ParticleIndexes &ps = pis;
+  IMP_USAGE_CHECK(values.size() == 3 * ps.size(),
+                  "Expected " << 3 * ps.size() << " values, got "
+                              << values.size());
+  check_sphere_attributes(this, ps, 3);
+  algebra::Sphere3D *spheres = access_spheres_data();
+  for (unsigned int i = 0; i < ps.size(); ++i) {
+    algebra::Sphere3D &s = spheres[ps[i].get_index()];
+    s = algebra::Sphere3D(algebra::Vector3D(values[3 * i], values[3 * i + 1],
+                                            values[3 * i + 2]),
+                          s.get_radius());
+  }
+}
+
+Floats Model::get_radius_values(ParticleIndexesAdaptor pis) const {
+  const ParticleIndexes &ps = pis;
+  check_sphere_attributes(this, ps, 4);
+  const algebra::Sphere3D *spheres = access_spheres_data();
+  Floats ret(ps.size());
+  for (unsigned int i = 0; i < ps.size(); ++i) {
+    ret[i] = spheres[ps[i].get_index()].get_radius();
+  }
+  return ret;
+}
+
+void Model::set_radius_values(ParticleIndexesAdaptor pis,
+                              const Floats &values) {
+  const ParticleIndexes &ps = pis;
+  IMP_USAGE_CHECK(values.size() == ps.size(),
+                  "Expected " << ps.size() << " values, got "
+                              << values.size());
+  check_sphere_attributes(this, ps, 4);
+  algebra::Sphere3D *spheres = access_spheres_data();
+  for (unsigned int i = 0; i < ps.size(); ++i) {
+    algebra::Sphere3D &s = spheres[ps[i].get_index()];
+    s = algebra::Sphere3D(s.get_center(), values[i]);
+  }
+}
+
+Floats Model::get_coordinate_derivative_values(
+    ParticleIndexesAdaptor pis) const {
+  const ParticleIndexes &ps = pis;
+  check_sphere_attributes(this, ps, 3);
+  const algebra::Sphere3D *derivatives = access_sphere_derivatives_data();
+  Floats ret(3 * ps.size());
+  for (unsigned int i = 0; i < ps.size(); ++i) {
+    const algebra::Vector3D &v = derivatives[ps[i].get_index()].get_center();
+    std::copy(v.begin(), v.end(), ret.begin() + 3 * i);
+  }
+  return ret;
+}
+
 ModelObjectsTemp Model::get_model_objects() const {
   ModelObjectsTemp ret;
   ret.reserve(dependency_graph_.size());
@@ -223,8 +223,10 @@ void Restraint::add_score_and_derivatives(ScoreAccumulator sa) const {
   ScoreAccumulator nsa(sa, this);
   validate_inputs();
   validate_outputs();
-  IMP_TASK((nsa), do_add_score_and_derivatives(nsa),
-           "add score and derivatives");
+  IMP_TASK((nsa), {
+    internal::EvaluationTimerScope timer(timer_);
+    do_add_score_and_derivatives(nsa);
+  }, "add score and derivatives");
   set_was_used(true);
 }
 
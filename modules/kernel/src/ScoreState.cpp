@@ -25,6 +25,7 @@ ScoreState::ScoreState(Model *m, std::string name)
 
 void ScoreState::before_evaluate() {
   IMP_OBJECT_LOG;
+  internal::EvaluationTimerScope timer(timer_);
   validate_inputs();
   validate_outputs();
   do_before_evaluate();
@@ -32,6 +33,7 @@ void ScoreState::before_evaluate() {
 
 void ScoreState::after_evaluate(DerivativeAccumulator *da) {
   IMP_OBJECT_LOG;
+  internal::EvaluationTimerScope timer(timer_, false);
   validate_inputs();
   validate_outputs();
   do_after_evaluate(da);
@@ -134,6 +134,61 @@ class Tests(IMP.test.TestCase):
             s.show()
         dg = IMP.get_dependency_graph(m)
 
+    def test_bulk_coordinates(self):
+        """Check bulk access to coordinates and radii"""
+        m = IMP.Model("bulk access")
+        keys = [IMP.FloatKey(k) for k in ("x", "y", "z", "radius")]
+        pis = []
+        for i in range(4):
+            pi = m.add_particle("P%d" % i)
+            for j, k in enumerate(keys):
+                m.add_attribute(k, pi, float(10 * i + j))
+            pis.append(pi)
+        self.assertEqual(list(m.get_coordinates_values(pis[1:3])),
+                         [10., 11., 12., 20., 21., 22.])
+        self.assertEqual(list(m.get_radius_values(pis[::-1])),
+                         [33., 23., 13., 3.])
+        m.set_coordinates_values([pis[2]], [1., 2., 3.])
+        self.assertEqual([m.get_attribute(k, pis[2]) for k in keys],
+                         [1., 2., 3., 23.])
+        m.set_radius_values([pis[0], pis[1]], [5., 6.])
+        self.assertEqual(m.get_attribute(keys[3], pis[1]), 6.)
+        self.assertEqual(m.get_attribute(keys[0], pis[1]), 10.)
+        self.assertEqual(len(m.get_coordinate_derivative_values(pis[:2])), 6)
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("no numpy module present")
+        coords = m.get_coordinates_array(pis)
+        self.assertEqual(coords.shape, (4, 3))
+        self.assertAlmostEqual(coords[2][1], 2., delta=1e-6)
+        m.set_coordinates_array(pis, coords + 1.)
+        self.assertAlmostEqual(m.get_attribute(keys[1], pis[3]), 32.,
+                               delta=1e-6)
+        self.assertAlmostEqual(m.get_radius_array(pis)[1], 6., delta=1e-6)
+
+    def test_evaluation_timing(self):
+        """Check timing of restraint and score state evaluation"""
+        m = IMP.Model("evaluation timing")
+        p = IMP.Particle(m)
+        s = DummyScoreState(m, ops=[p])
+        m.add_score_state(s)
+        r = DummyRestraint(m, ps=[p])
+        self.assertFalse(r.get_is_timed())
+        r.evaluate(False)
+        self.assertEqual(r.get_number_of_evaluations(), 0)
+        r.set_is_timed(True)
+        s.set_is_timed(True)
+        for i in range(3):
+            r.evaluate(False)
+        self.assertEqual(r.get_number_of_evaluations(), 3)
+        self.assertEqual(s.get_number_of_evaluations(), 3)
+        self.assertGreaterEqual(r.get_evaluation_time(), 0.)
+        self.assertGreaterEqual(s.get_evaluation_time(), 0.)
+        r.reset_evaluation_time()
+        self.assertEqual(r.get_number_of_evaluations(), 0)
+        self.assertEqual(r.get_evaluation_time(), 0.)
+
     def test_show(self):
         """Check Model.show() method"""
         class BrokenFile(object):
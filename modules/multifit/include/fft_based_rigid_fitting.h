@@ -58,9 +58,7 @@ class IMPMULTIFITEXPORT FFTFitting : public Object {
   internal::FFTWGrid<double> low_map_data_;   // low resolution map
   Pointer<em::DensityMap> low_map_;
   Pointer<em::SampledDensityMap> sampled_map_;  // sampled from protein
-  internal::FFTWGrid<double> sampled_map_data_, fftw_r_grid_mol_;
-  // high resolution map
-  internal::FFTWGrid<double> reversed_fftw_data_;
+  internal::FFTWGrid<double> sampled_map_data_;
   boost::scoped_array<double> kernel_filter_;
   unsigned int kernel_filter_ext_;
   boost::scoped_array<double> gauss_kernel_;  // low-pass (Gaussian) kernel
@@ -76,7 +74,7 @@ class IMPMULTIFITEXPORT FFTFitting : public Object {
   // FFT variables
   unsigned long fftw_nvox_r2c_; /* FFTW real to complex voxel count */
   unsigned long fftw_nvox_c2r_; /* FFTW complex to real voxel count */
-  internal::FFTWGrid<fftw_complex> fftw_grid_lo_, fftw_grid_hi_;
+  internal::FFTWGrid<fftw_complex> fftw_grid_lo_;
   internal::FFTWPlan fftw_plan_forward_lo_, fftw_plan_forward_hi_;
   internal::FFTWPlan fftw_plan_reverse_hi_;
   double fftw_scale_;  // eq to 1./nvox_
@@ -105,6 +103,10 @@ class IMPMULTIFITEXPORT FFTFitting : public Object {
   internal::FFTScores fft_scores_flipped_;
   // algebra::Rotation3Ds rots_;
   multifit::internal::EulerAnglesList rots_;
+  // probe coordinates and masses, and the shift to the map center
+  algebra::Vector3Ds probe_coords_;
+  Floats probe_masses_;
+  algebra::Vector3D probe_shift_;
 
   void prepare_probe(atom::Hierarchy mol2fit);
   void prepare_lowres_map(em::DensityMap *dmap);
@@ -116,8 +118,14 @@ class IMPMULTIFITEXPORT FFTFitting : public Object {
   void pad_resolution_map();
   em::DensityMap *crop_margin(em::DensityMap *in_map);
   // void fftw_translational_search(const algebra::Rotation3D &rot,int i);
-  void fftw_translational_search(const multifit::internal::EulerAngles &rot,
-                                 int i);
+  void prepare_rotation_buffers(internal::FFTRotationBuffers &buffers);
+  //! Correlate the rotated probe with the map for all translations
+  /** Only buffers is modified, so rotations can be scored concurrently. */
+  void fftw_rotation_scores(const multifit::internal::EulerAngles &rot,
+                            internal::FFTRotationBuffers &buffers);
+  //! Keep the best scoring rotations for each translation
+  void add_rotation_scores(const multifit::internal::EulerAngles &rot,
+                           int rot_ind, const double *scores);
   //! Detect the top fits
   FittingSolutionRecords detect_top_fits(
       const internal::RotScoresVec &rot_scores, bool cluster_fits,
@@ -128,6 +136,7 @@ class IMPMULTIFITEXPORT FFTFitting : public Object {
   FFTFitting() : Object("FFTFitting%1%") {}
   //! Fit a molecule inside its density
   /**
+     Rotations are scanned using IMP::get_number_of_threads() threads.
      \param[in] dmap the density map to fit into
      \param[in] density_threshold voxels below this value will be treated as 0
      \param[in] mol2fit the molecule to fit. The molecule has to be a rigid body
@@ -13,6 +13,10 @@
 #include <IMP/multifit/multifit_config.h>
 #include <IMP/em/DensityMap.h>
 #include <IMP/atom/Hierarchy.h>
+#include <IMP/algebra/Vector3D.h>
+#include <IMP/Pointer.h>
+#include <IMP/multifit/internal/FFTWGrid.h>
+#include "fftw3.h"
 
 IMPMULTIFIT_BEGIN_INTERNAL_NAMESPACE
 
@@ -67,6 +71,32 @@ void rotate_mol(atom::Hierarchy mh, double psi, double theta, double phi);
 IMPMULTIFITEXPORT
 void translate_mol(atom::Hierarchy mh, algebra::Vector3D t);
 
+//! Get coordinates rotated as rotate_mol() would, without moving particles
+IMPMULTIFITEXPORT
+algebra::Vector3Ds get_rotated_coordinates(const algebra::Vector3Ds &coords,
+                                           double psi, double theta,
+                                           double phi);
+
+//! Project points with the given masses onto a map
+/** This is the same trilinear interpolation as
+    em::SampledDensityMap::project(), but works on plain coordinates so
+    that several rotations of a molecule can be projected concurrently. */
+IMPMULTIFITEXPORT
+void project_coordinates(em::DensityMap *dmap,
+                         const algebra::Vector3Ds &coords,
+                         const Floats &masses, int x_margin, int y_margin,
+                         int z_margin, const algebra::Vector3D &shift);
+
+//! Work space used by one thread to score a rotation by FFT
+struct FFTRotationBuffers {
+  //! The rotated molecule projected on the map, and after filtering
+  Pointer<em::DensityMap> projected_map_, sampled_map_;
+  //! Real grid of the molecule, its transform, and the correlation
+  FFTWGrid<double> r_grid_mol_;
+  FFTWGrid<fftw_complex> grid_hi_;
+  FFTWGrid<double> reversed_data_;
+};
+
 IMPMULTIFITEXPORT
 double *convolve_array(double *in_arr, unsigned int nx, unsigned int ny,
                        unsigned int nz, double *kernel, unsigned int nk);
@@ -37,7 +37,7 @@ class Fitter(object):
         angle,
         num_fits,
         angles_per_voxel,
-            ref_pdb=''):
+            ref_pdb='', threads=1):
         self.em_map = em_map
         self.spacing = spacing
         self.resolution = resolution
@@ -51,8 +51,18 @@ class Fitter(object):
         self.num_fits = num_fits
         self.angles_per_voxel = angles_per_voxel
         self.ref_pdb = ref_pdb
+        self.threads = threads
 
     def run(self):
+        # The rotational search is done in parallel in the FFT fitting itself
+        old_threads = IMP.get_number_of_threads()
+        IMP.set_number_of_threads(self.threads)
+        try:
+            self._do_fit()
+        finally:
+            IMP.set_number_of_threads(old_threads)
+
+    def _do_fit(self):
         print("resolution is:", self.resolution)
         dmap = IMP.em.read_map(self.em_map)
         dmap.get_header().set_resolution(self.resolution)
@@ -104,7 +114,16 @@ def parse_args():
 Fit subunits into a density map with FFT."""
     parser = OptionParser(usage)
     parser.add_option("-c", "--cpu", dest="cpus", type="int", default=1,
-                      help="number of cpus to use (default 1)")
+                      help="number of cpus to use (default 1). Each subunit "
+                           "is fitted using this many threads (previously, "
+                           "this was the number of processes; use -p to "
+                           "fit several subunits at the same time)")
+    parser.add_option("-p", "--processes", dest="processes", type="int",
+                      default=1,
+                      help="number of subunits to fit at the same time, in "
+                           "separate processes (default 1). The cpus are "
+                           "shared between the processes. Each process "
+                           "reads the map, so this uses more memory")
     parser.add_option("-a", "--angle", dest="angle", type="float",
                       default=30,
                       help="angle delta (degrees) for FFT rotational "
@@ -132,8 +151,10 @@ Fit subunits into a density map with FFT."""
 
 
 def run(asmb_fn, options):
-    if multiproc_exception is None and options.cpus > 1:
+    processes = getattr(options, 'processes', 1)
+    if multiproc_exception is None and processes > 1:
         work_units = []
+    threads = max(1, options.cpus // max(1, processes))
     asmb_input = IMP.multifit.read_settings(asmb_fn)
     asmb_input.set_was_used(True)
     em_map = asmb_input.get_assembly_header().get_dens_fn()
@@ -153,21 +174,22 @@ def run(asmb_fn, options):
             fits_fn,
             options.angle,
             options.num,
-            options.angle_voxel)
-        if multiproc_exception is None and options.cpus > 1:
+            options.angle_voxel,
+            threads=threads)
+        if multiproc_exception is None and processes > 1:
             work_units.append(f)
         else:
-            if options.cpus > 1:
-                options.cpus = 1
+            if processes > 1:
+                processes = 1
                 print("""
 The Python 'multiprocessing' module (available in Python 2.6 and later) is
-needed to run on multiple CPUs, and could not be found
+needed to fit several subunits at the same time, and could not be found
 (Python error: '%s').
-Running on a single processor.""" % multiproc_exception, file=sys.stderr)
+Fitting one subunit at a time.""" % multiproc_exception, file=sys.stderr)
             f.run()
-    if multiproc_exception is None and options.cpus > 1:
+    if multiproc_exception is None and processes > 1:
         # No point in spawning more processes than components
-        nproc = min(options.cpus, asmb_input.get_number_of_component_headers())
+        nproc = min(processes, asmb_input.get_number_of_component_headers())
         p = Pool(processes=nproc)
         out = list(p.imap_unordered(do_work, work_units))
 
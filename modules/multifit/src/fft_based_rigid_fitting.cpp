@@ -9,9 +9,13 @@
 #include <IMP/multifit/internal/fft_fitting_utils.h>
 #include <IMP/constants.h>
 #include <IMP/atom/pdb.h>
+#include <IMP/atom/Mass.h>
 #include <IMP/log.h>
 #include <IMP/algebra/geometric_alignment.h>
+#include <IMP/threads.h>
+#include <IMP/thread_macros.h>
 #include <algorithm>
+#include <boost/shared_ptr.hpp>
 #include <boost/bind.hpp>
 #include <boost/lexical_cast.hpp>
 #include <boost/format.hpp>
@@ -309,7 +313,6 @@ FFTFittingOutput *FFTFitting::do_local_fitting(
 
   sampled_map_data_.resize(fftw_nvox_r2c_);
   fftw_grid_lo_.resize(fftw_nvox_c2r_);
-  fftw_grid_hi_.resize(fftw_nvox_c2r_);
 
   // create the sample map
   sampled_map_ = new em::SampledDensityMap(*(low_map_->get_header()));
@@ -350,25 +353,64 @@ FFTFittingOutput *FFTFitting::do_local_fitting(
   }
   fftw_execute(fftw_plan_forward_lo_.get());
   IMP_LOG_TERSE("Start FFT search for all rotations\n");
-  // create all plans needed for fft
+  // rotations are scored in parallel, each thread with its own buffers;
+  // the transform of the low resolution map is shared (read only)
+  unsigned int n_threads = std::max(
+      1U, std::min(get_number_of_threads(),
+                   static_cast<unsigned int>(rots_.size())));
+  std::vector<boost::shared_ptr<internal::FFTRotationBuffers> > buffers(
+      n_threads);
+  for (unsigned int k = 0; k < n_threads; k++) {
+    buffers[k].reset(new internal::FFTRotationBuffers());
+    prepare_rotation_buffers(*buffers[k]);
+  }
+  // create all plans needed for fft; they are executed on the buffers of
+  // each thread with the FFTW new-array interface
   // plan for FFT the molecule
-  fftw_r_grid_mol_.resize(nx_ * ny_ * nz_);
-  fftw_grid_hi_.resize(fftw_nvox_c2r_);
-  fftw_plan_forward_hi_ = fftw_plan_dft_r2c_3d(nz_, ny_, nx_, fftw_r_grid_mol_,
-                                               fftw_grid_hi_, FFTW_MEASURE);
+  fftw_plan_forward_hi_ =
+      fftw_plan_dft_r2c_3d(nz_, ny_, nx_, buffers[0]->r_grid_mol_,
+                           buffers[0]->grid_hi_, FFTW_MEASURE);
   // plan for IFFT (mol*EM)
-  reversed_fftw_data_.resize(fftw_nvox_r2c_);
-  fftw_plan_reverse_hi_ = fftw_plan_dft_c2r_3d(
-      nz_, ny_, nx_, fftw_grid_hi_, reversed_fftw_data_, FFTW_MEASURE);
-  IMP_LOG_TERSE("number of rots_:" << rots_.size() << std::endl);
+  fftw_plan_reverse_hi_ =
+      fftw_plan_dft_c2r_3d(nz_, ny_, nx_, buffers[0]->grid_hi_,
+                           buffers[0]->reversed_data_, FFTW_MEASURE);
+  // the probe is rotated about its current position
+  ParticlesTemp probe_ps = core::get_leaves(copy_mol_);
+  probe_coords_.resize(probe_ps.size());
+  probe_masses_.resize(probe_ps.size());
+  for (unsigned int i = 0; i < probe_ps.size(); i++) {
+    probe_coords_[i] = core::XYZ(probe_ps[i]).get_coordinates();
+    probe_masses_[i] = probe_ps[i]->get_value(atom::Mass::get_mass_key());
+  }
+  probe_shift_ =
+      map_cen_ - core::get_centroid(core::XYZs(core::get_leaves(orig_mol_)));
+  IMP_LOG_TERSE("number of rots_:" << rots_.size() << " using " << n_threads
+                                   << " threads" << std::endl);
   IMP::set_progress_display("searching rotations", rots_.size());
-  for (unsigned int kk = 0; kk < rots_.size(); kk++) {
-    fftw_translational_search(rots_[kk], kk);
-    IMP::add_to_progress_display();
+  FFTFitting *ff = this;
+  std::vector<boost::shared_ptr<internal::FFTRotationBuffers> > *pbuffers =
+      &buffers;
+  for (unsigned int first = 0; first < rots_.size(); first += n_threads) {
+    unsigned int last =
+        std::min(static_cast<unsigned int>(rots_.size()), first + n_threads);
+    IMP_THREADS((ff, pbuffers, first, last), {
+      for (unsigned int kk = first; kk < last; kk++) {
+        IMP_TASK((ff, pbuffers, first, kk),
+                 ff->fftw_rotation_scores(ff->rots_[kk],
+                                          *(*pbuffers)[kk - first]),
+                 "FFT rotation search");
+      }
+      IMP_OMP_PRAGMA(taskwait)
+    });
+    // merge the scores in rotation order, so the fits found do not depend
+    // on the number of threads
+    for (unsigned int kk = first; kk < last; kk++) {
+      add_rotation_scores(rots_[kk], kk, buffers[kk - first]->reversed_data_);
+      IMP::add_to_progress_display();
+    }
   }
   // clear grids
   fftw_grid_lo_.release();
-  fftw_grid_hi_.release();
   // detect the best fits
   IMP_LOG_TERSE("going to detect top fits" << std::endl);
   best_fits_ =
@@ -438,42 +480,58 @@ FFTFittingOutput *FFTFitting::do_local_fitting(
   return ret.release();
 }
 
-void FFTFitting::fftw_translational_search(
-    const multifit::internal::EulerAngles &rot, int rot_ind) {
-  // save original coordinates of the copy mol
-  ParticlesTemp temp_ps = core::get_leaves(copy_mol_);
-  algebra::Vector3Ds origs(temp_ps.size());
-  for (unsigned int i = 0; i < temp_ps.size(); i++) {
-    origs[i] = core::XYZ(temp_ps[i]).get_coordinates();
-  }
-  internal::rotate_mol(copy_mol_, rot.psi, rot.theta, rot.phi);
-  ParticlesTemp mol_ps = core::get_leaves(orig_mol_);
-  sampled_map_->reset_data(0.);
-  sampled_map_->project(temp_ps, margin_ignored_in_conv_[0],
-                        margin_ignored_in_conv_[1], margin_ignored_in_conv_[2],
-                        map_cen_ - core::get_centroid(core::XYZs(mol_ps)));
-  sampled_map_->convolute_kernel(filtered_kernel_.get(), filtered_kernel_ext_);
-  sampled_map_->multiply(1. / (sampled_norm_ * nvox_));
+void FFTFitting::prepare_rotation_buffers(
+    internal::FFTRotationBuffers &buffers) {
+  buffers.projected_map_ = new em::DensityMap(*(low_map_->get_header()));
+  buffers.projected_map_->set_was_used(true);
+  buffers.sampled_map_ = new em::DensityMap(*(low_map_->get_header()));
+  buffers.sampled_map_->set_was_used(true);
+  buffers.r_grid_mol_.resize(nx_ * ny_ * nz_);
+  buffers.grid_hi_.resize(fftw_nvox_c2r_);
+  buffers.reversed_data_.resize(fftw_nvox_r2c_);
+}
+
+void FFTFitting::fftw_rotation_scores(
+    const multifit::internal::EulerAngles &rot,
+    internal::FFTRotationBuffers &buffers) {
+  algebra::Vector3Ds coords = internal::get_rotated_coordinates(
+      probe_coords_, rot.psi, rot.theta, rot.phi);
+  internal::project_coordinates(
+      buffers.projected_map_, coords, probe_masses_,
+      margin_ignored_in_conv_[0], margin_ignored_in_conv_[1],
+      margin_ignored_in_conv_[2], probe_shift_);
+  buffers.sampled_map_->convolute_kernel(buffers.projected_map_,
+                                         filtered_kernel_.get(),
+                                         filtered_kernel_ext_);
+  buffers.sampled_map_->multiply(1. / (sampled_norm_ * nvox_));
 
   // FFT the molecule
-  copy_density_data(sampled_map_, fftw_r_grid_mol_);
-  fftw_execute(fftw_plan_forward_hi_.get());
+  double *r_grid_mol = buffers.r_grid_mol_;
+  fftw_complex *grid_hi = buffers.grid_hi_;
+  double *reversed_data = buffers.reversed_data_;
+  copy_density_data(buffers.sampled_map_, r_grid_mol);
+  fftw_execute_dft_r2c(fftw_plan_forward_hi_.get(), r_grid_mol, grid_hi);
   // IFFT(molxEM*)
   double save_b_re;
   for (unsigned int i = 0; i < fftw_nvox_c2r_; i++) {
-    save_b_re = fftw_grid_hi_[i][0];
-    fftw_grid_hi_[i][0] = (fftw_grid_lo_[i][0] * fftw_grid_hi_[i][0] +
-                           fftw_grid_lo_[i][1] * fftw_grid_hi_[i][1]) *
-                          fftw_scale_;
-    fftw_grid_hi_[i][1] = (fftw_grid_lo_[i][0] * fftw_grid_hi_[i][1] -
-                           fftw_grid_lo_[i][1] * save_b_re) *
-                          fftw_scale_;
+    save_b_re = grid_hi[i][0];
+    grid_hi[i][0] = (fftw_grid_lo_[i][0] * grid_hi[i][0] +
+                     fftw_grid_lo_[i][1] * grid_hi[i][1]) *
+                    fftw_scale_;
+    grid_hi[i][1] = (fftw_grid_lo_[i][0] * grid_hi[i][1] -
+                     fftw_grid_lo_[i][1] * save_b_re) *
+                    fftw_scale_;
   }
 
   for (unsigned long jj = 0; jj < fftw_nvox_r2c_; jj++) {
-    reversed_fftw_data_[jj] = 0.;
+    reversed_data[jj] = 0.;
   }
-  fftw_execute(fftw_plan_reverse_hi_.get());
+  fftw_execute_dft_c2r(fftw_plan_reverse_hi_.get(), grid_hi, reversed_data);
+}
+
+void FFTFitting::add_rotation_scores(
+    const multifit::internal::EulerAngles &rot, int rot_ind,
+    const double *scores) {
   // update the highest score found so far for each grid translation,
   // and save corresponding rotation
   double curr_score;
@@ -482,7 +540,7 @@ void FFTFitting::fftw_translational_search(
   int grid_ind[3] = {-1, -1, -1};
   double max_score = -INT_MAX;
   for (long i = 0; i < inside_num_flipped_; i++) {
-    curr_score = (*(reversed_fftw_data_ + fft_scores_flipped_[i].ifft));
+    curr_score = scores[fft_scores_flipped_[i].ifft];
     pos_ind = fft_scores_flipped_[i].ireal;
     // get the minimum value
     fits_hash_[pos_ind].push_back(internal::RotScore(rot_ind, curr_score));
@@ -524,9 +582,6 @@ void FFTFitting::fftw_translational_search(
   " "<<rot.phi*180/PI<< " "<<spacing_*nx_half_-spacing_*grid_ind[0]<<
   " "<< spacing_*ny_half_-spacing_*grid_ind[1]<<" "<<
   spacing_*nz_half_-spacing_*grid_ind[2] <<" "<< max_score << std::endl;*/
-  for (unsigned int i = 0; i < temp_ps.size(); i++) {
-    core::XYZ(temp_ps[i]).set_coordinates(origs[i]);
-  }
 }
 
 void FFTFitting::prepare_lowres_map(em::DensityMap *dmap) {
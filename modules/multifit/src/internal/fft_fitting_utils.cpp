@@ -199,6 +199,78 @@ void get_rotation_matrix(double m[3][3], double psi, double theta, double phi) {
   m[2][1] = -s2 * c3;
   m[2][2] = c2;
 }
+algebra::Vector3Ds get_rotated_coordinates(const algebra::Vector3Ds &coords,
+                                           double psi, double theta,
+                                           double phi) {
+  double m[3][3];
+  get_rotation_matrix(m, psi, theta, phi);
+  algebra::Vector3Ds ret(coords.size());
+  for (unsigned int i = 0; i < coords.size(); i++) {
+    double currx = coords[i][0];
+    double curry = coords[i][1];
+    double currz = coords[i][2];
+    ret[i] =
+        algebra::Vector3D(currx * m[0][0] + curry * m[0][1] + currz * m[0][2],
+                          currx * m[1][0] + curry * m[1][1] + currz * m[1][2],
+                          currx * m[2][0] + curry * m[2][1] + currz * m[2][2]);
+  }
+  return ret;
+}
+
+void project_coordinates(em::DensityMap *dmap,
+                         const algebra::Vector3Ds &coords,
+                         const Floats &masses, int x_margin, int y_margin,
+                         int z_margin, const algebra::Vector3D &shift) {
+  const em::DensityHeader *header = dmap->get_header();
+  int lower_margin[3] = {x_margin, y_margin, z_margin};
+  for (int i = 0; i < 3; i++) {
+    if (lower_margin[i] == 0) lower_margin[i] = 1;
+  }
+  int upper_margin[3] = {header->get_nx() - lower_margin[0],
+                         header->get_ny() - lower_margin[1],
+                         header->get_nz() - lower_margin[2]};
+  dmap->reset_data();
+  double *data = dmap->get_data();
+  algebra::Vector3D orig = dmap->get_origin();
+  double spacing = header->get_spacing();
+  for (unsigned int i = 0; i < coords.size(); i++) {
+    algebra::Vector3D loc = coords[i] + shift;
+    // get the float position on the grid
+    double x_find = (loc[0] - orig[0]) / spacing;
+    double y_find = (loc[1] - orig[1]) / spacing;
+    double z_find = (loc[2] - orig[2]) / spacing;
+    int x0 = dmap->get_dim_index_by_location(loc, 0);
+    int y0 = dmap->get_dim_index_by_location(loc, 1);
+    int z0 = dmap->get_dim_index_by_location(loc, 2);
+    int x1 = x0 + 1, y1 = y0 + 1, z1 = z0 + 1;
+    // check that the point is within the boundaries
+    if (x0 >= upper_margin[0] || x1 < lower_margin[0] ||
+        y0 >= upper_margin[1] || y1 < lower_margin[1] ||
+        z0 >= upper_margin[2] || z1 < lower_margin[2]) {
+      IMP_WARN("point " << i << " is not interpolated \n");
+      continue;
+    }
+    // interpolate
+    double a = x1 - x_find;
+    double b = y1 - y_find;
+    double c = z1 - z_find;
+    double ab = a * b;
+    double ab1 = a * (1 - b);
+    double a1b = (1 - a) * b;
+    double a1b1 = (1 - a) * (1 - b);
+    a = (1 - c);
+    float mass = masses[i];
+    data[dmap->xyz_ind2voxel(x0, y0, z0)] += ab * c * mass;
+    data[dmap->xyz_ind2voxel(x0, y0, z1)] += ab * a * mass;
+    data[dmap->xyz_ind2voxel(x0, y1, z0)] += ab1 * c * mass;
+    data[dmap->xyz_ind2voxel(x0, y1, z1)] += ab1 * a * mass;
+    data[dmap->xyz_ind2voxel(x1, y0, z0)] += a1b * c * mass;
+    data[dmap->xyz_ind2voxel(x1, y0, z1)] += a1b * a * mass;
+    data[dmap->xyz_ind2voxel(x1, y1, z0)] += a1b1 * c * mass;
+    data[dmap->xyz_ind2voxel(x1, y1, z1)] += a1b1 * a * mass;
+  }
+}
+
 void rotate_mol(atom::Hierarchy mh, double psi, double theta, double phi) {
   core::XYZs ps = core::XYZs(core::get_leaves(mh));
   double m[3][3];
@@ -36,9 +36,29 @@ class Tests(IMP.test.TestCase):
         if sys.platform == 'win32' and 'WINELOADERNOEXEC' in os.environ:
             self.skipTest("multiprocessing module does not work with Wine")
         self.run_python_module(fit_fft,
-                               ['-c', '2', self.get_input_file_name('twoblobs.asmb.input')])
+                               ['-c', '2', '-p', '2',
+                                self.get_input_file_name('twoblobs.asmb.input')])
         os.unlink(self.get_input_file_name('twoblobsA.fitting.out'))
         os.unlink(self.get_input_file_name('twoblobsB.fitting.out'))
 
+    def test_fit_fft_run_threads(self):
+        """Test fit_fft module fits do not depend on the number of threads"""
+        asmb = self.get_input_file_name('twoblobs.asmb.input')
+        outs = [self.get_input_file_name('twoblobs%s.fitting.out' % c)
+                for c in 'AB']
+        old_threads = IMP.get_number_of_threads()
+        fits = []
+        for cpus in ('1', '3'):
+            self.run_python_module(fit_fft, ['-c', cpus, asmb])
+            # the caller's number of threads is restored
+            self.assertEqual(IMP.get_number_of_threads(), old_threads)
+            cur = []
+            for out in outs:
+                with open(out) as fh:
+                    cur.append(fh.read())
+                os.unlink(out)
+            fits.append(cur)
+        self.assertEqual(fits[0], fits[1])
+
 if __name__ == '__main__':
     IMP.test.main()
@@ -0,0 +1,240 @@
+"""Benchmark the PMI post-processing (analysis and I/O) code paths.
+
+Synthetic trajectories are made from the proteins in the benchmark module
+data (one resolution-1 bead per residue, split into two molecules), written
+with IMP.pmi.output.Output as stat2 and RMF files, and then read back
+with the same functions used in a typical analysis. Each stage is timed
+and reported with IMP.benchmark.report.
+
+Timings can be stored with --save_baseline and compared against a
+previous run with --baseline; stages slower than the baseline by more than
+the given tolerance are listed and the script exits with a nonzero status.
+"""
+
+from __future__ import print_function
+import IMP
+import IMP.algebra
+import IMP.atom
+import IMP.core
+import IMP.benchmark
+import IMP.pmi.topology
+import IMP.pmi.output
+import IMP.pmi.analysis
+import IMP.pmi.io
+import IMP.pmi.tools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+P = IMP.OptionParser(description="PMI analysis and I/O benchmark.")
+P.add_option('--frames', type='int', default=50,
+             help='number of frames written for each protein (default 50)')
+P.add_option('--cluster_frames', type='int', default=20,
+             help='number of frames used for the distance matrix and '
+                  'precision (default 20)')
+P.add_option('--baseline', type='string', default=None,
+             help='JSON file of timings to compare against')
+P.add_option('--save_baseline', type='string', default=None,
+             help='write the timings of this run to this JSON file')
+P.add_option('--tolerance', type='float', default=0.25,
+             help='allowed relative slowdown with respect to the baseline '
+                  '(default 0.25)')
+opts, args = P.parse_args()
+if IMP.get_bool_flag('run_quick_test'):
+    opts.frames = min(opts.frames, 5)
+    opts.cluster_frames = min(opts.cluster_frames, 3)
+
+IMP.set_log_level(IMP.SILENT)
+
+# Redirect chatty PMI output so we can see benchmark output
+old_stdout = sys.stdout
+
+
+class DummyFile(object):
+    def write(self, txt):
+        pass
+
+    def flush(self):
+        pass
+
+
+class ScoreOutput(object):
+    """Minimal output object providing the score written to the stat file"""
+    def __init__(self):
+        self.score = 0.
+
+    def get_output(self):
+        return {"Total_Score": str(self.score)}
+
+
+def read_ca_coordinates(pdb_file):
+    """Return the sequence and CA coordinates of a PDB file"""
+    m = IMP.Model()
+    h = IMP.atom.read_pdb(pdb_file, m, IMP.atom.CAlphaPDBSelector())
+    seq = []
+    coords = []
+    for r in IMP.atom.get_by_type(h, IMP.atom.RESIDUE_TYPE):
+        rt = IMP.atom.Residue(r).get_residue_type()
+        seq.append(IMP.atom.get_one_letter_code(rt))
+        ca = IMP.atom.get_by_type(r, IMP.atom.ATOM_TYPE)[0]
+        coords.append(IMP.core.XYZ(ca).get_coordinates())
+    return "".join(seq), coords
+
+
+def build_system(m, pdb_file):
+    """Build a two-molecule PMI system with beads at the CA positions"""
+    seq, coords = read_ca_coordinates(pdb_file)
+    half = len(seq) // 2
+    s = IMP.pmi.topology.System(m)
+    st = s.create_state()
+    for name, subseq in (("A", seq[:half]), ("B", seq[half:])):
+        mol = st.create_molecule(name, sequence=subseq)
+        mol.add_representation(resolutions=[1])
+    hier = s.build()
+    particles = IMP.atom.Selection(hier, resolution=1).get_selected_particles()
+    for p, c in zip(particles, coords):
+        IMP.core.XYZ(p).set_coordinates(c)
+    return hier, particles, coords
+
+
+def perturb(particles, coords, rng):
+    """Move the beads to a randomly perturbed copy of the native structure"""
+    rot = IMP.algebra.get_random_rotation_3d(
+        IMP.algebra.get_identity_rotation_3d(), 0.2)
+    tr = IMP.algebra.Transformation3D(
+        rot, IMP.algebra.Vector3D(*[rng.gauss(0., 2.) for i in range(3)]))
+    for p, c in zip(particles, coords):
+        noise = IMP.algebra.Vector3D(*[rng.gauss(0., 1.5) for i in range(3)])
+        IMP.core.XYZ(p).set_coordinates(tr.get_transformed(c + noise))
+
+
+def run(label, pdb_file, tmpdir, timings):
+    """Time each stage of writing and analyzing a synthetic trajectory"""
+    def record(stage, start, check):
+        t = time.time() - start
+        timings[label + " " + stage] = t
+        IMP.benchmark.report("pmi analysis " + label, stage, t, check)
+
+    rng = random.Random(42)
+    m = IMP.Model()
+    hier, particles, coords = build_system(m, pdb_file)
+    rmf_file = os.path.join(tmpdir, label + ".rmf3")
+    stat_file = os.path.join(tmpdir, label + ".stat")
+    score = ScoreOutput()
+
+    output = IMP.pmi.output.Output()
+    output.init_rmf(rmf_file, [hier])
+    output.init_stat2(stat_file, [score],
+                      extralabels=["rmf_file", "rmf_frame_index"])
+    output.set_output_entry("rmf_file", rmf_file)
+    stat_time = 0.
+    rmf_time = 0.
+    for n in range(opts.frames):
+        perturb(particles, coords, rng)
+        score.score = rng.uniform(0., 100.)
+        output.set_output_entry("rmf_frame_index", n)
+        start = time.time()
+        output.write_rmf(rmf_file)
+        rmf_time += time.time() - start
+        start = time.time()
+        output.write_stat2(stat_file)
+        stat_time += time.time() - start
+    output.close_rmf(rmf_file)
+    timings[label + " write_rmf"] = rmf_time
+    IMP.benchmark.report("pmi analysis " + label, "write_rmf", rmf_time,
+                         opts.frames)
+    timings[label + " write_stat2"] = stat_time
+    IMP.benchmark.report("pmi analysis " + label, "write_stat2", stat_time,
+                         opts.frames)
+
+    start = time.time()
+    po = IMP.pmi.output.ProcessOutput(stat_file)
+    fields = po.get_fields(["Total_Score", "rmf_file", "rmf_frame_index"])
+    record("get_fields", start, len(fields["Total_Score"]))
+
+    start = time.time()
+    rmf_files, rmf_frames, scores, features = IMP.pmi.io.get_best_models(
+        [stat_file], score_key="Total_Score", feature_keys=[])
+    record("get_best_models", start, len(scores))
+
+    # the best scoring frames, in the format used by the clustering macro
+    best = sorted(zip(scores, rmf_files, rmf_frames),
+                  key=lambda x: float(x[0]))[:opts.cluster_frames]
+    rmf_tuples = [(s, f, int(fr), n, n)
+                  for n, (s, f, fr) in enumerate(best)]
+
+    start = time.time()
+    components = {"A": "A", "B": "B"}
+    (all_coordinates, alignment_coordinates, rmsd_coordinates,
+     rmf_file_name_index_dict, all_rmf_file_names) = \
+        IMP.pmi.io.read_coordinates_of_rmfs(IMP.Model(), rmf_tuples,
+                                            components, components)
+    record("read_coordinates_of_rmfs", start, len(all_coordinates))
+
+    start = time.time()
+    clustering = IMP.pmi.analysis.Clustering()
+    for name, c in zip(all_rmf_file_names, rmsd_coordinates):
+        clustering.fill(name, c)
+    clustering.dist_matrix()
+    record("Clustering.dist_matrix", start,
+           clustering.get_dist_matrix().sum())
+
+    start = time.time()
+    precision = IMP.pmi.analysis.Precision(
+        IMP.Model(), resolution=1, selection_dictionary={"A": ["A"]})
+    precision.set_precision_style('pairwise_rmsd')
+    precision.add_structures([(f, fr) for s, f, fr, n, r in rmf_tuples],
+                             "set")
+    outfile = os.path.join(tmpdir, label + ".precision")
+    precision.get_precision("set", "set", outfile=outfile)
+    record("Precision.get_precision", start, len(rmf_tuples))
+
+    start = time.time()
+    stath = IMP.pmi.output.StatHierarchyHandler(IMP.Model(), stat_file)
+    nframes = 0
+    for h in stath:
+        nframes += 1
+    record("StatHierarchyHandler", start, nframes)
+
+
+def compare_to_baseline(timings, baseline_file, tolerance):
+    """Return the stages slower than in the stored baseline"""
+    with open(baseline_file) as fh:
+        baseline = json.load(fh)
+    regressions = []
+    for key in sorted(timings):
+        if key in baseline and timings[key] > baseline[key] * (1. + tolerance):
+            regressions.append((key, baseline[key], timings[key]))
+    return regressions
+
+
+proteins = [("small", "small_protein.pdb"),
+            ("medium", "medium_protein.pdb"),
+            ("large", "large_protein.pdb")]
+if IMP.get_bool_flag('run_quick_test'):
+    proteins = proteins[:1]
+
+timings = {}
+tmpdir = tempfile.mkdtemp()
+sys.stdout = DummyFile()
+try:
+    for label, pdb in proteins:
+        run(label, IMP.benchmark.get_data_path(pdb), tmpdir, timings)
+finally:
+    sys.stdout = old_stdout
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+if opts.save_baseline:
+    with open(opts.save_baseline, 'w') as fh:
+        json.dump(timings, fh, indent=1, sort_keys=True)
+
+if opts.baseline:
+    regressions = compare_to_baseline(timings, opts.baseline, opts.tolerance)
+    for key, old, new in regressions:
+        print("REGRESSION %s: %.3fs (baseline %.3fs)" % (key, new, old))
+    if regressions:
+        sys.exit(1)
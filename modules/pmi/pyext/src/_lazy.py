@@ -0,0 +1,67 @@
+"""@namespace IMP.pmi._lazy
+   Deferred imports, to keep the time needed to import IMP.pmi low.
+"""
+
+import sys
+
+# Full names of all modules requested with lazy_import()
+_requested = set()
+
+
+class _LazyModule(object):
+    """Stand-in for a module that is only imported on first attribute
+       access."""
+
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            name = self.__dict__['_lazy_name']
+            __import__(name)
+            module = sys.modules[name]
+            self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        module = self._load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            # a submodule that was also requested lazily
+            name = self.__dict__['_lazy_name'] + '.' + attr
+            if name in _requested:
+                __import__(name)
+                return sys.modules[name]
+            raise
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        if self.__dict__['_lazy_module'] is None:
+            return "<lazily imported module '%s'>" % self.__dict__['_lazy_name']
+        return repr(self.__dict__['_lazy_module'])
+
+
+def lazy_import(name):
+    """Return the named module, or a stand-in that imports it on first use.
+       For a submodule (e.g. "IMP.pmi.analysis") the stand-in is also set as
+       an attribute of the parent package, if that is not already there, so
+       that code referring to the module by its full name works unchanged.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    _requested.add(name)
+    module = _LazyModule(name)
+    if '.' in name:
+        parent_name, child = name.rsplit('.', 1)
+        parent = sys.modules.get(parent_name)
+        if parent is not None and child not in parent.__dict__:
+            setattr(parent, child, module)
+    return module
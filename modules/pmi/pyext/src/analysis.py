@@ -6,18 +6,20 @@
 from __future__ import print_function
 import IMP
 import IMP.algebra
-import IMP.em
 import IMP.pmi
 import IMP.pmi.tools
 import IMP.pmi.output
-import IMP.rmf
-import RMF
-import IMP.pmi.analysis
+import IMP.pmi._lazy
 from operator import itemgetter
 from copy import deepcopy
 from math import log,sqrt
 import itertools
-import numpy as np
+
+# Imported on first use, to reduce the time needed to import this module
+IMP.pmi._lazy.lazy_import("IMP.em")
+IMP.pmi._lazy.lazy_import("IMP.rmf")
+RMF = IMP.pmi._lazy.lazy_import("RMF")
+np = IMP.pmi._lazy.lazy_import("numpy")
 
 
 class Alignment(object):
@@ -1279,6 +1281,7 @@ class GetContactMap(object):
         radii = []
         namelist = []
         test, testr = [], []
+        leaves = []
         for part in self.prot.get_children():
             SortedSegments = []
             print(part)
@@ -1293,11 +1296,7 @@ class GetContactMap(object):
 
             for sgmnt in SortedSegments:
                 for leaf in IMP.atom.get_leaves(sgmnt[0]):
-                    p = IMP.core.XYZR(leaf)
-                    crd = np.array([p.get_x(), p.get_y(), p.get_z()])
-
-                    coords.append(crd)
-                    radii.append(p.get_radius())
+                    leaves.append(leaf)
 
                     new_name = part.get_name() + '_' + sgmnt[0].get_name() +\
                         '_' + \
@@ -1311,8 +1310,9 @@ class GetContactMap(object):
                     for res in IMP.atom.Fragment(leaf).get_residue_indexes():
                         self.resmap[part.get_name()][res] = new_name
 
-        coords = np.array(coords)
-        radii = np.array(radii)
+        model = self.prot.get_model()
+        coords = model.get_coordinates_array(leaves)
+        radii = model.get_radius_array(leaves)
         if len(self.namelist) == 0:
             self.namelist = namelist
             self.contactmap = np.zeros((len(coords), len(coords)))
@@ -7,17 +7,20 @@ import IMP
 import IMP.algebra
 import IMP.atom
 import IMP.pmi
-import IMP.rmf
-import IMP.pmi.analysis
 import IMP.pmi.output
 import IMP.pmi.tools
-import RMF
+import IMP.pmi._lazy
 import sys,os
-import numpy as np
 import re
 from collections import defaultdict
 import itertools
 
+# Imported on first use, to reduce the time needed to import this module
+IMP.pmi._lazy.lazy_import("IMP.pmi.analysis")
+IMP.pmi._lazy.lazy_import("IMP.rmf")
+RMF = IMP.pmi._lazy.lazy_import("RMF")
+np = IMP.pmi._lazy.lazy_import("numpy")
+
 def parse_dssp(dssp_fn, limit_to_chains='',name_map=None):
     """Read a DSSP file, and return secondary structure elements (SSEs).
     Values are all PDB residue numbering.
@@ -480,8 +483,7 @@ def read_coordinates_of_rmfs(model,
         rmsd_coordinate_dict={}
 
         for pr in part_dict:
-            model_coordinate_dict[pr] = np.array(
-                [np.array(IMP.core.XYZ(i).get_coordinates()) for i in part_dict[pr]])
+            model_coordinate_dict[pr] = model.get_coordinates_array(part_dict[pr])
         # for each file, get (as floats) a list of all coordinates
         #  of all requested tuples, organized as dictionaries.
         for tuple_dict,result_dict in zip((alignment_components,rmsd_calculation_components),
@@ -494,8 +496,7 @@ def read_coordinates_of_rmfs(model,
             if IMP.pmi.get_is_canonical(prot):
                 for pr in tuple_dict:
                     ps = IMP.pmi.tools.select_by_tuple_2(prot,tuple_dict[pr],resolution=1)
-                    result_dict[pr] = [list(map(float,IMP.core.XYZ(p).get_coordinates()))
-                                       for p in ps]
+                    result_dict[pr] = model.get_coordinates_array(ps).tolist()
             else:
                 for pr in tuple_dict:
                     if type(tuple_dict[pr]) is str:
@@ -508,8 +509,7 @@ def read_coordinates_of_rmfs(model,
                         s=IMP.atom.Selection(prot,molecule=name,residue_indexes=range(rbegin,rend+1))
                     ps=s.get_selected_particles()
                     filtered_particles=[p for p in ps if p in all_ps_set]
-                    result_dict[pr] = \
-                        [list(map(float,IMP.core.XYZ(p).get_coordinates())) for p in filtered_particles]
+                    result_dict[pr] = model.get_coordinates_array(filtered_particles).tolist()
 
         all_coordinates.append(model_coordinate_dict)
         alignment_coordinates.append(template_coordinate_dict)
@@ -17,6 +17,8 @@ import IMP.display
 import operator
 import math
 import sys
+import bisect
+import weakref
 from collections import defaultdict
 
 # json default serializations
@@ -150,7 +152,7 @@ class _ProteinsResiduesArray(tuple):
         @input_data can be a dict or a tuple
         '''
         self.cldbsk=_CrossLinkDataBaseStandardKeys()
-        if type(input_data) is dict:
+        if isinstance(input_data, dict):
             monolink=False
             p1=input_data[self.cldbsk.protein1_key]
             try:
@@ -254,6 +256,252 @@ class FilterOperator(object):
         else:
             return op(FilterOperator1.evaluate(xl_item), FilterOperator2.evaluate(xl_item))
 
+    def _get_keys(self):
+        """Get the set of all keywords used by this filter"""
+        if len(self.operations) == 0:
+            return set([self.values[0]])
+        FilterOperator1, op, FilterOperator2 = self.operations
+        keys = FilterOperator1._get_keys()
+        if FilterOperator2 is not None:
+            keys |= FilterOperator2._get_keys()
+        return keys
+
+    def _get_candidates(self, cldb):
+        """Use the CrossLinkDataBase indexes to narrow down the cross-links
+        that can pass this filter.
+        Return a set of (xlid, index in the xlid list) positions that is
+        guaranteed to contain every passing cross-link (the filter still
+        has to be evaluated on them), or None if the whole database has
+        to be scanned."""
+        if len(self.operations) == 0:
+            keyword, op, value = self.values
+            if op is operator.eq:
+                return cldb._get_positions_equal_to(keyword, value)
+            elif op in _range_operators:
+                return cldb._get_positions_in_range(keyword, op, value)
+            return None
+        FilterOperator1, op, FilterOperator2 = self.operations
+        if FilterOperator2 is None:
+            return None
+        c1 = FilterOperator1._get_candidates(cldb)
+        c2 = FilterOperator2._get_candidates(cldb)
+        if op is operator.and_:
+            if c1 is None:
+                return c2
+            elif c2 is None:
+                return c1
+            else:
+                return c1 & c2
+        elif op is operator.or_ and c1 is not None and c2 is not None:
+            return c1 | c2
+        return None
+
+_range_operators = (operator.lt, operator.le, operator.gt, operator.ge)
+
+_number_types = (int, float) if sys.version_info[0] >= 3 \
+                else (int, long, float)
+
+class _CrossLink(dict):
+    """A single cross-link in a CrossLinkDataBase.
+    This behaves exactly like a dict, but tells the databases that have
+    indexed it when it is modified, so that they can drop their indexes."""
+    __slots__ = ('_owners',)
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._owners = None
+
+    def __reduce__(self):
+        # copies are not indexed by any database
+        return (_CrossLink, (dict(self),))
+
+    def _add_owner(self, cldb):
+        if self._owners is None:
+            self._owners = weakref.WeakSet()
+        self._owners.add(cldb)
+
+    def _modified(self):
+        if self._owners:
+            for cldb in self._owners:
+                cldb._values_changed()
+
+    def __setitem__(self, key, value):
+        self._modified()
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._modified()
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        self._modified()
+        dict.update(self, *args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self._modified()
+        return dict.setdefault(self, key, default)
+
+    def pop(self, *args):
+        self._modified()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._modified()
+        return dict.popitem(self)
+
+    def clear(self):
+        self._modified()
+        dict.clear(self)
+
+
+class _CrossLinkList(list):
+    """The list of cross-links at a unique ID of a CrossLinkDataBase.
+    This behaves exactly like a list, but tells the databases that hold it
+    when cross-links are added, removed or replaced, so that they can drop
+    their cached order and indexes."""
+    __slots__ = ('_owners',)
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self._owners = None
+
+    def __reduce__(self):
+        return (_CrossLinkList, (list(self),))
+
+    def _add_owner(self, cldb):
+        if self._owners is None:
+            self._owners = weakref.WeakSet()
+        self._owners.add(cldb)
+
+    def _modified(self):
+        if self._owners:
+            for cldb in self._owners:
+                cldb._structure_changed()
+
+    def __setitem__(self, i, value):
+        self._modified()
+        list.__setitem__(self, i, value)
+
+    def __delitem__(self, i):
+        self._modified()
+        list.__delitem__(self, i)
+
+    # Python 2 calls these for simple slices
+    def __setslice__(self, i, j, values):
+        self._modified()
+        list.__setslice__(self, i, j, values)
+
+    def __delslice__(self, i, j):
+        self._modified()
+        list.__delslice__(self, i, j)
+
+    def __iadd__(self, values):
+        self._modified()
+        return list.__iadd__(self, values)
+
+    def __imul__(self, n):
+        self._modified()
+        return list.__imul__(self, n)
+
+    def append(self, value):
+        self._modified()
+        list.append(self, value)
+
+    def extend(self, values):
+        self._modified()
+        list.extend(self, values)
+
+    def insert(self, i, value):
+        self._modified()
+        list.insert(self, i, value)
+
+    def remove(self, value):
+        self._modified()
+        list.remove(self, value)
+
+    def pop(self, *args):
+        self._modified()
+        return list.pop(self, *args)
+
+    def sort(self, *args, **kwargs):
+        self._modified()
+        list.sort(self, *args, **kwargs)
+
+    def reverse(self):
+        self._modified()
+        list.reverse(self)
+
+    def clear(self):
+        self._modified()
+        del self[:]
+
+
+class _CrossLinkDataBaseDict(dict):
+    """The dict of cross-link lists of a CrossLinkDataBase, keyed by unique
+    ID. This behaves exactly like a dict, but tells the databases that hold
+    it when unique IDs are added, removed or replaced. Lists stored in it
+    are converted to _CrossLinkList, so that changes to them are seen too."""
+    __slots__ = ('_owners',)
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self)
+        self._owners = None
+        for k, v in dict(*args, **kwargs).items():
+            dict.__setitem__(self, k, self._get_list(v))
+
+    def __reduce__(self):
+        return (_CrossLinkDataBaseDict, (dict(self),))
+
+    def _get_list(self, xls):
+        if not isinstance(xls, _CrossLinkList):
+            xls = _CrossLinkList(xls)
+        if self._owners:
+            for cldb in self._owners:
+                xls._add_owner(cldb)
+        return xls
+
+    def _add_owner(self, cldb):
+        if self._owners is None:
+            self._owners = weakref.WeakSet()
+        self._owners.add(cldb)
+        for xls in self.values():
+            xls._add_owner(cldb)
+
+    def _modified(self):
+        if self._owners:
+            for cldb in self._owners:
+                cldb._structure_changed()
+
+    def __setitem__(self, key, value):
+        self._modified()
+        dict.__setitem__(self, key, self._get_list(value))
+
+    def __delitem__(self, key):
+        self._modified()
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        self._modified()
+        for k, v in dict(*args, **kwargs).items():
+            dict.__setitem__(self, k, self._get_list(v))
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = [] if default is None else default
+        return dict.__getitem__(self, key)
+
+    def pop(self, *args):
+        self._modified()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._modified()
+        return dict.popitem(self)
+
+    def clear(self):
+        self._modified()
+        dict.clear(self)
+
 '''
 def filter_factory(xl_):
 
@@ -520,6 +768,11 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
                 and if a fasta_seq is given
         '''
 
+        self._version = 0
+        self._indexes = {}
+        self._index_version = None
+        self._sorted_ids = None
+        self._len = None
         if data_base is None:
             self.data_base = {}
         else:
@@ -541,46 +794,202 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         self.fasta_seq = fasta_seq      #type: IMP.pmi.topology.Sequences
         self._update()
 
+    def _get_data_base(self):
+        self._ensure_updated()
+        return self._data_base
+    def _set_data_base(self, data_base):
+        if not isinstance(data_base, _CrossLinkDataBaseDict):
+            data_base = _CrossLinkDataBaseDict(data_base)
+        data_base._add_owner(self)
+        self._data_base = data_base
+        self._update()
+    data_base = property(_get_data_base, _set_data_base,
+                         doc="The dictionary of cross-link lists, "
+                             "keyed by unique ID. Lists stored in it are "
+                             "replaced with lists that tell the database "
+                             "when they change, so modify the stored lists, "
+                             "not the ones that were passed in")
+
     def _update(self):
+        '''
+        Mark the whole dataset as changed. The derived values (sub indexes,
+        redundancy, residue link numbers and consistency) are recomputed
+        the next time the cross-links are accessed, and the indexes are
+        dropped.
+        '''
+        self._needs_update = True
+        self._structure_changed()
+
+    def __setstate__(self, state):
+        # the tracking containers do not pickle their owners
+        self.__dict__.update(state)
+        self._data_base._add_owner(self)
+        self._structure_changed()
+
+    def _values_changed(self):
+        '''Drop the indexes after a cross-link is modified'''
+        self._version += 1
+
+    def _structure_changed(self):
+        '''
+        Drop the indexes and the cached order and number of cross-links
+        after cross-links or unique IDs are added, removed or replaced
+        '''
+        self._version += 1
+        self._sorted_ids = None
+        self._len = None
+
+    def _ensure_updated(self, keys=None):
         '''
         Update the whole dataset after changes
+        @param keys if given, only update if any of these keys is derived
+        '''
+        if keys is not None and not self._get_derived_keys() & set(keys):
+            return
+        if self._needs_update:
+            self._needs_update = False
+            self.update_cross_link_unique_sub_index()
+            self.update_cross_link_redundancy()
+            self.update_residues_links_number()
+            self.check_cross_link_consistency()
+
+    def _get_derived_keys(self):
+        return set([self.ambiguity_key, self.unique_sub_index_key,
+                    self.unique_sub_id_key, self.redundancy_key,
+                    self.redundancy_list_key, self.residue1_links_number_key,
+                    self.residue2_links_number_key])
+
+    def _get_sorted_ids(self):
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self._data_base.keys())
+        return self._sorted_ids
+
+    def _iter_xls(self):
+        '''Iterate over the cross-links without updating derived values'''
+        for k in self._get_sorted_ids():
+            for xl in self._data_base[k]:
+                yield xl
+
+    def _get_index(self, key):
+        '''
+        Get the index of the values of a key. This is a tuple of a dict
+        mapping each value to the list of its (xlid, n) positions, and
+        a (values, positions) pair of lists sorted by value for numeric
+        keys. Either part is None if it cannot be used for that key.
+        Indexes are rebuilt lazily after the database or any of its
+        cross-links is modified.
         '''
-        self.update_cross_link_unique_sub_index()
-        self.update_cross_link_redundancy()
-        self.update_residues_links_number()
-        self.check_cross_link_consistency()
+        if self._index_version != self._version:
+            self._indexes = {}
+            self._index_version = self._version
+            for xls in self._data_base.values():
+                for xl in xls:
+                    if isinstance(xl, _CrossLink):
+                        xl._add_owner(self)
+        if key not in self._indexes:
+            self._indexes[key] = self._build_index(key)
+        return self._indexes[key]
+
+    def _build_index(self, key):
+        equal = {}
+        numeric = []
+        for xlid in self._get_sorted_ids():
+            for n, xl in enumerate(self._data_base[xlid]):
+                # plain dicts may have been changed behind our back
+                if not isinstance(xl, _CrossLink) or key not in xl:
+                    return None, None
+                value = xl[key]
+                if isinstance(value, float) and value != value:
+                    # NaN never compares equal, so can't be looked up
+                    return None, None
+                if equal is not None:
+                    try:
+                        equal.setdefault(value, []).append((xlid, n))
+                    except TypeError:
+                        equal = None
+                if numeric is not None:
+                    if isinstance(value, _number_types):
+                        numeric.append((value, (xlid, n)))
+                    else:
+                        numeric = None
+        if numeric is not None:
+            numeric.sort(key=operator.itemgetter(0))
+            numeric = ([v for v, pos in numeric], [pos for v, pos in numeric])
+        return equal, numeric
+
+    def _get_positions_equal_to(self, key, value):
+        equal, numeric = self._get_index(key)
+        if equal is None:
+            return None
+        try:
+            return set(equal.get(value, ()))
+        except TypeError:
+            return None
 
+    def _get_positions_in_range(self, key, op, value):
+        equal, numeric = self._get_index(key)
+        if numeric is None or not isinstance(value, _number_types) \
+           or value != value:
+            return None
+        values, positions = numeric
+        if op is operator.lt:
+            return set(positions[:bisect.bisect_left(values, value)])
+        elif op is operator.le:
+            return set(positions[:bisect.bisect_right(values, value)])
+        elif op is operator.gt:
+            return set(positions[bisect.bisect_right(values, value):])
+        else:
+            return set(positions[bisect.bisect_left(values, value):])
+
+    def _get_filtered_xls(self, FilterOperator):
+        '''
+        Yield (xlid, xl) for each cross-link passing the filter, in
+        database order. The indexes are used to avoid evaluating the filter
+        on cross-links that cannot pass it.
+        '''
+        self._ensure_updated(FilterOperator._get_keys())
+        candidates = FilterOperator._get_candidates(self)
+        if candidates is None:
+            for xlid in self._get_sorted_ids():
+                for xl in self._data_base[xlid]:
+                    if FilterOperator.evaluate(xl):
+                        yield xlid, xl
+        else:
+            for xlid, n in sorted(candidates):
+                xl = self._data_base[xlid][n]
+                if FilterOperator.evaluate(xl):
+                    yield xlid, xl
 
     def __iter__(self):
-        sorted_ids=sorted(self.data_base.keys())
-        for k in sorted_ids:
-            for xl in self.data_base[k]:
-                yield xl
+        self._ensure_updated()
+        for xl in self._iter_xls():
+            yield xl
 
     def xlid_iterator(self):
-        sorted_ids=sorted(self.data_base.keys())
-        for xlid in sorted_ids:
+        for xlid in self._get_sorted_ids():
             yield xlid
 
     def __getitem__(self,xlid):
-        return self.data_base[xlid]
+        self._ensure_updated()
+        return self._data_base[xlid]
 
     def __len__(self):
-        return len([xl for xl in self])
+        if self._len is None:
+            self._len = sum(len(xls) for xls in self._data_base.values())
+        return self._len
 
     def get_name(self):
         return self.name
 
     def set_name(self,name):
         new_data_base={}
-        for k in self.data_base:
-            new_data_base[k+"."+name]=self.data_base[k]
+        for k in self._data_base:
+            new_data_base[k+"."+name]=self._data_base[k]
         self.data_base=new_data_base
         self.name=name
-        self._update()
 
     def get_number_of_xlid(self):
-        return len(self.data_base)
+        return len(self._data_base)
 
 
     def create_set_from_file(self,file_name,converter=None,FixedFormatParser=None):
@@ -604,7 +1013,7 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
                 # each line is a cross-link
                 new_xl_dict={}
                 for nxl,xl in enumerate(xl_list):
-                    new_xl={}
+                    new_xl=_CrossLink()
                     for k in xl:
                         if k in self.converter:
                             new_xl[self.converter[k]]=self.type[self.converter[k]](xl[k])
@@ -644,7 +1053,7 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
                         if len(p)==1:
                             is_monolink=True
 
-                        new_xl={}
+                        new_xl=_CrossLink()
                         for k in new_dict:
                             new_xl[k]=new_dict[k]
                         new_xl[self.residue1_key]=self.type[self.residue1_key](p[0])
@@ -686,6 +1095,7 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
             for line in f:
                 xl=FixedFormatParser.get_data(line)
                 if xl:
+                    xl=_CrossLink(xl)
                     xl[self.unique_id_key]=str(nxl+1)
                     new_xl_dict[str(nxl)]=[xl]
                     nxl+=1
@@ -693,18 +1103,17 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
 
         self.data_base=new_xl_dict
         self.name=file_name
-        self._update()
 
     def update_cross_link_unique_sub_index(self):
-        for k in self.data_base:
-            for n,xl in enumerate(self.data_base[k]):
-                xl[self.ambiguity_key]=len(self.data_base[k])
+        for k in self._data_base:
+            for n,xl in enumerate(self._data_base[k]):
+                xl[self.ambiguity_key]=len(self._data_base[k])
                 xl[self.unique_sub_index_key]=n+1
                 xl[self.unique_sub_id_key]=k+"."+str(n+1)
 
     def update_cross_link_redundancy(self):
         redundancy_data_base={}
-        for xl in self:
+        for xl in self._iter_xls():
             pra=_ProteinsResiduesArray(xl)
             if pra not in redundancy_data_base:
                 redundancy_data_base[pra]=[xl[self.unique_sub_id_key]]
@@ -712,14 +1121,14 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
             else:
                 redundancy_data_base[pra].append(xl[self.unique_sub_id_key])
                 redundancy_data_base[pra.get_inverted()].append(xl[self.unique_sub_id_key])
-        for xl in self:
+        for xl in self._iter_xls():
             pra=_ProteinsResiduesArray(xl)
             xl[self.redundancy_key]=len(redundancy_data_base[pra])
             xl[self.redundancy_list_key]=redundancy_data_base[pra]
 
     def update_residues_links_number(self):
         residue_links={}
-        for xl in self:
+        for xl in self._iter_xls():
             (p1,p2,r1,r2)=_ProteinsResiduesArray(xl)
             if (p1,r1) not in residue_links:
                 residue_links[(p1,r1)]=set([(p2,r2)])
@@ -730,7 +1139,7 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
             else:
                 residue_links[(p2,r2)].add((p1,r1))
 
-        for xl in self:
+        for xl in self._iter_xls():
             (p1,p2,r1,r2)=_ProteinsResiduesArray(xl)
             xl[self.residue1_links_number_key]=len(residue_links[(p1,r1)])
             xl[self.residue2_links_number_key]=len(residue_links[(p2,r2)])
@@ -741,7 +1150,7 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
             cnt_matched, cnt_matched_file = 0, 0
             matched = {}
             non_matched = {}
-            for xl in self:
+            for xl in self._iter_xls():
                 (p1, p2, r1, r2) = _ProteinsResiduesArray(xl)
                 b_matched_file = False
                 if self.residue1_amino_acid_key in xl:
@@ -851,14 +1260,11 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
 
     def filter(self,FilterOperator):
         new_xl_dict={}
-        for id in self.data_base.keys():
-            for xl in self.data_base[id]:
-                if FilterOperator.evaluate(xl):
-                    if id not in new_xl_dict:
-                        new_xl_dict[id]=[xl]
-                    else:
-                        new_xl_dict[id].append(xl)
-        self._update()
+        for id, xl in self._get_filtered_xls(FilterOperator):
+            if id not in new_xl_dict:
+                new_xl_dict[id]=[xl]
+            else:
+                new_xl_dict[id].append(xl)
         return CrossLinkDataBase(self.cldbkc,new_xl_dict)
 
 
@@ -883,12 +1289,11 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
 
         #rename first database:
         new_data_base={}
-        for k in self.data_base:
-            new_data_base[k]=self.data_base[k]
+        for k in self._data_base:
+            new_data_base[k]=self._data_base[k]
         for k in CrossLinkDataBase2.data_base:
             new_data_base[k]=CrossLinkDataBase2.data_base[k]
         self.data_base=new_data_base
-        self._update()
 
     def set_value(self,key,new_value,FilterOperator=None):
         '''
@@ -902,12 +1307,12 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         example: `cldb1.set_value(cldb1.protein1_key,'FFF',FO(cldb.protein1_key,operator.eq,"AAA"))`
         '''
 
-        for xl in self:
-            if FilterOperator is not None:
-                if FilterOperator.evaluate(xl):
-                    xl[key]=new_value
-            else:
-                xl[key]=new_value
+        if FilterOperator is not None:
+            xls = [xl for xlid, xl in self._get_filtered_xls(FilterOperator)]
+        else:
+            xls = self._iter_xls()
+        for xl in xls:
+            xl[key]=new_value
         self._update()
 
     def get_values(self,key):
@@ -915,8 +1320,12 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         this function returns the list of values for a given key in the database
         alphanumerically sorted
         '''
+        self._ensure_updated([key])
+        equal, numeric = self._get_index(key)
+        if equal is not None:
+            return sorted(equal.keys())
         values=set()
-        for xl in self:
+        for xl in self._iter_xls():
             values.add(xl[key])
         return sorted(list(values))
 
@@ -927,7 +1336,7 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         @param offset: the offset value
         '''
 
-        for xl in self:
+        for xl in self._iter_xls():
             if xl[self.protein1_key] == protein_name:
                 xl[self.residue1_key]=xl[self.residue1_key]+offset
             if xl[self.protein2_key] == protein_name:
@@ -941,7 +1350,7 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         @param keyword the new keyword name:
         @param values_from_keyword the keyword from which we are copying the values:
         '''
-        for xl in self:
+        for xl in self._iter_xls():
             if values_from_keyword is not None:
                 xl[keyword] = xl[values_from_keyword]
             else:
@@ -966,31 +1375,30 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
                 self.set_value(self.protein2_key,new_name,fo2)
 
     def clone_protein(self,protein_name,new_protein_name):
-        new_xl_dict={}
-        for id in self.data_base.keys():
+        for id in self._data_base.keys():
             new_data_base=[]
-            for xl in self.data_base[id]:
+            for xl in self._data_base[id]:
                 new_data_base.append(xl)
                 if xl[self.protein1_key]==protein_name and xl[self.protein2_key]!=protein_name:
-                    new_xl=dict(xl)
+                    new_xl=_CrossLink(xl)
                     new_xl[self.protein1_key]=new_protein_name
                     new_data_base.append(new_xl)
                 elif xl[self.protein1_key]!=protein_name and xl[self.protein2_key]==protein_name:
-                    new_xl=dict(xl)
+                    new_xl=_CrossLink(xl)
                     new_xl[self.protein2_key]=new_protein_name
                     new_data_base.append(new_xl)
                 elif xl[self.protein1_key]==protein_name and xl[self.protein2_key]==protein_name:
-                    new_xl=dict(xl)
+                    new_xl=_CrossLink(xl)
                     new_xl[self.protein1_key]=new_protein_name
                     new_data_base.append(new_xl)
-                    new_xl=dict(xl)
+                    new_xl=_CrossLink(xl)
                     new_xl[self.protein2_key]=new_protein_name
                     new_data_base.append(new_xl)
-                    new_xl=dict(xl)
+                    new_xl=_CrossLink(xl)
                     new_xl[self.protein1_key]=new_protein_name
                     new_xl[self.protein2_key]=new_protein_name
                     new_data_base.append(new_xl)
-            self.data_base[id]=new_data_base
+            self._data_base[id]=new_data_base
         self._update()
 
     def filter_out_same_residues(self):
@@ -998,15 +1406,14 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         This function remove cross-links applied to the same residue
         (ie, same chain name and residue number)
         '''
-        new_xl_dict={}
-        for id in self.data_base.keys():
+        for id in self._data_base.keys():
             new_data_base=[]
-            for xl in self.data_base[id]:
+            for xl in self._data_base[id]:
                 if xl[self.protein1_key]==xl[self.protein2_key] and xl[self.residue1_key]==xl[self.residue2_key]:
                     continue
                 else:
                     new_data_base.append(xl)
-            self.data_base[id]=new_data_base
+            self._data_base[id]=new_data_base
         self._update()
 
 
@@ -1022,10 +1429,10 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
             raise ValueError('the percentage of random cross-link spectra should be between 0 and 1')
         nspectra=self.get_number_of_xlid()
         nrandom_spectra=int(nspectra*percentage)
-        random_keys=random.sample(self.data_base.keys(),nrandom_spectra)
+        random_keys=random.sample(self._get_sorted_ids(),nrandom_spectra)
         new_data_base={}
         for k in random_keys:
-            new_data_base[k]=self.data_base[k]
+            new_data_base[k]=self._data_base[k]
         return CrossLinkDataBase(self.cldbkc,new_data_base)
 
     def __str__(self):
@@ -1158,8 +1565,10 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
     def load(self,json_filename):
         import json
         with open(json_filename, 'r') as fp:
-            self.data_base = json.load(fp)
-        self._update()
+            data_base = json.load(fp)
+        for k in data_base:
+            data_base[k] = [_CrossLink(xl) for xl in data_base[k]]
+        self.data_base = data_base
         #getting rid of unicode
         # (can't do this in Python 3, since *everything* is Unicode there)
         if sys.version_info[0] < 3:
@@ -1301,6 +1710,8 @@ class MapCrossLinkDataBaseOnStructure(object):
         if type(rmf_or_stat_handler) is IMP.pmi.output.RMFHierarchyHandler or \
                 type(rmf_or_stat_handler) is IMP.pmi.output.StatHierarchyHandler:
             self.prots=rmf_or_stat_handler
+        # the hierarchy is the same in every frame, so index it only once
+        self.index=IMP.atom.SelectionIndex(self.prots)
         self.distances=defaultdict(list)
         self.array_to_id={}
         self.id_to_array={}
@@ -1354,13 +1765,11 @@ class MapCrossLinkDataBaseOnStructure(object):
 
     def _get_distance_and_particle_pair(self,r1,c1,r2,c2):
         '''more robust and slower version of above'''
-        sel=IMP.atom.Selection(self.prots,molecule=c1,residue_index=r1,resolution=1)
-        selpart_1=sel.get_selected_particles()
+        selpart_1=self.index.get_selected_particles(molecule=c1,residue_index=r1,resolution=1)
         if len(selpart_1)==0:
             print("MapCrossLinkDataBaseOnStructure: Warning: no particle selected for first site")
             return None
-        sel=IMP.atom.Selection(self.prots,molecule=c2,residue_index=r2,resolution=1)
-        selpart_2=sel.get_selected_particles()
+        selpart_2=self.index.get_selected_particles(molecule=c2,residue_index=r2,resolution=1)
         if len(selpart_2)==0:
             print("MapCrossLinkDataBaseOnStructure: Warning: no particle selected for second site")
             return None
@@ -1555,20 +1964,19 @@ class CrossLinkDataBaseFromStructure(object):
 
                         residues1=[i for i in range(1,len(seq)+1) if seq[i-1] in self.residue_types_1]
                         residues2=[i for i in range(1,len(seq)+1) if seq[i-1] in self.residue_types_2]
+                        sel_index=IMP.atom.SelectionIndex(molecule.hier)
                         for r in residues1:
-                            s=IMP.atom.Selection(molecule.hier,residue_index=r,resolution=1)
-                            ps=s.get_selected_particles()
+                            ps=sel_index.get_selected_particles(residue_index=r,resolution=1)
                             for p in ps:
-                                index=p.get_index()
-                                self.indexes_dict1[index]=(molecule,r)
-                                self.protein_residue_dict[(molecule,r)]=index
+                                pi=p.get_index()
+                                self.indexes_dict1[pi]=(molecule,r)
+                                self.protein_residue_dict[(molecule,r)]=pi
                         for r in residues2:
-                            s=IMP.atom.Selection(molecule.hier,residue_index=r,resolution=1)
-                            ps=s.get_selected_particles()
+                            ps=sel_index.get_selected_particles(residue_index=r,resolution=1)
                             for p in ps:
-                                index=p.get_index()
-                                self.indexes_dict2[index]=(molecule,r)
-                                self.protein_residue_dict[(molecule,r)]=index
+                                pi=p.get_index()
+                                self.indexes_dict2[pi]=(molecule,r)
+                                self.protein_residue_dict[(molecule,r)]=pi
 
 
     def get_all_possible_pairs(self):
@@ -214,15 +214,17 @@ class XLTable():
         if nomap:
             return
 
+        index=IMP.atom.SelectionIndex(self.mdl,
+                                      [h.get_particle_index() for h in prots])
+        res_one=set(particles_resolution_one)
         for cname in chain_names:
             print(cname)
             if self._first:
                 self.index_dict[cname]=range(prev_stop,prev_stop+len(self.sequence_dict[cname]))
             rindexes=range(1,len(self.sequence_dict[cname])+1)
             for rnum in rindexes:
-                sel=IMP.atom.Selection(prots,molecule=cname,residue_index=rnum)
-                selpart=sel.get_selected_particles()
-                selpart_res_one=list(set(particles_resolution_one) & set(selpart))
+                selpart=index.get_selected_particles(molecule=cname,residue_index=rnum)
+                selpart_res_one=list(res_one & set(selpart))
                 if len(selpart_res_one)>1: continue
                 if len(selpart_res_one)==0: continue
                 selpart_res_one=selpart_res_one[0]
@@ -4,25 +4,25 @@ Protocols for sampling structures and analyzing them.
 
 from __future__ import print_function, division
 import IMP
-import IMP.pmi.representation
 import IMP.pmi.tools
 import IMP.pmi.samplers
 import IMP.pmi.output
-import IMP.pmi.analysis
-import IMP.pmi.io
-import IMP.rmf
-import IMP.isd
-import IMP.pmi.dof
-import RMF
+import IMP.pmi._lazy
 import os
 import glob
 from operator import itemgetter
 from collections import defaultdict
-import numpy as np
 import string
 import itertools
 import math
 
+# Only needed by some of the macros; imported on first use
+IMP.pmi._lazy.lazy_import("IMP.pmi.representation")
+IMP.pmi._lazy.lazy_import("IMP.pmi.analysis")
+IMP.pmi._lazy.lazy_import("IMP.pmi.io")
+IMP.pmi._lazy.lazy_import("IMP.pmi.dof")
+np = IMP.pmi._lazy.lazy_import("numpy")
+
 class _RMFRestraints(object):
     """All restraints that are written out to the RMF file"""
     def __init__(self, model, user_restraints):
@@ -52,6 +52,19 @@ class _RMFRestraints(object):
             raise IndexError("Out of range")
 
 
+class _OutputSnapshot(object):
+    """The output of an object as it was when update() was last called"""
+    def __init__(self, obj):
+        self._obj = obj
+        self.update()
+
+    def update(self):
+        self._output = self._obj.get_output()
+
+    def get_output(self):
+        return self._output
+
+
 class ReplicaExchange0(object):
     """A macro to help setup and run replica exchange.
     Supports Monte Carlo and molecular dynamics.
@@ -95,9 +108,14 @@ class ReplicaExchange0(object):
                  rmf_dir="rmfs/",
                  best_pdb_dir="pdbs/",
                  replica_stat_file_suffix="stat_replica",
+                 stat_file_verbose_every=1,
                  em_object_for_rmf=None,
                  atomistic=False,
                  replica_exchange_object=None,
+                 evaluation_profiling=False,
+                 phase_profiling=False,
+                 incremental_scoring=False,
+                 close_pair_objects=None,
                  test_mode=False):
         """Constructor.
            @param model                    The IMP model
@@ -153,6 +171,26 @@ class ReplicaExchange0(object):
            @param write_initial_rmf        Write the initial configuration
            @param global_output_directory Folder that will be created to house
                   output.
+           @param stat_file_verbose_every Only write verbose per-restraint
+                  entries (e.g. individual cross-link distances) to the stat
+                  file every this many frames
+           @param evaluation_profiling If True, time the evaluation of each
+                  restraint and score state, write the timings to the stat
+                  file and print a summary at the end of the run
+           @param phase_profiling If True, write the time spent in each
+                  phase of the sampling loop (sampling, scoring, exchange
+                  of values between replicas, output and temperature swap)
+                  to the replica stat file and print a summary of all
+                  replicas at the end of the run
+           @param incremental_scoring If True, score each Monte Carlo step
+                  incrementally, only evaluating again the restraints that
+                  depend on the moved particles, and print how much faster
+                  this is than full evaluation. A ValueError is raised if
+                  the incremental and full scores differ.
+                  (see IMP.pmi.samplers.MonteCarlo.set_incremental_scoring())
+           @param close_pair_objects PMI restraints scored on close pairs,
+                  such as IMP.pmi.restraints.stereochemistry.ExcludedVolumeSphere;
+                  needed if incremental_scoring is True
         @param test_mode Set to True to avoid writing any files, just test one frame.
         """
         self.model = model
@@ -238,7 +276,12 @@ class ReplicaExchange0(object):
         self.vars["best_pdb_dir"] = best_pdb_dir
         self.vars["atomistic"] = atomistic
         self.vars["replica_stat_file_suffix"] = replica_stat_file_suffix
+        self.vars["stat_file_verbose_every"] = stat_file_verbose_every
         self.vars["geometries"] = None
+        self.vars["evaluation_profiling"] = evaluation_profiling
+        self.vars["phase_profiling"] = phase_profiling
+        self.vars["incremental_scoring"] = incremental_scoring
+        self.close_pair_objects = close_pair_objects
         self.test_mode = test_mode
 
     def add_geometries(self, geometries):
@@ -298,7 +341,24 @@ class ReplicaExchange0(object):
             print("Setting up MonteCarlo")
             sampler_mc = IMP.pmi.samplers.MonteCarlo(self.model,
                                                      self.monte_carlo_sample_objects,
-                                                     self.vars["monte_carlo_temperature"])
+                                                     self.vars["monte_carlo_temperature"],
+                                                     incremental=self.vars["incremental_scoring"],
+                                                     close_pair_objects=self.close_pair_objects)
+            if self.vars["incremental_scoring"]:
+                check = sampler_mc.get_incremental_scoring_check()
+                print("Incremental scoring: %.3g s per step, vs %.3g s for "
+                      "full evaluation (speedup %.1f); largest score "
+                      "difference %.3g" % (check["IncrementalTimePerStep"],
+                                           check["FullTimePerStep"],
+                                           check["Speedup"],
+                                           check["MaximumScoreDifference"]))
+                if check["MaximumRelativeScoreDifference"] > 1e-6:
+                    raise ValueError("Incremental scoring does not match "
+                                     "full evaluation of the restraints "
+                                     "(largest score difference %.3g); check "
+                                     "that all close pair restraints are "
+                                     "passed in close_pair_objects"
+                                     % check["MaximumScoreDifference"])
             if self.vars["simulated_annealing"]:
                 tmin=self.vars["simulated_annealing_minimum_temperature"]
                 tmax=self.vars["simulated_annealing_maximum_temperature"]
@@ -394,6 +454,12 @@ class ReplicaExchange0(object):
         if self.rmf_output_objects is not None:
             self.rmf_output_objects.append(sw)
 
+        profiler = None
+        if self.vars["evaluation_profiling"]:
+            profiler = IMP.pmi.tools.EvaluationProfiler(self.model)
+            if self.output_objects is not None:
+                self.output_objects.append(profiler)
+
         print("Setting up stat file")
         output = IMP.pmi.output.Output(atomistic=self.vars["atomistic"])
         low_temp_stat_file = globaldir + \
@@ -402,7 +468,8 @@ class ReplicaExchange0(object):
             if self.output_objects is not None:
                 output.init_stat2(low_temp_stat_file,
                               self.output_objects,
-                              extralabels=["rmf_file", "rmf_frame_index"])
+                              extralabels=["rmf_file", "rmf_frame_index"],
+                              verbose_every=self.vars["stat_file_verbose_every"])
         else:
             print("Stat file writing is disabled")
 
@@ -412,8 +479,19 @@ class ReplicaExchange0(object):
         print("Setting up replica stat file")
         replica_stat_file = globaldir + \
             self.vars["replica_stat_file_suffix"] + "." + str(myindex) + ".out"
+        phase_timer = IMP.pmi.tools.PhaseTimer(["sampling", "scoring",
+                                                "exchange_values", "output",
+                                                "swap"])
+        # the replica stat file is written after the swap, so that it
+        # includes the time spent on the frame's output and swap, but
+        # reports the replica exchange state from before the swap
+        rex_output = _OutputSnapshot(rex)
+        replica_output_objects = [rex_output]
+        if self.vars["phase_profiling"]:
+            replica_output_objects.append(phase_timer)
         if not self.test_mode:
-            output.init_stat2(replica_stat_file, [rex], extralabels=["score"])
+            output.init_stat2(replica_stat_file, replica_output_objects,
+                              extralabels=["score"])
 
         if not self.test_mode:
             print("Setting up best pdb files")
@@ -499,55 +577,62 @@ class ReplicaExchange0(object):
             if self.test_mode:
                 score = 0.
             else:
-                for nr in range(self.vars["num_sample_rounds"]):
-                    if sampler_md is not None:
-                        sampler_md.optimize(
-                                  self.vars["molecular_dynamics_steps"])
-                    if sampler_mc is not None:
-                        sampler_mc.optimize(self.vars["monte_carlo_steps"])
-                score = IMP.pmi.tools.get_restraint_set(
-                                             self.model).evaluate(False)
-                mpivs.set_value("score",score)
+                with phase_timer.phase("sampling"):
+                    for nr in range(self.vars["num_sample_rounds"]):
+                        if sampler_md is not None:
+                            sampler_md.optimize(
+                                      self.vars["molecular_dynamics_steps"])
+                        if sampler_mc is not None:
+                            sampler_mc.optimize(self.vars["monte_carlo_steps"])
+                with phase_timer.phase("scoring"):
+                    score = IMP.pmi.tools.get_restraint_set(
+                                                 self.model).evaluate(False)
+                with phase_timer.phase("exchange_values"):
+                    mpivs.set_value("score",score)
             output.set_output_entry("score", score)
 
 
 
             my_temp_index = int(rex.get_my_temp() * temp_index_factor)
 
-            if self.vars["save_coordinates_mode"] == "lowest_temperature":
-                save_frame=(min_temp_index == my_temp_index)
-            elif self.vars["save_coordinates_mode"] == "25th_score":
-                score_perc=mpivs.get_percentile("score")
-                save_frame=(score_perc*100.0<=25.0)
-            elif self.vars["save_coordinates_mode"] == "50th_score":
-                score_perc=mpivs.get_percentile("score")
-                save_frame=(score_perc*100.0<=50.0)
-            elif self.vars["save_coordinates_mode"] == "75th_score":
-                score_perc=mpivs.get_percentile("score")
-                save_frame=(score_perc*100.0<=75.0)
-
-            if save_frame:
-                print("--- frame %s score %s " % (str(i), str(score)))
-
-                if not self.test_mode:
-                    if i % self.vars["nframes_write_coordinates"]==0:
-                        print('--- writing coordinates')
-                        if self.vars["number_of_best_scoring_models"] > 0:
-                            output.write_pdb_best_scoring(score)
-                        output.write_rmf(rmfname)
-                        output.set_output_entry("rmf_file", rmfname)
-                        output.set_output_entry("rmf_frame_index", ntimes_at_low_temp)
-                    else:
-                        output.set_output_entry("rmf_file", rmfname)
-                        output.set_output_entry("rmf_frame_index", '-1')
-                    if self.output_objects is not None:
-                        output.write_stat2(low_temp_stat_file)
-                ntimes_at_low_temp += 1
+            with phase_timer.phase("exchange_values"):
+                if self.vars["save_coordinates_mode"] == "lowest_temperature":
+                    save_frame=(min_temp_index == my_temp_index)
+                elif self.vars["save_coordinates_mode"] == "25th_score":
+                    score_perc=mpivs.get_percentile("score")
+                    save_frame=(score_perc*100.0<=25.0)
+                elif self.vars["save_coordinates_mode"] == "50th_score":
+                    score_perc=mpivs.get_percentile("score")
+                    save_frame=(score_perc*100.0<=50.0)
+                elif self.vars["save_coordinates_mode"] == "75th_score":
+                    score_perc=mpivs.get_percentile("score")
+                    save_frame=(score_perc*100.0<=75.0)
+
+            with phase_timer.phase("output"):
+                if save_frame:
+                    print("--- frame %s score %s " % (str(i), str(score)))
+
+                    if not self.test_mode:
+                        if i % self.vars["nframes_write_coordinates"]==0:
+                            print('--- writing coordinates')
+                            if self.vars["number_of_best_scoring_models"] > 0:
+                                output.write_pdb_best_scoring(score)
+                            output.write_rmf(rmfname)
+                            output.set_output_entry("rmf_file", rmfname)
+                            output.set_output_entry("rmf_frame_index", ntimes_at_low_temp)
+                        else:
+                            output.set_output_entry("rmf_file", rmfname)
+                            output.set_output_entry("rmf_frame_index", '-1')
+                        if self.output_objects is not None:
+                            output.write_stat2(low_temp_stat_file)
+                    ntimes_at_low_temp += 1
 
+            rex_output.update()
+            if self.vars["replica_exchange_swap"]:
+                with phase_timer.phase("swap"):
+                    rex.swap_temp(i, score)
             if not self.test_mode:
                 output.write_stat2(replica_stat_file)
-            if self.vars["replica_exchange_swap"]:
-                rex.swap_temp(i, score)
         if self.representation:
             for p, state in self.representation._protocol_output:
                 p.add_replica_exchange(state, self)
@@ -556,6 +641,20 @@ class ReplicaExchange0(object):
             print("closing production rmf files")
             output.close_rmf(rmfname)
 
+        if profiler is not None:
+            print("Evaluation time of restraints and score states:")
+            print(profiler.get_summary())
+            profiler.disable()
+
+        if self.vars["phase_profiling"]:
+            if self.test_mode:
+                summary = phase_timer.get_summary()
+            else:
+                summary = phase_timer.get_summary(mpivs)
+            if myindex == 0:
+                print("Time spent in each phase of the sampling loop:")
+                print(summary)
+
 
 
 # ----------------------------------------------------------------------
@@ -2154,6 +2253,17 @@ class AnalysisReplicaExchange0(object):
         inputf.close()
         return objects
 
+def _get_superposition(x, y):
+    """Return the rotation matrix and translation vector that best
+       superpose the coordinates x (N x 3 array) onto y (Kabsch algorithm)"""
+    cx=x.mean(axis=0)
+    cy=y.mean(axis=0)
+    u, s, vt = np.linalg.svd((x-cx).T.dot(y-cy))
+    d=np.sign(np.linalg.det(vt.T.dot(u.T)))
+    rotation=vt.T.dot(np.diag([1.0,1.0,d])).dot(u.T)
+    return rotation, cy-rotation.dot(cx)
+
+
 class AnalysisReplicaExchange(object):
 
     """
@@ -2188,8 +2298,6 @@ class AnalysisReplicaExchange(object):
         self.sel0_alignment=IMP.atom.Selection(self.stath0)
         self.sel1_alignment=IMP.atom.Selection(self.stath1)
         self.clusters=[]
-        self.pairwise_rmsd={}
-        self.pairwise_molecular_assignment={}
         self.alignment=alignment
         self.update_seldicts()
         self.molcopydict0=IMP.pmi.tools.get_molecules_dictionary_by_copy(IMP.atom.get_leaves(self.stath0))
@@ -2211,6 +2319,7 @@ class AnalysisReplicaExchange(object):
         """
         self.sel0_alignment=IMP.atom.Selection(self.stath0,**kwargs)
         self.sel1_alignment=IMP.atom.Selection(self.stath1,**kwargs)
+        self.reset_pairwise_rmsd()
 
     ######################
     # Clustering functions
@@ -2276,12 +2385,22 @@ class AnalysisReplicaExchange(object):
             data.append(m)
         return data
 
-    def save_data(self,filename='data.pkl'):
+    def save_data(self,filename='data.pkl',rmsd_filename=None):
         """
         Save the data for the whole models into a pickle file
         @param filename string
+        @param rmsd_filename string (Default=None), if given also save the
+               rmsds and molecular assignments computed so far in this file
         """
         self.stath0.save_data(filename)
+        if rmsd_filename is not None:
+            try:
+                import cPickle as pickle
+            except ImportError:
+                import pickle
+            with open(rmsd_filename,'wb') as fl:
+                pickle.dump((self.pairwise_rmsd,self.pairwise_rmsd_mask,
+                             self.pairwise_molecular_assignment),fl)
 
     def set_data(self,data):
         """
@@ -2290,15 +2409,32 @@ class AnalysisReplicaExchange(object):
         """
         self.stath0.data=data
         self.stath1.data=data
+        self.reset_pairwise_rmsd()
 
-    def load_data(self,filename='data.pkl'):
+    def load_data(self,filename='data.pkl',rmsd_filename=None):
         """
         Load the data from an external pickled file
         @param filename string
+        @param rmsd_filename string (Default=None), if given also load the
+               rmsds and molecular assignments saved by save_data
         """
         self.stath0.load_data(filename)
         self.stath1.load_data(filename)
         self.best_models=len(self.stath0)
+        self.reset_pairwise_rmsd()
+        if rmsd_filename is not None:
+            try:
+                import cPickle as pickle
+            except ImportError:
+                import pickle
+            with open(rmsd_filename,'rb') as fl:
+                (pairwise_rmsd, pairwise_rmsd_mask,
+                 pairwise_molecular_assignment) = pickle.load(fl)
+            if pairwise_rmsd.shape!=self.pairwise_rmsd.shape:
+                raise ValueError("%s does not match the number of models" % rmsd_filename)
+            self.pairwise_rmsd=pairwise_rmsd
+            self.pairwise_rmsd_mask=pairwise_rmsd_mask
+            self.pairwise_molecular_assignment=pairwise_molecular_assignment
 
     def save_clusters(self,filename='clusters.pkl'):
         """
@@ -2340,9 +2476,7 @@ class AnalysisReplicaExchange(object):
         member_distance=defaultdict(float)
 
         for n0,n1 in itertools.combinations(cluster.members,2):
-            d0=self.stath0[n0]
-            d1=self.stath1[n1]
-            rmsd, _ = self.rmsd()
+            rmsd, _ = self.get_rmsd(n0, n1)
             member_distance[n0]+=rmsd
 
         if len(member_distance)>0:
@@ -2403,10 +2537,8 @@ class AnalysisReplicaExchange(object):
         npairs=0
         rmsd=0.0
         for n0 in cluster1.members:
-            d0=self.stath0[n0]
             for n1 in cluster2.members:
-                d1=self.stath1[n1]
-                tmp_rmsd, tmp_pairwise_molecular_assignment=self.rmsd()
+                tmp_rmsd, tmp_pairwise_molecular_assignment=self.get_rmsd(n0, n1)
                 rmsd+=tmp_rmsd
                 npairs+=1
         precision=rmsd/npairs
@@ -2661,10 +2793,7 @@ class AnalysisReplicaExchange(object):
     def plot_rmsd_matrix(self,filename):
         import numpy as np
         self.compute_all_pairwise_rmsd()
-        distance_matrix = np.zeros(
-            (len(self.stath0), len(self.stath1)))
-        for (n0,n1) in self.pairwise_rmsd:
-            distance_matrix[n0, n1] = self.pairwise_rmsd[(n0,n1)]
+        distance_matrix = self.get_pairwise_rmsd_matrix()
 
         import matplotlib as mpl
         mpl.use('Agg')
@@ -2716,6 +2845,92 @@ class AnalysisReplicaExchange(object):
         """
         self.seldict0=IMP.pmi.tools.get_selections_dictionary(self.sel0_rmsd.get_selected_particles())
         self.seldict1=IMP.pmi.tools.get_selections_dictionary(self.sel1_rmsd.get_selected_particles())
+        # the selected particles of each copy never change, only their coordinates
+        self.selparticles={}
+        for seldict in (self.seldict0, self.seldict1):
+            for sels in seldict.values():
+                for sel in sels:
+                    self.selparticles[id(sel)]=sel.get_selected_particles()
+        self.reset_pairwise_rmsd()
+
+    def reset_pairwise_rmsd(self):
+        """
+        Discard the coordinate arrays and the memoized rmsds and molecular
+        assignments, eg when the selections or the models change.
+        The rmsds of the model pairs i<j are kept in the condensed upper
+        triangle array pairwise_rmsd (see get_pair_index), and
+        pairwise_rmsd_mask tells which of them were computed
+        """
+        nmodels=len(self.stath0)
+        npairs=nmodels*(nmodels-1)//2
+        self.pairwise_rmsd=np.zeros(npairs,dtype=np.float32)
+        self.pairwise_rmsd_mask=np.zeros(npairs,dtype=bool)
+        self.pairwise_molecular_assignment={}
+        self.rmsd_coordinates=None
+        self.alignment_coordinates=None
+
+    def load_coordinates(self):
+        """
+        Read the rmsd and alignment coordinates of all models into arrays,
+        loading each frame only once. Also computes the centroid and the
+        radius of gyration of each model, used to bound the rmsd from below
+        """
+        if self.rmsd_coordinates is not None:
+            return
+        nmodels=len(self.stath0)
+        ps_alignment=self.sel0_alignment.get_selected_particles()
+        ps_rmsd=[]
+        # positions of the coordinates of each copy in the rmsd arrays
+        self.copy_slices={}
+        self.copy_indexes={}
+        for molname, sels in self.seldict0.items():
+            self.copy_slices[molname]=[]
+            self.copy_indexes[molname]=[]
+            for sel in sels:
+                ps=self.selparticles[id(sel)]
+                self.copy_slices[molname].append(slice(len(ps_rmsd),len(ps_rmsd)+len(ps)))
+                ps_rmsd+=ps
+                mol=IMP.pmi.tools.get_molecules([ps[0]])[0]
+                self.copy_indexes[molname].append(IMP.atom.Copy(mol).get_copy_index())
+
+        rmsd_coordinates=np.empty((nmodels,len(ps_rmsd),3),dtype=np.float32)
+        alignment_coordinates=np.empty((nmodels,len(ps_alignment),3),dtype=np.float32)
+        self.centroids=np.empty((nmodels,3))
+        self.radii_of_gyration=np.empty(nmodels)
+        for n in self.stath0.get_file_order():
+            self.stath0[n]
+            x=np.array([IMP.core.XYZ(p).get_coordinates() for p in ps_rmsd])
+            alignment_coordinates[n]=[IMP.core.XYZ(p).get_coordinates() for p in ps_alignment]
+            rmsd_coordinates[n]=x
+            self.centroids[n]=x.mean(axis=0)
+            self.radii_of_gyration[n]=math.sqrt(np.mean(np.sum((x-self.centroids[n])**2,axis=1)))
+        self.rmsd_coordinates=rmsd_coordinates
+        self.alignment_coordinates=alignment_coordinates
+
+    def get_rmsd_lower_bounds(self, n0, n1s):
+        """
+        Return lower bounds of the rmsd between model n0 and each of the models n1s.
+        They hold for any superposition and molecular assignment: after
+        superposition the rmsd is at least the difference of the radii of
+        gyration and, without superposition, it also includes the centroid distance
+        """
+        self.load_coordinates()
+        n1s=np.asarray(n1s,dtype=int)
+        lb2=(self.radii_of_gyration[n1s]-self.radii_of_gyration[n0])**2
+        if not self.alignment:
+            lb2+=np.sum((self.centroids[n1s]-self.centroids[n0])**2,axis=1)
+        return np.sqrt(lb2)
+
+    def get_candidates(self, n0, n1s, rmsd_cutoff, metric=IMP.atom.get_rmsd):
+        """
+        Return the models among n1s that can be closer than rmsd_cutoff to n0,
+        skipping the ones whose lower bound already exceeds the cutoff
+        """
+        n1s=list(n1s)
+        if metric is not IMP.atom.get_rmsd or len(n1s)==0:
+            return n1s
+        lbs=self.get_rmsd_lower_bounds(n0,n1s)
+        return [n1 for n1, lb in zip(n1s,lbs) if lb<rmsd_cutoff]
 
     def align(self):
         tr = IMP.atom.get_transformation_aligning_first_to_second(self.sel1_alignment, self.sel0_alignment)
@@ -2733,17 +2948,14 @@ class AnalysisReplicaExchange(object):
         initial filling of the clusters.
         '''
         n0 = idxs.pop()
-        d0 = self.stath0[n0]
         c = IMP.pmi.output.Cluster(len(self.clusters))
         self.clusters.append(c)
-        c.add_member(n0,d0)
+        c.add_member(n0,self.stath0.data[n0])
         clustered = set([n0])
-        for n1 in idxs:
-            d1 = self.stath1[n1]
-            if self.alignment: self.align()
-            rmsd, _ = self.rmsd(metric=metric)
+        for n1 in self.get_candidates(n0, sorted(idxs), rmsd_cutoff, metric):
+            rmsd, _ = self.get_rmsd(n0, n1, metric)
             if rmsd<rmsd_cutoff:
-                c.add_member(n1,d1)
+                c.add_member(n1,self.stath1.data[n1])
                 clustered.add(n1)
         idxs-=clustered
 
@@ -2757,9 +2969,9 @@ class AnalysisReplicaExchange(object):
         to_merge = []
         for c0, c1 in filter(lambda x: len(x[0].members)>1, itertools.combinations(self.clusters, 2)):
             n0, n1 = [c.members[0] for c in (c0,c1)]
-            d0 = self.stath0[n0]
-            d1 = self.stath1[n1]
-            rmsd, _ = self.rmsd()
+            if not self.get_candidates(n0, [n1], 2*rmsd_cutoff, metric):
+                continue
+            rmsd, _ = self.get_rmsd(n0, n1, metric)
             if rmsd<2*rmsd_cutoff and self.have_close_members(c0,c1,rmsd_cutoff,metric):
                 to_merge.append((c0,c1))
 
@@ -2774,12 +2986,11 @@ class AnalysisReplicaExchange(object):
         '''
         returns true if c0 and c1 have members that are closer than rmsd_cutoff
         '''
-        for n0, n1 in itertools.product(c0.members[1:], c1.members):
-            d0 = self.stath0[n0]
-            d1 = self.stath1[n1]
-            rmsd, _ = self.rmsd(metric=metric)
-            if rmsd<rmsd_cutoff:
-                return True
+        for n0 in c0.members[1:]:
+            for n1 in self.get_candidates(n0, c1.members, rmsd_cutoff, metric):
+                rmsd, _ = self.get_rmsd(n0, n1, metric)
+                if rmsd<rmsd_cutoff:
+                    return True
 
         return False
 
@@ -2792,68 +3003,151 @@ class AnalysisReplicaExchange(object):
         c1.members=[]
         c1.data={}
 
-    def rmsd_helper(self, sels0, sels1, metric):
+    def rmsd_helper(self, sels0, sels1, metric, coords0=None, coords1=None):
         '''
-        a function that returns the permutation best_sel of sels0 that minimizes metric
+        a function that returns the permutation best_sel of sels0 that minimizes metric.
+        The copy x copy matrix of squared metric values is computed once
+        (from the coordinate arrays coords0, coords1 if given) and the best
+        assignment is found by solving the linear assignment problem
         '''
-        best_rmsd2 = float('inf')
-        best_sel = None
-        for sels in itertools.permutations(sels0):
-            rmsd2=0.0
-            for sel0, sel1 in itertools.takewhile(lambda x: rmsd2<best_rmsd2, zip(sels, sels1)):
-                r=metric(sel0, sel1)
-                rmsd2+=r*r
-            if rmsd2 < best_rmsd2:
-                best_rmsd2 = rmsd2
-                best_sel = sels
-        return  best_sel, best_rmsd2
+        cost=[]
+        for j, sel1 in enumerate(sels1):
+            row=[]
+            for i, sel0 in enumerate(sels0):
+                if coords0 is not None and coords1 is not None:
+                    r2=np.mean(np.sum((coords0[i]-coords1[j])**2,axis=1))
+                else:
+                    r=metric(sel0, sel1)
+                    r2=r*r
+                row.append(float(r2))
+            cost.append(row)
+        assignment=IMP.pmi.tools.get_best_assignment(cost)
+        best_sel=tuple(sels0[i] for i in assignment)
+        best_rmsd2=sum(cost[j][i] for j, i in enumerate(assignment))
+        return best_sel, best_rmsd2
 
     def compute_all_pairwise_rmsd(self):
-        for d0 in self.stath0:
-            for d1 in self.stath1:
-                rmsd, _ = self.rmsd()
+        for n0, n1 in itertools.combinations(range(len(self.stath0)), 2):
+            rmsd, _ = self.get_rmsd(n0, n1)
+
+    def get_pair_index(self, n0, n1):
+        '''
+        Return the index of the pair of different models n0 and n1 in the
+        condensed upper triangle array pairwise_rmsd
+        '''
+        if n0>n1:
+            n0, n1 = n1, n0
+        nmodels=len(self.stath0)
+        return nmodels*n0-n0*(n0+1)//2+n1-n0-1
+
+    def get_pairwise_rmsd_matrix(self):
+        '''
+        Return the memoized rmsds as a symmetric models x models numpy array,
+        NaN where the rmsd was not computed and 0 on the diagonal
+        '''
+        nmodels=len(self.stath0)
+        distance_matrix=np.zeros((nmodels,nmodels))
+        upper=np.triu_indices(nmodels,1)
+        distance_matrix[upper]=np.where(self.pairwise_rmsd_mask,
+                                        self.pairwise_rmsd,np.nan)
+        distance_matrix.T[upper]=distance_matrix[upper]
+        return distance_matrix
 
     def rmsd(self,metric=IMP.atom.get_rmsd):
         '''
-        Computes the RMSD. Resolves ambiguous pairs assignments
+        Computes the RMSD between the current models of stath0 and stath1.
+        Resolves ambiguous pairs assignments
+        '''
+        return self.get_rmsd(self.stath0.current_index,self.stath1.current_index,metric)
+
+    def get_rmsd(self, n0, n1, metric=IMP.atom.get_rmsd):
+        '''
+        Computes the RMSD between models n0 and n1. Resolves ambiguous pairs assignments.
+        For the default metric the coordinate arrays are used, so that no frame is loaded,
+        otherwise the frames are loaded and stath1 is aligned onto stath0
         '''
         # here we memoize the rmsd and molecular assignment so that it's not done multiple times
-        n0=self.stath0.current_index
-        n1=self.stath1.current_index
-        if ((n0,n1) in self.pairwise_rmsd) and ((n0,n1) in self.pairwise_molecular_assignment):
-            return self.pairwise_rmsd[(n0,n1)], self.pairwise_molecular_assignment[(n0,n1)]
+        # (a model is compared with itself only when asked, so that is not memoized)
+        if n0!=n1:
+            k=self.get_pair_index(n0,n1)
+            if self.pairwise_rmsd_mask[k]:
+                return float(self.pairwise_rmsd[k]), self.pairwise_molecular_assignment[k]
+
+        #if it's not yet memoized
+        if metric is IMP.atom.get_rmsd:
+            total_rmsd, molecular_assignment = self.get_rmsd_from_coordinates(n0, n1)
+        else:
+            d0=self.stath0[n0]
+            d1=self.stath1[n1]
+            total_rmsd, molecular_assignment = self.get_rmsd_from_frames(metric)
+
+        if n0==n1:
+            return total_rmsd, molecular_assignment
+        self.pairwise_rmsd[k]=total_rmsd
+        self.pairwise_rmsd_mask[k]=True
+        self.pairwise_molecular_assignment[k]=molecular_assignment
+        return float(self.pairwise_rmsd[k]), molecular_assignment
 
+    def get_rmsd_from_coordinates(self, n0, n1):
+        '''
+        Computes the RMSD and molecular assignment between models n0 and n1
+        from the coordinate arrays
+        '''
+        self.load_coordinates()
+        x0=self.rmsd_coordinates[n0].astype(float)
+        x1=self.rmsd_coordinates[n1].astype(float)
+        if self.alignment:
+            rotation, translation = _get_superposition(self.alignment_coordinates[n1].astype(float),
+                                                       self.alignment_coordinates[n0].astype(float))
+            x1=x1.dot(rotation.T)+translation
+        total_rmsd=0.0
+        total_N=0
+        molecular_assignment={}
+        for molname, slices in self.copy_slices.items():
+            copies=list(range(len(slices)))
+            best_order, best_rmsd2 = self.rmsd_helper(copies, copies, None,
+                                                      [x0[s] for s in slices],
+                                                      [x1[s] for s in slices])
+            Ncoords = slices[0].stop-slices[0].start
+            Ncopies = len(slices)
+            total_rmsd += Ncoords*best_rmsd2
+            total_N += Ncoords*Ncopies
+
+            copy_indexes=self.copy_indexes[molname]
+            for i, j in zip(best_order, copies):
+                molecular_assignment[(molname,copy_indexes[i])]=(molname,copy_indexes[j])
+
+        return math.sqrt(total_rmsd/total_N), molecular_assignment
+
+    def get_rmsd_from_frames(self, metric):
+        '''
+        Computes the RMSD and molecular assignment between the current frames
+        of stath0 and stath1 with the given metric
+        '''
         if self.alignment:
             self.align()
-        #if it's not yet memoized
         total_rmsd=0.0
         total_N=0
         # this is a dictionary which keys are the molecule names, and values are the list of IMP.atom.Selection for all molecules that share the molecule name
-        seldict_best_order={}
         molecular_assignment={}
         for molname, sels0 in self.seldict0.items():
             sels_best_order, best_rmsd2 = self.rmsd_helper(sels0, self.seldict1[molname], metric)
 
-            Ncoords = len(sels_best_order[0].get_selected_particles())
+            Ncoords = len(self.selparticles[id(sels_best_order[0])])
             Ncopies = len(sels_best_order)
             total_rmsd += Ncoords*best_rmsd2
             total_N += Ncoords*Ncopies
 
             for sel0, sel1 in zip(sels_best_order, self.seldict1[molname]):
-                p0 = sel0.get_selected_particles()[0]
-                p1 = sel1.get_selected_particles()[0]
-                m0,m1 = IMP.pmi.tools.get_molecules([p0,p1])
+                p0 = self.selparticles[id(sel0)][0]
+                p1 = self.selparticles[id(sel1)][0]
+                m0 = IMP.pmi.tools.get_molecules([p0])[0]
+                m1 = IMP.pmi.tools.get_molecules([p1])[0]
                 c0 = IMP.atom.Copy(m0).get_copy_index()
                 c1 = IMP.atom.Copy(m1).get_copy_index()
                 molecular_assignment[(molname,c0)]=(molname,c1)
 
-        total_rmsd = math.sqrt(total_rmsd/total_N)
-
-        self.pairwise_rmsd[(n0,n1)]=total_rmsd
-        self.pairwise_molecular_assignment[(n0,n1)]=molecular_assignment
-        self.pairwise_rmsd[(n1,n0)]=total_rmsd
-        self.pairwise_molecular_assignment[(n1,n0)]=molecular_assignment
-        return total_rmsd, molecular_assignment
+        return math.sqrt(total_rmsd/total_N), molecular_assignment
 
     def set_reference(self,reference,cluster):
         """
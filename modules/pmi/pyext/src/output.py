@@ -4,16 +4,15 @@
 
 from __future__ import print_function, division
 import IMP
+import IMP.algebra
 import IMP.atom
 import IMP.core
 import IMP.pmi
 import IMP.pmi.tools
-import IMP.pmi.io
+import IMP.pmi._lazy
 import os
 import sys
 import ast
-import RMF
-import numpy as np
 import operator
 import string
 try:
@@ -21,6 +20,12 @@ try:
 except ImportError:
     import pickle
 
+# Imported on first use, to reduce the time needed to import this module
+IMP.pmi._lazy.lazy_import("IMP.pmi.io")
+IMP.pmi._lazy.lazy_import("IMP.rmf")
+RMF = IMP.pmi._lazy.lazy_import("RMF")
+np = IMP.pmi._lazy.lazy_import("numpy")
+
 class _ChainIDs(object):
     """Map indices to multi-character chain IDs.
        We label the first 26 chains A-Z, then we move to two-letter
@@ -62,6 +67,64 @@ def _flatten(seq):
             l.append(elt)
     return l
 
+class OutputColumns(object):
+    """Typed output values of an object, formatted only when written.
+
+       Objects passed to Output.init_stat2() may provide a
+       get_output_columns() method returning one of these, rather than
+       building a dictionary of strings in get_output(). Per-restraint
+       values are stored as a list of labels plus a matching array of
+       numbers, which can be filled in a single pass over the restraints.
+       Conversion to strings is left to Output.write_stat2().
+    """
+    def __init__(self):
+        self.scalars = {}
+        self.arrays = []
+        # get_output() values are written as-is; typed values are formatted
+        self._format_scalars = True
+
+    def add_scalar(self, key, value):
+        """Add a single entry, keyed by its full stat file key."""
+        self.scalars[key] = value
+
+    def add_array(self, prefix, labels, values, verbose=False):
+        """Add one entry per label, keyed by prefix + label.
+           @param prefix Text prepended to every label to make the key
+           @param labels The per-entry key suffixes
+           @param values A sequence (usually a NumPy array) of the same
+                  length as labels
+           @param verbose If True, these entries are only written every
+                  `verbose_every` frames (see Output.init_stat2())
+        """
+        if len(labels) != len(values):
+            raise ValueError("OutputColumns: %d labels but %d values for %s"
+                             % (len(labels), len(values), prefix))
+        self.arrays.append((prefix, labels, values, verbose))
+
+    def get_output(self, verbose=True):
+        """Get a get_output()-style dictionary of strings.
+           @param verbose If False, skip entries added as verbose
+        """
+        output = dict((k, str(v)) for k, v in self.scalars.items())
+        for prefix, labels, values, is_verbose in self.arrays:
+            if is_verbose and not verbose:
+                continue
+            for label, value in zip(labels, values):
+                output[prefix + label] = str(float(value))
+        return output
+
+
+def _get_output_columns(obj):
+    """Get an OutputColumns object for any object with output"""
+    if hasattr(obj, "get_output_columns"):
+        return obj.get_output_columns()
+    else:
+        cols = OutputColumns()
+        cols.scalars = obj.get_output()
+        cols._format_scalars = False
+        return cols
+
+
 class Output(object):
     """Class for easy writing of PDBs, RMFs, and stat files"""
     def __init__(self, ascii=True,atomistic=False):
@@ -69,6 +132,8 @@ class Output(object):
         self.dictionary_rmfs = {}
         self.dictionary_stats = {}
         self.dictionary_stats2 = {}
+        self._stat2_verbose_every = {}
+        self._stat2_nframes = {}
         self.best_score_list = None
         self.nbestscoring = None
         self.suffixes = []
@@ -675,11 +740,15 @@ class Output(object):
         name,
         listofobjects,
         extralabels=None,
-            listofsummedobjects=None):
+            listofsummedobjects=None,
+            verbose_every=1):
         # this is a new stat file that should be less
         # space greedy!
         # listofsummedobjects must be in the form [([obj1,obj2,obj3,obj4...],label)]
         # extralabels
+        # verbose_every: entries that objects flag as verbose in
+        # get_output_columns() (e.g. per-cross-link distances) are only
+        # written every verbose_every frames; they read as "None" otherwise
 
         if listofsummedobjects is None:
             listofsummedobjects = []
@@ -729,25 +798,42 @@ class Output(object):
             stat2_inverse,
             listofsummedobjects,
             extralabels)
+        self._stat2_verbose_every[name] = verbose_every
+        self._stat2_nframes[name] = 0
 
     def write_stat2(self, name, appendmode=True):
         output = {}
         (listofobjects, stat2_inverse, listofsummedobjects,
          extralabels) = self.dictionary_stats2[name]
+        nframe = self._stat2_nframes.get(name, 0)
+        self._stat2_nframes[name] = nframe + 1
+        verbose = nframe % self._stat2_verbose_every.get(name, 1) == 0
+
+        # get each object's output only once, even if it is also summed
+        columns = {}
+        def get_columns(obj):
+            if id(obj) not in columns:
+                columns[id(obj)] = _get_output_columns(obj)
+            return columns[id(obj)]
 
         # writing objects
         for obj in listofobjects:
-            od = obj.get_output()
-            dfiltered = dict((k, v) for k, v in od.items() if k[0] != "_")
-            for k in dfiltered:
-                output.update({stat2_inverse[k]: od[k]})
+            cols = get_columns(obj)
+            for k, v in cols.scalars.items():
+                if k[0] != "_":
+                    output[stat2_inverse[k]] = \
+                               str(v) if cols._format_scalars else v
+            for prefix, labels, values, is_verbose in cols.arrays:
+                if is_verbose and not verbose:
+                    continue
+                for label, value in zip(labels, values):
+                    output[stat2_inverse[prefix + label]] = str(float(value))
 
         # writing summedobjects
         for l in listofsummedobjects:
             partial_score = 0.0
             for t in l[0]:
-                d = t.get_output()
-                partial_score += float(d["_TotalScore"])
+                partial_score += float(get_columns(t).scalars["_TotalScore"])
             output.update({stat2_inverse[l[1]]: str(partial_score)})
 
         # writing extralabels
@@ -946,7 +1032,10 @@ class ProcessOutput(object):
                         if self.isfiltered(datavalue, relationship, value): continue
 
                     statistics.passed_filtertuple += 1
-                    [outdict[field].append(d[self.invstat2_dict[field]]) for field in fields]
+                    # verbose entries may be missing from decimated frames
+                    [outdict[field].append(d.get(self.invstat2_dict[field],
+                                                 "None"))
+                     for field in fields]
 
             f.close()
 
@@ -979,10 +1068,12 @@ class RMFHierarchyHandler(IMP.atom.Hierarchy):
      - slice create an iterator
      - can relink to another RMF file
      """
-    def __init__(self,model,rmf_file_name):
+    def __init__(self,model,rmf_file_name,max_open_rmf_files=4):
         """
         @param model: the IMP.Model()
         @param rmf_file_name: str, path of the rmf file
+        @param max_open_rmf_files: int, number of the most recently used rmf
+               files that are kept open and linked to the hierarchy
         """
         self.model=model
         try:
@@ -994,15 +1085,26 @@ class RMFHierarchyHandler(IMP.atom.Hierarchy):
         self.root_hier_ref = hs[0]
         IMP.atom.Hierarchy.__init__(self, self.root_hier_ref)
         self.model.update()
+        self.max_open_rmf_files=max_open_rmf_files
+        self.rmf_handles=IMP.pmi.tools.OrderedDict()
+        self.rmf_handles[rmf_file_name]=self.rh_ref
 
 
-    def link_to_rmf(self,rmf_file_name):
+    def link_to_rmf(self,rmf_file_name,frame=0):
         """
-        Link to another RMF file
+        Link to another RMF file and load one of its frames.
+        Recently used files stay open and linked, so going back to them
+        does not reopen nor relink them.
         """
-        self.rh_ref = RMF.open_rmf_file_read_only(rmf_file_name)
-        IMP.rmf.link_hierarchies(self.rh_ref, [self])
-        RMFHierarchyHandler.set_frame(self,0)
+        rh=self.rmf_handles.pop(rmf_file_name,None)
+        if rh is None:
+            rh=RMF.open_rmf_file_read_only(rmf_file_name)
+            IMP.rmf.link_hierarchies(rh, [self])
+        self.rmf_handles[rmf_file_name]=rh
+        while len(self.rmf_handles)>max(1,self.max_open_rmf_files):
+            self.rmf_handles.popitem(last=False)
+        self.rh_ref=rh
+        RMFHierarchyHandler.set_frame(self,frame)
 
     def set_frame(self,index):
         try:
@@ -1036,9 +1138,31 @@ class RMFHierarchyHandler(IMP.atom.Hierarchy):
 
 
 
+class _CoordinateCache(object):
+    """Coordinates of the frames already read from RMF files, keyed by
+       (rmf file name, frame index). It is shared by a StatHierarchyHandler
+       and its copies, which all have the same hierarchy structure."""
+    def __init__(self,max_frames=None):
+        self.max_frames=max_frames
+        self.frames=IMP.pmi.tools.OrderedDict()
+
+    def get(self,key):
+        coords=self.frames.pop(key,None)
+        if coords is not None:
+            self.frames[key]=coords
+        return coords
+
+    def add(self,key,coords):
+        self.frames[key]=coords
+        if self.max_frames is not None:
+            while len(self.frames)>self.max_frames:
+                self.frames.popitem(last=False)
+
+
 class StatHierarchyHandler(RMFHierarchyHandler):
     """ class to link stat files to several rmf files """
-    def __init__(self,model=None,stat_file=None,number_best_scoring_models=None,StatHierarchyHandler=None):
+    def __init__(self,model=None,stat_file=None,number_best_scoring_models=None,StatHierarchyHandler=None,
+                 coordinate_cache_size=0):
         """
 
         @param model: IMP.Model()
@@ -1046,6 +1170,10 @@ class StatHierarchyHandler(RMFHierarchyHandler):
             stat file name as key and a list of frames as values
         @param number_best_scoring_models:
         @param StatHierarchyHandler: copy constructor input object
+        @param coordinate_cache_size: number of frames whose coordinates are kept
+            in memory, so that going back to them does not read the rmf files
+            (0 disables the cache, None keeps all the frames). The cache is shared
+            with the copies of this object.
         """
 
         if not StatHierarchyHandler is None:
@@ -1056,10 +1184,14 @@ class StatHierarchyHandler(RMFHierarchyHandler):
             self.number_best_scoring_models=StatHierarchyHandler.number_best_scoring_models
             self.is_setup=True
             self.current_rmf=StatHierarchyHandler.current_rmf
-            self.current_frame=StatHierarchyHandler.current_frame
             self.current_index=StatHierarchyHandler.current_index
             self.score_threshold=StatHierarchyHandler.score_threshold
+            self.coordinate_cache=StatHierarchyHandler.coordinate_cache
+            self.coordinate_particles=None
             RMFHierarchyHandler.__init__(self, self.model,self.current_rmf)
+            # the new hierarchy is loaded with the first frame of the file
+            self.current_frame=0
+            self.loaded_frame=(self.current_rmf,0)
 
         else:
             #standard constructor
@@ -1071,6 +1203,12 @@ class StatHierarchyHandler(RMFHierarchyHandler):
             self.current_frame=None
             self.current_index=None
             self.score_threshold=None
+            self.loaded_frame=None
+            if coordinate_cache_size==0:
+                self.coordinate_cache=None
+            else:
+                self.coordinate_cache=_CoordinateCache(coordinate_cache_size)
+            self.coordinate_particles=None
 
             if type(stat_file) is str:
                 self.add_stat_file(stat_file)
@@ -1131,6 +1269,8 @@ class StatHierarchyHandler(RMFHierarchyHandler):
             RMFHierarchyHandler.__init__(self, self.model,self.get_rmf_names()[0])
             self.is_setup=True
             self.current_rmf=self.get_rmf_names()[0]
+            self.current_frame=0
+            self.loaded_frame=(self.current_rmf,0)
         self.set_frame(0)
 
     def save_data(self,filename='data.pkl'):
@@ -1171,17 +1311,82 @@ class StatHierarchyHandler(RMFHierarchyHandler):
         nm=self.data[index].rmf_name
         fidx=self.data[index].rmf_index
 
-        if nm != self.current_rmf:
-            self.link_to_rmf(nm)
-            self.current_rmf=nm
-            self.current_frame=None
-
-        if fidx!=self.current_frame:
-            RMFHierarchyHandler.set_frame(self, fidx)
-            self.current_frame=fidx
+        if (nm,fidx) != self.loaded_frame:
+            coords=None
+            if self.coordinate_cache is not None:
+                coords=self.coordinate_cache.get((nm,fidx))
+            if coords is not None:
+                self.set_coordinates(coords)
+            else:
+                if nm != self.current_rmf:
+                    self.link_to_rmf(nm,fidx)
+                    self.current_rmf=nm
+                else:
+                    RMFHierarchyHandler.set_frame(self, fidx)
+                self.current_frame=fidx
+                if self.coordinate_cache is not None:
+                    self.coordinate_cache.add((nm,fidx),self.get_coordinates())
+            self.loaded_frame=(nm,fidx)
 
         self.current_index = index
 
+    def get_file_order(self,indexes=None):
+        """
+        Return the indexes (by default all of them) sorted by rmf file and
+        frame, which is the cheapest order to load them in.
+        Use it as `for n in stath.get_file_order(): d=stath[n]`, n being
+        the index in the original order.
+        """
+        if indexes is None:
+            indexes=range(len(self))
+        return sorted(indexes,key=lambda n: (self.data[n].rmf_name,self.data[n].rmf_index,n))
+
+    def _get_coordinate_particles(self):
+        if self.coordinate_particles is None:
+            rbs, beads = IMP.pmi.tools.get_rbs_and_beads([self])
+            beads=[p for p in beads if IMP.core.XYZ.get_is_setup(p)]
+            nonrigid=[IMP.core.NonRigidMember.get_is_setup(p) for p in beads]
+            self.coordinate_particles=(rbs,beads,nonrigid)
+        return self.coordinate_particles
+
+    def get_coordinates(self):
+        """
+        Return the coordinates of the current frame as numpy arrays:
+        the reference frames of the rigid bodies (translation and quaternion),
+        and the coordinates of the beads (internal ones for non rigid members)
+        """
+        rbs, beads, nonrigid = self._get_coordinate_particles()
+        rb_frames=np.empty((len(rbs),7))
+        for n,rb in enumerate(rbs):
+            tr=rb.get_reference_frame().get_transformation_to()
+            rb_frames[n,:3]=tr.get_translation()
+            rb_frames[n,3:]=tr.get_rotation().get_quaternion()
+        bead_coords=np.empty((len(beads),3))
+        for n,(p,isnonrigid) in enumerate(zip(beads,nonrigid)):
+            if isnonrigid:
+                bead_coords[n]=IMP.core.NonRigidMember(p).get_internal_coordinates()
+            else:
+                bead_coords[n]=IMP.core.XYZ(p).get_coordinates()
+        return rb_frames, bead_coords
+
+    def set_coordinates(self,coords):
+        """
+        Set the coordinates from the output of get_coordinates()
+        """
+        rbs, beads, nonrigid = self._get_coordinate_particles()
+        rb_frames, bead_coords = coords
+        for p,isnonrigid,xyz in zip(beads,nonrigid,bead_coords):
+            v=IMP.algebra.Vector3D(*xyz)
+            if isnonrigid:
+                IMP.core.NonRigidMember(p).set_internal_coordinates(v)
+            else:
+                IMP.core.XYZ(p).set_coordinates(v)
+        for rb,f in zip(rbs,rb_frames):
+            rot=IMP.algebra.Rotation3D(IMP.algebra.Vector4D(*f[3:]))
+            tr=IMP.algebra.Transformation3D(rot,IMP.algebra.Vector3D(*f[:3]))
+            rb.set_reference_frame(IMP.algebra.ReferenceFrame3D(tr))
+        self.model.update()
+
     def __getitem__(self,int_slice_adaptor):
         if type(int_slice_adaptor) is int:
             self.set_frame(int_slice_adaptor)
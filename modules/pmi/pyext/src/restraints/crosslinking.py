@@ -14,7 +14,7 @@ import IMP.pmi.metadata
 import IMP.pmi.output
 import IMP.pmi.io.crosslink
 import IMP.pmi.restraints
-from math import log
+from math import log, exp
 from collections import defaultdict
 import itertools
 import operator
@@ -292,6 +292,7 @@ class CrossLinkingMassSpectrometryRestraint(IMP.pmi.restraints.RestraintBase):
         if len(self.xl_list) == 0:
             raise SystemError("CrossLinkingMassSpectrometryRestraint: no crosslink was constructed")
         self.xl_restraints = restraints
+        self._xl_output_cache = None
         lw = IMP.isd.LogWrapper(restraints,1.0)
         self.rs.add_restraint(lw)
 
@@ -393,33 +394,42 @@ class CrossLinkingMassSpectrometryRestraint(IMP.pmi.restraints.RestraintBase):
 
     def get_output(self):
         """ Get the output of the restraint to be used by the IMP.pmi.output object"""
-        output = super(CrossLinkingMassSpectrometryRestraint, self).get_output()
-
-        for xl in self.xl_list:
-
-            xl_label=xl["ShortLabel"]
-            ln = xl["Restraint"]
-            p0 = xl["Particle1"]
-            p1 = xl["Particle2"]
-            output["CrossLinkingMassSpectrometryRestraint_Score_" +
-                   xl_label] = str(-log(ln.unprotected_evaluate(None)))
-
-            d0 = IMP.core.XYZ(p0)
-            d1 = IMP.core.XYZ(p1)
-            output["CrossLinkingMassSpectrometryRestraint_Distance_" +
-                   xl_label] = str(IMP.core.get_distance(d0, d1))
-
+        return self.get_output_columns().get_output()
+
+    def get_output_columns(self):
+        """ Get the output of the restraint as an IMP.pmi.output.OutputColumns
+        object. The per-cross-link scores are the ones computed when the
+        restraint set was last evaluated (for the total score), so the
+        individual cross-link restraints are not evaluated again."""
+        output = IMP.pmi.output.OutputColumns()
+        output.scalars = super(CrossLinkingMassSpectrometryRestraint,
+                               self).get_output()
+
+        if self._xl_output_cache is None:
+            self._xl_output_cache = (
+                [xl["ShortLabel"] for xl in self.xl_list],
+                [xl["Restraint"] for xl in self.xl_list],
+                [(IMP.core.XYZ(xl["Particle1"]), IMP.core.XYZ(xl["Particle2"]))
+                 for xl in self.xl_list])
+        labels, restraints, xyzs = self._xl_output_cache
+
+        output.add_array("CrossLinkingMassSpectrometryRestraint_Score_",
+                         labels, [r.get_last_score() for r in restraints],
+                         verbose=True)
+        output.add_array("CrossLinkingMassSpectrometryRestraint_Distance_",
+                         labels, [IMP.core.get_distance(d0, d1)
+                                  for d0, d1 in xyzs],
+                         verbose=True)
 
         for psiname in self.psi_dictionary:
-            output["CrossLinkingMassSpectrometryRestraint_Psi_" +
-                    str(psiname) + self._label_suffix] = str(
-                        self.psi_dictionary[psiname][0].get_scale())
+            output.add_scalar("CrossLinkingMassSpectrometryRestraint_Psi_" +
+                    str(psiname) + self._label_suffix,
+                    self.psi_dictionary[psiname][0].get_scale())
 
         for sigmaname in self.sigma_dictionary:
-            output["CrossLinkingMassSpectrometryRestraint_Sigma_" +
-                   str(sigmaname) + self._label_suffix] = str(
-                    self.sigma_dictionary[sigmaname][0].get_scale())
-
+            output.add_scalar("CrossLinkingMassSpectrometryRestraint_Sigma_" +
+                   str(sigmaname) + self._label_suffix,
+                   self.sigma_dictionary[sigmaname][0].get_scale())
 
         return output
 
@@ -540,6 +550,7 @@ class AtomicCrossLinkMSRestraint(IMP.pmi.restraints.RestraintBase):
         self.particles=defaultdict(set)
         self.one_psi = one_psi
         self.bonded_pairs = []
+        self._xl_output_cache = None
         if self.one_psi:
             print('creating a single psi for all XLs')
         else:
@@ -987,7 +998,15 @@ class AtomicCrossLinkMSRestraint(IMP.pmi.restraints.RestraintBase):
 
 
     def get_output(self):
-        output = super(AtomicCrossLinkMSRestraint, self).get_output()
+        return self.get_output_columns().get_output()
+
+    def get_output_columns(self):
+        """Get the output of the restraint as an IMP.pmi.output.OutputColumns
+        object. This gives the same values as get_best_stats(), but reads
+        the probabilities from the last evaluation of the restraint set and
+        only computes the contribution distances."""
+        output = IMP.pmi.output.OutputColumns()
+        output.scalars = super(AtomicCrossLinkMSRestraint, self).get_output()
 
         ### HACK to make it easier to see the few sigmas
         #output["AtomicXLRestraint_sigma"] = self.sigma.get_scale()
@@ -995,17 +1014,38 @@ class AtomicCrossLinkMSRestraint(IMP.pmi.restraints.RestraintBase):
         #    output["AtomicXLRestraint_psi"] = self.psi.get_scale()
         ######
 
+        if self._xl_output_cache is None:
+            xls = [IMP.isd.AtomicCrossLinkMSRestraint.get_from(
+                       self.rs.get_restraint(nxl))
+                   for nxl in range(self.rs.get_number_of_restraints())]
+            contributions = []
+            for xl in xls:
+                pps = [xl.get_contribution(contr)
+                       for contr in range(xl.get_number_of_contributions())]
+                contributions.append([(IMP.core.XYZ(self.m, pp[0]),
+                                       IMP.core.XYZ(self.m, pp[1]))
+                                      for pp in pps])
+            self._xl_output_cache = (xls, contributions)
+        xls, contributions = self._xl_output_cache
+
+        labels = ["%i_" % nxl for nxl in range(len(xls))]
+        probs = [exp(-xl.get_last_score()) for xl in xls]
+        low_dists = [min([1e6] + [IMP.core.get_distance(d0, d1)
+                                  for d0, d1 in contrs])
+                     for contrs in contributions]
+        output.add_array("AtomicXLRestraint_",
+                         [l + "Prob" for l in labels], probs, verbose=True)
+        output.add_array("AtomicXLRestraint_",
+                         [l + "BestDist" for l in labels], low_dists,
+                         verbose=True)
+        if not self.one_psi:
+            output.add_array("AtomicXLRestraint_",
+                             [l + "psi" for l in labels],
+                             [IMP.isd.Scale(self.m, xl.get_psi()).get_scale()
+                              for xl in xls], verbose=True)
         # count distances above length
-        bad_count=0
-        stats = self.get_best_stats()
-        for nxl,s in enumerate(stats):
-            if s['low_dist']>20.0:
-                bad_count+=1
-            output["AtomicXLRestraint_%i_%s"%(nxl,"Prob")]=str(s['prob'])
-            output["AtomicXLRestraint_%i_%s"%(nxl,"BestDist")]=str(s['low_dist'])
-            if not self.one_psi:
-                output["AtomicXLRestraint_%i_%s"%(nxl,"psi")]=str(s['psi'])
-        output["AtomicXLRestraint_NumViol"] = str(bad_count)
+        output.add_scalar("AtomicXLRestraint_NumViol",
+                          len([d for d in low_dists if d > 20.0]))
         return output
 
 
@@ -21,6 +21,10 @@ class GaussianEMRestraint(object):
     """Fit Gaussian-decorated particles to an EM map
     (also represented with a set of Gaussians)
     \note This class wraps an isd::GaussianEMRestraint
+    \note The target GMM is read with IMP.isd.gmm_tools, so it is cached
+           (with other derived EM inputs) when a cache directory is set
+           with IMP.isd.gmm_tools.set_cache_directory() or the
+           IMP_GMM_CACHE_DIR environment variable.
     """
     def __init__(self, densities,
                  target_fn='',
@@ -39,6 +43,7 @@ class GaussianEMRestraint(object):
                  weight=1.0,
                  target_is_rigid_body=False,
                  local=False,
+                 slope_cutoff=0.0,
                  representation=None):
         """Constructor.
         @param densities The Gaussian-decorated particles to be restrained
@@ -79,6 +84,9 @@ class GaussianEMRestraint(object):
                against another one). Default is False.
         @param local Only consider density particles that are within the
                 specified model-density cutoff (experimental)
+        @param slope_cutoff If positive, approximate the slope term for
+               density particles further than this from each model particle
+               (see IMP.isd.GaussianEMRestraint.set_slope_cutoff())
         """
 
         # some parameters
@@ -174,6 +182,7 @@ class GaussianEMRestraint(object):
             cutoff_dist_model_data,
             slope,
             update_model, backbone_slope, local)
+        self.gaussianEM_restraint.set_slope_cutoff(slope_cutoff)
         if target_fn != '':
             self.gaussianEM_restraint.set_density_filename(target_fn)
 
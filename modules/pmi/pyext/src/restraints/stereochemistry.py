@@ -177,7 +177,8 @@ class ExcludedVolumeSphere(object):
                  included_objects=None,
                  other_objects=None,
                  resolution=1000,
-                 kappa=1.0):
+                 kappa=1.0,
+                 auto_tune=False):
         """Constructor.
         @param representation DEPRECATED - just pass objects
         @param included_objects Can be one of the following inputs:
@@ -189,6 +190,12 @@ class ExcludedVolumeSphere(object):
                If a number is chosen, for each particle, the closest
                resolution will be used (see IMP.atom.Selection).
         @param kappa Restraint strength
+        @param auto_tune If True, let the close pair container adapt its
+               slack and close pairs finder to the measured update and
+               evaluation times (see
+               IMP.container.ClosePairContainer.set_auto_tuning()).
+               This is faster for most systems, but runs are no longer
+               exactly reproducible. Ignored for bipartite restraints.
         """
 
         self.weight = 1.0
@@ -235,6 +242,7 @@ class ExcludedVolumeSphere(object):
         # setup score
         self.rs = IMP.RestraintSet(self.mdl, 'excluded_volume')
         ssps = IMP.core.SoftSpherePairScore(self.kappa)
+        self._included_ps = included_ps
         lsa = IMP.container.ListSingletonContainer(self.mdl)
         lsa.add(IMP.get_indexes(included_ps))
 
@@ -242,6 +250,7 @@ class ExcludedVolumeSphere(object):
         if not bipartite:
             rbcpf = IMP.core.RigidClosePairsFinder()
             self.cpc = IMP.container.ClosePairContainer(lsa, 0.0, rbcpf, 10.0)
+            self.cpc.set_auto_tuning(auto_tune)
             evr = IMP.container.PairsRestraint(ssps, self.cpc)
         else:
             other_lsa = IMP.container.ListSingletonContainer(self.mdl)
@@ -288,6 +297,42 @@ class ExcludedVolumeSphere(object):
     def evaluate(self):
         return self.weight * self.rs.unprotected_evaluate(None)
 
+    def get_close_pair_score(self):
+        """Get this restraint as a term of an
+           IMP.core.IncrementalScoringFunction.
+           @return the pair score (including the restraint weight), the
+                   distance cutoff, the particles and the pair filters,
+                   as passed to
+                   IMP.core.IncrementalScoringFunction.add_close_pair_score()
+                   Pairs in the same rigid body are filtered out, as they
+                   are by the close pair container.
+           \note Not available for bipartite restraints.
+        """
+        if not isinstance(self.cpc, IMP.container.ClosePairContainer):
+            raise ValueError("Bipartite excluded volume restraints cannot "
+                             "be scored incrementally")
+        ssps = IMP.core.SoftSpherePairScore(self.kappa * self.weight)
+        filters = list(self.cpc.get_pair_filters())
+        filters.append(IMP.core.SameRigidBodyPairFilter())
+        return (ssps, 0.0, self._included_ps, filters)
+
+    def get_close_pairs_statistics(self):
+        """Return a dict of statistics about the close pair container,
+           suitable for logging: the number of updates and rebuilds, the mean
+           number of pairs, the time (in seconds) spent updating the container
+           and evaluating the model, the current slack and the name of the
+           close pairs finder used. Empty for bipartite restraints."""
+        if not isinstance(self.cpc, IMP.container.ClosePairContainer):
+            return {}
+        return {"Updates": self.cpc.get_number_of_update_calls(),
+                "FullRebuilds": self.cpc.get_number_of_full_rebuilds(),
+                "PartialRebuilds": self.cpc.get_number_of_partial_rebuilds(),
+                "MeanPairs": self.cpc.get_mean_number_of_pairs(),
+                "UpdateTime": self.cpc.get_update_time(),
+                "EvaluationTime": self.cpc.get_evaluation_time(),
+                "Slack": self.cpc.get_slack(),
+                "Finder": self.cpc.get_close_pairs_finder().get_name()}
+
 class HelixRestraint(object):
     """Enforce ideal Helix dihedrals and bonds for a selection at resolution 0"""
     def __init__(self,
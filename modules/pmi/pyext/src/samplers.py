@@ -5,6 +5,8 @@
 from __future__ import print_function
 import IMP
 import IMP.core
+import IMP.container
+import time
 from IMP.pmi.tools import get_restraint_set
 
 class _SerialReplicaExchange(object):
@@ -33,6 +35,26 @@ class _SerialReplicaExchange(object):
         self.was_used = was_used
 
 
+def _get_uses_close_pairs(r):
+    """Return True if the restraint, or any restraint in it if it is a
+       RestraintSet, scores the contents of a close pair container."""
+    try:
+        rs = IMP.RestraintSet.get_from(r)
+    except ValueError:
+        rs = None
+    if rs is not None:
+        return any(_get_uses_close_pairs(c) for c in rs.get_restraints())
+    for i in r.get_inputs():
+        for cls in (IMP.container.ClosePairContainer,
+                    IMP.container.CloseBipartitePairContainer):
+            try:
+                cls.get_from(i)
+                return True
+            except ValueError:
+                pass
+    return False
+
+
 class MonteCarlo(object):
     """Sample using Monte Carlo"""
 
@@ -43,13 +65,18 @@ class MonteCarlo(object):
     except ImportError:
         isd_available = False
 
-    def __init__(self, m, objects=None, temp=1.0, filterbyname=None):
+    def __init__(self, m, objects=None, temp=1.0, filterbyname=None,
+                 incremental=False, close_pair_objects=None):
         """Setup Monte Carlo sampling
         @param m             The IMP Model
         @param objects       What to sample. Use flat list of particles or
                (deprecated) 'MC Sample Objects' from PMI1
         @param temp The MC temperature
         @param filterbyname Not used
+        @param incremental If True, score each step incrementally
+               (see set_incremental_scoring())
+        @param close_pair_objects PMI restraints scored on close pairs,
+               such as excluded volume, if incremental is True
         """
         self.losp = [
             "Rigid_Bodies",
@@ -143,7 +170,11 @@ class MonteCarlo(object):
         self.smv = IMP.core.SerialMover(self.mvs)
 
         self.mc = IMP.core.MonteCarlo(self.m)
-        self.mc.set_scoring_function(get_restraint_set(self.m))
+        self.isf = None
+        if incremental:
+            self.set_incremental_scoring(close_pair_objects)
+        else:
+            self.mc.set_scoring_function(get_restraint_set(self.m))
         self.mc.set_return_best(False)
         self.mc.set_kt(self.temp)
         self.mc.add_mover(self.smv)
@@ -160,8 +191,124 @@ class MonteCarlo(object):
         for ob in objectlist:
             rs.add_restraint(ob.get_restraint())
         sf = IMP.core.RestraintsScoringFunction([rs])
+        if self.isf is not None:
+            self.mc.set_incremental_scoring_function(None)
+            self.isf = None
         self.mc.set_scoring_function(sf)
 
+    def get_movable_particle_indexes(self):
+        """Get the indexes of all particles moved by the movers.
+           For rigid bodies these are the rigid body particles, not
+           their members."""
+        pis = []
+        seen = set()
+        for mo in self.smv.get_outputs():
+            try:
+                pi = IMP.Particle.get_from(mo).get_index()
+            except ValueError:
+                continue
+            if pi.get_index() not in seen:
+                seen.add(pi.get_index())
+                pis.append(pi)
+        return pis
+
+    def set_incremental_scoring(self, close_pair_objects=None):
+        """Score each step incrementally.
+           Rather than evaluating every PMI restraint after each move, only
+           the restraints that depend on the particles that were moved are
+           evaluated again (see IMP.core.IncrementalScoringFunction).
+           Restraints on members of a rigid body are found through the
+           rigid body, so rigid bodies and flexible beads can be mixed
+           freely. This is much faster for large systems, since each
+           mover generally only moves a small part of the system.
+
+           Restraints scored on the contents of a close pair container,
+           such as excluded volume, cannot be split up in this way, so
+           must be passed in close_pair_objects; their close pairs are
+           instead kept up to date for the moved particles only.
+           @param close_pair_objects PMI restraints that provide a
+                  get_close_pair_score() method, such as
+                  IMP.pmi.restraints.stereochemistry.ExcludedVolumeSphere
+           @see get_incremental_scoring_check()
+        """
+        if close_pair_objects is None:
+            close_pair_objects = []
+        rs = get_restraint_set(self.m)
+        close_pair_restraints = [ob.get_restraint()
+                                 for ob in close_pair_objects]
+        restraints = []
+        for r in rs.get_restraints():
+            if r in close_pair_restraints:
+                continue
+            if _get_uses_close_pairs(r):
+                raise ValueError("Restraint %s is scored on close pairs; "
+                                 "pass its PMI object in close_pair_objects "
+                                 "to score it incrementally" % r.get_name())
+            restraints.append(r)
+        self.isf = IMP.core.IncrementalScoringFunction(
+                         self.m, self.get_movable_particle_indexes(),
+                         restraints, rs.get_weight(), IMP.NO_MAX,
+                         "PMI incremental scoring %1%")
+        for ob in close_pair_objects:
+            ps, distance, particles, filters = ob.get_close_pair_score()
+            self.isf.add_close_pair_score(ps, distance, particles, filters)
+        self.mc.set_incremental_scoring_function(self.isf)
+
+    def get_incremental_scoring_check(self, nsteps=100):
+        """Check incremental scoring against full evaluation.
+           Each mover in turn proposes a move, which is scored both
+           incrementally and by evaluating all PMI restraints, then
+           rejected. The statistics of the movers are reset afterwards,
+           so this is best called before sampling.
+           @param nsteps The number of moves to try
+           @return a dict with the largest difference between the two
+                   scores, both absolute and relative to the full score
+                   (or to 1, if that is smaller), the mean time per step
+                   (in seconds) of the incremental and the full evaluation,
+                   and the speedup
+        """
+        if self.isf is None:
+            raise ValueError("Incremental scoring is not in use; "
+                             "call set_incremental_scoring() first")
+        full_sf = get_restraint_set(self.m).create_scoring_function()
+        movers = self.smv.get_movers()
+        self.isf.evaluate(False)
+        max_difference = max_relative_difference = 0.
+        incremental_time = full_time = 0.
+        for i in range(nsteps):
+            mv = movers[i % len(movers)]
+            moved = mv.propose().get_moved_particles()
+            start = time.time()
+            self.isf.set_moved_particles(moved)
+            incremental_score = self.isf.evaluate(False)
+            incremental_time += time.time() - start
+            start = time.time()
+            full_score = full_sf.evaluate(False)
+            full_time += time.time() - start
+            difference = abs(incremental_score - full_score)
+            max_difference = max(max_difference, difference)
+            max_relative_difference = max(
+                       max_relative_difference,
+                       difference / max(1., abs(full_score)))
+            mv.reject()
+            self.isf.reset_moved_particles()
+        # bring the stored scores back to the current configuration
+        self.isf.evaluate(False)
+        for mv in movers:
+            mv.reset_statistics()
+        self.movers_data = {}
+        incremental_time /= nsteps
+        full_time /= nsteps
+        if incremental_time > 0.:
+            speedup = full_time / incremental_time
+        else:
+            speedup = float('inf')
+        return {"MaximumScoreDifference": max_difference,
+                "MaximumRelativeScoreDifference": max_relative_difference,
+                "IncrementalTimePerStep": incremental_time,
+                "FullTimePerStep": full_time,
+                "Speedup": speedup}
+
     def set_simulated_annealing(
         self,
         min_temp,
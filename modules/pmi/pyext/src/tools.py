@@ -7,7 +7,6 @@
 from __future__ import print_function
 import IMP
 import IMP.algebra
-import IMP.isd
 import IMP.pmi
 import IMP.pmi.topology
 import collections
@@ -17,13 +16,18 @@ import sys,os
 import random
 import ast
 import time
-import RMF
-import IMP.rmf
+import contextlib
 from collections import defaultdict
 try:
     from collections import OrderedDict
 except ImportError:
     from IMP.pmi._compat_collections import OrderedDict
+import IMP.pmi._lazy
+
+# Imported on first use, to reduce the time needed to import this module
+IMP.pmi._lazy.lazy_import("IMP.isd")
+IMP.pmi._lazy.lazy_import("IMP.rmf")
+RMF = IMP.pmi._lazy.lazy_import("RMF")
 
 def _add_pmi_provenance(p):
     """Tag the given particle as being created by the current version of PMI."""
@@ -108,6 +112,152 @@ class Stopwatch(object):
         return output
 
 
+class EvaluationProfiler(object):
+    """Collect the time spent evaluating each restraint and score state.
+       Timing is turned on for the restraints and score states when this
+       object is created. Add it to outputobjects to get, for each of them,
+       the wall-clock time spent and the number of evaluations since the
+       last stat file entry; get_summary() returns the totals for the run."""
+
+    def __init__(self, model, restraints=None, score_states=None):
+        """Constructor.
+           @param model The IMP Model
+           @param restraints The restraints to time; by default, each
+                  restraint (usually a PMI restraint's RestraintSet) added
+                  to the model with add_restraint_to_model()
+           @param score_states The score states to time; by default, those
+                  required to evaluate the restraints
+        """
+        if restraints is None:
+            restraints = get_restraint_set(model).get_restraints()
+        self.restraints = list(restraints)
+        if score_states is None:
+            score_states = IMP.get_required_score_states(self.restraints)
+        self.score_states = list(score_states)
+        self.labels = []
+        used = set()
+        for obj in self.restraints + self.score_states:
+            label = obj.get_name()
+            n = 1
+            while label in used:
+                label = "%s_%d" % (obj.get_name(), n)
+                n += 1
+            used.add(label)
+            self.labels.append(label)
+        self.totals = [[0., 0] for obj in self.labels]
+        for obj in self.restraints + self.score_states:
+            obj.set_is_timed(True)
+            obj.reset_evaluation_time()
+
+    def _collect(self):
+        """Return and reset the time and calls since the last call"""
+        deltas = []
+        for obj, total in zip(self.restraints + self.score_states,
+                              self.totals):
+            t = obj.get_evaluation_time()
+            calls = obj.get_number_of_evaluations()
+            obj.reset_evaluation_time()
+            total[0] += t
+            total[1] += calls
+            deltas.append((t, calls))
+        return deltas
+
+    def get_output(self):
+        output = {}
+        for label, (t, calls) in zip(self.labels, self._collect()):
+            output["EvaluationProfiler_" + label + "_seconds"] = str(t)
+            output["EvaluationProfiler_" + label + "_calls"] = str(calls)
+        return output
+
+    def get_summary(self):
+        """Return a table of the total time spent on each restraint and
+           score state, slowest first."""
+        self._collect()
+        nrestraints = len(self.restraints)
+        rows = []
+        for n, (label, (t, calls)) in enumerate(zip(self.labels,
+                                                    self.totals)):
+            kind = "restraint" if n < nrestraints else "score state"
+            rows.append((t, calls, kind, label))
+        rows.sort(reverse=True)
+        lines = ["%-12s %12s %10s %12s  %s" % ("type", "seconds", "calls",
+                                               "ms/call", "name")]
+        for t, calls, kind, label in rows:
+            per_call = 1000. * t / calls if calls > 0 else 0.
+            lines.append("%-12s %12.3f %10d %12.4f  %s"
+                         % (kind, t, calls, per_call, label))
+        return "\n".join(lines)
+
+    def disable(self):
+        """Turn off timing of the restraints and score states"""
+        for obj in self.restraints + self.score_states:
+            obj.set_is_timed(False)
+
+
+class PhaseTimer(object):
+    """Collect the wall-clock time spent in the phases of a sampling loop.
+       Wrap each phase in a `with timer.phase(name):` block. Add an instance
+       of this class to outputobjects to get the time spent in each phase
+       since the last stat file entry; get_summary() returns the totals."""
+
+    def __init__(self, phases):
+        """Constructor.
+           @param phases The names of the phases, in the order they are
+                  reported
+        """
+        self.phases = list(phases)
+        self.totals = dict((p, 0.) for p in self.phases)
+        self._since_output = dict((p, 0.) for p in self.phases)
+        self.starttime = time.time()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Add the time spent in the with block to the given phase"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.totals[name] += elapsed
+            self._since_output[name] += elapsed
+
+    def get_output(self):
+        output = {}
+        for p in self.phases:
+            output["PhaseTimer_" + p + "_seconds"] = str(self._since_output[p])
+            self._since_output[p] = 0.
+        return output
+
+    def get_summary(self, mpi_values=None):
+        """Return a table of the total time spent in each phase.
+           @param mpi_values If an IMP.pmi.samplers.MPI_values object is
+                  given, the mean, minimum and maximum over all replicas
+                  are reported. In this case all replicas must call this
+                  method, after the last exchange.
+        """
+        elapsed = time.time() - self.starttime
+        phases = self.phases + ["other", "total"]
+        totals = dict(self.totals)
+        totals["total"] = elapsed
+        totals["other"] = elapsed - sum(self.totals.values())
+        values = {}
+        for p in phases:
+            if mpi_values is None:
+                values[p] = [totals[p]]
+            else:
+                mpi_values.set_value("PhaseTimer_" + p, totals[p])
+                values[p] = mpi_values.get_values("PhaseTimer_" + p)
+        lines = ["%-16s %12s %12s %12s %8s" % ("phase", "mean (s)",
+                                               "min (s)", "max (s)", "%")]
+        mean_total = sum(values["total"]) / len(values["total"])
+        for p in phases:
+            mean = sum(values[p]) / len(values[p])
+            percent = 100. * mean / mean_total if mean_total > 0. else 0.
+            lines.append("%-16s %12.3f %12.3f %12.3f %8.1f"
+                         % (p, mean, min(values[p]), max(values[p]), percent))
+        return "\n".join(lines)
+
+
 class SetupNuisance(object):
 
     def __init__(self, m, initialvalue, minvalue, maxvalue, isoptimized=True):
@@ -1948,6 +2098,80 @@ def get_selections_dictionary(input_objects):
             seldict[name].append(IMP.atom.Selection(m))
     return seldict
 
+def get_best_assignment(cost):
+    """Solve the linear assignment problem for a square cost matrix.
+    @param cost a list of lists (or 2D array), cost[i][j] being the cost
+           of assigning row i to column j
+    @return a list assignment such that row i is assigned to column
+            assignment[i] and the total cost is minimal.
+    Uses scipy.optimize.linear_sum_assignment if available, otherwise
+    falls back to a pure Python implementation of the Hungarian algorithm,
+    O(n^3) in the number of rows.
+    """
+    n = len(cost)
+    for row in cost:
+        if len(row) != n:
+            raise ValueError("The cost matrix must be square")
+    if n == 0:
+        return []
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        linear_sum_assignment = None
+    if linear_sum_assignment is not None:
+        import numpy
+        rows, cols = linear_sum_assignment(numpy.asarray(cost, dtype=float))
+        assignment = [0] * n
+        for i, j in zip(rows, cols):
+            assignment[int(i)] = int(j)
+        return assignment
+
+    # Hungarian algorithm with row/column potentials; indices are shifted
+    # by one so that row/column 0 can act as a sentinel
+    inf = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (n + 1)
+    p = [0] * (n + 1)
+    way = [0] * (n + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (n + 1)
+        used = [False] * (n + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            delta = inf
+            j1 = 0
+            for j in range(1, n + 1):
+                if not used[j]:
+                    cur = cost[i0 - 1][j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(n + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+    assignment = [0] * n
+    for j in range(1, n + 1):
+        assignment[p[j] - 1] = j - 1
+    return assignment
+
 def get_densities(input_objects):
     """Given a list of PMI objects, returns all density hierarchies within
     these objects.  The output of this function can be inputted into
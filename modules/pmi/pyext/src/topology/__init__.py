@@ -790,7 +790,8 @@ class PDBSequences(object):
 
 
     def read_sequences(self,pdb_fn,name_map):
-        t = IMP.atom.read_pdb(pdb_fn, self.m, IMP.atom.ATOMPDBSelector())
+        t = system_tools.pdb_cache.get_hierarchy(self.m, pdb_fn,
+                                    selector=IMP.atom.ATOMPDBSelector())
         cs=IMP.atom.get_by_type(t,IMP.atom.CHAIN_TYPE)
         for c in cs:
             id=IMP.atom.Chain(c).get_id()
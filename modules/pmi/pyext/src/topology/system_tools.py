@@ -1,12 +1,23 @@
 from __future__ import print_function, division
 import IMP
 import IMP.atom
-import IMP.isd.gmm_tools
+import IMP.core
 import IMP.pmi
 import IMP.pmi.tools
+import IMP.pmi._lazy
 from collections import defaultdict
 from math import pi
 import os
+import io
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Only needed for densities; imported on first use
+IMP.pmi._lazy.lazy_import("IMP.isd")
+IMP.pmi._lazy.lazy_import("IMP.isd.gmm_tools")
 
 def resnums2str(res):
     """Take iterable of TempResidues and return compatified string"""
@@ -29,6 +40,144 @@ def resnums2str(res):
             ret+=', '
     return ret
 
+class PDBCache(object):
+    """Per-process cache of the atom records of PDB files.
+    Each file is split once into its models and chains; a hierarchy for a
+    single chain is then read from just the lines of that chain, so that
+    building many molecules from one large PDB file does not parse the
+    whole file each time. Entries are keyed by the absolute path,
+    modification time and size of the file, so a file that changes on disk
+    is read again.
+
+    If `persistent` is True, the split file is also stored (compressed)
+    next to the PDB file, with the extension `.pmicache`, and used by
+    later runs as long as the PDB file is unchanged.
+    """
+    suffix = '.pmicache'
+    _version = 1
+
+    def __init__(self, persistent=False):
+        self.persistent = persistent
+        # absolute path -> ((mtime, size), list of models)
+        self._files = {}
+
+    def clear(self):
+        """Forget all cached files"""
+        self._files.clear()
+
+    def get_hierarchy(self, mdl, pdb_fn, chain_id=None, selector=None,
+                      model_num=None):
+        """Read a structure from a (cached) PDB file.
+        @param mdl       The IMP model to create the particles in
+        @param pdb_fn    The file to read
+        @param chain_id  Chain ID to read (None reads all chains)
+        @param selector  IMP.atom.PDBSelector applied to the atom records
+               (default: IMP.atom.get_default_pdb_selector())
+        @param model_num Model of a multi-model PDB file to read
+               (default: the first model)
+        @return an IMP.atom.Hierarchy, as returned by IMP.atom.read_pdb()
+        """
+        models = self._get_models(pdb_fn)
+        if model_num is None:
+            model_num = 0
+        if model_num >= len(models):
+            raise Exception("you requested model num "+str(model_num)+\
+                            " but the PDB file only contains "+str(len(models))+" models")
+        chains = models[model_num]
+        if chain_id is None:
+            text = b''.join(lines for chain, lines in chains)
+        else:
+            text = b''.join(lines for chain, lines in chains
+                            if chain == chain_id)
+        if not text:
+            raise ValueError("No atoms for chain %s in model %d of %s"
+                             % (chain_id, model_num, pdb_fn))
+        if selector is None:
+            selector = IMP.atom.get_default_pdb_selector()
+        mh = IMP.atom.read_pdb(io.BytesIO(text), mdl, selector)
+        # Refer to the original file rather than the in-memory stream
+        mh.set_name(pdb_fn)
+        for c in IMP.atom.get_by_type(mh, IMP.atom.CHAIN_TYPE):
+            if IMP.core.Provenanced.get_is_setup(c):
+                prov = IMP.core.Provenanced(c).get_provenance()
+                if IMP.core.StructureProvenance.get_is_setup(prov):
+                    IMP.core.StructureProvenance(prov).set_filename(pdb_fn)
+        return mh
+
+    def _get_models(self, pdb_fn):
+        path = os.path.abspath(pdb_fn)
+        st = os.stat(path)
+        key = (st.st_mtime, st.st_size)
+        entry = self._files.get(path)
+        if entry is None or entry[0] != key:
+            models = None
+            if self.persistent:
+                models = self._read_persistent(path, key)
+            if models is None:
+                models = self._split(path)
+                if self.persistent:
+                    self._write_persistent(path, key, models)
+            entry = (key, models)
+            self._files[path] = entry
+        return entry[1]
+
+    def _split(self, path):
+        """Split the ATOM/HETATM records of a PDB file into models, each a
+           list of (chain ID, records) pairs in file order. As for
+           IMP.atom.read_pdb(), records before the first MODEL record are
+           part of the first model."""
+        models = []
+        chains = None
+        seen_model = False
+        with open(path, 'rb') as fh:
+            for line in fh:
+                rec = line[:6]
+                if rec == b'MODEL ':
+                    if seen_model:
+                        chains = None
+                    seen_model = True
+                elif rec == b'ATOM  ' or rec == b'HETATM':
+                    if chains is None:
+                        chains = IMP.pmi.tools.OrderedDict()
+                        models.append(chains)
+                    if not line.endswith(b'\n'):
+                        line += b'\n'
+                    chain = line[21:22].decode('latin-1')
+                    if chain not in chains:
+                        chains[chain] = []
+                    chains[chain].append(line)
+        return [[(chain, b''.join(lines)) for chain, lines in chains.items()]
+                for chains in models]
+
+    def _read_persistent(self, path, key):
+        try:
+            with open(path + self.suffix, 'rb') as fh:
+                version, file_key, models = pickle.loads(
+                                                zlib.decompress(fh.read()))
+        except Exception:
+            return None
+        if version == self._version and tuple(file_key) == key:
+            return models
+
+    def _write_persistent(self, path, key, models):
+        fname = path + self.suffix
+        tmpname = fname + '.%d' % os.getpid()
+        try:
+            with open(tmpname, 'wb') as fh:
+                fh.write(zlib.compress(pickle.dumps(
+                         (self._version, key, models), protocol=2)))
+            os.rename(tmpname, fname)
+        except (IOError, OSError):
+            # The cache is only an optimization, so carry on if the directory
+            # isn't writeable
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+
+
+#: The PDBCache used when building PMI topologies
+pdb_cache = PDBCache()
+
+
 def get_structure(mdl,pdb_fn,chain_id,res_range=None,offset=0,model_num=None,ca_only=False):
     """read a structure from a PDB file and return a list of residues
     @param mdl The IMP model
@@ -45,16 +194,7 @@ def get_structure(mdl,pdb_fn,chain_id,res_range=None,offset=0,model_num=None,ca_
     sel = IMP.atom.get_default_pdb_selector()
     if ca_only:
         sel = IMP.atom.CAlphaPDBSelector()
-    if model_num is None:
-        mh = IMP.atom.read_pdb(pdb_fn,mdl,
-                               IMP.atom.AndPDBSelector(IMP.atom.ChainPDBSelector(chain_id), sel))
-
-    else:
-        mhs = IMP.atom.read_multimodel_pdb(pdb_fn,mdl,sel)
-        if model_num>=len(mhs):
-            raise Exception("you requested model num "+str(model_num)+\
-                            " but the PDB file only contains "+str(len(mhs))+" models")
-        mh = IMP.atom.Selection(mhs[model_num],chain=chain_id,with_representation=True)
+    mh = pdb_cache.get_hierarchy(mdl, pdb_fn, chain_id, sel, model_num)
 
     if res_range==[] or res_range is None:
         sel = IMP.atom.Selection(mh,chain=chain_id,atom_type=IMP.atom.AtomType('CA'))
@@ -3,6 +3,7 @@ import IMP.pmi
 import IMP.pmi.macros
 import IMP.test
 import glob
+import os
 
 class Tests(IMP.test.TestCase):
 
@@ -50,6 +51,37 @@ class Tests(IMP.test.TestCase):
         are.apply_molecular_assignments(1)
         are.save_clusters()
 
+    def test_analysis_replica_exchange_rmsd_cache(self):
+        model=IMP.Model()
+        sts=sorted(glob.glob(self.get_input_file_name("output_test/stat.0.out").replace(".0.",".*.")))
+        are=IMP.pmi.macros.AnalysisReplicaExchange(model,sts,10)
+        are.set_alignment_selection(molecule="Rpb4")
+        nmodels=len(are.stath0)
+        for n1 in range(1,nmodels):
+            rmsd, assignment = are.get_rmsd(0,n1)
+            # the array based rmsd matches the one computed on the frames
+            d0=are.stath0[0]
+            d1=are.stath1[n1]
+            frame_rmsd, frame_assignment = are.get_rmsd_from_frames(IMP.atom.get_rmsd)
+            self.assertAlmostEqual(rmsd,frame_rmsd,delta=1e-3)
+            self.assertEqual(assignment,frame_assignment)
+            self.assertLessEqual(are.get_rmsd_lower_bounds(0,[n1])[0],rmsd+1e-3)
+
+        with IMP.test.temporary_directory() as tmpdir:
+            data_fn=os.path.join(tmpdir,"data.pkl")
+            rmsd_fn=os.path.join(tmpdir,"rmsd.pkl")
+            are.save_data(data_fn,rmsd_fn)
+            are2=IMP.pmi.macros.AnalysisReplicaExchange(model,sts,10)
+            are2.load_data(data_fn,rmsd_fn)
+            self.assertTrue(are2.pairwise_rmsd_mask[
+                                [are2.get_pair_index(0,n1) for n1 in range(1,nmodels)]].all())
+            for n1 in range(1,nmodels):
+                self.assertAlmostEqual(are2.get_rmsd(n1,0)[0],
+                                       are.get_rmsd(0,n1)[0],delta=1e-6)
+            matrix=are2.get_pairwise_rmsd_matrix()
+            self.assertEqual(matrix.shape,(nmodels,nmodels))
+            self.assertAlmostEqual(matrix[1,0],are.get_rmsd(0,1)[0],delta=1e-6)
+
 
 if __name__ == '__main__':
     IMP.test.main()
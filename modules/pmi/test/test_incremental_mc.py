@@ -0,0 +1,99 @@
+import IMP
+import IMP.test
+import IMP.core
+import IMP.pmi
+import IMP.pmi.dof
+import IMP.pmi.io.crosslink
+import IMP.pmi.restraints.crosslinking
+import IMP.pmi.restraints.stereochemistry
+import IMP.pmi.samplers
+import IMP.pmi.topology
+import IMP.pmi.tools
+
+
+class Tests(IMP.test.TestCase):
+
+    def _make_system(self):
+        mdl = IMP.Model()
+        s = IMP.pmi.topology.System(mdl)
+        st1 = s.create_state()
+        seqs = IMP.pmi.topology.Sequences(
+                       self.get_input_file_name('seqs.fasta'))
+        m1 = st1.create_molecule("Prot1", sequence=seqs["Protein_1"])
+        atomic_res = m1.add_structure(self.get_input_file_name('prot.pdb'),
+                                      chain_id='A', res_range=(55, 63),
+                                      offset=-54)
+        m1.add_representation(atomic_res, resolutions=[1, 10])
+        m1.add_representation(m1.get_non_atomic_residues(), resolutions=[1])
+        m2 = st1.create_molecule("Prot2", sequence=seqs["Protein_2"])
+        m2.add_representation(m2.get_residues(), resolutions=[1])
+        hier = s.build()
+
+        # a rigid body with a flexible tail, and a chain of flexible beads
+        dof = IMP.pmi.dof.DegreesOfFreedom(mdl)
+        dof.create_rigid_body(m1, nonrigid_parts=m1.get_non_atomic_residues())
+        dof.create_flexible_beads(m2)
+        IMP.pmi.tools.shuffle_configuration(hier, max_translation=10)
+
+        # at resolution 1 the rigid body has several beads, whose pairs
+        # must not be scored
+        ev = IMP.pmi.restraints.stereochemistry.ExcludedVolumeSphere(
+                                   included_objects=[m1, m2], resolution=1)
+        ev.add_to_model()
+        cr = IMP.pmi.restraints.stereochemistry.ConnectivityRestraint(m2)
+        cr.add_to_model()
+
+        tname = self.get_tmp_file_name("incremental_xls.txt")
+        with open(tname, "w") as fh:
+            fh.write("prot1,res1,prot2,res2\n"
+                     "Prot1,3,Prot2,7\nProt1,10,Prot2,2\n")
+        cldbkc = IMP.pmi.io.crosslink.CrossLinkDataBaseKeywordsConverter()
+        cldbkc.set_protein1_key("prot1")
+        cldbkc.set_protein2_key("prot2")
+        cldbkc.set_residue1_key("res1")
+        cldbkc.set_residue2_key("res2")
+        cldb = IMP.pmi.io.crosslink.CrossLinkDataBase(cldbkc)
+        cldb.create_set_from_file(tname)
+        xl = IMP.pmi.restraints.crosslinking.\
+                 CrossLinkingMassSpectrometryRestraint(
+                     root_hier=hier, CrossLinkDataBase=cldb, resolution=1)
+        xl.add_to_model()
+        dof.get_nuisances_from_restraint(xl)
+        return mdl, dof, ev
+
+    def test_incremental(self):
+        """Test incremental scoring of PMI Monte Carlo"""
+        mdl, dof, ev = self._make_system()
+        mc = IMP.pmi.samplers.MonteCarlo(mdl, dof.get_movers(), 1.0,
+                                         incremental=True,
+                                         close_pair_objects=[ev])
+        self.assertIsNotNone(mc.isf)
+        ps, distance, particles, filters = ev.get_close_pair_score()
+        rigid = [p for p in particles
+                 if IMP.core.RigidMember.get_is_setup(p)]
+        self.assertGreater(len(rigid), 1)
+        self.assertTrue(any(isinstance(f, IMP.core.SameRigidBodyPairFilter)
+                            for f in filters))
+        check = mc.get_incremental_scoring_check(20)
+        self.assertAlmostEqual(check["MaximumScoreDifference"], 0.,
+                               delta=1e-4)
+        self.assertLess(check["MaximumRelativeScoreDifference"], 1e-6)
+        self.assertGreater(check["Speedup"], 0.)
+        for mv in mc.smv.get_movers():
+            self.assertEqual(mv.get_number_of_proposed(), 0)
+
+        full_sf = IMP.pmi.tools.get_restraint_set(mdl).create_scoring_function()
+        for i in range(3):
+            mc.optimize(5)
+            self.assertAlmostEqual(mc.get_mc().get_last_accepted_energy(),
+                                   full_sf.evaluate(False), delta=1e-4)
+
+    def test_close_pairs_needed(self):
+        """Test that close pair restraints must be passed explicitly"""
+        mdl, dof, ev = self._make_system()
+        self.assertRaises(ValueError, IMP.pmi.samplers.MonteCarlo,
+                          mdl, dof.get_movers(), 1.0, incremental=True)
+
+
+if __name__ == '__main__':
+    IMP.test.main()
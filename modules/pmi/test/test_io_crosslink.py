@@ -344,6 +344,117 @@ class Tests(IMP.test.TestCase):
         nentry=len([xl for xl in cldb if (xl[cldb.protein1_key]=="AAA")])
         self.assertEqual(len(cldb1),nentry)
 
+    def test_filter_indexed(self):
+        """Test that indexed filters match a full scan"""
+        import operator
+        from IMP.pmi.io.crosslink import FilterOperator as FO
+        cldb=self.setup_cldb("xl_dataset_test.dat")
+        fos=[FO(cldb.residue1_key,operator.le,30)&FO(cldb.residue2_key,operator.ge,10),
+             FO(cldb.residue1_key,operator.lt,30)|FO(cldb.protein2_key,operator.eq,"BBB"),
+             FO(cldb.protein1_key,operator.eq,"AAA")&~FO("sample",operator.eq,"human"),
+             FO(cldb.redundancy_key,operator.gt,1)]
+        for fo in fos:
+            expected=[IMP.pmi.io.crosslink._ProteinsResiduesArray(xl)
+                      for xl in cldb if fo.evaluate(xl)]
+            filtered=[IMP.pmi.io.crosslink._ProteinsResiduesArray(xl)
+                      for xl in cldb.filter(fo)]
+            self.assertEqual(filtered,expected)
+        # indexes must follow changes to the cross-links
+        fo=FO(cldb.protein1_key,operator.eq,"FFF")
+        self.assertEqual(len(cldb.filter(fo)),0)
+        cldb.set_value(cldb.protein1_key,'FFF',FO(cldb.protein1_key,operator.eq,"AAA"))
+        nentry=len([xl for xl in cldb if xl[cldb.protein1_key]=="FFF"])
+        self.assertGreater(nentry,0)
+        self.assertEqual(len(cldb.filter(fo)),nentry)
+        for xl in cldb:
+            xl[cldb.protein1_key]="FFF"
+        self.assertEqual(len(cldb.filter(fo)),len(cldb))
+        self.assertEqual(cldb.get_values(cldb.protein1_key),["FFF"])
+
+    def test_filter_indexed_direct_changes(self):
+        """Test that indexes follow direct changes to the data_base"""
+        import operator
+        from IMP.pmi.io.crosslink import FilterOperator as FO
+        cldb=self.setup_cldb("xl_dataset_test.dat")
+        other=self.setup_cldb("xl_dataset_test.dat")
+        fo=FO(cldb.protein1_key,operator.eq,"AAA")
+        nentry=len(cldb.filter(fo))
+        nxl=len(cldb)
+        self.assertEqual(len(other.filter(fo)),nentry)
+        # modifying another database does not touch this one's indexes
+        version=cldb._version
+        for xl in other:
+            xl[other.protein1_key]="FFF"
+        self.assertEqual(cldb._version,version)
+        self.assertEqual(len(other.filter(fo)),0)
+        # cross-links appended to and deleted from the lists directly
+        xlid=sorted(cldb.data_base.keys())[0]
+        xls=cldb.data_base[xlid]
+        new_xl=IMP.pmi.io.crosslink._CrossLink(xls[0])
+        new_xl[cldb.protein1_key]="AAA"
+        xls.append(new_xl)
+        self.assertEqual(len(cldb),nxl+1)
+        self.assertEqual(len(cldb.filter(fo)),nentry+1)
+        del xls[-1]
+        self.assertEqual(len(cldb),nxl)
+        self.assertEqual(len(cldb.filter(fo)),nentry)
+        # a cross-link replaced in place
+        old_xl=xls[0]
+        new_xl=IMP.pmi.io.crosslink._CrossLink(old_xl)
+        new_xl[cldb.protein1_key]="GGG"
+        xls[0]=new_xl
+        self.assertEqual(len(cldb.filter(FO(cldb.protein1_key,operator.eq,"GGG"))),1)
+        # unique IDs added and removed directly
+        cldb.data_base["new"]=[IMP.pmi.io.crosslink._CrossLink(old_xl)]
+        self.assertEqual(len(cldb),nxl+1)
+        self.assertIn("new",list(cldb.xlid_iterator()))
+        del cldb.data_base["new"]
+        self.assertEqual(len(cldb),nxl)
+        self.assertNotIn("new",list(cldb.xlid_iterator()))
+
+    def test_cached_order_follows_changes(self):
+        """Test that iteration and filters follow changes to the database"""
+        import operator
+        from IMP.pmi.io.crosslink import FilterOperator as FO
+        cldb=self.setup_cldb("xl_dataset_test.dat")
+        other=self.setup_cldb("xl_dataset_test.dat")
+        fo=FO(cldb.protein1_key,operator.eq,"AAA")
+        def get_expected():
+            return [xl for k in sorted(cldb.data_base.keys())
+                    for xl in cldb.data_base[k]]
+        def check():
+            self.assertEqual(list(cldb),get_expected())
+            self.assertEqual(len(cldb),len(get_expected()))
+            self.assertEqual(list(cldb.xlid_iterator()),
+                             sorted(cldb.data_base.keys()))
+            self.assertEqual(list(cldb.filter(fo)),
+                             [xl for xl in get_expected() if fo.evaluate(xl)])
+        check()
+        # the order is cached until the database changes
+        ids=cldb._get_sorted_ids()
+        check()
+        self.assertIs(cldb._get_sorted_ids(),ids)
+        xlid=ids[0]
+        new_xl=IMP.pmi.io.crosslink._CrossLink(cldb.data_base[xlid][0])
+        new_xl[cldb.protein1_key]="AAA"
+        # a unique ID that sorts first, given as a plain list
+        cldb.data_base["0"]=[new_xl]
+        check()
+        cldb.data_base["0"].append(
+                        IMP.pmi.io.crosslink._CrossLink(new_xl))
+        check()
+        cldb.data_base["0"][0][cldb.protein1_key]="BBB"
+        check()
+        cldb.data_base.pop("0")
+        check()
+        del cldb.data_base[xlid][:]
+        check()
+        cldb.append_database(other)
+        check()
+        cldb.set_value(cldb.protein1_key,"AAA",
+                       FO(cldb.protein2_key,operator.eq,"BBB"))
+        check()
+
     def test_clone_protein(self):
         cldb=self.setup_cldb("xl_dataset_test.dat")
         expected_crosslinks=[]
@@ -360,6 +471,7 @@ class Tests(IMP.test.TestCase):
             expected_crosslinks.append(array)
 
         cldb.clone_protein("AAA","AAC")
+        self.assertEqual(len(cldb),len(expected_crosslinks))
 
         for xl in cldb:
             array=IMP.pmi.io.crosslink._ProteinsResiduesArray(xl)
@@ -564,5 +676,29 @@ class Tests(IMP.test.TestCase):
             self.assertEqual(pra[2],xl[cldb.residue1_key])
             self.assertEqual(pra[3],xl[cldb.residue2_key])
 
+    def test_database_from_structure(self):
+        """Test CrossLinkDataBaseFromStructure with several residues"""
+        import IMP.pmi.topology
+        mdl = IMP.Model()
+        s = IMP.pmi.topology.System(mdl)
+        st1 = s.create_state()
+        seqs = IMP.pmi.topology.Sequences(
+                                 self.get_input_file_name('seqs.fasta'))
+        # QEALVVKDLL: three leucines, two valines
+        m1 = st1.create_molecule("Prot1", sequence=seqs["Protein_1"])
+        m1.add_representation(m1.get_residues(), resolutions=[1])
+        s.build()
+        cldbfs = IMP.pmi.io.crosslink.CrossLinkDataBaseFromStructure(
+                         system=s, residue_types_1=["L"],
+                         residue_types_2=["V"])
+        self.assertEqual(sorted(r for (m, r) in
+                                cldbfs.indexes_dict1.values()), [4, 9, 10])
+        self.assertEqual(sorted(r for (m, r) in
+                                cldbfs.indexes_dict2.values()), [5, 6])
+        self.assertEqual(len(cldbfs.protein_residue_dict), 5)
+        for (m, r), pi in cldbfs.protein_residue_dict.items():
+            sel = IMP.atom.Selection(m.hier, residue_index=r, resolution=1)
+            self.assertEqual(sel.get_selected_particle_indexes(), [pi])
+
 if __name__ == '__main__':
     IMP.test.main()
@@ -0,0 +1,40 @@
+from __future__ import print_function
+import IMP
+import IMP.test
+import IMP.pmi._lazy
+import sys
+
+
+class Tests(IMP.test.TestCase):
+
+    def test_lazy_import(self):
+        """Test lazy_import()"""
+        # modules that are already imported are returned directly
+        self.assertIs(IMP.pmi._lazy.lazy_import("IMP.pmi"), IMP.pmi)
+        name = "IMP.pmi._lazy_test_module"
+        self.assertNotIn(name, sys.modules)
+        m = IMP.pmi._lazy.lazy_import(name)
+        # a stand-in is set on the parent package; accessing it imports
+        # the module, but this one does not exist
+        self.assertIs(IMP.pmi._lazy_test_module, m)
+        self.assertRaises(ImportError, getattr, m, "foo")
+        del IMP.pmi._lazy_test_module
+
+        j = IMP.pmi._lazy.lazy_import("json")
+        self.assertEqual(j.dumps([1]), "[1]")
+
+    def test_lazy_submodule(self):
+        """Test lazy_import() of a submodule of a lazy module"""
+        for name in ("xml.dom.minidom", "xml.dom"):
+            if name in sys.modules:
+                self.skipTest("%s already imported" % name)
+        xml_dom = IMP.pmi._lazy.lazy_import("xml.dom")
+        IMP.pmi._lazy.lazy_import("xml.dom.minidom")
+        self.assertNotIn("xml.dom.minidom", sys.modules)
+        doc = xml_dom.minidom.parseString("<a/>")
+        self.assertEqual(doc.documentElement.tagName, "a")
+        self.assertIn("xml.dom.minidom", sys.modules)
+
+
+if __name__ == '__main__':
+    IMP.test.main()
@@ -88,6 +88,45 @@ class Tests(IMP.test.TestCase):
         self.assertEqual(stats.passed_get_every, 5)
         self.assertEqual(stats.passed_filtertuple, 3)
 
+    def test_write_stat2_columns(self):
+        """Test writing typed output columns to a stat2 file"""
+        class ColumnsObject(object):
+            def get_output_columns(self):
+                cols = IMP.pmi.output.OutputColumns()
+                cols.add_scalar("_TotalScore", 3.0)
+                cols.add_scalar("Test_Score", 3.0)
+                cols.add_array("Test_Distance_", ["a", "b"], [1.0, 2.5],
+                               verbose=True)
+                return cols
+            def get_output(self):
+                return self.get_output_columns().get_output()
+        class DictObject(object):
+            def get_output(self):
+                return {"_TotalScore": "1.0", "Dict_Score": "1.0"}
+        objs = [ColumnsObject(), DictObject()]
+        with IMP.test.temporary_directory() as tmpdir:
+            fname = os.path.join(tmpdir, "stat.out")
+            output = IMP.pmi.output.Output()
+            output.init_stat2(fname, objs, listofsummedobjects=[(objs, "Sum")],
+                              verbose_every=2)
+            for i in range(3):
+                output.write_stat2(fname)
+            po = IMP.pmi.output.ProcessOutput(fname)
+            self.assertEqual(sorted(po.get_keys()),
+                             ['Dict_Score', 'Sum', 'Test_Distance_a',
+                              'Test_Distance_b', 'Test_Score'])
+            fields = po.get_fields(["Test_Score", "Test_Distance_b",
+                                    "Dict_Score", "Sum"])
+        self.assertEqual(fields["Test_Score"], ["3.0"] * 3)
+        self.assertEqual(fields["Test_Distance_b"], ["2.5", "None", "2.5"])
+        self.assertEqual(fields["Dict_Score"], ["1.0"] * 3)
+        self.assertEqual(fields["Sum"], ["4.0"] * 3)
+
+    def test_output_columns_mismatch(self):
+        """Test OutputColumns with mismatched labels and values"""
+        cols = IMP.pmi.output.OutputColumns()
+        self.assertRaises(ValueError, cols.add_array, "Test_", ["a"], [])
+
     def _check_coordinate_identity(self,ps1,ps2):
         for n,p in enumerate(ps1):
             d1=IMP.core.XYZ(p)
@@ -347,6 +386,40 @@ class Tests(IMP.test.TestCase):
             self._check_coordinate_identity(lvs, lvs_read)
 
 
+    def test_StatHierarchyHandler_coordinate_cache(self):
+        import glob
+        m=IMP.Model()
+        stat_names=glob.glob(self.get_input_file_name("output_test/stat.0.out").replace("stat.0.out","stat.*.out"))
+        stath=IMP.pmi.output.StatHierarchyHandler(m,stat_names,10,
+                                                  coordinate_cache_size=None)
+        stathcopy=IMP.pmi.output.StatHierarchyHandler(StatHierarchyHandler=stath)
+        self.assertIs(stath.coordinate_cache,stathcopy.coordinate_cache)
+        lvs=IMP.atom.get_leaves(stath)
+        lvscopy=IMP.atom.get_leaves(stathcopy)
+
+        # traversal in file order visits all models once
+        order=stath.get_file_order()
+        self.assertEqual(sorted(order),list(range(len(stath))))
+        keys=[(stath.data[n].rmf_name,stath.data[n].rmf_index) for n in order]
+        self.assertEqual(keys,sorted(keys))
+
+        # coordinates read from the rmf files are cached, and going back
+        # to a frame gives the same coordinates in both handlers
+        coords={}
+        for n in order:
+            stath[n]
+            coords[n]=[IMP.core.XYZ(p).get_coordinates() for p in lvs]
+        self.assertEqual(len(stath.coordinate_cache.frames),
+                         len(set(keys)))
+        for n in reversed(order):
+            stath[n]
+            stathcopy[n]
+            for v,p,pcopy in zip(coords[n],lvs,lvscopy):
+                self.assertLess(IMP.algebra.get_distance(
+                             v,IMP.core.XYZ(p).get_coordinates()),1e-4)
+                self.assertLess(IMP.algebra.get_distance(
+                             v,IMP.core.XYZ(pcopy).get_coordinates()),1e-4)
+
     def test_StatHierarchyHandler_rmf_based(self):
         import ntpath
         import glob
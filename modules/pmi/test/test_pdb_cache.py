@@ -0,0 +1,114 @@
+from __future__ import print_function
+import IMP
+import IMP.algebra
+import IMP.atom
+import IMP.core
+import IMP.test
+import IMP.pmi.topology
+import IMP.pmi.topology.system_tools
+import os
+import shutil
+
+
+def get_atoms(h):
+    return [(IMP.atom.Atom(a).get_atom_type(),
+             IMP.atom.get_residue(IMP.atom.Atom(a)).get_index(),
+             IMP.core.XYZ(a).get_coordinates())
+            for a in IMP.atom.get_by_type(h, IMP.atom.ATOM_TYPE)]
+
+
+class Tests(IMP.test.TestCase):
+
+    def assert_same_atoms(self, h1, h2):
+        a1 = get_atoms(h1)
+        a2 = get_atoms(h2)
+        self.assertEqual(len(a1), len(a2))
+        self.assertGreater(len(a1), 0)
+        for (t1, r1, c1), (t2, r2, c2) in zip(a1, a2):
+            self.assertEqual(t1, t2)
+            self.assertEqual(r1, r2)
+            self.assertLess(IMP.algebra.get_distance(c1, c2), 1e-4)
+
+    def test_chain(self):
+        """Test reading single chains via the PDB cache"""
+        pdb = self.get_input_file_name('mini.pdb')
+        cache = IMP.pmi.topology.system_tools.PDBCache()
+        m = IMP.Model()
+        for chain in ('A', 'B'):
+            sel = IMP.atom.get_default_pdb_selector()
+            h = cache.get_hierarchy(m, pdb, chain, sel)
+            ref = IMP.atom.read_pdb(pdb, m, IMP.atom.AndPDBSelector(
+                       IMP.atom.ChainPDBSelector(chain), sel))
+            self.assert_same_atoms(h, ref)
+            chains = IMP.atom.get_by_type(h, IMP.atom.CHAIN_TYPE)
+            self.assertEqual([IMP.atom.Chain(c).get_id() for c in chains],
+                             [chain])
+            prov = IMP.core.Provenanced(chains[0]).get_provenance()
+            self.assertEqual(IMP.core.StructureProvenance(prov).get_filename(),
+                             os.path.abspath(pdb))
+        # The file should only have been split once
+        self.assertEqual(len(cache._files), 1)
+        self.assertRaises(ValueError, cache.get_hierarchy, m, pdb, 'Z')
+
+    def test_models(self):
+        """Test reading models of a multi-model file via the PDB cache"""
+        pdb = self.get_input_file_name('multi.pdb')
+        cache = IMP.pmi.topology.system_tools.PDBCache()
+        m = IMP.Model()
+        sel = IMP.atom.CAlphaPDBSelector()
+        refs = IMP.atom.read_multimodel_pdb(pdb, m, sel)
+        self.assertEqual(len(refs), 2)
+        for model_num, ref in enumerate(refs):
+            h = cache.get_hierarchy(m, pdb, selector=sel, model_num=model_num)
+            self.assert_same_atoms(h, ref)
+        self.assertRaises(Exception, cache.get_hierarchy, m, pdb,
+                          model_num=2)
+
+    def test_persistent(self):
+        """Test the PDB cache stored on disk"""
+        with IMP.test.temporary_directory() as tmpdir:
+            pdb = os.path.join(tmpdir, 'mini.pdb')
+            shutil.copy(self.get_input_file_name('mini.pdb'), pdb)
+            cache = IMP.pmi.topology.system_tools.PDBCache(persistent=True)
+            m = IMP.Model()
+            h1 = cache.get_hierarchy(m, pdb, 'A')
+            self.assertTrue(os.path.exists(pdb + cache.suffix))
+            # A new cache should use the stored file rather than the PDB
+            cache = IMP.pmi.topology.system_tools.PDBCache(persistent=True)
+            st = os.stat(pdb)
+            self.assertIsNotNone(cache._read_persistent(
+                    os.path.abspath(pdb), (st.st_mtime, st.st_size)))
+            h2 = cache.get_hierarchy(m, pdb, 'A')
+            self.assert_same_atoms(h1, h2)
+            # Changing the PDB file should invalidate the cache
+            with open(pdb) as fh:
+                lines = [l for l in fh if l[21:22] != 'A']
+            with open(pdb, 'w') as fh:
+                fh.writelines(lines)
+            os.utime(pdb, (1, 1))
+            self.assertRaises(ValueError, cache.get_hierarchy, m, pdb, 'A')
+            cache = IMP.pmi.topology.system_tools.PDBCache(persistent=True)
+            self.assertRaises(ValueError, cache.get_hierarchy, m, pdb, 'A')
+
+    def test_topology(self):
+        """Test building several molecules from one PDB file"""
+        pdb = self.get_input_file_name('mini.pdb')
+        IMP.pmi.topology.system_tools.pdb_cache.clear()
+        m = IMP.Model()
+        s = IMP.pmi.topology.System(m)
+        st = s.create_state()
+        seqs = IMP.pmi.topology.PDBSequences(m, pdb)
+        self.assertEqual(list(seqs.sequences.keys()), ['A', 'B'])
+        for chain in ('A', 'B'):
+            mol = st.create_molecule("Prot" + chain, sequence='A' * 10,
+                                     chain_id=chain)
+            res = mol.add_structure(pdb, chain_id=chain, soft_check=True)
+            self.assertGreater(len(res), 0)
+            mol.add_representation(res, resolutions=[1])
+        s.build()
+        self.assertEqual(len(IMP.pmi.topology.system_tools.pdb_cache._files),
+                         1)
+
+
+if __name__ == '__main__':
+    IMP.test.main()
@@ -14,6 +14,7 @@ import IMP.pmi.restraints
 import IMP.pmi.restraints.em
 import IMP.pmi.restraints.crosslinking
 import IMP.pmi.macros
+import IMP.pmi.samplers
 import RMF
 import IMP.rmf
 from math import *
@@ -733,6 +734,113 @@ class Tests(IMP.test.TestCase):
         rs = IMP.pmi.tools.get_restraint_set(m, rmf=True)
         self.assertEqual(rs.get_number_of_restraints(), 1)
 
+    def test_evaluation_profiler(self):
+        """Test EvaluationProfiler"""
+        m = IMP.Model()
+        r1 = IMP._ConstRestraint(m, [], 1)
+        r1.set_name("const")
+        r2 = IMP._ConstRestraint(m, [], 2)
+        r2.set_name("const")
+        IMP.pmi.tools.add_restraint_to_model(m, r1)
+        IMP.pmi.tools.add_restraint_to_model(m, r2)
+        profiler = IMP.pmi.tools.EvaluationProfiler(m)
+        self.assertTrue(r1.get_is_timed())
+        rs = IMP.pmi.tools.get_restraint_set(m)
+        for i in range(3):
+            self.assertAlmostEqual(rs.evaluate(False), 3., delta=1e-6)
+        output = profiler.get_output()
+        self.assertEqual(output["EvaluationProfiler_const_calls"], "3")
+        self.assertEqual(output["EvaluationProfiler_const_1_calls"], "3")
+        self.assertGreaterEqual(
+                float(output["EvaluationProfiler_const_seconds"]), 0.)
+        # counters are reset after each output
+        rs.evaluate(False)
+        output = profiler.get_output()
+        self.assertEqual(output["EvaluationProfiler_const_calls"], "1")
+        summary = profiler.get_summary().split("\n")
+        self.assertEqual(len(summary), 3)
+        self.assertIn(" 4 ", summary[1])
+        profiler.disable()
+        self.assertFalse(r2.get_is_timed())
+
+    def test_phase_timer(self):
+        """Test PhaseTimer"""
+        timer = IMP.pmi.tools.PhaseTimer(["a", "b"])
+        with timer.phase("a"):
+            pass
+        with timer.phase("b"):
+            sum(range(1000))
+        output = timer.get_output()
+        self.assertEqual(sorted(output.keys()),
+                         ["PhaseTimer_a_seconds", "PhaseTimer_b_seconds"])
+        self.assertGreaterEqual(float(output["PhaseTimer_b_seconds"]), 0.)
+        # time is reported since the last output
+        output = timer.get_output()
+        self.assertEqual(float(output["PhaseTimer_b_seconds"]), 0.)
+        self.assertGreaterEqual(timer.totals["b"], 0.)
+        def fail():
+            with timer.phase("a"):
+                raise ValueError("test")
+        self.assertRaises(ValueError, fail)
+        summary = timer.get_summary(IMP.pmi.samplers.MPI_values(
+                                    IMP.pmi.samplers._SerialReplicaExchange()))
+        rows = [l.split()[0] for l in summary.split("\n")]
+        self.assertEqual(rows, ["phase", "a", "b", "other", "total"])
+
+    def test_get_best_assignment(self):
+        """Test get_best_assignment()"""
+        import itertools
+        import random
+        self.assertEqual(IMP.pmi.tools.get_best_assignment([]), [])
+        self.assertEqual(IMP.pmi.tools.get_best_assignment(
+                                  [[4., 1., 3.], [2., 0., 5.], [3., 2., 2.]]),
+                         [1, 0, 2])
+        self.assertRaises(ValueError, IMP.pmi.tools.get_best_assignment,
+                          [[1., 2.], [3.]])
+        for n in range(1, 7):
+            cost = [[random.uniform(0., 10.) for j in range(n)]
+                    for i in range(n)]
+            assignment = IMP.pmi.tools.get_best_assignment(cost)
+            self.assertEqual(sorted(assignment), list(range(n)))
+            best = min(sum(cost[i][p[i]] for i in range(n))
+                       for p in itertools.permutations(range(n)))
+            self.assertAlmostEqual(
+                      sum(cost[i][assignment[i]] for i in range(n)), best,
+                      delta=1e-6)
+
+    def test_get_best_assignment_fallback(self):
+        """Test get_best_assignment() without scipy"""
+        import random
+        import sys
+        try:
+            import scipy.optimize
+        except ImportError:
+            scipy = None
+        random.seed(42)
+        costs = [[[4., 1., 3.], [2., 0., 5.], [3., 2., 2.]]]
+        for n in range(1, 9):
+            costs.append([[random.uniform(0., 10.) for j in range(n)]
+                          for i in range(n)])
+        if scipy is not None:
+            expected = [IMP.pmi.tools.get_best_assignment(cost)
+                        for cost in costs]
+        else:
+            expected = [[1, 0, 2]]
+        # a None entry in sys.modules makes the scipy import fail
+        old_module = sys.modules.get('scipy.optimize')
+        sys.modules['scipy.optimize'] = None
+        try:
+            assignments = [IMP.pmi.tools.get_best_assignment(cost)
+                           for cost in costs]
+        finally:
+            if old_module is None:
+                del sys.modules['scipy.optimize']
+            else:
+                sys.modules['scipy.optimize'] = old_module
+        self.assertEqual(assignments[:len(expected)], expected)
+        for cost, assignment in zip(costs, assignments):
+            self.assertEqual(sorted(assignment), list(range(len(cost))))
+
 
 if __name__ == '__main__':
     IMP.test.main()
@@ -0,0 +1,67 @@
+from __future__ import print_function
+import IMP
+import IMP.test
+import IMP.algebra
+import IMP.atom
+import IMP.core
+import IMP.pmi
+import IMP.pmi.output
+import IMP.pmi.topology
+try:
+    import matplotlib
+    import scipy
+except ImportError:
+    matplotlib = None
+if matplotlib is not None:
+    import IMP.pmi.io.xltable
+
+
+class Tests(IMP.test.TestCase):
+
+    def test_load_rmf_coordinates(self):
+        """Test XLTable reading coordinates from an RMF file"""
+        if matplotlib is None:
+            self.skipTest("no matplotlib or scipy module")
+        mdl = IMP.Model()
+        s = IMP.pmi.topology.System(mdl)
+        st = s.create_state()
+        seqs = IMP.pmi.topology.Sequences(
+                                  self.get_input_file_name('seqs.fasta'))
+        names = ["Prot1", "Prot2"]
+        for name, seqname in zip(names, ["Protein_1", "Protein_2"]):
+            mol = st.create_molecule(name, sequence=seqs[seqname])
+            mol.add_representation(mol.get_residues(), resolutions=[1])
+        hier = s.build()
+        for i, p in enumerate(IMP.atom.get_leaves(hier)):
+            IMP.core.XYZ(p).set_coordinates(IMP.algebra.Vector3D(4. * i,
+                                                                 0., 0.))
+        rmf_fn = self.get_tmp_file_name("xltable.rmf3")
+        o = IMP.pmi.output.Output()
+        o.init_rmf(rmf_fn, [hier])
+        o.write_rmf(rmf_fn)
+        o.close_rmf(rmf_fn)
+
+        xlt = IMP.pmi.io.xltable.XLTable(35)
+        for name, seqname in zip(names, ["Protein_1", "Protein_2"]):
+            xlt.load_sequence_from_fasta_file(
+                              self.get_input_file_name('seqs.fasta'),
+                              id_in_fasta_file=seqname, protein_name=name)
+        xlt.load_rmf_coordinates(rmf_fn, 0, names)
+        nres = len(seqs["Protein_1"]) + len(seqs["Protein_2"])
+        self.assertEqual(xlt.av_dist_map.shape, (nres, nres))
+
+        def get_coordinates(name, residue):
+            p, = IMP.atom.Selection(hier, molecule=name, residue_index=residue,
+                                    resolution=1).get_selected_particles()
+            return IMP.core.XYZ(p).get_coordinates()
+        first2 = len(seqs["Protein_1"])
+        for i, j, c0, c1 in ((0, 1, ("Prot1", 1), ("Prot1", 2)),
+                             (0, first2 + 2, ("Prot1", 1), ("Prot2", 3))):
+            self.assertAlmostEqual(xlt.av_dist_map[i, j],
+                                   IMP.algebra.get_distance(
+                                        get_coordinates(*c0),
+                                        get_coordinates(*c1)), delta=1e-4)
+
+
+if __name__ == '__main__':
+    IMP.test.main()
@@ -0,0 +1,123 @@
+"""Report the time taken to import each module used by a script.
+
+Every import done while running the script (or while importing the
+given modules) is timed. Both the cumulative time (including the modules
+it imports in turn) and the time spent in the module itself are reported,
+slowest first.
+"""
+
+from __future__ import print_function
+from optparse import OptionParser
+import sys
+import time
+import runpy
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+
+class ImportTimer(object):
+    """Replacement for __import__ that times the first import of modules"""
+
+    def __init__(self):
+        self.original_import = builtins.__import__
+        # module name -> [cumulative time, self time]
+        self.times = {}
+        self._children = []
+
+    def _get_full_name(self, name, globals, level):
+        """Get the absolute name of a (possibly relative) import"""
+        if level == 0 or not globals:
+            return name
+        package = globals.get('__package__')
+        if not package:
+            package = globals.get('__name__', '')
+            if '__path__' not in globals:
+                package = package.rpartition('.')[0]
+        if level > 1:
+            package = package.rsplit('.', level - 1)[0]
+        return package + '.' + name if name else package
+
+    def __call__(self, name, globals=None, locals=None, fromlist=(),
+                 level=0):
+        full_name = self._get_full_name(name, globals, level)
+        if full_name in sys.modules:
+            return self.original_import(name, globals, locals, fromlist,
+                                        level)
+        start = time.time()
+        self._children.append(0.)
+        try:
+            return self.original_import(name, globals, locals, fromlist,
+                                        level)
+        finally:
+            elapsed = time.time() - start
+            children = self._children.pop()
+            if self._children:
+                self._children[-1] += elapsed
+            t = self.times.setdefault(full_name, [0., 0.])
+            t[0] += elapsed
+            t[1] += elapsed - children
+
+    def install(self):
+        builtins.__import__ = self
+
+    def uninstall(self):
+        builtins.__import__ = self.original_import
+
+    def get_report(self, number=None):
+        times = sorted(self.times.items(), key=lambda x: x[1][0],
+                       reverse=True)
+        if number is not None:
+            times = times[:number]
+        lines = ["%12s %12s  %s" % ("cumul. (ms)", "self (ms)", "module")]
+        for name, (cumulative, own) in times:
+            lines.append("%12.1f %12.1f  %s" % (1000. * cumulative,
+                                                1000. * own, name))
+        lines.append("Total time in self: %.1f ms"
+                     % (1000. * sum(t[1] for t in self.times.values())))
+        return "\n".join(lines)
+
+
+def parse_args():
+    usage = """%prog [options] [script.py [script arguments]]
+
+Report the time taken to import each module used by a Python script,
+e.g. to find out which modules slow down the start of a PMI modeling
+script. Use -m to time importing modules rather than running a script."""
+    parser = OptionParser(usage)
+    parser.disable_interspersed_args()
+    parser.add_option("-m", "--module", action="append", default=[],
+                      help="import this module (can be given more than once) "
+                           "rather than running a script")
+    parser.add_option("-n", "--number", type="int", default=30,
+                      help="number of modules to report (default 30; "
+                           "0 reports all)")
+    opts, args = parser.parse_args()
+    if not args and not opts.module:
+        parser.error("need a script or at least one module")
+    return opts, args
+
+
+def main():
+    opts, args = parse_args()
+    timer = ImportTimer()
+    timer.install()
+    try:
+        if opts.module:
+            for m in opts.module:
+                __import__(m)
+        else:
+            sys.argv = args
+            try:
+                runpy.run_path(args[0], run_name="__main__")
+            except SystemExit:
+                pass
+    finally:
+        timer.uninstall()
+    print(timer.get_report(opts.number or None))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+/**
+ *  \file IMP/saxs/internal/pair_distributions.h
+ *  \brief Parallel accumulation of pair distance distributions
+ *
+ *  Copyright 2007-2017 IMP Inventors. All rights reserved.
+ *
+ */
+
+#ifndef IMPSAXS_INTERNAL_PAIR_DISTRIBUTIONS_H
+#define IMPSAXS_INTERNAL_PAIR_DISTRIBUTIONS_H
+
+#include <IMP/saxs/saxs_config.h>
+#include <IMP/saxs/Distribution.h>
+#include <IMP/algebra/Vector3D.h>
+#include <IMP/threads.h>
+#include <IMP/thread_macros.h>
+#include <IMP/Vector.h>
+#include <algorithm>
+#include <vector>
+
+IMPSAXS_BEGIN_INTERNAL_NAMESPACE
+
+//! Approximate number of atom pairs accumulated by one task.
+/** The split of the pairs into tasks, and the order in which the per-task
+    distributions are summed, do not depend on the number of threads, so
+    profiles are bitwise identical whatever the number of threads. */
+const unsigned long pair_chunk_size = 1UL << 20;
+
+//! Coordinates stored as separate x, y and z arrays
+/** This layout lets the compiler vectorize the distance loops. */
+struct CoordinateArrays {
+  std::vector<double> x, y, z;
+  CoordinateArrays(const Vector<algebra::Vector3D>& coordinates)
+      : x(coordinates.size()), y(coordinates.size()), z(coordinates.size()) {
+    for (unsigned int i = 0; i < coordinates.size(); ++i) {
+      x[i] = coordinates[i][0];
+      y[i] = coordinates[i][1];
+      z[i] = coordinates[i][2];
+    }
+  }
+  unsigned int size() const { return x.size(); }
+};
+
+//! Accumulate the weighted squared distances of pairs of atoms
+/** If the two coordinate sets are the same object, each unordered pair
+    i < j is visited once, followed by the autocorrelation term for atom i;
+    otherwise all pairs (i, j) are visited. Weights must provide
+    add_pair(i, j, dist2, distributions) and add_self(i, distributions).
+ */
+template <class Weights>
+class PairDistributions {
+  const CoordinateArrays& c1_;
+  const CoordinateArrays& c2_;
+  bool same_;
+  const Weights& weights_;
+  std::vector<unsigned int> row_bounds_;
+
+ public:
+  PairDistributions(const CoordinateArrays& c1, const CoordinateArrays& c2,
+                    const Weights& weights)
+      : c1_(c1), c2_(c2), same_(&c1 == &c2), weights_(weights) {
+    // split the rows into chunks of roughly equal numbers of pairs
+    row_bounds_.push_back(0);
+    unsigned long pairs = 0;
+    for (unsigned int i = 0; i < c1_.size(); ++i) {
+      pairs += same_ ? c1_.size() - i : c2_.size();
+      if (pairs >= pair_chunk_size) {
+        row_bounds_.push_back(i + 1);
+        pairs = 0;
+      }
+    }
+    if (row_bounds_.back() != c1_.size()) row_bounds_.push_back(c1_.size());
+  }
+
+  unsigned int get_number_of_chunks() const { return row_bounds_.size() - 1; }
+
+  //! Accumulate the pairs of the given chunk of rows into distributions
+  void add_chunk(unsigned int chunk,
+                 Vector<RadialDistributionFunction>& distributions) const {
+    std::vector<double> dist2(c2_.size());
+    const double* x2 = c2_.x.empty() ? nullptr : &c2_.x[0];
+    const double* y2 = c2_.y.empty() ? nullptr : &c2_.y[0];
+    const double* z2 = c2_.z.empty() ? nullptr : &c2_.z[0];
+    for (unsigned int i = row_bounds_[chunk]; i < row_bounds_[chunk + 1];
+         ++i) {
+      unsigned int start = same_ ? i + 1 : 0;
+      unsigned int end = c2_.size();
+      double xi = c1_.x[i], yi = c1_.y[i], zi = c1_.z[i];
+      for (unsigned int j = start; j < end; ++j) {
+        double dx = xi - x2[j], dy = yi - y2[j], dz = zi - z2[j];
+        dist2[j] = dx * dx + dy * dy + dz * dz;
+      }
+      for (unsigned int j = start; j < end; ++j) {
+        weights_.add_pair(i, j, dist2[j], distributions);
+      }
+      if (same_) weights_.add_self(i, distributions);
+    }
+  }
+
+  //! Add all pairs to distributions, using all available threads
+  void add_to(Vector<RadialDistributionFunction>& distributions) const {
+    unsigned int nchunks = get_number_of_chunks();
+    unsigned int nthreads = std::max(1U, get_number_of_threads());
+    const PairDistributions* pd = this;
+    for (unsigned int first = 0; first < nchunks; first += nthreads) {
+      unsigned int last = std::min(nchunks, first + nthreads);
+      Vector<Vector<RadialDistributionFunction> > chunk_distributions(
+          last - first,
+          Vector<RadialDistributionFunction>(distributions.size()));
+      Vector<Vector<RadialDistributionFunction> >* cd = &chunk_distributions;
+      IMP_THREADS((pd, cd, first, last), {
+        for (unsigned int chunk = first; chunk < last; ++chunk) {
+          IMP_TASK((pd, cd, first, chunk),
+                   pd->add_chunk(chunk, (*cd)[chunk - first]),
+                   "saxs pair distributions");
+        }
+        IMP_OMP_PRAGMA(taskwait)
+      });
+      // sum in chunk order, for results independent of the thread count
+      for (unsigned int i = 0; i < chunk_distributions.size(); ++i) {
+        for (unsigned int k = 0; k < distributions.size(); ++k) {
+          distributions[k].add(chunk_distributions[i][k]);
+        }
+      }
+    }
+  }
+};
+
+//! Add pair distributions of coordinates (with themselves if the same)
+template <class Weights>
+inline void add_pair_distributions(
+    const CoordinateArrays& c1, const CoordinateArrays& c2,
+    const Weights& weights,
+    Vector<RadialDistributionFunction>& distributions) {
+  PairDistributions<Weights> pd(c1, c2, weights);
+  pd.add_to(distributions);
+}
+
+//! Weights f_i * f_j, for a single distribution
+struct FormFactorWeights {
+  const Vector<double>& ff1_;
+  const Vector<double>& ff2_;
+  FormFactorWeights(const Vector<double>& ff1, const Vector<double>& ff2)
+      : ff1_(ff1), ff2_(ff2) {}
+  void add_pair(unsigned int i, unsigned int j, double dist2,
+                Vector<RadialDistributionFunction>& d) const {
+    double prod = ff1_[i] * ff2_[j];
+    d[0].add_to_distribution(dist2, 2 * prod);
+  }
+  void add_self(unsigned int i, Vector<RadialDistributionFunction>& d) const {
+    d[0].add_to_distribution(0.0, ff1_[i] * ff1_[i]);
+  }
+};
+
+//! The same weight for every pair, for a single distribution
+struct ConstantWeights {
+  double ff_;
+  ConstantWeights(double ff) : ff_(ff) {}
+  void add_pair(unsigned int, unsigned int, double dist2,
+                Vector<RadialDistributionFunction>& d) const {
+    d[0].add_to_distribution(dist2, 2 * ff_);
+  }
+  void add_self(unsigned int, Vector<RadialDistributionFunction>& d) const {
+    d[0].add_to_distribution(0.0, ff_);
+  }
+};
+
+//! Weights of the partial profiles (3, or 6 with a water layer)
+struct PartialWeights {
+  const Vector<double>& vacuum1_;
+  const Vector<double>& dummy1_;
+  const Vector<double>& water1_;
+  const Vector<double>& vacuum2_;
+  const Vector<double>& dummy2_;
+  const Vector<double>& water2_;
+  bool water_;
+  PartialWeights(const Vector<double>& vacuum1, const Vector<double>& dummy1,
+                 const Vector<double>& water1, const Vector<double>& vacuum2,
+                 const Vector<double>& dummy2, const Vector<double>& water2,
+                 bool water)
+      : vacuum1_(vacuum1), dummy1_(dummy1), water1_(water1),
+        vacuum2_(vacuum2), dummy2_(dummy2), water2_(water2), water_(water) {}
+  void add_pair(unsigned int i, unsigned int j, double dist,
+                Vector<RadialDistributionFunction>& r_dist) const {
+    r_dist[0].add_to_distribution(
+        dist, 2 * vacuum1_[i] * vacuum2_[j]);  // constant
+    r_dist[1].add_to_distribution(dist, 2 * dummy1_[i] * dummy2_[j]);  // c1^2
+    r_dist[2].add_to_distribution(dist,
+                                  2 * (vacuum1_[i] * dummy2_[j] +
+                                       vacuum2_[j] * dummy1_[i]));  // -c1
+    if (water_) {
+      r_dist[3].add_to_distribution(dist,
+                                    2 * water1_[i] * water2_[j]);  // c2^2
+      r_dist[4].add_to_distribution(
+          dist, 2 * (vacuum1_[i] * water2_[j] +
+                     vacuum2_[j] * water1_[i]));  // c2
+      r_dist[5].add_to_distribution(
+          dist, 2 * (water1_[i] * dummy2_[j] +
+                     water2_[j] * dummy1_[i]));  // -c1*c2
+    }
+  }
+  void add_self(unsigned int i,
+                Vector<RadialDistributionFunction>& r_dist) const {
+    r_dist[0].add_to_distribution(0.0, vacuum1_[i] * vacuum1_[i]);
+    r_dist[1].add_to_distribution(0.0, dummy1_[i] * dummy1_[i]);
+    r_dist[2].add_to_distribution(0.0, 2 * vacuum1_[i] * dummy1_[i]);
+    if (water_) {
+      r_dist[3].add_to_distribution(0.0, water1_[i] * water1_[i]);
+      r_dist[4].add_to_distribution(0.0, 2 * vacuum1_[i] * water1_[i]);
+      r_dist[5].add_to_distribution(0.0, 2 * water1_[i] * dummy1_[i]);
+    }
+  }
+};
+
+IMPSAXS_END_INTERNAL_NAMESPACE
+
+#endif /* IMPSAXS_INTERNAL_PAIR_DISTRIBUTIONS_H */
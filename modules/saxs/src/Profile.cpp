@@ -9,6 +9,7 @@
 #include <IMP/saxs/utility.h>
 #include <IMP/saxs/internal/sinc_function.h>
 #include <IMP/saxs/internal/exp_function.h>
+#include <IMP/saxs/internal/pair_distributions.h>
 
 #include <IMP/math.h>
 #include <IMP/core/XYZ.h>
@@ -377,24 +378,19 @@ void Profile::calculate_profile_real(const Particles& particles,
                                      FormFactorType ff_type) {
   IMP_LOG_TERSE("start real profile calculation for "
                 << particles.size() << " particles" << std::endl);
-  RadialDistributionFunction r_dist;  // fi(0) fj(0)
   // prepare coordinates and form factors in advance, for faster access
   Vector<algebra::Vector3D> coordinates;
   get_coordinates(particles, coordinates);
   Vector<double> form_factors;
   get_form_factors(particles, ff_table_, form_factors, ff_type);
 
-  // iterate over pairs of atoms
-  for (unsigned int i = 0; i < coordinates.size(); i++) {
-    for (unsigned int j = i + 1; j < coordinates.size(); j++) {
-      double dist = get_squared_distance(coordinates[i], coordinates[j]);
-      double prod = form_factors[i] * form_factors[j];
-      r_dist.add_to_distribution(dist, 2 * prod);
-    }
-    // add autocorrelation part
-    r_dist.add_to_distribution(0.0, square(form_factors[i]));
-  }
-  squared_distribution_2_profile(r_dist);
+  // iterate over pairs of atoms, including autocorrelation part
+  Vector<RadialDistributionFunction> r_dist(1);  // fi(0) fj(0)
+  internal::CoordinateArrays xyz(coordinates);
+  internal::add_pair_distributions(
+      xyz, xyz, internal::FormFactorWeights(form_factors, form_factors),
+      r_dist);
+  squared_distribution_2_profile(r_dist[0]);
 }
 
 double Profile::calculate_I0(const Particles& particles,
@@ -409,22 +405,17 @@ void Profile::calculate_profile_constant_form_factor(const Particles& particles,
                                                      double form_factor) {
   IMP_LOG_TERSE("start real profile calculation for "
                 << particles.size() << " particles" << std::endl);
-  RadialDistributionFunction r_dist;
   // prepare coordinates and form factors in advance, for faster access
   Vector<algebra::Vector3D> coordinates;
   get_coordinates(particles, coordinates);
   double ff = square(form_factor);
 
-  // iterate over pairs of atoms
-  for (unsigned int i = 0; i < coordinates.size(); i++) {
-    for (unsigned int j = i + 1; j < coordinates.size(); j++) {
-      double dist = get_squared_distance(coordinates[i], coordinates[j]);
-      r_dist.add_to_distribution(dist, 2 * ff);
-    }
-    // add autocorrelation part
-    r_dist.add_to_distribution(0.0, ff);
-  }
-  squared_distribution_2_profile(r_dist);
+  // iterate over pairs of atoms, including autocorrelation part
+  Vector<RadialDistributionFunction> r_dist(1);
+  internal::CoordinateArrays xyz(coordinates);
+  internal::add_pair_distributions(xyz, xyz, internal::ConstantWeights(ff),
+                                   r_dist);
+  squared_distribution_2_profile(r_dist[0]);
 }
 
 
@@ -455,38 +446,13 @@ void Profile::calculate_profile_partial(const Particles& particles,
   if (surface.size() == particles.size()) r_size = 6;
   Vector<RadialDistributionFunction> r_dist(r_size);
 
-  // iterate over pairs of atoms
-  for (unsigned int i = 0; i < coordinates.size(); i++) {
-    for (unsigned int j = i + 1; j < coordinates.size(); j++) {
-      double dist = get_squared_distance(coordinates[i], coordinates[j]);
-      r_dist[0].add_to_distribution(
-          dist, 2 * vacuum_ff[i] * vacuum_ff[j]);  // constant
-      r_dist[1]
-          .add_to_distribution(dist, 2 * dummy_ff[i] * dummy_ff[j]);  // c1^2
-      r_dist[2]
-          .add_to_distribution(dist, 2 * (vacuum_ff[i] * dummy_ff[j] +
-                                          vacuum_ff[j] * dummy_ff[i]));  // -c1
-      if (r_size > 3) {
-        r_dist[3]
-            .add_to_distribution(dist, 2 * water_ff[i] * water_ff[j]);  // c2^2
-        r_dist[4]
-            .add_to_distribution(dist, 2 * (vacuum_ff[i] * water_ff[j] +
-                                            vacuum_ff[j] * water_ff[i]));  // c2
-        r_dist[5].add_to_distribution(
-            dist, 2 * (water_ff[i] * dummy_ff[j] +
-                       water_ff[j] * dummy_ff[i]));  // -c1*c2
-      }
-    }
-    // add autocorrelation part
-    r_dist[0].add_to_distribution(0.0, square(vacuum_ff[i]));
-    r_dist[1].add_to_distribution(0.0, square(dummy_ff[i]));
-    r_dist[2].add_to_distribution(0.0, 2 * vacuum_ff[i] * dummy_ff[i]);
-    if (r_size > 3) {
-      r_dist[3].add_to_distribution(0.0, square(water_ff[i]));
-      r_dist[4].add_to_distribution(0.0, 2 * vacuum_ff[i] * water_ff[i]);
-      r_dist[5].add_to_distribution(0.0, 2 * water_ff[i] * dummy_ff[i]);
-    }
-  }
+  // iterate over pairs of atoms, including autocorrelation part
+  internal::CoordinateArrays xyz(coordinates);
+  internal::add_pair_distributions(
+      xyz, xyz, internal::PartialWeights(vacuum_ff, dummy_ff, water_ff,
+                                         vacuum_ff, dummy_ff, water_ff,
+                                         r_size > 3),
+      r_dist);
 
   // convert to reciprocal space
   squared_distributions_2_partial_profiles(r_dist);
@@ -539,28 +505,12 @@ void Profile::calculate_profile_partial(const Particles& particles1,
   Vector<RadialDistributionFunction> r_dist(r_size);
 
   // iterate over pairs of atoms
-  for (unsigned int i = 0; i < coordinates1.size(); i++) {
-    for (unsigned int j = 0; j < coordinates2.size(); j++) {
-      double dist = get_squared_distance(coordinates1[i], coordinates2[j]);
-      r_dist[0].add_to_distribution(
-          dist, 2 * vacuum_ff1[i] * vacuum_ff2[j]);  // constant
-      r_dist[1]
-          .add_to_distribution(dist, 2 * dummy_ff1[i] * dummy_ff2[j]);  // c1^2
-      r_dist[2].add_to_distribution(dist,
-                                    2 * (vacuum_ff1[i] * dummy_ff2[j] +
-                                         vacuum_ff2[j] * dummy_ff1[i]));  // -c1
-      if (r_size > 3) {
-        r_dist[3].add_to_distribution(dist,
-                                      2 * water_ff1[i] * water_ff2[j]);  // c2^2
-        r_dist[4].add_to_distribution(
-            dist, 2 * (vacuum_ff1[i] * water_ff2[j] +
-                       vacuum_ff2[j] * water_ff1[i]));  // c2
-        r_dist[5].add_to_distribution(
-            dist, 2 * (water_ff1[i] * dummy_ff2[j] +
-                       water_ff2[j] * dummy_ff1[i]));  //-c1*c2
-      }
-    }
-  }
+  internal::CoordinateArrays xyz1(coordinates1), xyz2(coordinates2);
+  internal::add_pair_distributions(
+      xyz1, xyz2, internal::PartialWeights(vacuum_ff1, dummy_ff1, water_ff1,
+                                           vacuum_ff2, dummy_ff2, water_ff2,
+                                           r_size > 3),
+      r_dist);
 
   // convert to reciprocal space
   squared_distributions_2_partial_profiles(r_dist);
@@ -755,7 +705,6 @@ void Profile::calculate_profile_real(const Particles& particles1,
   IMP_LOG_TERSE("start real profile calculation for "
                 << particles1.size() << " + " << particles2.size()
                 << " particles" << std::endl);
-  RadialDistributionFunction r_dist;  // fi(0) fj(0)
 
   // copy coordinates and form factors in advance, to avoid n^2 copy
   // operations
@@ -767,14 +716,12 @@ void Profile::calculate_profile_real(const Particles& particles1,
   get_form_factors(particles2, ff_table_, form_factors2, ff_type);
 
   // iterate over pairs of atoms
-  for (unsigned int i = 0; i < coordinates1.size(); i++) {
-    for (unsigned int j = 0; j < coordinates2.size(); j++) {
-      double dist = get_squared_distance(coordinates1[i], coordinates2[j]);
-      double prod = form_factors1[i] * form_factors2[j];
-      r_dist.add_to_distribution(dist, 2 * prod);
-    }
-  }
-  squared_distribution_2_profile(r_dist);
+  Vector<RadialDistributionFunction> r_dist(1);  // fi(0) fj(0)
+  internal::CoordinateArrays xyz1(coordinates1), xyz2(coordinates2);
+  internal::add_pair_distributions(
+      xyz1, xyz2, internal::FormFactorWeights(form_factors1, form_factors2),
+      r_dist);
+  squared_distribution_2_profile(r_dist[0]);
 }
 
 void Profile::distribution_2_profile(const RadialDistributionFunction& r_dist) {
@@ -83,6 +83,37 @@ class Tests(IMP.test.TestCase):
         print('RatioVolatilityScore after adjustment of excluded volume and water layer parameters = ' + str(vr))
         self.assertAlmostEqual(vr, 5.70, delta=0.01)
 
+    def test_saxs_profile_threads(self):
+        """Check profiles do not depend on the number of threads"""
+        m = IMP.Model()
+        # about 3000 atoms, so that the 4.5 million pairs (2.3 million
+        # between the two halves) are split into several chunks of 2^20
+        mp = IMP.atom.read_pdb(self.get_input_file_name('single_dna.pdb'), m,
+                               IMP.atom.NonWaterNonHydrogenPDBSelector())
+        particles = IMP.atom.get_by_type(mp, IMP.atom.ATOM_TYPE)
+        self.assertGreater(len(particles), 2900)
+        half = len(particles) // 2
+
+        def get_profiles():
+            p1 = IMP.saxs.Profile(0, 0.5, 0.005)
+            p1.calculate_profile(particles)
+            p2 = IMP.saxs.Profile(0, 0.5, 0.005)
+            p2.calculate_profile_partial(particles)
+            p3 = IMP.saxs.Profile(0, 0.5, 0.005)
+            p3.calculate_profile(particles[:half], particles[half:])
+            return [[p.get_intensity(i) for i in range(p.size())]
+                    for p in (p1, p2, p3)]
+
+        old_threads = IMP.get_number_of_threads()
+        try:
+            IMP.set_number_of_threads(1)
+            serial = get_profiles()
+            IMP.set_number_of_threads(4)
+            threaded = get_profiles()
+        finally:
+            IMP.set_number_of_threads(old_threads)
+        self.assertEqual(serial, threaded)
+
     def test_saxs_restraint(self):
         """Check saxs restraint"""
         m = IMP.Model()
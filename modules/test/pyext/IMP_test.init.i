@@ -20,6 +20,7 @@ from ._compat_python import unittest2
 import datetime
 import pickle
 import contextlib
+import json
 
 # Fall back to the sets.Set class on older Pythons that don't have
 # the 'set' builtin type.
@@ -62,6 +63,9 @@ skip = unittest.skip
 skipIf = unittest.skipIf
 skipUnless = unittest.skipUnless
 
+def _get_skip_expensive():
+    return os.environ.get('IMP_TEST_SKIP_EXPENSIVE', '') not in ('', '0')
+
 @IMP.deprecated_object("2.7", "Use temporary_working_directory() instead.")
 class RunInTempDir(object):
     """Simple RAII-style class to run in a temporary directory.
@@ -193,6 +197,9 @@ class TestCase(unittest.TestCase):
         self._progname = os.path.abspath(sys.argv[0])
 
     def setUp(self):
+        if _get_skip_expensive() and os.path.basename(
+                          self._progname).startswith('expensive_test_'):
+            self.skipTest("expensive test")
         self.__check_level = IMP.get_check_level()
         # Turn on expensive runtime checks while running the test suite:
         IMP.set_check_level(IMP.USAGE_AND_INTERNAL)
@@ -700,6 +707,10 @@ class _ExecDictProxy(object):
              "return self._d.%s(*args, **keys)" % (meth, meth))
 
 
+# Options set by main() from the command line or environment
+_test_options = {'jobs': 1, 'timing_file': None, 'slowest': 0}
+
+
 class _TestResult(unittest.TextTestResult):
 
     def __init__(self, stream=None, descriptions=None, verbosity=None):
@@ -712,8 +723,35 @@ class _TestResult(unittest.TextTestResult):
                                  os.path.basename(sys.argv[0]))
             with open(fname, 'wb') as fh:
                 pickle.dump(self.all_tests, fh, -1)
+        if _test_options['timing_file']:
+            self._write_timing_file(_test_options['timing_file'])
+        if _test_options['slowest'] > 0:
+            self._show_slowest_tests(_test_options['slowest'])
         super(_TestResult, self).stopTestRun()
 
+    def _get_timings(self):
+        return sorted(({'name': t['name'], 'time': t['time'],
+                        'state': t['state']} for t in self.all_tests),
+                      key=lambda t: t['time'], reverse=True)
+
+    def _write_timing_file(self, fname):
+        """Write the time taken by each test, slowest first, as JSON.
+           If fname is a directory, the file is written there, named
+           after the test script."""
+        if os.path.isdir(fname):
+            fname = os.path.join(fname,
+                                 os.path.basename(sys.argv[0]) + '.json')
+        with open(fname, 'w') as fh:
+            json.dump(self._get_timings(), fh, indent=1)
+
+    def _show_slowest_tests(self, number):
+        self.stream.writeln()
+        self.stream.writeln("Slowest tests:")
+        for t in self._get_timings()[:number]:
+            self.stream.writeln("%9.3fs %-8s %s" % (t['time'], t['state'],
+                                                    t['name']))
+        self.stream.writeln()
+
     def startTest(self, test):
         super(_TestResult, self).startTest(test)
         test.start_time=datetime.datetime.now()
@@ -769,10 +807,165 @@ class _TestResult(unittest.TextTestResult):
             return str(test)
 
 
+def _get_test_cases(suite):
+    """Get a flat list of all test cases in a suite"""
+    tests = []
+    for t in suite:
+        if isinstance(t, unittest.TestSuite):
+            tests.extend(_get_test_cases(t))
+        else:
+            tests.append(t)
+    return tests
+
+
+class _OutputCollector(object):
+    """File-like object that stores all output written to it"""
+    def __init__(self):
+        self._output = []
+    def write(self, txt):
+        self._output.append(txt)
+    def flush(self):
+        pass
+    def getvalue(self):
+        return "".join(self._output)
+
+
+# Tests to be run by worker processes, and the verbosity of their output
+_parallel_tests = {}
+_parallel_result_args = (True, 1)
+
+def _run_parallel_test(test_id):
+    """Run a single test in a worker process, in its own temporary directory.
+       Return the outcome in a form that can be sent to the parent."""
+    test = _parallel_tests[test_id]
+    output = _OutputCollector()
+    descriptions, verbosity = _parallel_result_args
+    result = _TestResult(unittest.runner._WritelnDecorator(output),
+                         descriptions, verbosity)
+    origdir = os.getcwd()
+    origtmp = os.environ.get('IMP_TMP_DIR')
+    with temporary_directory() as tmpdir:
+        os.chdir(tmpdir)
+        os.environ['IMP_TMP_DIR'] = tmpdir
+        try:
+            # run via a suite so that class fixtures are handled
+            unittest.TestSuite([test])(result)
+        finally:
+            os.chdir(origdir)
+            if origtmp is None:
+                del os.environ['IMP_TMP_DIR']
+            else:
+                os.environ['IMP_TMP_DIR'] = origtmp
+    return {'id': test_id, 'output': output.getvalue(),
+            'all_tests': result.all_tests, 'tests_run': result.testsRun,
+            'failures': [d for t, d in result.failures],
+            'errors': [d for t, d in result.errors],
+            'skipped': [r for t, r in result.skipped],
+            'expected_failures': [d for t, d in result.expectedFailures],
+            'unexpected_successes': len(result.unexpectedSuccesses)}
+
+
+def _get_fork_context():
+    """Get a multiprocessing context that forks, or None if not available"""
+    import multiprocessing
+    if hasattr(multiprocessing, 'get_context'):
+        try:
+            return multiprocessing.get_context('fork')
+        except ValueError:
+            return None
+    elif sys.platform == 'win32':
+        return None
+    else:
+        return multiprocessing
+
+
+class _ParallelTestSuite(object):
+    """Run the test cases of a suite in a pool of worker processes.
+       Each test runs in its own temporary working directory; the outcomes
+       are collected in the result passed by the test runner."""
+    def __init__(self, suite, jobs):
+        self.tests = _get_test_cases(suite)
+        self.jobs = jobs
+
+    def countTestCases(self):
+        return len(self.tests)
+
+    def __call__(self, result):
+        global _parallel_tests, _parallel_result_args
+        _parallel_tests = dict((t.id(), t) for t in self.tests)
+        _parallel_result_args = (result.descriptions,
+                                 2 if result.showAll else
+                                 1 if result.dots else 0)
+        # Workers are forked, so they see the tests set up above
+        pool = _get_fork_context().Pool(min(self.jobs, len(self.tests)))
+        try:
+            for out in pool.imap_unordered(_run_parallel_test,
+                                           [t.id() for t in self.tests]):
+                self._add_outcome(result, out)
+        finally:
+            pool.close()
+            pool.join()
+        return result
+
+    def _add_outcome(self, result, out):
+        test = _parallel_tests[out['id']]
+        result.stream.write(out['output'])
+        result.stream.flush()
+        result.all_tests.extend(out['all_tests'])
+        result.testsRun += out['tests_run']
+        result.failures.extend((test, d) for d in out['failures'])
+        result.errors.extend((test, d) for d in out['errors'])
+        result.skipped.extend((test, r) for r in out['skipped'])
+        result.expectedFailures.extend((test, d)
+                                       for d in out['expected_failures'])
+        result.unexpectedSuccesses.extend([test]
+                                          * out['unexpected_successes'])
+
+
 class _TestRunner(unittest.TextTestRunner):
     def _makeResult(self):
         return _TestResult(self.stream, self.descriptions, self.verbosity)
 
+    def run(self, test):
+        jobs = _test_options['jobs']
+        if jobs > 1 and test.countTestCases() > 1:
+            if _get_fork_context() is None:
+                self.stream.writeln("Cannot run tests in parallel on this "
+                                    "platform; running them serially")
+            else:
+                test = _ParallelTestSuite(test, jobs)
+        return super(_TestRunner, self).run(test)
+
+
+def _parse_test_options(argv):
+    """Handle IMP.test-specific command line options.
+       Defaults are taken from environment variables; the options are
+       removed from argv and the rest returned."""
+    env = os.environ
+    _test_options['jobs'] = int(env.get('IMP_TEST_JOBS', 1))
+    _test_options['timing_file'] = env.get('IMP_TEST_TIMING_FILE')
+    _test_options['slowest'] = int(env.get('IMP_TEST_SLOWEST', 0))
+    rest = []
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg == '--skip-expensive':
+            # set in the environment, so that subprocesses see it too
+            os.environ['IMP_TEST_SKIP_EXPENSIVE'] = '1'
+        elif arg in ('-j', '--jobs', '--timing-file', '--slowest'):
+            if not args:
+                raise ValueError("Option %s needs a value" % arg)
+            value = args.pop(0)
+            if arg == '--timing-file':
+                _test_options['timing_file'] = value
+            elif arg == '--slowest':
+                _test_options['slowest'] = int(value)
+            else:
+                _test_options['jobs'] = int(value)
+        else:
+            rest.append(arg)
+    return rest
+
 
 def main(*args, **keys):
     """Run a set of tests; similar to unittest.main().
@@ -780,9 +973,27 @@ def main(*args, **keys):
        ensures that main() is from the same unittest module that the
        IMP.test testcases are. In addition, turns on some extra checks
        (e.g. trying to use deprecated code will cause an exception
-       to be thrown)."""
+       to be thrown).
+
+       Some extra command line options are also handled:
+        - `-j N` or `--jobs N`: run the test cases in N worker processes,
+          each test in its own temporary directory (IMP_TEST_JOBS)
+        - `--skip-expensive`: skip all tests if the script is named
+          `expensive_test_*.py`, the same naming convention that the build
+          uses to label expensive tests (IMP_TEST_SKIP_EXPENSIVE)
+        - `--timing-file FILE`: write the time taken by each test, slowest
+          first, as JSON; if FILE is a directory, the file is named after
+          the test script (IMP_TEST_TIMING_FILE)
+        - `--slowest N`: list the N slowest tests after the run
+          (IMP_TEST_SLOWEST)
+       The environment variables in parentheses set the defaults."""
     import IMP
     IMP.set_deprecation_exceptions(True)
+    if 'argv' in keys:
+        keys['argv'] = [keys['argv'][0]] \
+                       + _parse_test_options(keys['argv'][1:])
+    else:
+        sys.argv[1:] = _parse_test_options(sys.argv[1:])
     return unittest.main(testRunner=_TestRunner, *args, **keys)
 
 import subprocess
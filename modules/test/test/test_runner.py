@@ -0,0 +1,84 @@
+from __future__ import print_function
+import IMP
+import IMP.test
+import os
+import sys
+import json
+import subprocess
+
+TEST_SCRIPT = """
+import IMP.test
+import os
+
+class Tests(IMP.test.TestCase):
+    def test_ok(self):
+        # each test runs in its own directory when run in parallel
+        self.assertFalse(os.path.exists("marker"))
+        open("marker", "w").close()
+
+    def test_ok_too(self):
+        self.assertFalse(os.path.exists("marker"))
+        open("marker", "w").close()
+
+    def test_fail(self):
+        self.assertEqual(1, 2)
+
+if __name__ == '__main__':
+    IMP.test.main()
+"""
+
+
+class Tests(IMP.test.TestCase):
+
+    def _run_script(self, tmpdir, args, name="test_script.py"):
+        script = os.path.join(tmpdir, name)
+        with open(script, "w") as fh:
+            fh.write(TEST_SCRIPT)
+        env = os.environ.copy()
+        env.pop('IMP_TEST_SKIP_EXPENSIVE', None)
+        p = subprocess.Popen([sys.executable, script] + args, cwd=tmpdir,
+                             env=env, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT,
+                             universal_newlines=True)
+        out, err = p.communicate()
+        return p.returncode, out
+
+    def test_timing_file(self):
+        """Check parallel runs with a timing file"""
+        with IMP.test.temporary_directory() as tmpdir:
+            timing = os.path.join(tmpdir, "timing.json")
+            ret, out = self._run_script(tmpdir, ["-j", "2", "--skip-expensive",
+                                                 "--timing-file", timing,
+                                                 "--slowest", "2"])
+            self.assertNotEqual(ret, 0)
+            self.assertIn("Ran 3 tests", out)
+            self.assertIn("failures=1", out)
+            self.assertNotIn("skipped", out)
+            self.assertIn("Slowest tests:", out)
+            with open(timing) as fh:
+                timings = json.load(fh)
+            self.assertEqual(sorted(t['name'] for t in timings),
+                             ['Tests.test_fail', 'Tests.test_ok',
+                              'Tests.test_ok_too'])
+            states = dict((t['name'], t['state']) for t in timings)
+            self.assertEqual(states['Tests.test_ok'], 'OK')
+            times = [t['time'] for t in timings]
+            self.assertEqual(times, sorted(times, reverse=True))
+
+    def test_expensive(self):
+        """Check that expensive_test_* scripts are skipped on request"""
+        name = "expensive_test_script.py"
+        with IMP.test.temporary_directory() as tmpdir:
+            ret, out = self._run_script(tmpdir, ["Tests.test_ok"], name=name)
+            self.assertEqual(ret, 0)
+            self.assertIn("Ran 1 test", out)
+            self.assertNotIn("skipped", out)
+            ret, out = self._run_script(tmpdir, ["--skip-expensive"],
+                                        name=name)
+            self.assertEqual(ret, 0)
+            self.assertIn("Ran 3 tests", out)
+            self.assertIn("skipped=3", out)
+
+
+if __name__ == '__main__':
+    IMP.test.main()